@@ -0,0 +1,163 @@
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from .logger import fw_logger
+from .config import BASELINE_SAMPLE, BASELINE_WRITE_BATCH, BASELINE_DIFF_LIMIT
+
+def case_hash(test_case):
+    """
+    Returns a content hash of a test case as written in the suite (before
+    expansion), independent of key order.
+    """
+    canonical = json.dumps(test_case, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+class BaselineStore:
+    """
+    SQLite store of the test cases a suite contained (by content hash) and the
+    last result seen for every target, per vantage point. Lets a run probe only
+    new or edited test cases plus a sample of unchanged ones, and reports how
+    each verdict changed against the previous run.
+    Safe to share between the thread reading test cases and the one consuming results.
+    """
+    def __init__(self, path):
+        """
+        Initializes the BaselineStore.
+
+        Args:
+            path (str): SQLite file holding the baseline; created if missing.
+        """
+        self.path = path
+        self.run_started = time.time()
+        self.selection = {'new': 0, 'modified': 0, 'unchanged_probed': 0, 'unchanged_skipped': 0}
+        self.diff = {'compared': 0, 'new_targets': 0, 'unchanged': 0, 'verdict_changes': 0, 'status_changes': 0,
+                     'changes': []}
+        self._seen = []
+        self._results = []
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS test_cases (case_hash TEXT PRIMARY KEY, name TEXT, first_seen REAL, "
+            "last_seen REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS test_cases_name ON test_cases (name)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results (vantage TEXT, dest_ip TEXT, dest_port INTEGER, protocol TEXT, "
+            "name TEXT, expected_result TEXT, actual_result TEXT, status TEXT, run_at REAL, "
+            "PRIMARY KEY (vantage, dest_ip, dest_port, protocol))")
+        self._db.commit()
+
+    def select(self, test_cases, changed_only=False, sample=BASELINE_SAMPLE, seed=None):
+        """
+        Records every test case of the suite in the baseline and yields the ones
+        to run: all of them, or with `changed_only` the new and edited ones plus
+        a random `sample` share of the unchanged ones.
+
+        Args:
+            test_cases (iterable): Test case dictionaries as read from the suite.
+            changed_only (bool): Skip unchanged test cases that are not sampled.
+            sample (float): Share of unchanged test cases to run anyway.
+            seed (int): Seed for the sample, or None for a different one every run.
+
+        Yields:
+            dict: The test cases to run.
+        """
+        draw = random.Random(seed).random
+        for test_case in test_cases:
+            digest = case_hash(test_case)
+            name = test_case.get('name') if isinstance(test_case, dict) else None
+            with self._lock:
+                known = self._db.execute("SELECT 1 FROM test_cases WHERE case_hash = ?", (digest,)).fetchone()
+                if known is None:
+                    edited = name is not None and self._db.execute(
+                        "SELECT 1 FROM test_cases WHERE name = ? AND last_seen < ?",
+                        (name, self.run_started)).fetchone()
+                    self.selection['modified' if edited else 'new'] += 1
+                self._seen.append((digest, name))
+                if len(self._seen) >= BASELINE_WRITE_BATCH:
+                    self._write()
+            if known is None:
+                yield test_case
+            elif not changed_only or draw() < sample:
+                self.selection['unchanged_probed'] += 1
+                yield test_case
+            else:
+                self.selection['unchanged_skipped'] += 1
+
+    def observe(self, result):
+        """
+        Compares one result with the baseline and records it as the new baseline
+        for its target.
+
+        Args:
+            result (TestResult or dict): A finished test result.
+        """
+        test = result if isinstance(result, dict) else result.to_dict()
+        key = (test.get('vantage') or "", str(test['dest_ip']), int(test['dest_port']), test['protocol'])
+        with self._lock:
+            row = self._db.execute(
+                "SELECT actual_result, status, run_at FROM results "
+                "WHERE vantage = ? AND dest_ip = ? AND dest_port = ? AND protocol = ?", key).fetchone()
+            self._results.append(key + (test['name'], test['expected_result'], test['actual_result'],
+                                        test['status'], self.run_started))
+            if len(self._results) >= BASELINE_WRITE_BATCH:
+                self._write()
+
+            self.diff['compared'] += 1
+            if row is None:
+                self.diff['new_targets'] += 1
+                return
+            actual_result, status, run_at = row
+            if actual_result == test['actual_result'] and status == test['status']:
+                self.diff['unchanged'] += 1
+                return
+            self.diff['verdict_changes' if actual_result != test['actual_result'] else 'status_changes'] += 1
+            if len(self.diff['changes']) < BASELINE_DIFF_LIMIT:
+                change = {'name': test['name'], 'dest_ip': key[1], 'dest_port': key[2], 'protocol': key[3],
+                          'expected_result': test['expected_result'],
+                          'previous_result': actual_result, 'actual_result': test['actual_result'],
+                          'previous_status': status, 'status': test['status'], 'previous_run_at': run_at}
+                if key[0]:
+                    change['vantage'] = key[0]
+                self.diff['changes'].append(change)
+
+    def _write(self):
+        """
+        Writes staged test cases and results. Must be called with the lock held.
+        """
+        self._db.executemany(
+            "INSERT INTO test_cases VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (case_hash) DO UPDATE SET name = excluded.name, last_seen = excluded.last_seen",
+            [(digest, name, self.run_started, self.run_started) for digest, name in self._seen])
+        self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self._results)
+        self._db.commit()
+        self._seen.clear()
+        self._results.clear()
+
+    def close(self):
+        """
+        Writes the rest of the run to the store and drops test cases that are
+        no longer in the suite.
+
+        Returns:
+            dict: The selection counts, 'removed' test case names and the diff
+                (counts and up to BASELINE_DIFF_LIMIT changes).
+        """
+        with self._lock:
+            self._write()
+            # An edited test case leaves its old hash behind under the same name; only
+            # names missing from this run count as removed
+            removed = [name for (name,) in self._db.execute(
+                "SELECT DISTINCT name FROM test_cases WHERE last_seen < ? AND name NOT IN "
+                "(SELECT name FROM test_cases WHERE last_seen >= ? AND name IS NOT NULL) ORDER BY name",
+                (self.run_started, self.run_started))]
+            self._db.execute("DELETE FROM test_cases WHERE last_seen < ?", (self.run_started,))
+            self._db.commit()
+            self._db.close()
+        report = dict(self.selection, removed=removed, **self.diff)
+        fw_logger.info(f"[*] Baseline: {report['compared']} results compared, {report['verdict_changes']} verdict "
+                       f"changes (saved to {self.path})")
+        return report
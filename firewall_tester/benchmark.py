@@ -0,0 +1,262 @@
+import array
+import collections
+import contextlib
+import json
+import logging
+import multiprocessing
+import resource
+import time
+
+import click
+
+from .logger import fw_logger, set_probe_log_level
+from .config import DEFAULT_RETRIES
+from .responder import SimulatedTarget, LoopbackResponder
+from .tester import FirewallRuleTester
+
+# First port of the range probed on a loopback or namespace target
+BENCH_BASE_PORT = 20000
+
+def generate_suite(size, hosts=256, ports=1024, udp_share=0.0, dest_ip=None, base_port=1):
+    """
+    Yields `size` single-probe test cases spread over `hosts` addresses in
+    10.0.0.0/8 (or all aimed at `dest_ip`) and `ports` ports from `base_port`.
+
+    Args:
+        size (int): Number of test cases.
+        hosts (int): Number of distinct destinations.
+        ports (int): Number of distinct ports per destination.
+        udp_share (float): Share of UDP test cases; the rest are TCP.
+        dest_ip (str): Single destination for every test case, or None.
+        base_port (int): First port.
+    """
+    udp_every = round(1 / udp_share) if udp_share else 0
+    for i in range(size):
+        host = i % hosts
+        address = dest_ip or f"10.{(host >> 16) & 255}.{(host >> 8) & 255}.{host & 255}"
+        port = base_port + (i // hosts) % ports
+        protocol = "udp" if udp_every and i % udp_every == 0 else "tcp"
+        yield {"name": f"bench {i}", "dest_ip": address, "dest_port": port, "protocol": protocol,
+               "expected_result": "open"}
+
+def _percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+def run_benchmark(size, target="simulated", tester_options=None, target_options=None, suite_options=None):
+    """
+    Runs one suite of `size` test cases through FirewallRuleTester and
+    measures it. Per-probe latency runs from the moment the tester takes a
+    test case from the source to the moment its result comes out, so it
+    includes scheduling, batch windows and retransmissions.
+
+    Args:
+        size (int): Number of test cases.
+        target (str): 'simulated' for the in-process SimulatedTarget,
+            'loopback' to start a LoopbackResponder on the target address, or
+            'remote' for a responder started separately (e.g. in a network
+            namespace with --serve).
+        tester_options (dict): FirewallRuleTester arguments.
+        target_options (dict): SimulatedTarget arguments, or for the socket
+            targets 'address' and 'open_share'.
+        suite_options (dict): generate_suite() arguments.
+
+    Returns:
+        dict: size, target, engine, seconds, probes_per_second, p50_ms,
+            p99_ms, cpu_seconds, peak_rss_mb and verdict counts.
+
+    Raises:
+        ValueError: If the connect engine is to run against the simulated
+            target, which only answers packets built by the tester.
+    """
+    tester_options = dict(tester_options or {})
+    target_options = dict(target_options or {})
+    suite_options = dict(suite_options or {})
+    if target == "simulated" and tester_options.get('tcp_engine') == "connect":
+        raise ValueError("The simulated target cannot answer the connect engine; "
+                         "benchmark it against the loopback or remote target.")
+
+    if target == "simulated":
+        stand_in = SimulatedTarget(**target_options)
+        context = stand_in.attach()
+    else:
+        address = target_options.get('address', "127.0.0.1")
+        ports = suite_options.setdefault('ports', 1024)
+        suite_options.update(dest_ip=address, hosts=1, base_port=BENCH_BASE_PORT)
+        open_every = round(1 / target_options['open_share']) if target_options.get('open_share') else 0
+        open_ports = range(BENCH_BASE_PORT, BENCH_BASE_PORT + ports, open_every) if open_every else ()
+        context = LoopbackResponder(address, open_ports, open_ports) if target == "loopback" \
+            else contextlib.nullcontext()
+
+    pulled = collections.deque()
+    latencies = array.array('d')
+    verdicts = collections.Counter()
+
+    def timed_source():
+        for test_case in generate_suite(size, **suite_options):
+            pulled.append(time.perf_counter())
+            yield test_case
+
+    with context, FirewallRuleTester(timed_source(), **tester_options) as tester:
+        cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        for outcome in tester.iter_outcomes():
+            now = time.perf_counter()
+            latencies.append(now - pulled.popleft())
+            verdicts[outcome.actual_result if outcome is not None else "skipped"] += 1
+        seconds = time.perf_counter() - started
+        cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    latencies = sorted(latencies)
+    p50, p99 = _percentile(latencies, 0.5), _percentile(latencies, 0.99)
+    return {
+        'size': size,
+        'target': target,
+        'engine': tester_options.get('tcp_engine', "sr1"),
+        'udp_engine': tester_options.get('udp_engine', "sr1"),
+        'seconds': round(seconds, 3),
+        'probes_per_second': round(size / seconds, 1) if seconds else None,
+        'p50_ms': None if p50 is None else round(p50 * 1000, 3),
+        'p99_ms': None if p99 is None else round(p99 * 1000, 3),
+        'cpu_seconds': round((cpu_after.ru_utime - cpu_before.ru_utime) + (cpu_after.ru_stime - cpu_before.ru_stime), 3),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(cpu_after.ru_maxrss / 1024, 1),
+        'verdicts': dict(verdicts),
+    }
+
+def _run_isolated(size, options, results):
+    """
+    Process body for one benchmark run, so peak RSS covers only that run.
+    """
+    if not options.pop('log'):
+        fw_logger.setLevel(logging.ERROR)
+        set_probe_log_level('off')
+    try:
+        results.put(run_benchmark(size, **options))
+    except BaseException as e:
+        results.put(RuntimeError(f"Benchmark of {size} test cases failed: {e}"))
+
+def run_isolated(size, **options):
+    """
+    Runs run_benchmark() in a freshly spawned interpreter and returns its
+    measurements. Pass log=True to keep the tester's per-test logging.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    options.setdefault('log', False)
+    process = context.Process(target=_run_isolated, args=(size, options, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+def format_results(rows):
+    """
+    Formats benchmark measurements as a table.
+
+    Args:
+        rows (list): Dictionaries returned by run_benchmark().
+
+    Returns:
+        list: The table lines.
+    """
+    def show(value):
+        return "n/a" if value is None else value
+
+    lines = [f"{'cases':>9} {'target':>9} {'engine':>6} {'seconds':>9} {'probes/s':>10} {'p50 ms':>9} "
+             f"{'p99 ms':>9} {'cpu s':>8} {'rss MB':>8}"]
+    for row in rows:
+        lines.append(f"{row['size']:>9} {row['target']:>9} {row['engine']:>6} {row['seconds']:>9} "
+                     f"{show(row['probes_per_second']):>10} {show(row['p50_ms']):>9} {show(row['p99_ms']):>9} "
+                     f"{row['cpu_seconds']:>8} {row['peak_rss_mb']:>8}")
+    return lines
+
+@click.command()
+@click.option('--sizes', default="1000,10000,100000", show_default=True,
+              help='Comma-separated suite sizes (number of test cases) to run.')
+@click.option('--target', type=click.Choice(['simulated', 'loopback', 'remote']), default='simulated',
+              show_default=True, help='In-process simulated responder, a responder on loopback started by the '
+                                      'benchmark, or one started separately with --serve.')
+@click.option('--target-ip', default="127.0.0.1", show_default=True,
+              help='Address of the loopback or remote responder.')
+@click.option('--tcp-engine', type=click.Choice(['sr1', 'batch', 'connect']), default='sr1', show_default=True)
+@click.option('--udp-engine', type=click.Choice(['sr1', 'batch']), default='sr1', show_default=True)
+@click.option('--concurrency', '-c', type=click.IntRange(min=1), default=64, show_default=True)
+@click.option('--timeout', type=click.FloatRange(min=0, min_open=True), default=0.2, show_default=True,
+              help='Initial probe timeout in seconds.')
+@click.option('--retries', type=click.IntRange(min=0), default=DEFAULT_RETRIES, show_default=True)
+@click.option('--fast-path/--scapy-path', default=True, help='Batch engine packet path on real targets.')
+@click.option('--hosts', type=click.IntRange(min=1), default=256, show_default=True,
+              help='Distinct destinations in a simulated suite.')
+@click.option('--ports', type=click.IntRange(min=1, max=45535), default=1024, show_default=True,
+              help='Distinct ports per destination.')
+@click.option('--udp-share', type=click.FloatRange(0, 1), default=0.0, show_default=True,
+              help='Share of UDP test cases.')
+@click.option('--latency-ms', type=click.FloatRange(min=0), default=0.5, show_default=True,
+              help='Simulated round-trip time.')
+@click.option('--jitter-ms', type=click.FloatRange(min=0), default=0.0, show_default=True,
+              help='Maximum simulated extra round-trip time.')
+@click.option('--loss', type=click.FloatRange(0, 1), default=0.0, show_default=True,
+              help='Simulated packet loss probability.')
+@click.option('--reset', type=click.FloatRange(0, 1), default=0.3, show_default=True,
+              help='Share of simulated targets answering with a RST (ICMP port-unreachable for UDP).')
+@click.option('--unreachable', type=click.FloatRange(0, 1), default=0.1, show_default=True,
+              help='Share of simulated targets answering with ICMP admin-prohibited.')
+@click.option('--silent', type=click.FloatRange(0, 1), default=0.1, show_default=True,
+              help='Share of simulated targets that never answer.')
+@click.option('--icmp-rate', type=click.FloatRange(min=0, min_open=True), default=None,
+              help='ICMP errors per second each simulated destination sends at most (default: no limit).')
+@click.option('--open-share', type=click.FloatRange(0, 1), default=0.1, show_default=True,
+              help='Share of ports the loopback responder opens.')
+@click.option('--log/--no-log', default=False, help="Keep the tester's per-test logging (off by default).")
+@click.option('--json', 'json_file', type=click.Path(dir_okay=False), default=None,
+              help='Also write the measurements to this JSON file.')
+@click.option('--serve', is_flag=True,
+              help='Only run the responder on --target-ip (e.g. inside a network namespace) until interrupted.')
+def main(sizes, target, target_ip, tcp_engine, udp_engine, concurrency, timeout, retries, fast_path, hosts, ports,
+         udp_share, latency_ms, jitter_ms, loss, reset, unreachable, silent, icmp_rate, open_share, log, json_file,
+         serve):
+    """
+    Measures the tester's throughput, per-probe latency, CPU time and peak
+    memory on suites of increasing size.
+    """
+    open_every = round(1 / open_share) if open_share else 0
+    if target == "simulated" and tcp_engine == "connect" and not serve:
+        raise click.UsageError("--tcp-engine connect needs --target loopback or remote; "
+                               "the simulated target cannot answer connect().")
+    if serve:
+        open_ports = range(BENCH_BASE_PORT, BENCH_BASE_PORT + ports, open_every) if open_every else ()
+        with LoopbackResponder(target_ip, open_ports, open_ports):
+            click.echo(f"Responder on {target_ip}: ports {BENCH_BASE_PORT}-{BENCH_BASE_PORT + ports - 1}, "
+                       f"every {open_every or 'no'} port open. Press Ctrl-C to stop.")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                return
+
+    if target == "simulated":
+        target_options = dict(latency=latency_ms / 1000, jitter=jitter_ms / 1000, loss=loss, reset=reset,
+                              unreachable=unreachable, silent=silent, icmp_rate=icmp_rate)
+    else:
+        target_options = dict(address=target_ip, open_share=open_share)
+    options = dict(target=target, log=log, target_options=target_options,
+                   tester_options=dict(tcp_engine=tcp_engine, udp_engine=udp_engine, concurrency=concurrency,
+                                       timeout=timeout, retries=retries, fast_path=fast_path),
+                   suite_options=dict(hosts=hosts, ports=ports, udp_share=udp_share))
+
+    rows = []
+    click.echo(format_results([])[0])
+    for size in (int(size) for size in sizes.split(',') if size.strip()):
+        rows.append(run_isolated(size, **options))
+        click.echo(format_results(rows[-1:])[1])
+    if json_file:
+        with open(json_file, 'w') as f:
+            json.dump(rows, f, indent=4)
+        click.echo(f"Results saved to: {json_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import collections
+import sqlite3
+import threading
+import time
+
+from .logger import fw_logger
+from .config import CACHE_TTL, CACHE_MAX_ENTRIES
+from .payloads import payload_digest
+
+# Verdicts that say nothing about the firewall and are never cached
+UNCACHEABLE_RESULTS = ('error', 'skipped')
+
+class ProbeCache:
+    """
+    Caches probe verdicts keyed on (dest_ip, dest_port, protocol, payload
+    digest) so duplicate probes are sent once per run; UDP probes with
+    different payloads are different probes. With a path, verdicts are also persisted
+    to a local SQLite store and reused by later runs while younger than the TTL.
+    Safe to share between probe threads.
+    """
+    def __init__(self, path=None, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        """
+        Initializes the ProbeCache.
+
+        Args:
+            path (str): SQLite file to persist verdicts to, or None for an in-memory cache.
+            ttl (float): Seconds a verdict stays fresh.
+            max_entries (int): Maximum number of verdicts kept in memory and on disk;
+                the least recently used ones are evicted first.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._inflight = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(probes)")]
+            if columns and 'payload' not in columns:
+                # Stores written before payloads were part of the key cannot tell them apart
+                self._db.execute("DROP TABLE probes")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS probes (dest_ip TEXT, dest_port INTEGER, protocol TEXT, payload TEXT, "
+                "verdict TEXT, probed_at REAL, PRIMARY KEY (dest_ip, dest_port, protocol, payload))")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(dest_ip, dest_port, protocol, payload=b''):
+        """
+        Returns the cache key of a probe; `payload` is the UDP datagram's payload.
+        """
+        return (str(dest_ip), int(dest_port), protocol.lower(), payload_digest(payload))
+
+    def _load(self, key, now):
+        """
+        Returns a fresh (verdict, probed_at) for `key` from memory or disk, or None.
+        Must be called with the lock held.
+        """
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT verdict, probed_at FROM probes "
+                "WHERE dest_ip = ? AND dest_port = ? AND protocol = ? AND payload = ?",
+                key).fetchone()
+            if row is not None:
+                entry = row
+                self._store(key, entry)
+        if entry is None or now - entry[1] > self.ttl:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns the fresh cached verdict for `key`, or None.
+        """
+        with self._lock:
+            entry = self._load(key, time.time())
+        return None if entry is None else entry[0]
+
+    def put(self, key, verdict):
+        """
+        Records a freshly probed verdict for `key`.
+        """
+        if verdict in UNCACHEABLE_RESULTS:
+            return
+        entry = (verdict, time.time())
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._dirty[key] = entry
+
+    def get_or_probe(self, key, probe):
+        """
+        Returns the cached verdict for `key`, or runs `probe()` and caches its
+        verdict. Concurrent callers for the same key wait for the first probe
+        instead of sending a duplicate.
+
+        Args:
+            key (tuple): (dest_ip, dest_port, protocol, payload digest) from make_key().
+            probe (callable): Performs the probe and returns its verdict.
+
+        Returns:
+            tuple: (verdict, cached), where `cached` is True if no probe was sent.
+        """
+        while True:
+            with self._lock:
+                entry = self._load(key, time.time())
+                if entry is not None:
+                    self.hits += 1
+                    return entry[0], True
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    self.misses += 1
+                    self._inflight[key] = threading.Event()
+                    break
+            waiter.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[0], True
+            # The first probe failed and cached nothing; probe again ourselves
+
+        try:
+            verdict = probe()
+            self.put(key, verdict)
+            return verdict, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    def close(self):
+        """
+        Writes new verdicts to the on-disk store, drops expired entries and
+        evicts the least recently probed ones beyond `max_entries`.
+        """
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)",
+                [key + entry for key, entry in self._dirty.items()])
+            self._dirty.clear()
+            self._db.execute("DELETE FROM probes WHERE probed_at < ?", (time.time() - self.ttl,))
+            self._db.execute(
+                "DELETE FROM probes WHERE rowid NOT IN "
+                "(SELECT rowid FROM probes ORDER BY probed_at DESC LIMIT ?)", (self.max_entries,))
+            self._db.commit()
+            self._db.close()
+            self._db = None
+        fw_logger.info(f"[*] Probe cache: {self.hits} hits, {self.misses} misses (saved to {self.path})")
@@ -0,0 +1,378 @@
+import ipaddress
+import socket
+import struct
+import threading
+import time
+
+from .logger import fw_logger
+from .config import PCAP_SNAPLEN, PCAP_WRITE_BUFFER, REPLAY_PROBE_WINDOW
+from .rawpacket import IPPROTO_TCP, IPPROTO_UDP, parse_reply
+
+# Link-layer header types (www.tcpdump.org/linktypes.html) and the readers of
+# the headers in front of the IPv4 packet. DLT_RAW is 12 or 14 depending on
+# the platform that wrote the file.
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+_RAW_LINKTYPES = (LINKTYPE_RAW, LINKTYPE_IPV4, 12, 14)
+
+_PCAP_MAGIC = 0xa1b2c3d4
+_PCAP_MAGIC_NANO = 0xa1b23c4d
+# pcap magic numbers as read little-endian from files of either byte order
+_PCAP_MAGICS = (_PCAP_MAGIC, 0xd4c3b2a1, _PCAP_MAGIC_NANO, 0x4d3cb2a1)
+_PCAPNG_SECTION = 0x0a0d0d0a
+_PCAPNG_BYTE_ORDER = 0x1a2b3c4d
+
+_PCAP_HEADER = struct.Struct('<IHHiIII')
+_PCAP_RECORD = struct.Struct('<IIII')
+
+_TCP_SYN_ACK = 0x12
+_TCP_RST_ACK = 0x14
+
+def _ip_offset(linktype, data):
+    """
+    Returns the offset of the IPv4 header in a frame of `linktype`, or None
+    if the frame does not carry IPv4.
+    """
+    if linktype in _RAW_LINKTYPES:
+        offset = 0
+    elif linktype == LINKTYPE_ETHERNET:
+        offset, ethertype = 14, data[12:14]
+        while ethertype in (b'\x81\x00', b'\x88\xa8') and len(data) >= offset + 4:  # VLAN tags
+            ethertype = data[offset + 2:offset + 4]
+            offset += 4
+        if ethertype != b'\x08\x00':
+            return None
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset = 16 if data[14:16] == b'\x08\x00' else None
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        offset = 20 if data[0:2] == b'\x08\x00' else None
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        # The address family is in the writer's byte order for NULL, network order for LOOP
+        offset = 4 if data[0:4] in (b'\x02\x00\x00\x00', b'\x00\x00\x00\x02') else None
+    else:
+        raise ValueError(f"unsupported link-layer type {linktype}")
+    if offset is None or len(data) < offset + 20 or data[offset] >> 4 != 4:
+        return None
+    return offset
+
+class PcapWriter:
+    """
+    Records probes and replies to a pcap file as raw IPv4 packets
+    (LINKTYPE_RAW), the form the raw fast path builds and parses them in.
+    Writes are serialised with a lock, so concurrent probe threads and
+    reply sniffers can share one writer.
+    """
+    def __init__(self, path):
+        """
+        Creates the file and writes the pcap header.
+
+        Args:
+            path (str): Path of the capture to write.
+        """
+        self.path = path
+        self.packets = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb', buffering=PCAP_WRITE_BUFFER)
+        self._file.write(_PCAP_HEADER.pack(_PCAP_MAGIC, 2, 4, 0, 0, PCAP_SNAPLEN, LINKTYPE_RAW))
+
+    def write(self, data, timestamp=None):
+        """
+        Appends one packet.
+
+        Args:
+            data (bytes): The packet, starting at the IPv4 header.
+            timestamp (float): When it was sent or captured, or None for now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        micros = int(round(float(timestamp) * 1000000))
+        size = len(data)
+        with self._lock:
+            if self._file is None:
+                return  # Replies may still arrive after the run closed the capture
+            self._file.write(_PCAP_RECORD.pack(micros // 1000000, micros % 1000000, min(size, PCAP_SNAPLEN), size))
+            self._file.write(data[:PCAP_SNAPLEN])
+            self.packets += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                fw_logger.info(f"[*] Recorded {self.packets} packets to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("capture is truncated")
+    return data
+
+def _iter_pcap(f, magic):
+    """
+    Yields (timestamp, linktype, frame) from a pcap file after its magic number.
+    """
+    order = '<' if struct.unpack('<I', magic)[0] in (_PCAP_MAGIC, _PCAP_MAGIC_NANO) else '>'
+    scale = 1e-9 if struct.unpack(order + 'I', magic)[0] == _PCAP_MAGIC_NANO else 1e-6
+    linktype = struct.unpack(order + 'HHiIII', _read_exact(f, 20))[5] & 0x0FFFFFFF
+    record = struct.Struct(order + 'IIII')
+    while True:
+        header = f.read(record.size)
+        if not header:
+            return
+        if len(header) != record.size:
+            raise ValueError("capture is truncated")
+        seconds, fraction, captured, _ = record.unpack(header)
+        yield seconds + fraction * scale, linktype, _read_exact(f, captured)
+
+def _tsresol(options, order):
+    """
+    Returns the timestamp unit in seconds from the options of a pcapng
+    Interface Description Block (if_tsresol, microseconds by default).
+    """
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(order + 'HH', options, offset)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+def _iter_pcapng(f, block_type):
+    """
+    Yields (timestamp, linktype, frame) from a pcapng file after the type of its first block.
+    """
+    order = '<'
+    interfaces = []  # (linktype, timestamp unit) per Interface Description Block of the section
+    while block_type:
+        length_bytes = _read_exact(f, 4)
+        if struct.unpack('<I', block_type)[0] == _PCAPNG_SECTION:
+            magic = _read_exact(f, 4)
+            order = '<' if struct.unpack('<I', magic)[0] == _PCAPNG_BYTE_ORDER else '>'
+            length = struct.unpack(order + 'I', length_bytes)[0]
+            _read_exact(f, length - 12)
+            interfaces = []
+        else:
+            kind = struct.unpack(order + 'I', block_type)[0]
+            length = struct.unpack(order + 'I', length_bytes)[0]
+            if length < 12:
+                raise ValueError(f"invalid pcapng block length {length}")
+            body = _read_exact(f, length - 12)
+            _read_exact(f, 4)  # Trailing copy of the block length
+            if kind == 1:  # Interface Description Block
+                interfaces.append((struct.unpack_from(order + 'H', body)[0], _tsresol(body[8:], order)))
+            elif kind == 6:  # Enhanced Packet Block
+                interface, high, low, captured = struct.unpack_from(order + 'IIII', body)
+                linktype, unit = interfaces[interface]
+                yield ((high << 32) | low) * unit, linktype, body[20:20 + captured]
+            elif kind == 3 and interfaces:  # Simple Packet Block, which has no timestamp
+                captured = min(struct.unpack_from(order + 'I', body)[0], len(body) - 4)
+                yield 0.0, interfaces[0][0], body[4:4 + captured]
+        block_type = f.read(4)
+
+def iter_packets(path):
+    """
+    Streams the IPv4 packets of a pcap or pcapng capture one at a time,
+    whatever link-layer headers it was captured with. Packets of other
+    network protocols are skipped.
+
+    Args:
+        path (str): Path of the capture.
+
+    Yields:
+        tuple: (timestamp, packet bytes starting at the IPv4 header).
+
+    Raises:
+        ValueError: If the file is not a capture, or is truncated.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+        value = struct.unpack('<I', magic)[0] if len(magic) == 4 else None
+        if value == _PCAPNG_SECTION:
+            frames = _iter_pcapng(f, magic)
+        elif value in _PCAP_MAGICS:
+            frames = _iter_pcap(f, magic)
+        else:
+            raise ValueError(f"{path} is not a pcap or pcapng capture")
+        for timestamp, linktype, frame in frames:
+            offset = _ip_offset(linktype, frame)
+            if offset is not None:
+                yield timestamp, memoryview(frame)[offset:]
+
+def _expire(probes, horizon):
+    """
+    Forgets the pending probes sent before `horizon`, oldest first.
+    """
+    while probes:
+        key = next(iter(probes))
+        if probes[key][1] >= horizon:
+            return
+        del probes[key]
+
+class CaptureReplay:
+    """
+    Re-evaluates test cases against a capture of an earlier run instead of
+    the network. The capture is streamed once: probes are matched to their
+    replies the way the live engines match them, and only one verdict per
+    probed target is kept. A target's first reply decides it; a target whose
+    probes all went unanswered is 'filtered' (TCP) or 'open|filtered' (UDP).
+
+    A TCP SYN without ACK is a probe. A UDP datagram is a probe only if it
+    is not a reply and comes from one of `sources`, so the DNS, NTP or mDNS
+    traffic of a tcpdump capture is not mistaken for probes. Pending probes
+    are dropped once answered or after REPLAY_PROBE_WINDOW seconds of
+    capture time, so memory follows the targets, not the packets.
+    """
+    def __init__(self, path, sources=None):
+        """
+        Initializes the CaptureReplay. Call load() to read the capture.
+
+        Args:
+            path (str): Path of a pcap or pcapng capture, such as one written by --record.
+            sources (iterable): Addresses the probes were sent from, or None to
+                take the source of the capture's first packet (a --record
+                capture starts with a probe) and of every TCP probe.
+        """
+        self.path = path
+        self.packets = 0
+        self.sources = set(sources or ())
+        self._learn_sources = not self.sources
+        self._verdicts = {}  # (address, port, protocol) -> verdict, or None while unanswered
+        self._addresses = {}
+
+    def load(self):
+        """
+        Streams the capture and indexes the verdict of every probed target.
+        Returns self.
+
+        Raises:
+            ValueError: If the file is not a capture, or is truncated.
+        """
+        tcp_probes = {}  # (address, port, source port, seq) -> (target, timestamp), oldest first
+        udp_probes = {}  # (address, port, source port) -> (target, timestamp), oldest first
+        for timestamp, packet in iter_packets(self.path):
+            self.packets += 1
+            if self._learn_sources and self.packets == 1:
+                self.sources.add(socket.inet_ntoa(packet[12:16]))
+            _expire(tcp_probes, timestamp - REPLAY_PROBE_WINDOW)
+            _expire(udp_probes, timestamp - REPLAY_PROBE_WINDOW)
+            self._dissect(packet, timestamp, tcp_probes, udp_probes)
+        fw_logger.info(f"[*] Replaying {self.path}: {self.packets} packets, {len(self._verdicts)} probed targets.")
+        return self
+
+    def _probe(self, probes, key, target, timestamp):
+        """
+        Records a probe as pending, unless its target already has a verdict.
+        """
+        if self._verdicts.setdefault(target, None) is None:
+            probes.pop(key, None)  # A retransmission waits from its own send time
+            probes[key] = (target, timestamp)
+
+    def _answer(self, probes, key, verdict):
+        """
+        Matches a reply to its pending probe and forgets the probe.
+        """
+        entry = probes.pop(key, None)
+        if entry is not None and self._verdicts.get(entry[0]) is None:
+            self._verdicts[entry[0]] = verdict
+
+    def _dissect(self, packet, timestamp, tcp_probes, udp_probes):
+        """
+        Records a probe as pending, or matches a reply to its pending probe.
+        """
+        reply = parse_reply(packet)
+        if reply is None:
+            return
+        if reply[0] == 'tcp':
+            _, src_ip, sport, dport, ack, flags = reply
+            if flags & 0x12 == 0x02:  # A SYN without ACK is one of our probes
+                if self._learn_sources:
+                    self.sources.add(src_ip)
+                target = (socket.inet_ntoa(packet[16:20]), dport, "tcp")
+                seq = struct.unpack_from('!I', packet, (packet[0] & 0x0F) * 4 + 4)[0]
+                self._probe(tcp_probes, (target[0], dport, sport, seq), target, timestamp)
+            elif flags & 0x10:  # Only ACKs answer a SYN
+                verdict = {_TCP_SYN_ACK: "open", _TCP_RST_ACK: "closed"}.get(flags, "filtered")
+                self._answer(tcp_probes, (src_ip, sport, dport, (ack - 1) & 0xFFFFFFFF), verdict)
+        elif reply[0] == 'udp':
+            _, src_ip, sport, dport = reply
+            if (src_ip, sport, dport) in udp_probes:
+                self._answer(udp_probes, (src_ip, sport, dport), "open")
+            elif src_ip in self.sources:
+                target = (socket.inet_ntoa(packet[16:20]), dport, "udp")
+                self._probe(udp_probes, (target[0], dport, sport), target, timestamp)
+        elif reply[2] == 3:  # ICMP destination unreachable quoting a probe
+            _, _, _, code, quoted_dst, quoted_proto, quoted_sport, quoted_dport, quoted_seq = reply
+            if quoted_proto == IPPROTO_TCP:
+                self._answer(tcp_probes, (quoted_dst, quoted_dport, quoted_sport, quoted_seq), "filtered")
+            elif quoted_proto == IPPROTO_UDP:
+                self._answer(udp_probes, (quoted_dst, quoted_dport, quoted_sport),
+                             "closed" if code == 3 else "open|filtered")
+
+    def resolve(self, dest_ip):
+        """
+        Returns `dest_ip` as an IPv4 address, or None for a hostname: the
+        capture holds addresses only, and replay stays off the network.
+        """
+        if dest_ip not in self._addresses:
+            try:
+                self._addresses[dest_ip] = str(ipaddress.IPv4Address(dest_ip))
+            except ValueError:
+                fw_logger.error(f"[ERROR] {dest_ip} is not an IPv4 address; capture replay does not resolve hostnames")
+                self._addresses[dest_ip] = None
+        return self._addresses[dest_ip]
+
+    def verdict(self, dest_ip, dest_port, protocol):
+        """
+        Returns the result the recorded probes of one target got.
+
+        Args:
+            dest_ip (str): Destination address or hostname.
+            dest_port (int): Destination port.
+            protocol (str): 'tcp' or 'udp'.
+
+        Returns:
+            str: 'open', 'closed', 'filtered', 'open|filtered', or 'error' if the
+                capture holds no probe of the target.
+        """
+        address = self.resolve(str(dest_ip))
+        if address is None:
+            return "error"
+        target = (address, int(dest_port), protocol)
+        if target not in self._verdicts:
+            fw_logger.warning(f"[WARNING] {dest_ip}:{dest_port}/{protocol} was not probed in {self.path}")
+            return "error"
+        verdict = self._verdicts[target]
+        if verdict is None:
+            return "filtered" if protocol == "tcp" else "open|filtered"  # No answer to any probe
+        return verdict
+
+def load_capture(file_path, sources=None):
+    """
+    Streams a pcap or pcapng capture into a CaptureReplay.
+
+    Args:
+        file_path (str): Path to the capture.
+        sources (iterable): Addresses the probes were sent from, or None to
+            learn them from the capture (see CaptureReplay).
+
+    Returns:
+        CaptureReplay: The verdict of every target probed in the capture.
+
+    Raises:
+        ValueError: If the file is not a capture, or is truncated.
+    """
+    return CaptureReplay(file_path, sources=sources).load()
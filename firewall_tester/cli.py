@@ -1,47 +1,458 @@
 import click
+import itertools
+import json
+import signal
+import socket
 import sys
 import os
+import time
 
 from .tester import FirewallRuleTester
-from .rules_parser import parse_test_cases
-from .reporter import generate_report
-from .logger import fw_logger
+from .sharding import ShardedRuleTester
+from .distributed import Coordinator, run_worker
+from .monitor import FirewallMonitor
+from .rules_parser import iter_test_cases
+from .reporter import (generate_report, get_report_writer, format_summary, format_vantage_summary,
+                       format_host_timing, format_plan, format_metrics, format_baseline_diff, REPORT_WRITERS)
+from .metrics import RunMetrics, MetricsExporter
+from .profiling import SamplingProfiler, format_profile
+from .results import RESULT_FIELDS
+from .logger import fw_logger, set_probe_log_level, set_log_format, set_console_stream
+from .cache import ProbeCache
+from .baseline import BaselineStore
+from .ruleset import load_ruleset
+from .capture import PcapWriter, load_capture
+from .rawpacket import raw_sockets_available
+from .config import (DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, DEFAULT_RETRIES, CACHE_TTL, CACHE_MAX_ENTRIES,
+                     PROFILE_FILE, LOG_FORMAT, PROBE_LOG_AUTO_LIMIT, BASELINE_SAMPLE,
+                     MONITOR_INTERVAL, HOST_TIMING_TOP)
+
+def write_streaming_report(tester, output_format, output_file, fields=RESULT_FIELDS, embed_metrics=False,
+                           baseline=None, host_timing_top=HOST_TIMING_TOP):
+    """
+    Runs the tests and writes each result to the report as soon as it finishes,
+    then logs the summary counts and the `host_timing_top` slowest hosts (every
+    host if None). With `embed_metrics`, the tester's run
+    metrics are appended to the report and the summary. Every result is also
+    compared with the `baseline` store, if one is given.
+    """
+    clock = time.perf_counter
+    report_seconds = 0.0
+    stream = open(output_file, 'w', newline='') if output_file else sys.stdout
+    try:
+        writer = get_report_writer(output_format, stream, fields)
+        for result in tester.iter_results():
+            started = clock()
+            writer.write(result)
+            if baseline is not None:
+                baseline.observe(result)
+            report_seconds += clock() - started
+        tester.metrics.add_phase('report', report_seconds)
+        if embed_metrics:
+            writer.write_metrics(tester.metrics.summary())
+        writer.close()
+    finally:
+        if output_file:
+            stream.close()
+
+    if output_file:
+        fw_logger.info(f"[*] Report saved to: {output_file}")
+    fw_logger.info("\n".join(["\n--- Firewall Rule Test Summary ---"] + format_summary(writer.tally)
+                              + format_vantage_summary(writer.vantage_tallies)
+                              + format_host_timing(tester.timing.summary(), host_timing_top)
+                              + (format_metrics(tester.metrics.summary()) if embed_metrics else [])))
+
+def write_report(tester, output_format, output_file, embed_metrics=False, baseline=None,
+                 host_timing_top=HOST_TIMING_TOP):
+    """
+    Runs the tests, collecting every result, then writes the console or JSON
+    report, listing the `host_timing_top` slowest hosts (every host if None).
+    With `embed_metrics`, the tester's run metrics are included. Every
+    result is also compared with the `baseline` store, if one is given.
+    """
+    results = tester.run_tests()
+    started = time.perf_counter()
+    if baseline is not None:
+        for result in results:
+            baseline.observe(result)
+    metrics = None
+    if embed_metrics:
+        # Taken before rendering, so the embedded report phase covers comparing the results, not rendering them
+        tester.metrics.add_phase('report', time.perf_counter() - started)
+        metrics = tester.metrics.summary()
+        started = time.perf_counter()
+    report = generate_report(results, output_format, host_timing=tester.timing.summary(), metrics=metrics,
+                             host_timing_top=host_timing_top)
+    tester.metrics.add_phase('report', time.perf_counter() - started)
+
+    if output_file:
+        try:
+            with open(output_file, 'w') as f:
+                f.write(report)
+            fw_logger.info(f"[*] Report saved to: {output_file}")
+        except IOError as e:
+            fw_logger.error(f"Error: Could not write report to file {output_file}: {e}")
+    elif output_format != 'console':
+        # Machine-readable: the report alone on stdout, the log lines on stderr
+        sys.stdout.write(report + "\n")
+        sys.stdout.flush()
+    else:
+        # Use the logger to print the report to the console
+        fw_logger.info(report)
+
+def write_baseline_diff(baseline, diff_report):
+    """
+    Saves the baseline store and logs the verdict changes of the run, also
+    writing them to `diff_report` as JSON if given.
+    """
+    diff = baseline.close()
+    fw_logger.info("\n".join(format_baseline_diff(diff)))
+    if diff_report:
+        try:
+            with open(diff_report, 'w') as f:
+                json.dump(diff, f, indent=4)
+            fw_logger.info(f"[*] Baseline diff saved to: {diff_report}")
+        except IOError as e:
+            fw_logger.error(f"Error: Could not write baseline diff to file {diff_report}: {e}")
+
+def run_monitor(tester, interval, alert_dir):
+    """
+    Monitors the tester's suite until SIGINT or SIGTERM.
+    """
+    monitor = FirewallMonitor(tester, interval=interval, alert_dir=alert_dir)
+    handlers = {signum: signal.signal(signum, lambda *_: monitor.stop()) for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        monitor.run()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+def pick_tcp_engine(tcp_engine):
+    """
+    Returns the TCP engine to probe with: the requested one, or the connect()
+    engine if the requested one needs raw sockets this process cannot open.
+    """
+    if tcp_engine != "connect" and not raw_sockets_available():
+        fw_logger.warning(f"[WARNING] Raw sockets are unavailable (not running as root?); using the connect TCP engine "
+                          f"instead of {tcp_engine}.")
+        return "connect"
+    return tcp_engine
+
+def pick_udp_engine(udp_engine):
+    """
+    Returns the UDP engine to probe with: the requested one, or 'skip' if raw
+    sockets are unavailable, since UDP probes have no unprivileged fallback.
+    """
+    if udp_engine != "skip" and not raw_sockets_available():
+        fw_logger.warning("[WARNING] Raw sockets are unavailable (not running as root?); UDP test cases will be "
+                          "reported as skipped.")
+        return "skip"
+    return udp_engine
+
+def validate_suite(test_cases_file, **tester_options):
+    """
+    Validates a test case file and logs the probe plan without touching the
+    network. Exits with status 1 if any test case is invalid.
+    """
+    errors = []
+    with FirewallRuleTester(test_cases=iter_test_cases(test_cases_file, errors), **tester_options) as tester:
+        plan = tester.plan()
+    fw_logger.info("\n".join(["\n--- Firewall Rule Test Plan ---"] + format_plan(plan)))
+    if errors or not plan['test_cases']:
+        fw_logger.error(f"[ERROR] Validation failed: {len(errors)} invalid records, {plan['test_cases']} valid test cases.")
+        sys.exit(1)
+    fw_logger.info(f"[*] {test_cases_file} is valid.")
 
 @click.command()
-@click.argument('test_cases_file', type=click.Path(exists=True))
-@click.option('--output-format', '-f', type=click.Choice(['console', 'json'], case_sensitive=False),
-default='console', help='Output format for the report.')
+@click.argument('test_cases_file', type=click.Path(exists=True), required=False)
+@click.option('--output-format', '-f', type=click.Choice(['console', 'json'] + list(REPORT_WRITERS), case_sensitive=False),
+default='console', help='Output format for the report. jsonl, csv and junit are written incrementally.')
 @click.option('--output-file', '-o', type=str,
-              help='Save report to a file (e.g., report.json or report.txt).')
-def main(test_cases_file, output_format, output_file):
+              help='Save report to a file (e.g., report.json, report.csv or report.txt).')
+@click.option('--tcp-engine', type=click.Choice(['sr1', 'batch', 'connect'], case_sensitive=False), default=None,
+              help='TCP probe engine: one sr1() per test, one batched SYN scan for the whole run, or non-blocking '
+                   'connect() calls that need no root. connect is used automatically when raw sockets are unavailable. '
+                   '[default: sr1, or batch with --monitor]')
+@click.option('--udp-engine', type=click.Choice(['sr1', 'batch'], case_sensitive=False), default=None,
+              help='UDP probe engine: one sr1() per test, or batched probes interleaved across hosts and paced to '
+                   'each host\'s learned ICMP rate limit, re-probing ports whose port-unreachable it may have dropped. '
+                   '[default: sr1, or batch with --monitor]')
+@click.option('--udp-payloads/--no-udp-payloads', default=True,
+              help='Probe well-known UDP ports (DNS, NTP, SNMP, IKE, ...) with a request their service answers, so '
+                   'allowed ports show up as open. Test case payload / payload_hex fields override it either way.')
+@click.option('--concurrency', '-c', type=click.IntRange(min=1), default=DEFAULT_CONCURRENCY,
+              help='Maximum number of probes in flight.')
+@click.option('--max-pps', type=click.FloatRange(min=0, min_open=True), default=None,
+              help='Global packets-per-second limit on every probe and retransmission, whatever the engine.')
+@click.option('--per-host-limit', type=click.IntRange(min=1), default=None,
+              help='Maximum number of in-flight probes per destination.')
+@click.option('--timeout', type=click.FloatRange(min=0, min_open=True), default=DEFAULT_TIMEOUT,
+              help='Probe timeout in seconds (the initial per-host timeout with adaptive timeouts).')
+@click.option('--adaptive-timeout/--fixed-timeout', default=True,
+              help='Derive per-host timeouts from measured round-trip times.')
+@click.option('--retries', type=click.IntRange(min=0), default=DEFAULT_RETRIES,
+              help='Retransmissions of an unanswered probe before it is declared filtered.')
+@click.option('--cache/--no-cache', default=True,
+              help='Probe each (dest_ip, dest_port, protocol) once and reuse its verdict for duplicates.')
+@click.option('--cache-file', type=click.Path(dir_okay=False), default=None,
+              help='Persist probe verdicts to this SQLite file and reuse fresh ones across runs.')
+@click.option('--cache-ttl', type=click.FloatRange(min=0), default=CACHE_TTL,
+              help='Seconds a cached verdict stays fresh.')
+@click.option('--cache-size', type=click.IntRange(min=1), default=CACHE_MAX_ENTRIES,
+              help='Maximum number of cached verdicts.')
+@click.option('--fast-path/--scapy-path', default=True,
+              help='Build batched SYNs from raw packet templates instead of scapy packets (needs raw sockets).')
+@click.option('--validate-only', '--dry-run', 'validate_only', is_flag=True,
+              help='Parse, validate and expand the test cases and print the planned probe count and estimated '
+                   'run time without sending any packets.')
+@click.option('--ruleset', 'ruleset_file', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Evaluate the test cases offline against an iptables-save or "nft list ruleset" dump.')
+@click.option('--ruleset-chain', default='INPUT', show_default=True,
+              help='Chain probes enter in the ruleset (INPUT, FORWARD or a chain name).')
+@click.option('--ruleset-source', default=None,
+              help="The tester's source address as the simulated firewall sees it.")
+@click.option('--ruleset-iface', default=None,
+              help='The interface probes arrive on at the simulated firewall.')
+@click.option('--record', 'record_file', type=click.Path(dir_okay=False), default=None,
+              help='Record every probe sent and reply received to this pcap file.')
+@click.option('--replay', 'replay_file', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Re-evaluate the test cases offline against a pcap or pcapng capture of an earlier run.')
+@click.option('--replay-source', default=None,
+              help="Comma-separated addresses the replayed capture's probes were sent from "
+                   "(default: the source of its first packet and of every TCP probe).")
+@click.option('--shards', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes to split the test cases across.')
+@click.option('--shard-by', type=click.Choice(['destination', 'interface'], case_sensitive=False),
+              default='destination', help='Split by a hash of the destination, or one shard per --interfaces entry.')
+@click.option('--interfaces', default=None,
+              help='Comma-separated interfaces to send from, one shard each (e.g. eth0,eth1,vlan20).')
+@click.option('--coordinator', 'coordinator_address', default=None, metavar='ADDRESS',
+              help='Hand the suite out to worker agents connecting on ADDRESS (host:port or unix:/path).')
+@click.option('--vantages', default=None,
+              help='Comma-separated vantage points that each run the whole suite (with --coordinator).')
+@click.option('--worker', 'worker_address', default=None, metavar='ADDRESS',
+              help='Run as a worker agent for the coordinator at ADDRESS instead of reading a test case file.')
+@click.option('--vantage', default=None,
+              help="This worker's vantage point (default: the host name).")
+@click.option('--token', envvar='FW_TESTER_TOKEN', default=None,
+              help='Shared secret workers present to the coordinator (with --coordinator or --worker; '
+                   'also read from FW_TESTER_TOKEN).')
+@click.option('--metrics-file', type=click.Path(dir_okay=False), default=None,
+              help='Keep run metrics in this Prometheus textfile, rewritten during the run and at the end.')
+@click.option('--metrics-port', type=click.IntRange(min=0, max=65535), default=None,
+              help='Serve live run metrics on http://127.0.0.1:PORT/metrics (and /metrics.json).')
+@click.option('--all-host-timing', is_flag=True,
+              help=f'List every host in the per-host timing summary, not just the {HOST_TIMING_TOP} slowest.')
+@click.option('--embed-metrics', is_flag=True,
+              help='Embed the run metrics JSON summary in the report (not available for csv).')
+@click.option('--profile', is_flag=True,
+              help='Sample the stacks of every thread during the run and log the busiest functions.')
+@click.option('--profile-output', type=click.Path(dir_okay=False), default=PROFILE_FILE, show_default=True,
+              help='Where --profile writes its collapsed stacks (for flamegraph.pl or speedscope).')
+@click.option('--baseline', 'baseline_file', type=click.Path(dir_okay=False), default=None,
+              help='Compare the results with, then record them in, this SQLite baseline of test case hashes '
+                   'and verdicts, and report every verdict change.')
+@click.option('--changed-only', is_flag=True,
+              help='With --baseline, probe only new or modified test cases plus a sample of unchanged ones.')
+@click.option('--sample-unchanged', type=click.FloatRange(min=0, max=1), default=BASELINE_SAMPLE, show_default=True,
+              help='Share of unchanged test cases a --changed-only run probes anyway.')
+@click.option('--sample-seed', type=int, default=None,
+              help='Seed for choosing the --sample-unchanged test cases (random by default).')
+@click.option('--diff-report', type=click.Path(dir_okay=False), default=None,
+              help='Also write the baseline diff to this JSON file.')
+@click.option('--monitor', is_flag=True,
+              help='Run as a daemon that keeps probing the suite, spread evenly over --interval, and alerts '
+                   'on every verdict change. Stops on SIGINT or SIGTERM.')
+@click.option('--interval', type=click.FloatRange(min=0, min_open=True), default=MONITOR_INTERVAL,
+              show_default=True, help='Seconds between two --monitor probes of a normal priority target.')
+@click.option('--alert-dir', type=click.Path(file_okay=False), default=None,
+              help='With --monitor, also write every verdict change to this directory as a JSON file.')
+@click.option('--probe-log-level', type=click.Choice(['auto', 'debug', 'info', 'warning', 'off'],
+                                                    case_sensitive=False), default='auto', show_default=True,
+              help=f'Per-test-case log lines: all (info), failures only (warning), none (off), or all for the '
+                   f'first {PROBE_LOG_AUTO_LIMIT} and then none (auto).')
+@click.option('--log-format', type=click.Choice(['text', 'json'], case_sensitive=False), default=LOG_FORMAT,
+              show_default=True, help='Write the log file as text lines or as one JSON object per line.')
+def main(test_cases_file, output_format, output_file, tcp_engine, udp_engine, udp_payloads, concurrency, max_pps,
+         per_host_limit, timeout, adaptive_timeout, retries, cache, cache_file, cache_ttl, cache_size, fast_path,
+         validate_only, ruleset_file, ruleset_chain, ruleset_source, ruleset_iface, record_file, replay_file,
+         replay_source, shards, shard_by, interfaces, coordinator_address, vantages, worker_address, vantage, token,
+         metrics_file, metrics_port, all_host_timing, embed_metrics, profile, profile_output, baseline_file,
+         changed_only, sample_unchanged, sample_seed, diff_report, monitor, interval, alert_dir, probe_log_level,
+         log_format):
     """
     A command-line tool to test firewall rules.
 
-    TEST_CASES_FILE: Path to a YAML file containing firewall test cases.
+    TEST_CASES_FILE: Path to a YAML (single or multi-document) or JSON Lines
+    (.jsonl) file containing firewall test cases. Not used with --worker.
     """
+    if not test_cases_file and (validate_only or not worker_address):
+        raise click.UsageError("Missing argument 'TEST_CASES_FILE'.")
+    if (changed_only or diff_report) and not baseline_file:
+        raise click.UsageError("--changed-only and --diff-report need --baseline.")
+    if monitor and (worker_address or coordinator_address or shards > 1 or shard_by == 'interface'
+                    or baseline_file or output_file):
+        raise click.UsageError("--monitor runs one tester in this process and reports through alerts; it cannot be "
+                               "combined with --worker, --coordinator, --shards, --baseline or --output-file.")
+    if replay_file and ruleset_file:
+        raise click.UsageError("--replay and --ruleset are two offline sources; pick one.")
+    if replay_source and not replay_file:
+        raise click.UsageError("--replay-source needs --replay.")
+    if record_file and (replay_file or ruleset_file or worker_address or coordinator_address or shards > 1
+                        or shard_by == 'interface'):
+        raise click.UsageError("--record captures the probes of one tester in this process; it cannot be combined "
+                               "with --replay, --ruleset, --worker, --coordinator or --shards.")
+    set_probe_log_level(probe_log_level.lower())
+    set_log_format(log_format.lower())
+    if output_format != 'console' and not output_file:
+        # The report goes to stdout; keep the log lines out of it
+        set_console_stream('stderr')
+    host_timing_top = None if all_host_timing else HOST_TIMING_TOP
     try:
-        fw_logger.info(f"[*] Starting Firewall Rule Tester with test cases from: {test_cases_file}")
+        if worker_address:
+            fw_logger.info(f"[*] Starting Firewall Rule Tester worker for coordinator: {worker_address}")
+        else:
+            fw_logger.info(f"[*] Starting Firewall Rule Tester with test cases from: {test_cases_file}")
+
+        # A monitor keeps the batch engines' sockets and sniffers open for its whole life; sr1 opens them per probe
+        default_engine = "batch" if monitor else "sr1"
+        tcp_engine = (tcp_engine or default_engine).lower()
+        udp_engine = (udp_engine or default_engine).lower()
+        if not ruleset_file and not replay_file and not coordinator_address:
+            tcp_engine = pick_tcp_engine(tcp_engine)
+            udp_engine = pick_udp_engine(udp_engine)
+
+        if validate_only:
+            validate_suite(test_cases_file, tcp_engine=tcp_engine, udp_engine=udp_engine,
+                           concurrency=concurrency, max_pps=max_pps, timeout=timeout, retries=retries)
+            return
 
-        test_cases = parse_test_cases(test_cases_file)
-        if not test_cases:
-            fw_logger.error("Error: No test cases loaded. Exiting.")
+        ruleset = None
+        if ruleset_file:
+            try:
+                ruleset = load_ruleset(ruleset_file, chain=ruleset_chain, source_ip=ruleset_source,
+                                       iface=ruleset_iface)
+            except (ValueError, OSError) as e:
+                fw_logger.error(f"[ERROR] Could not load ruleset {ruleset_file}: {e}")
+                sys.exit(1)
+            # Simulated verdicts must not mix with cached live ones
+            cache = False
+        elif replay_file:
+            replay_sources = [address.strip() for address in replay_source.split(',') if address.strip()] \
+                if replay_source else None
+            try:
+                ruleset = load_capture(replay_file, sources=replay_sources)
+            except (ValueError, OSError) as e:
+                fw_logger.error(f"[ERROR] Could not load capture {replay_file}: {e}")
+                sys.exit(1)
+            # Recorded verdicts must not mix with cached live ones either
+            cache = False
+
+        tester_options = dict(tcp_engine=tcp_engine, udp_engine=udp_engine, concurrency=concurrency,
+                              max_pps=max_pps, per_host_limit=per_host_limit, timeout=timeout,
+                              adaptive_timeout=adaptive_timeout, retries=retries, fast_path=fast_path, ruleset=ruleset,
+                              udp_payloads=udp_payloads)
+        interface_list = [name.strip() for name in interfaces.split(',') if name.strip()] if interfaces else []
+        if shard_by == 'interface' and not interface_list:
+            fw_logger.error("[ERROR] --shard-by interface needs --interfaces.")
             sys.exit(1)
 
-        tester = FirewallRuleTester(test_cases=test_cases)
+        recorder = None
+        if record_file:
+            if tcp_engine == "connect":
+                fw_logger.warning("[WARNING] The connect engine leaves the TCP handshakes to the kernel; "
+                                  "only UDP probes will be recorded.")
+            recorder = PcapWriter(record_file)
+            # Verdicts kept from earlier runs would leave their targets out of the capture
+            cache_file = None
 
-        results = tester.run_tests()
-        report = generate_report(results, output_format)
+        run_metrics = RunMetrics()
+        exporter = None
+        if metrics_file or metrics_port is not None:
+            exporter = MetricsExporter(run_metrics, textfile=metrics_file, port=metrics_port).start()
+        profiler = SamplingProfiler().start() if profile else None
+        tester = None
+        try:
+            if worker_address:
+                probe_cache = ProbeCache(path=cache_file, ttl=cache_ttl, max_entries=cache_size) if cache else None
+                try:
+                    run_worker(worker_address, vantage or socket.gethostname(), cache=probe_cache, token=token,
+                               iface=interface_list[0] if interface_list else None, metrics=run_metrics,
+                               **tester_options)
+                except (ValueError, OSError) as e:
+                    fw_logger.error(f"[ERROR] Worker stopped: {e}")
+                    sys.exit(1)
+                finally:
+                    if probe_cache is not None:
+                        probe_cache.close()
+                fw_logger.info("[*] Firewall Rule Tester finished.")
+                return
 
-        if output_file:
-            try:
-                with open(output_file, 'w') as f:
-                    f.write(report)
-                fw_logger.info(f"[*] Report saved to: {output_file}")
-            except IOError as e:
-                fw_logger.error(f"Error: Could not write report to file {output_file}: {e}")
-        else:
-            # Use the logger to print the report to the console
-            fw_logger.info(report)
+            # Stream test cases so probing starts while the file is still being read
+            test_cases = iter_test_cases(test_cases_file, metrics=run_metrics)
+            baseline = None
+            if baseline_file:
+                baseline = BaselineStore(baseline_file)
+                test_cases = baseline.select(test_cases, changed_only=changed_only, sample=sample_unchanged,
+                                             seed=sample_seed)
+            first_test_case = next(test_cases, None)
+            if first_test_case is None:
+                if baseline is not None and baseline.selection['unchanged_skipped']:
+                    fw_logger.info("[*] No new or modified test cases, and none of the unchanged ones sampled.")
+                    write_baseline_diff(baseline, diff_report)
+                    fw_logger.info("[*] Firewall Rule Tester finished.")
+                    return
+                fw_logger.error("Error: No test cases loaded. Exiting.")
+                sys.exit(1)
+            test_cases = itertools.chain([first_test_case], test_cases)
+
+            if monitor:
+                # No probe cache: a verdict reused from an earlier probe would hide a change
+                tester = FirewallRuleTester(test_cases=test_cases, iface=interface_list[0] if interface_list else None,
+                                            metrics=run_metrics, recorder=recorder, **tester_options)
+                run_monitor(tester, interval, alert_dir)
+                fw_logger.info("[*] Firewall Rule Tester finished.")
+                return
+
+            probe_cache = None
+            if coordinator_address:
+                # Probing options belong to the workers; the coordinator only hands out work
+                vantage_list = [name.strip() for name in vantages.split(',') if name.strip()] if vantages else None
+                tester = Coordinator(test_cases, coordinator_address, vantages=vantage_list, metrics=run_metrics,
+                                     token=token)
+            elif shards > 1 or shard_by == 'interface':
+                # Every shard opens its own cache file next to --cache-file; shards never share a destination
+                cache_options = {'path': cache_file, 'ttl': cache_ttl, 'max_entries': cache_size} if cache else None
+                tester = ShardedRuleTester(test_cases, shards, shard_by=shard_by.lower(), interfaces=interface_list,
+                                           cache_options=cache_options, metrics=run_metrics, **tester_options)
+            else:
+                probe_cache = ProbeCache(path=cache_file, ttl=cache_ttl, max_entries=cache_size) if cache else None
+                tester = FirewallRuleTester(test_cases=test_cases, cache=probe_cache,
+                                            iface=interface_list[0] if interface_list else None, metrics=run_metrics,
+                                            recorder=recorder, **tester_options)
+
+            if output_format in REPORT_WRITERS:
+                fields = RESULT_FIELDS + ('vantage',) if coordinator_address else RESULT_FIELDS
+                write_streaming_report(tester, output_format, output_file, fields, embed_metrics, baseline,
+                                       host_timing_top)
+            else:
+                write_report(tester, output_format, output_file, embed_metrics, baseline, host_timing_top)
+            if baseline is not None:
+                write_baseline_diff(baseline, diff_report)
+            if probe_cache is not None:
+                probe_cache.close()
+        finally:
+            if isinstance(tester, FirewallRuleTester):
+                tester.close()
+            if recorder is not None:
+                recorder.close()
+            if profiler is not None:
+                profiler.stop()
+                profiler.write_collapsed(profile_output)
+                fw_logger.info("\n".join(format_profile(profiler)))
+                fw_logger.info(f"[*] Profile saved to: {profile_output}")
+            if exporter is not None:
+                exporter.stop()
 
     except Exception as e:
         fw_logger.critical(f"[CRITICAL] An unhandled error occurred: {e}")
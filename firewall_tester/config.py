@@ -6,8 +6,140 @@ import os
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
 LOG_FILE = os.path.join(LOG_DIR, 'firewall_test.log')
 
+# Log file format: 'text' lines or 'json' objects (one per line)
+LOG_FORMAT = 'text'
+
+# Maximum number of log records the background log writer writes per flush
+LOG_BATCH_SIZE = 512
+
+# Per-probe log records kept by the default 'auto' probe log level before
+# per-probe logging is switched off
+PROBE_LOG_AUTO_LIMIT = 1000
+
 # Default timeout for network operations in seconds
 DEFAULT_TIMEOUT = 1
 
+# Bounds in seconds for per-host timeouts derived from measured RTTs
+MIN_RTT_TIMEOUT = 0.1
+MAX_RTT_TIMEOUT = 10
+
+# Hosts the timing table keeps RTT estimates and counters for; the least recently probed are dropped
+TIMING_MAX_HOSTS = 65536
+
+# Slowest hosts the per-host timing report lists by default, below a line summing up every host
+HOST_TIMING_TOP = 10
+
+# Retransmissions of an unanswered probe before it is declared filtered
+DEFAULT_RETRIES = 0
+
+# Default number of probes in flight (1 runs test cases serially)
+DEFAULT_CONCURRENCY = 1
+
+# Seconds a cached probe verdict stays fresh, and the maximum number kept
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 100000
+
+# Share of unchanged test cases a --changed-only run probes anyway to catch drift
+BASELINE_SAMPLE = 0.05
+
+# Test cases and results staged in memory before they are written to the baseline store
+BASELINE_WRITE_BATCH = 10000
+
+# Maximum number of verdict changes listed in a baseline diff (all are counted)
+BASELINE_DIFF_LIMIT = 10000
+
+# Number of expanded test cases covered by one batched SYN scan window
+BATCH_SCAN_SIZE = 4096
+
+# Receive buffer in bytes for the raw reply sockets of the batch SYN fast path
+RAW_RECV_BUFFER = 8 * 1024 * 1024
+
+# Maximum number of probes the scheduler keeps submitted but not yet handed back;
+# a slow probe at the head of the run stops new ones from being queued behind it
+SCHEDULER_MAX_PENDING = 4096
+
+# Maximum number of TCP connect() probes in flight at once for the unprivileged
+# connect engine; also capped by the open file limit
+CONNECT_MAX_IN_FLIGHT = 4096
+
+# Assumed ICMP error rate limit of a destination until learned: Linux sends about one
+# error per second per destination, after a burst of six
+ICMP_RATE = 1.0
+ICMP_BURST = 6
+
+# Upper bound of a learned ICMP error rate limit, in errors per second
+ICMP_RATE_MAX = 1000.0
+
+# UDP probes are paced at this factor above a host's learned ICMP rate, so the
+# estimate can grow toward the real limit; errors the host then drops are re-probed
+ICMP_HEADROOM = 1.5
+
+# Recent ICMP errors per host that its rate limit is measured over
+ICMP_RATE_WINDOW = 32
+
+# Re-probes of an unanswered UDP port whose port-unreachable the host may have
+# rate limited away
+UDP_REPROBES = 2
+
+# Rules per block of the two-level ruleset simulator index
+RULE_BLOCK_SIZE = 256
+
+# Test cases sent to (and results returned from) a shard worker per message, counted
+# after expansion; one destination's ports are never split between messages
+SHARD_CHUNK_SIZE = 256
+
+# Maximum number of test cases in flight across all shards, bounding the reorder buffer
+SHARD_WINDOW = 65536
+
+# Test cases handed to a distributed worker per work unit
+DIST_CHUNK_SIZE = 1024
+
+# Work units a distributed worker requests ahead of the one it is running
+DIST_PREFETCH = 2
+
+# Maximum number of work units between the oldest unreported one and the newest
+# handed out, bounding how far one vantage point can run ahead of another
+DIST_WINDOW = 64
+
+# Seconds after which an idle worker may rerun a work unit a slow worker still holds
+DIST_REISSUE_AFTER = 30
+
+# Upper bounds in seconds of the run metrics' RTT histogram buckets
+METRICS_RTT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Seconds between rewrites of the Prometheus metrics textfile during a run
+METRICS_WRITE_INTERVAL = 15
+
+# Seconds between stack samples taken by the --profile sampling profiler
+PROFILE_INTERVAL = 0.005
+
+# Collapsed-stack output of the --profile sampling profiler
+PROFILE_FILE = os.path.join(LOG_DIR, 'profile.folded')
+
+# Seconds over which --monitor spreads one round of probes to every target
+MONITOR_INTERVAL = 3600
+
+# Probes per --monitor interval for each test case 'priority'
+MONITOR_PRIORITIES = {'high': 4, 'normal': 1, 'low': 0.25}
+
+# Probes falling due within this many seconds of each other go out in one --monitor batch
+MONITOR_BATCH_WINDOW = 0.25
+
+# Snapshot length written in the header of --record captures
+PCAP_SNAPLEN = 65535
+
+# Bytes of a --record capture buffered in memory before they are written to disk
+PCAP_WRITE_BUFFER = 1 << 20
+
+# Seconds a probe read from a --replay capture waits for its reply before it counts as
+# unanswered and is forgotten
+REPLAY_PROBE_WINDOW = 60
+
+# Seconds between checks of the kernel's route change notifications by the route cache
+ROUTE_CHECK_INTERVAL = 1.0
+
+# Seconds the route cache keeps an entry where route changes cannot be watched (no rtnetlink)
+ROUTE_CACHE_TTL = 60
+
 # Verbosity level for console output
 VERBOSE_CONSOLE_OUTPUT = True
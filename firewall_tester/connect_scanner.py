@@ -0,0 +1,266 @@
+import collections
+import errno
+import heapq
+import itertools
+import resource
+import selectors
+import socket
+import struct
+import time
+
+from .logger import fw_logger
+from .config import DEFAULT_TIMEOUT, CONNECT_MAX_IN_FLIGHT
+
+# connect() errors the kernel reports for ICMP unreachables, local firewall
+# rejects and its own SYN timeout: the port is behind a filter
+FILTERED_ERRNOS = frozenset(code for code in (
+    errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EACCES, errno.EPERM, errno.ETIMEDOUT,
+    getattr(errno, 'EHOSTDOWN', None), getattr(errno, 'ENONET', None)) if code is not None)
+
+# Errors that mean this process ran out of sockets or ports, not that the probe failed
+EXHAUSTED_ERRNOS = frozenset((errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL))
+
+# File descriptors left for the log, cache and report files while connections are in flight
+RESERVED_FDS = 64
+
+# Close with an RST instead of a FIN, so open ports leave no TIME_WAIT sockets behind
+_LINGER_RESET = struct.pack('ii', 1, 0)
+
+def connection_limit(wanted):
+    """
+    Returns how many sockets can be open at once, up to `wanted`. Raises the
+    soft open file limit toward the hard one first if it is lower.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = wanted + RESERVED_FDS
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        raised = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (raised, hard))
+            soft = raised
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return wanted
+    return max(1, min(wanted, soft - RESERVED_FDS))
+
+class ConnectScanner:
+    """
+    TCP engine for unprivileged runs. Every target gets a non-blocking
+    connect(), thousands at once, driven by one selectors loop (epoll on
+    Linux); the kernel does the handshake, so no raw sockets or root are
+    needed. A completed connection means open, ECONNREFUSED closed, and an
+    ICMP unreachable or no answer within the reply window filtered.
+
+    Open ports see a full handshake, which they may log, where a SYN scan
+    only sends a SYN and an RST.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, iface=None, inter=0, timing=None, retries=0,
+                 max_in_flight=CONNECT_MAX_IN_FLIGHT, recorder=None, routes=None, rate_limiter=None):
+        """
+        Initializes the ConnectScanner.
+
+        Args:
+            timeout (float): Seconds to wait for a connection, used when no timing table is given.
+            iface (str): Interface to bind the sockets to (SO_BINDTODEVICE), or None.
+            inter (float): Delay in seconds between two consecutive connects.
+            timing (TimingTable): Per-host RTT estimates that size each connect's
+                window and record RTT samples, or None for a fixed window.
+            retries (int): Reconnects of a target whose connect timed out.
+            max_in_flight (int): Maximum number of connects in progress at once.
+            recorder (PcapWriter): Unused; the kernel makes the handshakes, so there
+                are no packets to record.
+            routes (RouteCache): Unused; the kernel routes every connect itself.
+            rate_limiter (TokenBucket): Run-wide packet rate limit every connect,
+                reconnects included, waits for, or None for no limit.
+        """
+        self.timeout = timeout
+        self.iface = iface
+        self.inter = inter
+        self.timing = timing
+        self.retries = retries
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter
+        self._verdicts = {}
+        self._addresses = {}
+        self._persistent = False
+
+    @staticmethod
+    def available():
+        return True
+
+    def open(self, targets):
+        """
+        Marks the start of a series of scans, which then log their progress at
+        debug level. Connect scans hold no sockets between scans.
+        """
+        self._persistent = True
+        return self
+
+    def close(self):
+        self._persistent = False
+
+    def _window(self, dest_ip, attempt):
+        if self.timing is None:
+            return self.timeout * (2 ** attempt)
+        return self.timing.timeout_for(dest_ip, attempt)
+
+    def _connect(self, selector, target, attempt):
+        """
+        Starts a non-blocking connect to `target`.
+
+        Returns:
+            tuple: (socket, None) if the connect is in progress, or
+                (None, errno) if it finished or failed at once.
+        """
+        sock = None
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+            if self.iface:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.iface.encode())
+            if self.timing is not None:
+                self.timing.record_probe(target[0], attempt)
+            code = sock.connect_ex((self._addresses[target[0]], target[1]))
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+            return None, e.errno
+        if code in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+            selector.register(sock, selectors.EVENT_WRITE, (target, attempt, time.monotonic()))
+            return sock, None
+        sock.close()
+        return None, code
+
+    def _finish(self, target, attempt, code, rtt=None):
+        """
+        Records the verdict a finished connect means.
+        """
+        if code == 0:
+            verdict, kind = "open", "syn-ack"
+        elif code == errno.ECONNREFUSED:
+            verdict, kind = "closed", "rst"
+        elif code in FILTERED_ERRNOS:
+            verdict, kind = "filtered", "icmp-unreachable"
+        else:
+            fw_logger.error(f"[ERROR] TCP connect to {target[0]}:{target[1]} failed: {errno.errorcode.get(code, code)}")
+            self._verdicts[target] = "error"
+            return
+        self._verdicts[target] = verdict
+        if self.timing is not None and code != errno.ETIMEDOUT:
+            # Karn's rule: replies to reconnects are not RTT samples
+            self.timing.record_reply(target[0], rtt if attempt == 0 else None, kind)
+
+    def _run(self, targets):
+        """
+        Keeps up to max_in_flight connects in progress until every target has
+        a verdict or ran out of attempts. Returns the number of connects made.
+
+        Running out of sockets or local ports lowers the limit to the connects
+        in progress; every connect that finishes raises it by one again.
+        """
+        ceiling = limit = connection_limit(self.max_in_flight)
+        queue = collections.deque((target, 0) for target in targets)
+        deadlines = []  # (deadline, tiebreak, socket) of connects in progress
+        tiebreak = itertools.count()
+        in_flight = 0
+        connects = 0
+
+        with selectors.DefaultSelector() as selector:
+            while queue or in_flight:
+                while queue and in_flight < limit:
+                    target, attempt = queue.popleft()
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.acquire()
+                    sock, code = self._connect(selector, target, attempt)
+                    connects += 1
+                    if sock is not None:
+                        in_flight += 1
+                        heapq.heappush(deadlines, (time.monotonic() + self._window(target[0], attempt),
+                                                   next(tiebreak), sock))
+                    elif code in EXHAUSTED_ERRNOS and in_flight:
+                        # Out of sockets or local ports: wait for connects in progress to free some
+                        queue.appendleft((target, attempt))
+                        limit = in_flight
+                        break
+                    else:
+                        self._finish(target, attempt, code)
+                    if self.inter:
+                        time.sleep(self.inter)
+
+                if not in_flight:
+                    continue  # Every connect failed at once; nothing to wait for
+                timeout = max(0, deadlines[0][0] - time.monotonic()) if deadlines else None
+                for key, _ in selector.select(timeout):
+                    sock = key.fileobj
+                    target, attempt, started = key.data
+                    selector.unregister(sock)
+                    in_flight -= 1
+                    limit = min(ceiling, limit + 1)
+                    code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    sock.close()
+                    self._finish(target, attempt, code, time.monotonic() - started)
+
+                now = time.monotonic()
+                while deadlines and (deadlines[0][0] <= now or deadlines[0][2].fileno() < 0):
+                    _, _, sock = heapq.heappop(deadlines)
+                    if sock.fileno() < 0:
+                        continue  # Finished before its deadline
+                    target, attempt, _ = selector.get_key(sock).data
+                    selector.unregister(sock)
+                    sock.close()
+                    in_flight -= 1
+                    limit = min(ceiling, limit + 1)
+                    if self.timing is not None:
+                        self.timing.record_timeout(target[0])
+                    if attempt < self.retries:
+                        queue.append((target, attempt + 1))
+        return connects
+
+    def _resolve(self, targets):
+        """
+        Resolves each distinct destination to an IPv4 address once per scan.
+        Returns the targets that could not be resolved.
+        """
+        for dest_ip in {dest_ip for dest_ip, _ in targets}:
+            try:
+                self._addresses[dest_ip] = socket.gethostbyname(dest_ip)
+            except (OSError, UnicodeError) as e:
+                fw_logger.error(f"[ERROR] Could not resolve {dest_ip}: {e}")
+        return [target for target in targets if target[0] not in self._addresses]
+
+    def scan(self, targets):
+        """
+        Connects to every (dest_ip, dest_port) target.
+
+        Args:
+            targets (iterable): (dest_ip, dest_port) tuples.
+
+        Returns:
+            dict: Maps (dest_ip, dest_port) to 'open', 'closed', 'filtered' or 'error'.
+        """
+        targets = list(dict.fromkeys(targets))
+        if not targets:
+            return {}
+
+        self._verdicts = {}
+        self._addresses = {}
+        results = {target: "error" for target in self._resolve(targets)}
+        targets = [target for target in targets if target[0] in self._addresses]
+        if not targets:
+            return results
+
+        log = fw_logger.debug if self._persistent else fw_logger.info
+        log(f"[*] Connecting to {len(targets)} TCP targets...")
+        try:
+            connects = self._run(targets)
+        except Exception as e:
+            fw_logger.error(f"[ERROR] TCP connect scan failed: {e}")
+            results.update((target, "error") for target in targets)
+            return results
+        log(f"[*] Made {connects} TCP connects for {len(targets)} targets.")
+
+        # No answer usually means filtered
+        results.update((target, self._verdicts.get(target, "filtered")) for target in targets)
+        return results
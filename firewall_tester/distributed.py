@@ -0,0 +1,545 @@
+import collections
+import hmac
+import itertools
+import json
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+
+from .logger import fw_logger
+from .config import DIST_CHUNK_SIZE, DIST_PREFETCH, DIST_WINDOW, DIST_REISSUE_AFTER
+from .rules_parser import expand_test_cases
+from .results import RESULT_FIELDS
+from .metrics import RunMetrics, timed
+from .sharding import run_chunks, _MergedTiming
+from .tester import FirewallRuleTester
+
+# Seconds the coordinator waits for workers to report their timing after the run
+_FINISH_TIMEOUT = 5
+
+def parse_address(address):
+    """
+    Parses a coordinator address: 'unix:/path/to/socket' for a Unix socket or
+    'host:port' for TCP, where an empty host listens on all interfaces and
+    IPv6 hosts are written in brackets ('[::1]:7878').
+
+    Args:
+        address (str): The address to parse.
+
+    Returns:
+        tuple: (socket family, address to bind or connect to).
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"Invalid address '{address}': expected host:port or unix:/path/to/socket")
+    if host.startswith("[") and host.endswith("]"):
+        return socket.AF_INET6, (host[1:-1], int(port))
+    return socket.AF_INET, (host, int(port))
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _is_outcome(outcome):
+    return isinstance(outcome, dict) and all(field in outcome for field in RESULT_FIELDS) \
+        and isinstance(outcome['status'], str) and isinstance(outcome['actual_result'], str)
+
+def _check_message(message):
+    """
+    Raises ValueError unless a message from a worker has the shape its type
+    needs, so nothing a peer sends can fail deeper in the coordinator loop.
+    """
+    if not isinstance(message, dict) or not isinstance(message.get('type'), str):
+        raise ValueError("not a JSON object with a type")
+    kind = message['type']
+    if kind == 'hello':
+        if not isinstance(message.get('vantage', ""), (str, type(None))) \
+                or not isinstance(message.get('token', ""), str):
+            raise ValueError("hello with a vantage point or token that is not a string")
+    elif kind == 'request':
+        if not _is_int(message.get('count', 1)):
+            raise ValueError("request without an integer count")
+    elif kind == 'results':
+        outcomes = message.get('outcomes')
+        if not _is_int(message.get('chunk')) or not isinstance(outcomes, list):
+            raise ValueError("results without a work unit number and a list of outcomes")
+        if not all(outcome is None or _is_outcome(outcome) for outcome in outcomes):
+            raise ValueError("results with a malformed outcome")
+    elif kind == 'timing':
+        rows = message.get('rows')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) and 'host' in row for row in rows) \
+                or not isinstance(message.get('metrics', {}), dict):
+            raise ValueError("timing without a list of host rows and a metrics summary")
+
+class _Connection:
+    """
+    One JSON object per line over a stream socket.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self._reader = sock.makefile('rb')
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        data = (json.dumps(message, separators=(',', ':'), default=str) + "\n").encode()
+        with self._lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """
+        Returns the next message, or None once the peer has closed the connection.
+        """
+        line = self._reader.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.close()
+        self.sock.close()
+
+class _Worker:
+    """
+    Coordinator-side state of one connected worker.
+    """
+    def __init__(self, worker_id, connection, vantage, group):
+        self.id = worker_id
+        self.connection = connection
+        self.vantage = vantage
+        self.group = group
+        self.wanted = 0      # Work units requested and not yet handed out
+        self.assigned = {}   # Work unit -> time it was handed out
+
+class _Group:
+    """
+    Progress of one vantage point (or of the shared pool) through the suite.
+    """
+    def __init__(self):
+        self.next_chunk = 0                  # First work unit never handed out in this group
+        self.requeue = collections.deque()   # Work units to hand out again, e.g. after a disconnect
+        self.holders = {}                    # Outstanding work unit -> {worker id: time handed out}
+        self.finished = {}                   # Work unit -> (vantage, outcomes) until it is reported
+
+class Coordinator:
+    """
+    Splits a test suite into work units and hands them to worker agents that
+    connect over TCP or a Unix socket. Workers pull work, so fast workers take
+    more of it. A unit held by a slow worker is handed to an idle one as well,
+    and the first result wins. The units of a worker that disconnects go back
+    in the queue.
+
+    With vantage points, every vantage point runs the whole suite, split among
+    its own workers. Without, all workers share one pool. Results are yielded
+    in test-case order, each tagged with the vantage point it was probed from.
+    """
+    def __init__(self, test_cases, address, vantages=None, chunk_size=DIST_CHUNK_SIZE, window=DIST_WINDOW,
+                 reissue_after=DIST_REISSUE_AFTER, metrics=None, token=None):
+        """
+        Initializes the Coordinator.
+
+        Args:
+            test_cases (iterable): A list or stream of test case dictionaries.
+            address (str): Address to listen on (see parse_address()).
+            vantages (list): Vantage point names that each run the whole suite,
+                or None to spread the suite over all workers.
+            chunk_size (int): Expanded test cases per work unit.
+            window (int): Maximum number of work units between the oldest
+                unreported one and the newest handed out.
+            reissue_after (float): Seconds after which an idle worker may rerun
+                a work unit another worker still holds.
+            metrics (RunMetrics): Run metrics for results as they arrive and the
+                workers' probe counters as they finish, or None for a fresh set.
+            token (str): Shared secret every worker must present in its hello
+                message, or None to accept any worker.
+        """
+        self.test_cases = test_cases
+        self.family, self.address = parse_address(address)
+        self.vantages = list(vantages or [])
+        self.chunk_size = chunk_size
+        self.window = window
+        self.reissue_after = reissue_after
+        self.timing = _MergedTiming()
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.token = token
+        self.results = []
+        self._server = None
+        self._events = queue.Queue()
+        self._connecting = {}
+        self._workers = {}
+        self._finishing = False
+
+    def start(self):
+        """
+        Starts listening for workers. iter_results() calls this itself; call
+        it first to learn the bound address, e.g. after listening on port 0.
+        """
+        if self._server is not None:
+            return
+        server = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_UNIX:
+            # Remove a socket left behind by an earlier run, but never a regular file
+            if os.path.exists(self.address) and stat.S_ISSOCK(os.stat(self.address).st_mode):
+                os.unlink(self.address)
+        else:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(self.address)
+        server.listen()
+        self._server = server
+        self.address = server.getsockname()
+        threading.Thread(target=self._accept_loop, name="coordinator-accept", daemon=True).start()
+        fw_logger.info(f"[*] Coordinator listening on {self.address}")
+        if self.family != socket.AF_UNIX and self.token is None:
+            fw_logger.warning("[WARNING] No worker token set: any peer that can reach the coordinator can submit "
+                              "results.")
+        if self.vantages:
+            fw_logger.info(f"[*] Waiting for workers from vantage points: {', '.join(self.vantages)}")
+
+    def _accept_loop(self):
+        worker_ids = itertools.count(1)
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return  # The server socket was closed
+            threading.Thread(target=self._read_loop, args=(next(worker_ids), _Connection(sock)), daemon=True).start()
+
+    def _read_loop(self, worker_id, connection):
+        """
+        Forwards one worker's messages to the coordinator loop; None marks a
+        closed connection.
+        """
+        self._events.put((worker_id, connection))
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                self._events.put((worker_id, message))
+        except (OSError, ValueError):
+            pass
+        self._events.put((worker_id, None))
+
+    def _load(self):
+        """
+        Reads the next work unit from the test cases. Returns False once they
+        are exhausted.
+        """
+        test_cases = list(itertools.islice(self._source, self.chunk_size))
+        if not test_cases:
+            self._exhausted = True
+            return False
+        self._chunks[self._loaded] = test_cases
+        self._loaded += 1
+        return True
+
+    def _handle(self, worker_id, message):
+        if isinstance(message, _Connection):
+            self._connecting[worker_id] = message
+            return
+        worker = self._workers.get(worker_id)
+        if message is None:
+            self._connecting.pop(worker_id, None)
+            if worker is not None:
+                self._drop(worker)
+            return
+
+        try:
+            _check_message(message)
+        except ValueError as e:
+            if worker is not None or worker_id in self._connecting:
+                self._reject(worker_id, f"malformed message: {e}")
+            return
+        kind = message['type']
+        if kind == 'hello' and worker_id in self._connecting:
+            vantage = message.get('vantage') or "default"
+            if self.token is not None and not hmac.compare_digest(message.get('token', "").encode(),
+                                                                  self.token.encode()):
+                self._reject(worker_id, "wrong or missing token")
+                return
+            if self.vantages and vantage not in self.vantages:
+                self._reject(worker_id, f"unknown vantage point '{vantage}', expected one of: "
+                                        f"{', '.join(self.vantages)}")
+                return
+            connection = self._connecting.pop(worker_id)
+            self._workers[worker_id] = _Worker(worker_id, connection, vantage, vantage if self.vantages else None)
+            fw_logger.info(f"[*] Worker {worker_id} joined from vantage point '{vantage}'.")
+        elif worker is None:
+            return
+        elif kind == 'request':
+            worker.wanted += max(0, message.get('count', 1))
+        elif kind == 'results':
+            self._complete(worker, message['chunk'], message['outcomes'])
+        elif kind == 'timing':
+            summary = None
+            if 'metrics' in message:
+                try:
+                    # Merged into a scratch set first, so a malformed summary leaves the run's counters untouched
+                    scratch = RunMetrics()
+                    scratch.merge(message['metrics'], results=False)
+                    summary = scratch.summary()
+                except (KeyError, TypeError, ValueError, IndexError, AttributeError) as e:
+                    self._reject(worker_id, f"malformed metrics summary ({e!r})")
+                    return
+            for row in message['rows']:
+                self.timing.rows.append(dict(row, host=f"{row['host']} ({worker.vantage})"))
+            if summary is not None:
+                # Results are counted once as they arrive; reruns would count twice here
+                self.metrics.merge(summary, results=False)
+
+    def _reject(self, worker_id, reason):
+        """
+        Tells a worker why it is turned away and closes its connection. Work
+        units it held go back in the queue.
+        """
+        fw_logger.warning(f"[WARNING] Rejected worker {worker_id}: {reason}.")
+        worker = self._workers.get(worker_id)
+        if worker is not None:
+            self._drop(worker)
+            connection = worker.connection
+        else:
+            connection = self._connecting.pop(worker_id)
+        try:
+            connection.send({'type': 'error', 'message': reason})
+        except OSError:
+            pass
+        connection.close()
+
+    def _complete(self, worker, chunk, outcomes):
+        worker.assigned.pop(chunk, None)
+        group = self._groups[worker.group]
+        holders = group.holders.get(chunk)
+        if holders is None or worker.id not in holders:
+            return  # Another worker reported this unit first
+        del group.holders[chunk]
+        if len(outcomes) != len(self._chunks[chunk]):
+            fw_logger.error(f"[ERROR] Worker {worker.id} returned {len(outcomes)} results for work unit {chunk} "
+                            f"of {len(self._chunks[chunk])} test cases; re-queueing it.")
+            group.requeue.appendleft(chunk)
+            return
+        group.finished[chunk] = (worker.vantage, outcomes)
+        for other in holders:
+            if other != worker.id and other in self._workers:
+                self._workers[other].assigned.pop(chunk, None)
+
+    def _drop(self, worker):
+        del self._workers[worker.id]
+        group = self._groups[worker.group]
+        requeued = []
+        for chunk in worker.assigned:
+            holders = group.holders.get(chunk)
+            if holders is None:
+                continue
+            holders.pop(worker.id, None)
+            if not holders:
+                del group.holders[chunk]
+                requeued.append(chunk)
+        group.requeue.extendleft(sorted(requeued, reverse=True))
+        if self._finishing:
+            return
+        fw_logger.warning(f"[WARNING] Worker {worker.id} ('{worker.vantage}') disconnected; "
+                          f"re-queued {len(requeued)} work units.")
+        if not any(other.group == worker.group for other in self._workers.values()):
+            fw_logger.warning(f"[WARNING] No workers left for vantage point '{worker.vantage}'; waiting for one "
+                              f"to connect.")
+
+    def _next_chunk_for(self, worker, now):
+        """
+        Picks the work unit to hand to a worker next, or None if there is none
+        for it right now.
+        """
+        group = self._groups[worker.group]
+        while group.requeue:
+            chunk = group.requeue.popleft()
+            if chunk >= self._next_out and chunk not in group.finished and chunk not in group.holders:
+                return chunk
+        if group.next_chunk < self._loaded:
+            group.next_chunk += 1
+            return group.next_chunk - 1
+        if not self._exhausted and self._loaded - self._next_out < self.window and self._load():
+            group.next_chunk += 1
+            return group.next_chunk - 1
+
+        # Nothing new: rerun the longest-held unit of a slow worker
+        stale = [(min(holders.values()), chunk) for chunk, holders in group.holders.items()
+                 if len(holders) == 1 and worker.id not in holders]
+        if stale:
+            issued_at, chunk = min(stale)
+            if now - issued_at >= self.reissue_after:
+                fw_logger.info(f"[*] Re-issuing work unit {chunk}, outstanding for {now - issued_at:.1f}s, "
+                               f"to worker {worker.id}.")
+                return chunk
+        return None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for worker in list(self._workers.values()):
+            group = self._groups[worker.group]
+            while worker.wanted:
+                chunk = self._next_chunk_for(worker, now)
+                if chunk is None:
+                    break
+                worker.wanted -= 1
+                worker.assigned[chunk] = now
+                group.holders.setdefault(chunk, {})[worker.id] = now
+                try:
+                    worker.connection.send({'type': 'chunk', 'chunk': chunk, 'test_cases': self._chunks[chunk]})
+                except OSError:
+                    break  # The read loop reports the disconnect
+
+    def iter_outcomes(self):
+        """
+        Runs the suite on the connected workers and yields, for every expanded
+        test case and vantage point in order, its result dictionary tagged
+        with a 'vantage' key, or None if it was skipped.
+        """
+        yield from timed(self._iter_outcomes(), self.metrics, 'probe')
+
+    def _iter_outcomes(self):
+        self.start()
+        self._groups = {group: _Group() for group in (self.vantages or [None])}
+        self._chunks = {}  # Work unit -> test cases, until every group has reported it
+        self._source = iter(expand_test_cases(self.test_cases))
+        self._loaded = self._next_out = 0
+        self._exhausted = False
+        self._load()
+
+        try:
+            while not (self._exhausted and self._next_out == self._loaded):
+                try:
+                    worker_id, message = self._events.get(timeout=1)
+                except queue.Empty:
+                    pass  # Wake up anyway to look for units to re-issue
+                else:
+                    self._handle(worker_id, message)
+
+                while self._next_out < self._loaded and all(
+                        self._next_out in group.finished for group in self._groups.values()):
+                    for group in self._groups.values():
+                        vantage, outcomes = group.finished.pop(self._next_out)
+                        for outcome in outcomes:
+                            if outcome is not None:
+                                outcome['vantage'] = vantage
+                                self.metrics.count_result(outcome['status'], outcome['actual_result'])
+                            yield outcome
+                    del self._chunks[self._next_out]
+                    self._next_out += 1
+                self.metrics.set_queue_depth('work_units', self._loaded - self._next_out)
+                self._dispatch()
+        finally:
+            self._finish()
+        fw_logger.info(f"[*] Distributed run finished: {self._next_out} work units.")
+
+    def _finish(self):
+        """
+        Tells the workers the suite is done, collects their timing and stops
+        listening.
+        """
+        self._finishing = True
+        for worker in self._workers.values():
+            try:
+                worker.connection.send({'type': 'done'})
+            except OSError:
+                pass
+        deadline = time.monotonic() + _FINISH_TIMEOUT
+        while self._workers and time.monotonic() < deadline:
+            try:
+                self._handle(*self._events.get(timeout=0.1))
+            except queue.Empty:
+                continue
+        for connection in list(self._connecting.values()) + [w.connection for w in self._workers.values()]:
+            connection.close()
+        self._server.close()
+        if self.family == socket.AF_UNIX:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+    def iter_results(self):
+        """
+        Runs the suite on the connected workers and yields a result dictionary
+        for each expanded test case and vantage point, in test-case order.
+        """
+        for result in self.iter_outcomes():
+            if result is not None:
+                yield result
+
+    def run_tests(self):
+        """
+        Runs the suite on the connected workers and stores the results.
+        """
+        self.results.extend(self.iter_results())
+        return self.results
+
+def run_worker(address, vantage, prefetch=DIST_PREFETCH, cache=None, token=None, **tester_options):
+    """
+    Connects to a coordinator and runs the work units it hands out through one
+    FirewallRuleTester until the coordinator reports the suite done.
+
+    Args:
+        address (str): The coordinator's address (see parse_address()).
+        vantage (str): The vantage point this worker probes from.
+        prefetch (int): Work units to request ahead of the one being run.
+        cache (ProbeCache): Optional probe cache for the tester.
+        token (str): Shared secret the coordinator expects, or None.
+        **tester_options: FirewallRuleTester arguments.
+
+    Returns:
+        int: The number of work units run.
+    """
+    family, sockaddr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(sockaddr)
+    connection = _Connection(sock)
+    chunks = queue.Queue()
+    ended = []  # Why the coordinator ended the session: None when the suite is done
+
+    def read():
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    ended.append("connection closed by the coordinator")
+                    return
+                kind = message.get('type')
+                if kind == 'chunk':
+                    chunks.put((message['chunk'], message['test_cases']))
+                elif kind == 'done':
+                    ended.append(None)
+                    return
+                elif kind == 'error':
+                    ended.append(message.get('message'))
+                    return
+        except (OSError, ValueError) as e:
+            ended.append(str(e))
+        finally:
+            chunks.put(None)
+
+    fw_logger.info(f"[*] Worker connected to coordinator {address} from vantage point '{vantage}'.")
+    hello = {'type': 'hello', 'vantage': vantage}
+    if token is not None:
+        hello['token'] = token
+    connection.send(hello)
+    threading.Thread(target=read, name="worker-reader", daemon=True).start()
+    try:
+        connection.send({'type': 'request', 'count': max(1, prefetch)})
+        units = 0
+        with FirewallRuleTester([], cache=cache, **tester_options) as tester:
+            for chunk, outcomes in run_chunks(tester, chunks):
+                connection.send({'type': 'results', 'chunk': chunk,
+                                 'outcomes': [None if outcome is None else outcome.to_dict() for outcome in outcomes]})
+                connection.send({'type': 'request', 'count': 1})
+                units += 1
+        if ended and ended[0] is not None:
+            raise ConnectionError(f"Coordinator {address} ended the session: {ended[0]}")
+        connection.send({'type': 'timing', 'rows': tester.timing.summary(), 'metrics': tester.metrics.summary()})
+    finally:
+        connection.close()
+    fw_logger.info(f"[*] Worker finished: ran {units} work units.")
+    return units
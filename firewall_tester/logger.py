@@ -1,36 +1,310 @@
 # firewall_tester/logger.py
 
+import atexit
+import json
 import logging
+import logging.handlers
+import multiprocessing.util
 import os
+import queue
 import sys
-from .config import LOG_FILE, LOG_DIR, VERBOSE_CONSOLE_OUTPUT
+import threading
+from .config import LOG_FILE, LOG_FORMAT, LOG_BATCH_SIZE, PROBE_LOG_AUTO_LIMIT, VERBOSE_CONSOLE_OUTPUT
+
+# Level that disables a logger entirely
+LOG_OFF = logging.CRITICAL + 1
+
+# Attributes every LogRecord has; anything else was passed with extra= and
+# goes into the JSON log as a field
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'taskName'}
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, with extra= fields as keys.
+    """
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def _file_formatter(log_format):
+    if log_format == 'json':
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+class _BatchedStreamHandler(logging.StreamHandler):
+    """
+    Stream handler that leaves flushing to the log writer, which flushes once
+    per batch instead of once per record.
+    """
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+class _LogFileHandler(logging.FileHandler):
+    """
+    File handler that creates the log directory and opens the log file only
+    when the first record is written, so importing the package does no I/O.
+    Flushing is left to the log writer.
+    """
+    def __init__(self, filename):
+        super().__init__(filename, delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+class _LogWriter:
+    """
+    Background thread that formats and writes queued records in batches of up
+    to LOG_BATCH_SIZE, flushing the handlers once per batch.
+    """
+    _STOP = object()
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < LOG_BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stopping = False
+            for record in batch:
+                if record is self._STOP:
+                    stopping = True
+                elif isinstance(record, threading.Event):
+                    continue  # A flush marker; set once the batch is written
+                else:
+                    for handler in self.handlers:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+            for handler in self.handlers:
+                try:
+                    handler.flush()
+                except (OSError, ValueError):
+                    pass  # The stream went away (e.g. stdout closed at exit); keep writing the rest
+            for record in batch:
+                if isinstance(record, threading.Event):
+                    record.set()
+            if stopping:
+                return
+
+    def flush(self, timeout=5):
+        """
+        Waits until every record queued so far has been written.
+        """
+        if self._thread.is_alive():
+            written = threading.Event()
+            self.queue.put(written)
+            written.wait(timeout)
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join(5)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the process's log writer thread, so the thread that logs
+    never waits on disk or terminal writes. Records are passed as they are and
+    formatted by the writer. A writer is started lazily in every process,
+    including shard workers, and drained when the process exits.
+    """
+    def __init__(self, handlers):
+        super().__init__(None)
+        self.handlers = handlers
+        self.writer = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        # Empty the write buffers before forking so the child cannot write them again
+        os.register_at_fork(before=self.flush, after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._start_lock = threading.Lock()
+
+    def _writer(self):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self.writer = _LogWriter(self.handlers)
+                    self._pid = os.getpid()
+                    atexit.register(self.writer.stop)
+                    # multiprocessing workers leave through os._exit(), which skips atexit
+                    multiprocessing.util.Finalize(None, self.writer.stop, exitpriority=0)
+        return self.writer
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self._writer().queue.put(record)
+
+    def flush(self):
+        if self._pid == os.getpid():
+            self.writer.flush()
 
 def setup_logging():
     """
     Configures logging for the Firewall Rule Tester.
-    Logs to a file and optionally to the console.
+    Logs to a file and optionally to the console, through a background writer.
     """
-    # Ensure log directory exists
-    os.makedirs(LOG_DIR, exist_ok=True)
-
     # Create a logger
     fw_logger = logging.getLogger('firewall_tester')
     fw_logger.setLevel(logging.INFO)
     fw_logger.propagate = False  # Prevent duplicate messages in console
 
-    # File handler
-    file_handler = logging.FileHandler(LOG_FILE)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    fw_logger.addHandler(file_handler)
+    # File handler, opened on first use
+    file_handler = _LogFileHandler(LOG_FILE)
+    file_handler.setFormatter(_file_formatter(LOG_FORMAT))
+    handlers = [file_handler]
 
     # Console handler
     if VERBOSE_CONSOLE_OUTPUT:
-        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler = _BatchedStreamHandler(sys.stdout)
         # Use a formatter that only shows the message for console output
         console_handler.setFormatter(logging.Formatter('%(message)s'))
-        fw_logger.addHandler(console_handler)
+        handlers.append(console_handler)
 
+    fw_logger.addHandler(_QueueHandler(handlers))
     return fw_logger
 
+class _ProbeLogLimit(logging.Filter):
+    """
+    Lets the first `limit` per-probe records through, then turns per-probe
+    logging off so large runs do not pay for it.
+    """
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.count = 0
+
+    def filter(self, record):
+        self.count += 1
+        if self.count == self.limit:
+            probe_logger.setLevel(LOG_OFF)
+            fw_logger.info(f"[*] Per-probe logging stops after {self.limit} records; "
+                           "use --probe-log-level info to keep it on.")
+        return self.count <= self.limit
+
+def set_probe_log_level(level):
+    """
+    Sets how much the tester logs per test case.
+
+    Args:
+        level (str): 'debug' or 'info' for every test case, 'warning' for
+            failures only, 'off' for nothing, or 'auto' for every test case
+            until PROBE_LOG_AUTO_LIMIT records have been logged, then nothing.
+    """
+    global _probe_log_level
+    _probe_log_level = level
+    for log_filter in list(probe_logger.filters):
+        probe_logger.removeFilter(log_filter)
+    if level == 'auto':
+        probe_logger.setLevel(logging.INFO)
+        probe_logger.addFilter(_ProbeLogLimit(PROBE_LOG_AUTO_LIMIT))
+    else:
+        probe_logger.setLevel(LOG_OFF if level == 'off' else getattr(logging, level.upper()))
+
+def set_log_format(log_format):
+    """
+    Switches the log file between 'text' lines and 'json' objects.
+    """
+    global _log_format
+    _log_format = log_format
+    for handler in fw_logger.handlers:
+        for target in getattr(handler, 'handlers', ()):
+            if isinstance(target, logging.FileHandler):
+                target.setFormatter(_file_formatter(log_format))
+
+def set_console_stream(name):
+    """
+    Sends console output to 'stdout' (the default) or 'stderr', e.g. to keep
+    a machine-readable report written to stdout free of log lines.
+    """
+    global _console_stream
+    _console_stream = name
+    for handler in fw_logger.handlers:
+        for target in getattr(handler, 'handlers', ()):
+            if isinstance(target, _BatchedStreamHandler):
+                handler.flush()
+                target.setStream(getattr(sys, name))
+
+def set_log_file(path):
+    """
+    Points the log file at `path` instead of LOG_FILE. Records already
+    written stay in the old file.
+    """
+    for handler in fw_logger.handlers:
+        for target in getattr(handler, 'handlers', ()):
+            if isinstance(target, _LogFileHandler):
+                handler.flush()
+                target.close()
+                target.baseFilename = os.path.abspath(path)
+
+def _log_file():
+    for handler in fw_logger.handlers:
+        for target in getattr(handler, 'handlers', ()):
+            if isinstance(target, _LogFileHandler):
+                return target.baseFilename
+    return None
+
+def logging_settings():
+    """
+    Returns the logging settings made so far, for a spawned process (which
+    starts from the defaults) to take over with apply_logging_settings().
+    """
+    return {'level': fw_logger.level, 'probe_log_level': _probe_log_level, 'log_format': _log_format,
+            'log_file': _log_file(), 'console': _console_stream}
+
+def apply_logging_settings(settings):
+    """
+    Applies settings returned by logging_settings() in another process.
+    """
+    fw_logger.setLevel(settings['level'])
+    set_probe_log_level(settings['probe_log_level'])
+    set_log_format(settings['log_format'])
+    if settings['log_file'] is not None:
+        set_log_file(settings['log_file'])
+    set_console_stream(settings['console'])
+
+def flush_logs():
+    """
+    Waits until everything logged so far has been written.
+    """
+    for handler in fw_logger.handlers:
+        handler.flush()
+
 # Initialize logger when module is imported
 fw_logger = setup_logging()
+_log_format = LOG_FORMAT
+_console_stream = 'stdout'
+
+# Per-test-case lines ([TEST], [PASS], [FAIL]) go through this child logger
+probe_logger = logging.getLogger('firewall_tester.probe')
+set_probe_log_level('auto')
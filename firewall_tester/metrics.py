@@ -0,0 +1,346 @@
+import bisect
+import collections
+import http.server
+import json
+import os
+import threading
+import time
+
+from .logger import fw_logger
+from .config import METRICS_RTT_BUCKETS, METRICS_WRITE_INTERVAL
+
+# Phases reported for every run, in order
+PHASES = ('parse', 'validate', 'probe', 'report')
+
+class RunMetrics:
+    """
+    Counters, an RTT histogram, per-phase timings and queue depths for one
+    run. Safe to share between probe threads.
+    """
+    def __init__(self, rtt_buckets=METRICS_RTT_BUCKETS):
+        """
+        Initializes the RunMetrics.
+
+        Args:
+            rtt_buckets (tuple): Upper bounds in seconds of the RTT histogram buckets.
+        """
+        self.rtt_buckets = tuple(rtt_buckets)
+        self.started_at = time.time()
+        self.probes_sent = 0
+        self.retransmits = 0
+        self.timeouts = 0
+        self.replies = collections.Counter()
+        self.tests = collections.Counter()
+        self.verdicts = collections.Counter()
+        self.rtt_counts = [0] * (len(self.rtt_buckets) + 1)  # The last bucket is +Inf
+        self.rtt_sum = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queue_depth = {}
+        self.queue_depth_max = {}
+        self.route_lookups = collections.Counter()
+        self.route_invalidations = 0
+        self._lock = threading.Lock()
+
+    def count_probe(self, attempt=0):
+        """
+        Counts one transmitted probe; attempts above 0 are retransmissions.
+        """
+        with self._lock:
+            self.probes_sent += 1
+            if attempt:
+                self.retransmits += 1
+
+    def count_reply(self, kind, rtt=None):
+        """
+        Counts one reply of the given kind ('syn-ack', 'rst', 'icmp-unreachable',
+        'udp', ...) and adds its round-trip time in seconds to the histogram.
+        """
+        with self._lock:
+            self.replies[kind or "other"] += 1
+            if rtt is not None and rtt >= 0:
+                self.rtt_counts[bisect.bisect_left(self.rtt_buckets, rtt)] += 1
+                self.rtt_sum += rtt
+
+    def count_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def count_result(self, status, verdict):
+        """
+        Counts one finished test case.
+        """
+        with self._lock:
+            self.tests[status] += 1
+            self.verdicts[verdict] += 1
+
+    def count_route_lookup(self, hit):
+        """
+        Counts one route cache lookup as a hit or a miss.
+        """
+        with self._lock:
+            self.route_lookups["hit" if hit else "miss"] += 1
+
+    def count_route_invalidation(self):
+        with self._lock:
+            self.route_invalidations += 1
+
+    def add_phase(self, phase, seconds):
+        """
+        Adds `seconds` to the time spent in `phase`.
+        """
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def set_queue_depth(self, queue, depth):
+        """
+        Records the current depth of a named queue, keeping its maximum.
+        """
+        self.queue_depth[queue] = depth
+        if depth > self.queue_depth_max.get(queue, 0):
+            self.queue_depth_max[queue] = depth
+
+    def merge(self, summary, results=True):
+        """
+        Adds the counters of another run's summary (e.g. a shard's) to these.
+
+        Args:
+            summary (dict): The output of another RunMetrics' summary().
+            results (bool): Also add its test and verdict counts; pass False
+                when the results are counted as they arrive instead.
+        """
+        with self._lock:
+            self.probes_sent += summary['probes_sent']
+            self.retransmits += summary['retransmits']
+            self.timeouts += summary['timeouts']
+            self.replies.update(summary['replies'])
+            if results:
+                self.tests.update(summary['tests'])
+                self.verdicts.update(summary['verdicts'])
+            for i, count in enumerate(summary['rtt']['counts']):
+                self.rtt_counts[i] += count
+            self.rtt_sum += summary['rtt']['sum_seconds']
+            for phase, seconds in summary['raw_phases'].items():
+                # Shards probe in parallel; the merging run times its own probe phase
+                if phase != 'probe':
+                    self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            for queue, depth in summary['queue_depth_max'].items():
+                self.queue_depth_max[queue] = max(depth, self.queue_depth_max.get(queue, 0))
+            self.route_lookups.update({"hit": summary['route_cache']['hits'],
+                                       "miss": summary['route_cache']['misses']})
+            self.route_invalidations += summary['route_cache']['invalidations']
+
+    def summary(self):
+        """
+        Returns the metrics as a JSON-serializable dictionary. Test cases are
+        read while the probes run, so the parse and validate time is taken
+        out of the probe phase.
+        """
+        with self._lock:
+            phases = dict(self.phases)
+            raw_phases = dict(self.phases)
+            phases['probe'] = max(0.0, phases['probe'] - phases['parse'] - phases['validate'])
+            rtt_count = sum(self.rtt_counts)
+            return {
+                'elapsed_seconds': round(time.time() - self.started_at, 3),
+                'probes_sent': self.probes_sent,
+                'retransmits': self.retransmits,
+                'timeouts': self.timeouts,
+                'replies': dict(self.replies),
+                'tests': dict(self.tests),
+                'verdicts': dict(self.verdicts),
+                'rtt': {
+                    'buckets': list(self.rtt_buckets),
+                    'counts': list(self.rtt_counts),
+                    'count': rtt_count,
+                    'sum_seconds': self.rtt_sum,
+                    'mean_ms': round(self.rtt_sum / rtt_count * 1000, 3) if rtt_count else None,
+                },
+                'phases': {phase: round(seconds, 3) for phase, seconds in phases.items()},
+                'raw_phases': raw_phases,
+                'queue_depth': dict(self.queue_depth),
+                'queue_depth_max': dict(self.queue_depth_max),
+                'route_cache': {'hits': self.route_lookups["hit"], 'misses': self.route_lookups["miss"],
+                                'invalidations': self.route_invalidations},
+            }
+
+def timed(iterable, metrics, phase, batch=1024):
+    """
+    Yields the items of `iterable`, adding the time spent producing them (but
+    not the time the consumer spends between items) to `phase`, once every
+    `batch` items and when the iteration ends.
+    """
+    clock = time.perf_counter
+    iterator = iter(iterable)
+    elapsed = 0.0
+    count = 0
+    try:
+        while True:
+            started = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += clock() - started
+                return
+            elapsed += clock() - started
+            count += 1
+            if count == batch:
+                metrics.add_phase(phase, elapsed)
+                elapsed = 0.0
+                count = 0
+            yield item
+    finally:
+        metrics.add_phase(phase, elapsed)
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+def format_prometheus(summary):
+    """
+    Formats a metrics summary in the Prometheus text exposition format.
+
+    Args:
+        summary (dict): The output of RunMetrics.summary().
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP firewall_tester_{name} {help_text}")
+        lines.append(f"# TYPE firewall_tester_{name} {kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"firewall_tester_{name}{suffix}{labels} {value}")
+
+    metric('probes_sent_total', 'counter', "Probes transmitted, including retransmissions.",
+           [("", "", summary['probes_sent'])])
+    metric('retransmits_total', 'counter', "Probe retransmissions.", [("", "", summary['retransmits'])])
+    metric('timeouts_total', 'counter', "Probe transmissions that got no reply in time.",
+           [("", "", summary['timeouts'])])
+    metric('replies_total', 'counter', "Replies received, by type.",
+           [("", _labels(type=kind), count) for kind, count in sorted(summary['replies'].items())])
+    metric('tests_total', 'counter', "Finished test cases, by status.",
+           [("", _labels(status=status), count) for status, count in sorted(summary['tests'].items())])
+    metric('verdicts_total', 'counter', "Finished test cases, by actual result.",
+           [("", _labels(verdict=verdict), count) for verdict, count in sorted(summary['verdicts'].items())])
+
+    rtt = summary['rtt']
+    buckets, cumulative = [], 0
+    for bound, count in zip(rtt['buckets'] + ["+Inf"], rtt['counts']):
+        cumulative += count
+        buckets.append(("_bucket", _labels(le=bound), cumulative))
+    metric('rtt_seconds', 'histogram', "Round-trip time of first-transmission replies.",
+           buckets + [("_sum", "", rtt['sum_seconds']), ("_count", "", rtt['count'])])
+
+    metric('phase_seconds', 'gauge', "Seconds spent in each phase of the run.",
+           [("", _labels(phase=phase), seconds) for phase, seconds in summary['phases'].items()])
+    metric('queue_depth', 'gauge', "Current depth of each work queue.",
+           [("", _labels(queue=queue), depth) for queue, depth in sorted(summary['queue_depth'].items())])
+    metric('queue_depth_max', 'gauge', "Maximum depth of each work queue during the run.",
+           [("", _labels(queue=queue), depth) for queue, depth in sorted(summary['queue_depth_max'].items())])
+    route_cache = summary['route_cache']
+    metric('route_cache_lookups_total', 'counter', "Route cache lookups, by result.",
+           [("", _labels(result="hit"), route_cache['hits']), ("", _labels(result="miss"), route_cache['misses'])])
+    metric('route_cache_invalidations_total', 'counter', "Route cache flushes after routing changes.",
+           [("", "", route_cache['invalidations'])])
+    metric('elapsed_seconds', 'gauge', "Seconds since the run started.", [("", "", summary['elapsed_seconds'])])
+    return "\n".join(lines) + "\n"
+
+def write_textfile(summary, path):
+    """
+    Writes a metrics summary as a Prometheus textfile (e.g. for the node
+    exporter's textfile collector), replacing the file atomically.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(format_prometheus(summary))
+    os.replace(temp_path, path)
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    metrics = None  # Bound by MetricsExporter
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = format_prometheus(self.metrics.summary()), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(self.metrics.summary()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsExporter:
+    """
+    Publishes live run metrics: rewrites a Prometheus textfile every
+    METRICS_WRITE_INTERVAL seconds and/or serves /metrics (Prometheus) and
+    /metrics.json over HTTP.
+    """
+    def __init__(self, metrics, textfile=None, port=None, host="127.0.0.1"):
+        """
+        Initializes the MetricsExporter.
+
+        Args:
+            metrics (RunMetrics): The metrics to publish.
+            textfile (str): Path of the Prometheus textfile, or None.
+            port (int): Port for the HTTP endpoint, or None for no endpoint.
+            host (str): Address the HTTP endpoint listens on.
+        """
+        self.metrics = metrics
+        self.textfile = textfile
+        self.port = port
+        self.host = host
+        self._server = None
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.port is not None:
+            handler = type("MetricsHandler", (_MetricsHandler,), {'metrics': self.metrics})
+            self._server = http.server.ThreadingHTTPServer((self.host, self.port), handler)
+            self.port = self._server.server_address[1]
+            self._threads.append(threading.Thread(target=self._server.serve_forever, name="metrics-http",
+                                                  daemon=True))
+            fw_logger.info(f"[*] Serving metrics on http://{self.host}:{self.port}/metrics")
+        if self.textfile:
+            self._threads.append(threading.Thread(target=self._write_loop, name="metrics-textfile", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _write_loop(self):
+        while not self._stopping.wait(METRICS_WRITE_INTERVAL):
+            self._write()
+
+    def _write(self):
+        try:
+            write_textfile(self.metrics.summary(), self.textfile)
+        except OSError as e:
+            fw_logger.error(f"[ERROR] Could not write metrics to {self.textfile}: {e}")
+
+    def stop(self):
+        """
+        Stops publishing; the textfile is written one last time.
+        """
+        self._stopping.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self.textfile:
+            self._write()
+            fw_logger.info(f"[*] Metrics saved to: {self.textfile}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
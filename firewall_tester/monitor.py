@@ -0,0 +1,140 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+from .logger import fw_logger
+from .config import MONITOR_INTERVAL, MONITOR_PRIORITIES, MONITOR_BATCH_WINDOW
+from .rules_parser import expand_test_cases
+
+class FirewallMonitor:
+    """
+    Long-running mode of a FirewallRuleTester. Every target of the suite is
+    probed once per interval (more or less often by its 'priority'), each at
+    its own evenly spaced time instead of all in one burst, so the load on
+    the firewall stays flat. The tester, and with the batch engines their
+    scanners' sockets and sniffers, stay open for the life of the monitor.
+    Alerts whenever a target's verdict or pass/fail status changes.
+    """
+    def __init__(self, tester, interval=MONITOR_INTERVAL, alert_dir=None):
+        """
+        Initializes the FirewallMonitor.
+
+        Args:
+            tester (FirewallRuleTester): The tester whose test cases to monitor.
+                The suite is expanded once and held in memory.
+            interval (float): Seconds between two probes of a 'normal' priority target.
+            alert_dir (str): Directory to write one JSON file per alert to, for
+                a webhook or mail forwarder to pick up, or None to only log alerts.
+        """
+        self.tester = tester
+        self.interval = interval
+        self.alert_dir = alert_dir
+        self.probes = 0
+        self.alerts = 0
+        self._test_cases = list(expand_test_cases(tester.test_cases))
+        self._last = {}
+        self._stopping = threading.Event()
+        self._alert_ids = itertools.count(1)
+        if alert_dir:
+            os.makedirs(alert_dir, exist_ok=True)
+
+    def _period(self, test_case):
+        """
+        Returns the seconds between two probes of a test case's target.
+        """
+        priority = test_case.get('priority', 'normal') if isinstance(test_case, dict) else 'normal'
+        return self.interval / MONITOR_PRIORITIES[str(priority).lower()]
+
+    def stop(self):
+        """
+        Makes run() return after the batch of probes in progress.
+        """
+        self._stopping.set()
+
+    def run(self, duration=None):
+        """
+        Probes the suite until stop() is called or `duration` seconds have passed.
+
+        Args:
+            duration (float): Seconds to run for, or None to run until stopped.
+        """
+        count = len(self._test_cases)
+        if not count:
+            fw_logger.error("[ERROR] No test cases to monitor.")
+            return
+        periods = [self._period(test_case) for test_case in self._test_cases]
+        start = time.monotonic()
+        deadline = None if duration is None else start + duration
+        # Target i is first probed i/count of the way into its period, spreading every priority evenly
+        schedule = [(start + period * i / count, i) for i, period in enumerate(periods)]
+        heapq.heapify(schedule)
+        targets = {"tcp": [], "udp": []}
+        for test_case in self._test_cases:
+            if isinstance(test_case, dict):
+                protocol = str(test_case.get('protocol', '')).lower()
+                if protocol in targets:
+                    targets[protocol].append((test_case['dest_ip'], test_case['dest_port']))
+
+        fw_logger.info(f"[*] Monitoring {count} targets, one probe each every {self.interval:g}s "
+                       f"(about {sum(1 / period for period in periods):.2f} probes/s).")
+        with self.tester.open_scanner(targets["tcp"], targets["udp"]):
+            while not self._stopping.is_set():
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    break
+                if schedule[0][0] > now + MONITOR_BATCH_WINDOW:
+                    wait = schedule[0][0] - now
+                    self._stopping.wait(wait if deadline is None else min(wait, deadline - now))
+                    continue
+                due = []
+                while schedule[0][0] <= now + MONITOR_BATCH_WINDOW:
+                    at, i = heapq.heappop(schedule)
+                    due.append(i)
+                    # Stay on the grid; a target that fell a whole period behind skips the missed slot
+                    following = at + periods[i]
+                    heapq.heappush(schedule, (following if following > now else now + periods[i], i))
+                self._probe(due)
+        fw_logger.info(f"[*] Monitoring stopped after {self.probes} probes and {self.alerts} alerts.")
+
+    def _probe(self, indices):
+        """
+        Runs the due test cases through the tester as one small run.
+        """
+        test_cases = [self._test_cases[i] for i in indices]
+        # Expanded test cases expand to themselves, so outcomes line up with indices
+        for i, outcome in zip(indices, self.tester.probe_cases(test_cases)):
+            self.probes += 1
+            if outcome is None:
+                continue
+            current = (outcome.actual_result, outcome.status)
+            previous = self._last.get(i)
+            self._last[i] = current
+            if previous is not None and previous != current:
+                self._alert(outcome, previous)
+
+    def _alert(self, result, previous):
+        """
+        Logs a verdict change and writes it to the alert directory.
+        """
+        self.alerts += 1
+        previous_result, previous_status = previous
+        fw_logger.warning(f"[ALERT] '{result.name}' ({result.dest_ip}:{result.dest_port}/{result.protocol}) changed "
+                          f"from '{previous_result}' ({previous_status}) to '{result.actual_result}' "
+                          f"({result.status}), expected '{result.expected_result}'.")
+        if not self.alert_dir:
+            return
+        event = dict(result.to_dict(), event="verdict_changed", time=time.time(),
+                     previous_result=previous_result, previous_status=previous_status)
+        name = f"alert-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(self._alert_ids)}.json"
+        path = os.path.join(self.alert_dir, name)
+        # Written under a dot name and renamed, so watchers only ever see complete events
+        temp_path = os.path.join(self.alert_dir, f".{name}.tmp")
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(event, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            fw_logger.error(f"[ERROR] Could not write alert to {path}: {e}")
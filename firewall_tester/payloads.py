@@ -0,0 +1,150 @@
+import hashlib
+import struct
+import threading
+
+from .rawpacket import payload_word_sum
+
+def _rpc_null_call(program, version):
+    """
+    Returns an ONC RPC call of procedure 0 (NULL) with AUTH_NULL credentials.
+    """
+    # xid, CALL, RPC version 2, program, version, procedure, credential and verifier flavor/length
+    return struct.pack('!10I', 0x46575431, 0, 2, program, version, 0, 0, 0, 0, 0)
+
+def _quic_version_probe():
+    """
+    Returns a QUIC long-header packet with a reserved version, padded to the
+    1200 bytes servers require, which makes them answer with a Version Negotiation.
+    """
+    dcid = bytes.fromhex('4657545354515543')
+    header = b'\xc0' + bytes.fromhex('1a2a3a4a') + bytes([len(dcid)]) + dcid + b'\x00'
+    return header + bytes(1200 - len(header))
+
+# Requests that get a reply out of the service usually found on a UDP port, so
+# an allowed port shows up as 'open' instead of 'open|filtered'. Syslog, DHCP,
+# RADIUS and WireGuard stay silent without valid credentials and are left out.
+UDP_PAYLOADS = {
+    # DNS: standard query for the root NS records, recursion not desired
+    53: bytes.fromhex('46570000 0001 0000 0000 0000 00 0002 0001'),
+    # TFTP: read request for a file that should not exist; servers answer with an error
+    69: b'\x00\x01fwtest.txt\x00octet\x00',
+    # Portmapper: RPC NULL call to program 100000 version 2
+    111: _rpc_null_call(100000, 2),
+    # NTP: version 4 client request
+    123: b'\xe3' + bytes(47),
+    # NetBIOS name service: node status request for '*'
+    137: bytes.fromhex('4657 0000 0001 0000 0000 0000') + b'\x20CKAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA\x00'
+         + bytes.fromhex('0021 0001'),
+    # SNMP: v1 GetRequest for sysDescr.0 with community 'public'
+    161: bytes.fromhex('3026 020100 0406 7075626c6963 a019 020101 020100 020100 300e 300c'
+                       '0608 2b06010201010100 0500'),
+    # IKE: v1 Main Mode offer of 3DES/SHA1/PSK/group 2; peers answer with an SA or a notification
+    500: bytes.fromhex('4657545349534b4d 0000000000000000 01 10 02 00 00000000 00000050'
+                       '00 00 0034 00000001 00000001'
+                       '00 00 0028 01 01 00 01'
+                       '00 00 0020 01 01 0000'
+                       '80010005 80020002 80030001 80040002 800b0001 800c7080'),
+    # QUIC: forces a Version Negotiation packet
+    443: _quic_version_probe(),
+    # IPMI / ASF RMCP presence ping
+    623: bytes.fromhex('0600ff06 000011be 80000000'),
+    # OpenVPN: P_CONTROL_HARD_RESET_CLIENT_V2 (servers without tls-auth answer)
+    1194: bytes.fromhex('38 4657545354565049 00 00000000'),
+    # SSDP: unicast M-SEARCH
+    1900: b'M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\nMAN: "ssdp:discover"\r\nMX: 1\r\n'
+          b'ST: ssdp:all\r\n\r\n',
+    # NFS: RPC NULL call to program 100003 version 3
+    2049: _rpc_null_call(100003, 3),
+    # STUN: binding request
+    3478: bytes.fromhex('0001 0000 2112a442 465754535453545546575453'),
+    # SIP: OPTIONS request
+    5060: b'OPTIONS sip:fwtest SIP/2.0\r\nVia: SIP/2.0/UDP fwtest;branch=z9hG4bKfwtest\r\n'
+          b'From: <sip:fwtest@fwtest>;tag=fwtest\r\nTo: <sip:fwtest@fwtest>\r\nCall-ID: fwtest\r\n'
+          b'CSeq: 1 OPTIONS\r\nMax-Forwards: 70\r\nContact: <sip:fwtest@fwtest>\r\nAccept: application/sdp\r\n'
+          b'Content-Length: 0\r\n\r\n',
+    # NAT-PMP: external address request
+    5351: b'\x00\x00',
+    # mDNS: legacy unicast query for the DNS-SD service list
+    5353: bytes.fromhex('4657 0000 0001 0000 0000 0000') + b'\x09_services\x07_dns-sd\x04_udp\x05local\x00'
+          + bytes.fromhex('000c 0001'),
+    # CoAP: confirmable GET /.well-known/core
+    5683: bytes.fromhex('40014657 bb') + b'.well-known' + b'\x04core',
+    # memcached: 'version' command behind the UDP frame header
+    11211: bytes.fromhex('0001 0000 0001 0000') + b'version\r\n',
+}
+
+def payload_digest(payload):
+    """
+    Returns a short digest that tells probes with different payloads apart in
+    cache and verdict keys, or '' for an empty datagram (and for TCP).
+    """
+    if not payload:
+        return ''
+    return hashlib.blake2b(payload, digest_size=8).hexdigest()
+
+def decode_payload(test_case):
+    """
+    Returns the payload override of a test case: 'payload' as UTF-8 text or
+    'payload_hex' as hex digits (whitespace allowed), or None if it sets none.
+    An empty override sends an empty datagram.
+
+    Raises:
+        ValueError: If the override is not a string or not valid hex, or both are set.
+    """
+    text, digits = test_case.get('payload'), test_case.get('payload_hex')
+    if text is not None and digits is not None:
+        raise ValueError("set either 'payload' or 'payload_hex', not both")
+    if text is not None:
+        if not isinstance(text, str):
+            raise ValueError(f"'payload' must be a string, got {text!r}")
+        return text.encode('utf-8')
+    if digits is not None:
+        if not isinstance(digits, str):
+            raise ValueError(f"'payload_hex' must be a string of hex digits, got {digits!r}")
+        return bytes.fromhex(digits)
+    return None
+
+class PayloadLibrary:
+    """
+    UDP probe payloads by destination port, plus per-test overrides. Built
+    once per run: every payload is held as bytes with its checksum word sum
+    precomputed for the raw fast path, and each distinct override is decoded
+    the first time it is seen. Safe to share between probe threads.
+    """
+    def __init__(self, payloads=None, enabled=True):
+        """
+        Initializes the PayloadLibrary.
+
+        Args:
+            payloads (dict): Maps destination ports to payload bytes, or None
+                for UDP_PAYLOADS.
+            enabled (bool): Send the port payloads; if False, probes are empty
+                unless a test case sets an override.
+        """
+        table = (UDP_PAYLOADS if payloads is None else payloads) if enabled else {}
+        self._by_port = {port: (payload, payload_word_sum(payload)) for port, payload in table.items()}
+        self._overrides = {}
+        self._lock = threading.Lock()
+
+    def get(self, dest_port, test_case=None):
+        """
+        Returns the payload to probe a UDP port with.
+
+        Args:
+            dest_port (int): The destination port.
+            test_case (dict): The test case being probed, whose override wins.
+
+        Returns:
+            tuple: (payload bytes, checksum word sum of the payload).
+        """
+        if test_case is not None and ('payload' in test_case or 'payload_hex' in test_case):
+            key = (test_case.get('payload'), test_case.get('payload_hex'))
+            with self._lock:
+                entry = self._overrides.get(key)
+                if entry is None:
+                    payload = decode_payload(test_case)
+                    if payload is not None:
+                        entry = self._overrides[key] = (payload, payload_word_sum(payload))
+            if entry is not None:
+                return entry
+        return self._by_port.get(dest_port, (b'', 0))
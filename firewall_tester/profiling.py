@@ -0,0 +1,107 @@
+import collections
+import os
+import sys
+import threading
+
+from .config import PROFILE_INTERVAL
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for every thread of the process. Probes run on
+    scheduler, sniffer and receive threads, which cProfile (main thread only)
+    never sees; sampling all stacks at a fixed interval shows where a run
+    spends its time, including time spent waiting.
+    """
+    def __init__(self, interval=PROFILE_INTERVAL, ignore=("metrics-",)):
+        """
+        Initializes the SamplingProfiler.
+
+        Args:
+            interval (float): Seconds between samples.
+            ignore (tuple): Name prefixes of threads not to sample, such as
+                the metrics exporter's.
+        """
+        self.interval = interval
+        self.ignore = tuple(ignore)
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stopping.wait(self.interval):
+            names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, str(thread_id))
+                if thread_id == own_id or name.startswith(self.ignore):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack.append(name)
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def top(self, limit=20):
+        """
+        Returns the functions seen most often, as (function, inclusive share,
+        self share) tuples with shares of all thread samples.
+        """
+        total = sum(self.stacks.values())
+        inclusive = collections.Counter()
+        exclusive = collections.Counter()
+        for stack, count in self.stacks.items():
+            for name in set(stack[1:]):
+                inclusive[name] += count
+            exclusive[stack[-1]] += count
+        return [(name, count / total, exclusive[name] / total) for name, count in inclusive.most_common(limit)]
+
+    def write_collapsed(self, path):
+        """
+        Writes the samples as collapsed stacks ("thread;outer;...;inner count"),
+        the input format of flamegraph.pl and speedscope.
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+def format_profile(profiler, limit=20):
+    """
+    Formats the functions a run spent most of its time in.
+
+    Args:
+        profiler (SamplingProfiler): A stopped profiler.
+        limit (int): Number of functions to list.
+
+    Returns:
+        list: The report lines.
+    """
+    lines = [f"\n[%%%] Profile ({profiler.samples} samples every {profiler.interval * 1000:g}ms, all threads):",
+             f"  {'total':>6} {'self':>6}  function"]
+    for name, inclusive, exclusive in profiler.top(limit):
+        lines.append(f"  {inclusive:>6.1%} {exclusive:>6.1%}  {name}")
+    return lines
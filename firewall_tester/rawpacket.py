@@ -0,0 +1,205 @@
+import socket
+import struct
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+# IPv4 header without options, as scapy builds it by default (id=1, ttl=64)
+_IP_HEADER = struct.Struct('!BBHHHBBH4s4s')
+# TCP header without options, as scapy builds it by default (window=8192)
+_TCP_HEADER = struct.Struct('!HHIIBBHHH')
+_UDP_HEADER = struct.Struct('!HHHH')
+
+_WORDS_2 = struct.Struct('!HH')
+_ADDR_WORDS = struct.Struct('!HH')
+
+def checksum(data):
+    """
+    Computes the Internet checksum (RFC 1071) of `data`.
+    """
+    if len(data) % 2:
+        data = bytes(data) + b'\x00'
+    return _fold(sum(struct.unpack(f'!{len(data) // 2}H', data)))
+
+def _fold(total):
+    """
+    Folds a 32-bit one's complement sum to 16 bits and complements it.
+    """
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+def _sum_words(data):
+    return sum(struct.unpack(f'!{len(data) // 2}H', data))
+
+class TcpTemplate:
+    """
+    Prebuilt IPv4 + TCP header bytes for one source address, source port and
+    flag set. Each packet only patches the destination address, destination
+    port and sequence number into the buffer and updates both checksums from
+    precomputed partial sums. The bytes match scapy's
+    IP(src, dst) / TCP(sport, dport, flags, seq) exactly.
+    """
+    def __init__(self, src_ip, sport, flags=TCP_SYN, window=8192, ttl=64):
+        """
+        Initializes the TcpTemplate.
+
+        Args:
+            src_ip (str): Source IPv4 address.
+            sport (int): Source port.
+            flags (int): TCP flag bits (TCP_SYN, TCP_RST, ...).
+            window (int): Advertised window.
+            ttl (int): IP time to live.
+        """
+        self.src = socket.inet_aton(src_ip)
+        self.buffer = bytearray(40)
+        _IP_HEADER.pack_into(self.buffer, 0, 0x45, 0, 40, 1, 0, ttl, IPPROTO_TCP, 0, self.src, b'\x00' * 4)
+        _TCP_HEADER.pack_into(self.buffer, 20, sport, 0, 0, 0, 5 << 4, flags, window, 0, 0)
+        # Partial sums over everything that never changes
+        self._ip_sum = _sum_words(self.buffer[:20])
+        self._tcp_sum = _sum_words(self.src) + IPPROTO_TCP + 20 + _sum_words(self.buffer[20:])
+
+    def build(self, dst_ip, dport, seq):
+        """
+        Patches a probe into the template buffer.
+
+        Args:
+            dst_ip (bytes): Packed destination IPv4 address (socket.inet_aton).
+            dport (int): Destination port.
+            seq (int): Sequence number.
+
+        Returns:
+            bytearray: The template buffer, valid until the next build() call.
+        """
+        buf = self.buffer
+        buf[16:20] = dst_ip
+        dst_hi, dst_lo = _ADDR_WORDS.unpack(dst_ip)
+        struct.pack_into('!H', buf, 10, _fold(self._ip_sum + dst_hi + dst_lo))
+        struct.pack_into('!HI', buf, 22, dport, seq)
+        tcp_sum = self._tcp_sum + dst_hi + dst_lo + dport + (seq >> 16) + (seq & 0xFFFF)
+        struct.pack_into('!H', buf, 36, _fold(tcp_sum))
+        return buf
+
+class UdpTemplate:
+    """
+    Prebuilt IPv4 + UDP header bytes for one source address and source port,
+    with the destination address, destination port and payload patched in per
+    probe. The bytes match scapy's IP(src, dst) / UDP(sport, dport) / payload.
+    """
+    def __init__(self, src_ip, sport, ttl=64):
+        """
+        Initializes the UdpTemplate.
+
+        Args:
+            src_ip (str): Source IPv4 address.
+            sport (int): Source port.
+            ttl (int): IP time to live.
+        """
+        self.src = socket.inet_aton(src_ip)
+        self.sport = sport
+        self.ttl = ttl
+        self._src_sum = _sum_words(self.src)
+
+    def build(self, dst_ip, dport, payload=b'', payload_sum=None):
+        """
+        Builds a probe datagram.
+
+        Args:
+            dst_ip (bytes): Packed destination IPv4 address (socket.inet_aton).
+            dport (int): Destination port.
+            payload (bytes): UDP payload.
+            payload_sum (int): Precomputed one's complement word sum of the
+                payload (see payload_word_sum), to skip summing it per probe.
+
+        Returns:
+            bytearray: The datagram.
+        """
+        udp_len = 8 + len(payload)
+        buf = bytearray(20 + udp_len)
+        _IP_HEADER.pack_into(buf, 0, 0x45, 0, 20 + udp_len, 1, 0, self.ttl, IPPROTO_UDP, 0, self.src, dst_ip)
+        struct.pack_into('!H', buf, 10, checksum(buf[:20]))
+        buf[28:] = payload
+        if payload_sum is None:
+            payload_sum = payload_word_sum(payload)
+        dst_hi, dst_lo = _ADDR_WORDS.unpack(dst_ip)
+        udp_sum = _fold(self._src_sum + dst_hi + dst_lo + IPPROTO_UDP + udp_len
+                        + self.sport + dport + udp_len + payload_sum)
+        _UDP_HEADER.pack_into(buf, 20, self.sport, dport, udp_len, udp_sum or 0xFFFF)
+        return buf
+
+def payload_word_sum(payload):
+    """
+    Returns the one's complement word sum of a payload, padded to even length.
+    """
+    if len(payload) % 2:
+        payload = bytes(payload) + b'\x00'
+    return _sum_words(payload)
+
+def parse_reply(data):
+    """
+    Dissects a received IPv4 packet with struct on a memoryview, without
+    building any scapy objects.
+
+    Args:
+        data (memoryview or bytes): The packet, starting at the IP header.
+
+    Returns:
+        tuple: One of
+            ('tcp', src_ip, sport, dport, ack, flags),
+            ('udp', src_ip, sport, dport),
+            ('icmp', src_ip, type, code, quoted_dst_ip, quoted_proto, quoted_sport, quoted_dport, quoted_seq),
+        with addresses as dotted-quad strings, or None if the packet is not one of those.
+    """
+    if len(data) < 20 or data[0] >> 4 != 4:
+        return None
+    ihl = (data[0] & 0x0F) * 4
+    proto = data[9]
+    src_ip = socket.inet_ntoa(data[12:16])
+    if proto == IPPROTO_TCP and len(data) >= ihl + 14:
+        sport, dport, _, ack, _, flags = struct.unpack_from('!HHIIBB', data, ihl)
+        return ('tcp', src_ip, sport, dport, ack, flags)
+    if proto == IPPROTO_UDP and len(data) >= ihl + 4:
+        sport, dport = _WORDS_2.unpack_from(data, ihl)
+        return ('udp', src_ip, sport, dport)
+    if proto == IPPROTO_ICMP and len(data) >= ihl + 8:
+        icmp_type, code = data[ihl], data[ihl + 1]
+        inner = ihl + 8
+        quoted_dst = quoted_proto = quoted_sport = quoted_dport = quoted_seq = None
+        if len(data) >= inner + 20:
+            inner_ihl = (data[inner] & 0x0F) * 4
+            quoted_proto = data[inner + 9]
+            quoted_dst = socket.inet_ntoa(data[inner + 16:inner + 20])
+            if len(data) >= inner + inner_ihl + 4:
+                quoted_sport, quoted_dport = _WORDS_2.unpack_from(data, inner + inner_ihl)
+            if quoted_proto == IPPROTO_TCP and len(data) >= inner + inner_ihl + 8:
+                quoted_seq = struct.unpack_from('!I', data, inner + inner_ihl + 4)[0]
+        return ('icmp', src_ip, icmp_type, code, quoted_dst, quoted_proto, quoted_sport, quoted_dport, quoted_seq)
+    return None
+
+def source_address_for(dst_ip, iface=None):
+    """
+    Returns the local IPv4 address the kernel would use to reach `dst_ip`,
+    through `iface` if given.
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        if iface is not None:
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, iface.encode())
+        probe.connect((dst_ip, 9))
+        return probe.getsockname()[0]
+    finally:
+        probe.close()
+
+def raw_sockets_available():
+    """
+    Returns True if this process may open raw IPv4 sockets.
+    """
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW).close()
+        return True
+    except (OSError, AttributeError):
+        return False
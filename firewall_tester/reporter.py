@@ -1,45 +1,360 @@
+import csv
+import heapq
 import json
+from xml.sax.saxutils import escape, quoteattr
 
-def generate_report(test_results, output_format="console"):
+from .config import HOST_TIMING_TOP
+from .results import RESULT_FIELDS, ResultTally
+
+def _as_dict(result):
+    return result if isinstance(result, dict) else result.to_dict()
+
+def format_summary(tally):
+    """
+    Formats the pass/fail/skip counts of a run.
+
+    Args:
+        tally (ResultTally): Running counts for the run.
+
+    Returns:
+        list: The summary lines.
+    """
+    lines = [
+        f"Total test cases run: {tally.total}",
+        f"Passed: {tally.passed}",
+        f"Failed: {tally.failed}",
+        f"Skipped: {tally.skipped}",
+    ]
+    if tally.cached:
+        lines.append(f"Results from probe cache: {tally.cached}")
+    return lines
+
+def _add_vantage(tallies, test):
+    vantage = test.get('vantage')
+    if vantage is not None:
+        tallies.setdefault(vantage, ResultTally()).add(test)
+
+def format_vantage_summary(tallies):
+    """
+    Formats the pass/fail/skip counts of each vantage point of a distributed run.
+
+    Args:
+        tallies (dict): Vantage point name -> ResultTally.
+
+    Returns:
+        list: The summary lines, none if no result carried a vantage point.
+    """
+    if not tallies:
+        return []
+    lines = ["\nPer vantage point:"]
+    for vantage, tally in sorted(tallies.items()):
+        lines.append(f"  - {vantage}: {tally.total} run, {tally.passed} passed, {tally.failed} failed, "
+                     f"{tally.skipped} skipped")
+    return lines
+
+def format_plan(plan):
+    """
+    Formats the planned probe counts and estimated run time of a dry run.
+
+    Args:
+        plan (dict): The plan from FirewallRuleTester.plan().
+
+    Returns:
+        list: The report lines.
+    """
+    return [
+        f"Test cases: {plan['test_cases']}",
+        f"Planned probes: {plan['probes']} (TCP: {plan['tcp_probes']}, UDP: {plan['udp_probes']}, "
+        f"unsupported: {plan['unsupported']})",
+        f"Estimated run time: up to {plan['estimated_seconds']:.1f}s",
+    ]
+
+def format_host_timing(host_timing, top=HOST_TIMING_TOP):
+    """
+    Formats per-host probe counters and RTT estimates: a line summing up
+    every host, then the `top` hosts with the highest smoothed RTT.
+
+    Args:
+        host_timing (list): Rows from TimingTable.summary().
+        top (int): Number of hosts to list, or None to list every host.
+
+    Returns:
+        list: The report lines.
+    """
+    if top is not None:
+        probes = retransmits = replies = timeouts = silent = 0
+        for row in host_timing:
+            probes += row['probes']
+            retransmits += row['retransmits']
+            replies += row['replies']
+            timeouts += row['timeouts']
+            silent += row['srtt_ms'] is None
+        lines = ["\n[~~~] Per-Host Timing:",
+                 f"  Hosts: {len(host_timing)} ({silent} without an RTT sample), Probes: {probes} "
+                 f"(retransmits: {retransmits}), Replies: {replies}, Timeouts: {timeouts}"]
+        host_timing = heapq.nlargest(top, (row for row in host_timing if row['srtt_ms'] is not None),
+                                     key=lambda row: row['srtt_ms'])
+        if host_timing:
+            lines.append(f"  Slowest {len(host_timing)} hosts:")
+    else:
+        lines = ["\n[~~~] Per-Host Timing:"]
+    for row in host_timing:
+        srtt = "n/a" if row['srtt_ms'] is None else f"{row['srtt_ms']}ms"
+        rttvar = "n/a" if row['rttvar_ms'] is None else f"{row['rttvar_ms']}ms"
+        lines.append(f"  - Host: {row['host']}")
+        lines.append(f"    Probes: {row['probes']} (retransmits: {row['retransmits']}), "
+                     f"Replies: {row['replies']}, Timeouts: {row['timeouts']}")
+        lines.append(f"    SRTT: {srtt}, RTTVAR: {rttvar}, Timeout: {row['timeout_ms']}ms")
+    return lines
+
+def format_metrics(summary):
+    """
+    Formats the headline numbers of a metrics summary for the console report.
+
+    Args:
+        summary (dict): The output of RunMetrics.summary().
+
+    Returns:
+        list: The report lines.
+    """
+    phases = ", ".join(f"{phase} {seconds}s" for phase, seconds in summary['phases'].items())
+    lines = ["\n[###] Run Metrics:",
+             f"  Phases: {phases}",
+             f"  Probes sent: {summary['probes_sent']} (retransmits: {summary['retransmits']}, "
+             f"timeouts: {summary['timeouts']})"]
+    if summary['replies']:
+        lines.append("  Replies: " + ", ".join(f"{kind} {count}" for kind, count in sorted(summary['replies'].items())))
+    if summary['rtt']['count']:
+        lines.append(f"  RTT samples: {summary['rtt']['count']}, mean {summary['rtt']['mean_ms']}ms")
+    if summary['queue_depth_max']:
+        lines.append("  Max queue depth: " + ", ".join(
+            f"{queue} {depth}" for queue, depth in sorted(summary['queue_depth_max'].items())))
+    route_cache = summary['route_cache']
+    if route_cache['hits'] or route_cache['misses']:
+        lines.append(f"  Route cache: {route_cache['hits']} hits, {route_cache['misses']} misses, "
+                     f"{route_cache['invalidations']} invalidations")
+    return lines
+
+def format_baseline_diff(diff):
+    """
+    Formats the verdict changes of a run against its baseline.
+
+    Args:
+        diff (dict): The output of BaselineStore.close().
+
+    Returns:
+        list: The report lines.
+    """
+    lines = ["\n[~~~] Baseline Diff:",
+             f"  Test cases: {diff['new']} new, {diff['modified']} modified, {diff['unchanged_probed']} unchanged probed, "
+             f"{diff['unchanged_skipped']} unchanged skipped, {len(diff['removed'])} removed",
+             f"  Results: {diff['compared']} compared, {diff['unchanged']} unchanged, {diff['new_targets']} new "
+             f"targets, {diff['verdict_changes']} verdict changes, {diff['status_changes']} status changes"]
+    for change in diff['changes']:
+        vantage = f" from {change['vantage']}" if 'vantage' in change else ""
+        lines.append(f"  [{change['previous_status']} -> {change['status']}] {change['name']}{vantage}: "
+                     f"{change['previous_result']} -> {change['actual_result']} "
+                     f"(expected {change['expected_result']})")
+    hidden = diff['verdict_changes'] + diff['status_changes'] - len(diff['changes'])
+    if hidden:
+        lines.append(f"  ... {hidden} more changes not listed")
+    for name in diff['removed']:
+        lines.append(f"  [REMOVED] {name}")
+    return lines
+
+def generate_report(test_results, output_format="console", host_timing=None, metrics=None,
+                    host_timing_top=HOST_TIMING_TOP):
     """
     Generates a report from the firewall test results.
 
     Args:
         test_results (list): A list of test result dictionaries.
         output_format (str): The desired output format ('console' or 'json').
+        host_timing (list): Optional per-host timing rows for the console report.
+        host_timing_top (int): Slowest hosts the console report lists, or None
+            for every host (see format_host_timing()).
+        metrics (dict): Optional run metrics summary to embed. The JSON report
+            then becomes an object with 'results' and 'metrics' keys.
 
     Returns:
         str: The formatted report.
     """
     if output_format == "json":
-        return json.dumps(test_results, indent=4)
+        results = [_as_dict(r) for r in test_results]
+        return json.dumps(results if metrics is None else {'results': results, 'metrics': metrics}, indent=4)
     else:
+        # Single pass: count everything and keep only what gets listed
+        tally = ResultTally()
+        vantage_tallies = {}
+        failed_tests = []
+        skipped_tests = []
+        for result in test_results:
+            tally.add(result)
+            test = _as_dict(result)
+            _add_vantage(vantage_tallies, test)
+            if test['status'] == 'FAIL':
+                failed_tests.append(test)
+            if test['actual_result'] == 'skipped':
+                skipped_tests.append(test)
+
         report_lines = []
         report_lines.append("\n--- Firewall Rule Test Report ---")
-        report_lines.append(f"Total test cases run: {len(test_results)}")
-
-        passed_tests = [r for r in test_results if r['status'] == 'PASS']
-        failed_tests = [r for r in test_results if r['status'] == 'FAIL']
-        skipped_tests = [r for r in test_results if r['actual_result'] == 'skipped']
-
-        report_lines.append(f"Passed: {len(passed_tests)}")
-        report_lines.append(f"Failed: {len(failed_tests)}")
-        report_lines.append(f"Skipped: {len(skipped_tests)}")
+        report_lines.extend(format_summary(tally))
+        report_lines.extend(format_vantage_summary(vantage_tallies))
 
         if failed_tests:
             report_lines.append("\n[!!!] Failed Test Cases:")
             for test in failed_tests:
                 report_lines.append(f"  - Name: {test['name']}")
                 report_lines.append(f"    Target: {test['dest_ip']}:{test['dest_port']}/{test['protocol']}")
+                if test.get('vantage') is not None:
+                    report_lines.append(f"    Vantage point: {test['vantage']}")
                 report_lines.append(f"    Expected: {test['expected_result']}")
-                report_lines.append(f"    Actual: {test['actual_result']}")
+                report_lines.append(f"    Actual: {test['actual_result']}" + (" (from probe cache)" if test.get('cached') else ""))
                 report_lines.append("    Recommendation: Review firewall rules for this traffic.")
 
         if skipped_tests:
             report_lines.append("\n[---] Skipped Test Cases:")
             for test in skipped_tests:
                 report_lines.append(f"  - Name: {test['name']}")
-                report_lines.append(f"    Reason: Unsupported protocol '{test['protocol']}'.")
+                if test['protocol'] == 'udp':
+                    report_lines.append("    Reason: UDP probes need raw sockets.")
+                else:
+                    report_lines.append(f"    Reason: Unsupported protocol '{test['protocol']}'.")
+
+        if host_timing:
+            report_lines.extend(format_host_timing(host_timing, host_timing_top))
+
+        if metrics:
+            report_lines.extend(format_metrics(metrics))
 
         report_lines.append("\n--- End of Report ---")
         return "\n".join(report_lines)
+
+class ReportWriter:
+    """
+    Base class for report writers that write each result to the output as soon
+    as it finishes and keep only running tallies in memory.
+    """
+    def __init__(self, stream, fields=RESULT_FIELDS):
+        """
+        Initializes the ReportWriter.
+
+        Args:
+            stream (file): A text stream opened for writing.
+            fields (tuple): Result fields for formats with fixed columns.
+        """
+        self.stream = stream
+        self.fields = fields
+        self.tally = ResultTally()
+        self.vantage_tallies = {}
+        self.write_header()
+
+    def write_header(self):
+        pass
+
+    def write_result(self, result):
+        raise NotImplementedError
+
+    def write_footer(self):
+        pass
+
+    def write_metrics(self, metrics):
+        """
+        Embeds a run metrics summary in the report, where the format allows it.
+        Call before close().
+        """
+        pass
+
+    def write(self, result):
+        """
+        Writes one result and updates the running tallies.
+
+        Args:
+            result (TestResult or dict): A test result.
+        """
+        self.tally.add(result)
+        if isinstance(result, dict):
+            _add_vantage(self.vantage_tallies, result)
+        self.write_result(result)
+
+    def close(self):
+        """
+        Finishes the report. The underlying stream is left open.
+        """
+        self.write_footer()
+        self.stream.flush()
+
+class JsonlReportWriter(ReportWriter):
+    """
+    Writes one JSON object per result (JSON Lines).
+    """
+    def write_result(self, result):
+        self.stream.write(json.dumps(_as_dict(result)))
+        self.stream.write("\n")
+
+    def write_metrics(self, metrics):
+        self.stream.write(json.dumps({'metrics': metrics}))
+        self.stream.write("\n")
+
+class CsvReportWriter(ReportWriter):
+    """
+    Writes one CSV row per result, with a header row.
+    """
+    def write_header(self):
+        self._writer = csv.writer(self.stream)
+        self._writer.writerow(self.fields)
+
+    def write_result(self, result):
+        test = _as_dict(result)
+        self._writer.writerow([test.get(field) for field in self.fields])
+
+class JUnitReportWriter(ReportWriter):
+    """
+    Writes a JUnit XML report with one <testcase> per result. Counts are left
+    to the consumer, since they are not known until the run ends.
+    """
+    def write_header(self):
+        self.stream.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.stream.write('<testsuites>\n<testsuite name="firewall_tester">\n')
+
+    def write_result(self, result):
+        test = _as_dict(result)
+        target = f"{test['dest_ip']}:{test['dest_port']}/{test['protocol']}"
+        if test.get('vantage') is not None:
+            target = f"{test['vantage']}/{target}"
+        self.stream.write(f'  <testcase classname={quoteattr(target)} name={quoteattr(str(test["name"]))}>')
+        if test.get('cached'):
+            self.stream.write('<properties><property name="cached" value="true"/></properties>')
+        if test['actual_result'] == 'skipped':
+            self.stream.write(f'<skipped message={quoteattr("Unsupported protocol " + test["protocol"])}/>')
+        elif test['status'] == 'FAIL':
+            message = f"Expected '{test['expected_result']}', Got '{test['actual_result']}'"
+            self.stream.write(f'<failure message={quoteattr(message)}>{escape(message)}</failure>')
+        self.stream.write('</testcase>\n')
+
+    def write_metrics(self, metrics):
+        self.stream.write(f'  <system-out>{escape(json.dumps(metrics))}</system-out>\n')
+
+    def write_footer(self):
+        self.stream.write('</testsuite>\n</testsuites>\n')
+
+REPORT_WRITERS = {
+    'jsonl': JsonlReportWriter,
+    'csv': CsvReportWriter,
+    'junit': JUnitReportWriter,
+}
+
+def get_report_writer(output_format, stream, fields=RESULT_FIELDS):
+    """
+    Creates a streaming report writer.
+
+    Args:
+        output_format (str): One of 'jsonl', 'csv' or 'junit'.
+        stream (file): A text stream opened for writing.
+        fields (tuple): Result fields for formats with fixed columns.
+
+    Returns:
+        ReportWriter: The writer for the requested format.
+    """
+    return REPORT_WRITERS[output_format](stream, fields)
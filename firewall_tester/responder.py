@@ -0,0 +1,341 @@
+import contextlib
+import heapq
+import itertools
+import random
+import selectors
+import socket
+import threading
+import time
+import zlib
+
+from .logger import fw_logger
+from .config import ICMP_BURST
+from .syn_scanner import BatchSynScanner
+from .udp_scanner import UdpScanner
+from .scapy_loader import load_scapy, module_getattr
+from . import tester as tester_module
+
+# scapy is only imported when the simulated target builds its first reply
+_SCAPY_NAMES = ('IP', 'TCP', 'UDP', 'ICMP', 'IPerror')
+__getattr__ = module_getattr(globals(), _SCAPY_NAMES, __name__)
+
+# What a simulated target does with a probe
+OPEN, RESET, UNREACHABLE, SILENT = "open", "reset", "unreachable", "silent"
+
+class SimulatedTarget:
+    """
+    In-process stand-in for the network: answers probes after a configurable
+    latency, with a configurable mix of open ports, TCP resets (or ICMP
+    port-unreachable for UDP), ICMP admin-prohibited errors and silence, plus
+    random packet loss. Each target's behaviour is a stable hash of
+    (dest_ip, dest_port, protocol), so repeated runs see the same verdicts.
+    Like a real host, it can rate-limit the ICMP errors it sends.
+
+    attach() swaps it in for scapy's sr1()/sr() and the batch scanners, so
+    FirewallRuleTester runs its real code paths against it.
+    """
+    def __init__(self, latency=0.0005, jitter=0.0, loss=0.0, reset=0.3, unreachable=0.1, silent=0.1, seed=0,
+                 icmp_rate=None, icmp_burst=ICMP_BURST):
+        """
+        Initializes the SimulatedTarget.
+
+        Args:
+            latency (float): Round-trip time of an answered probe, in seconds.
+            jitter (float): Maximum random extra round-trip time, in seconds.
+            loss (float): Probability that a probe or its reply is lost.
+            reset (float): Share of targets that reset the connection (TCP) or
+                answer ICMP port-unreachable (UDP).
+            unreachable (float): Share of targets behind an ICMP admin-prohibited filter.
+            silent (float): Share of targets that never answer (dropped).
+            seed (int): Seed for the loss and jitter draws.
+            icmp_rate (float): ICMP errors per second each destination sends at
+                most, after a burst of `icmp_burst`, or None for no limit.
+            icmp_burst (int): ICMP errors a destination sends back to back.
+        """
+        if reset + unreachable + silent > 1:
+            raise ValueError("The reset, unreachable and silent shares add up to more than 1")
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reset = reset
+        self.unreachable = unreachable
+        self.silent = silent
+        self.icmp_rate = icmp_rate
+        self.icmp_burst = icmp_burst
+        self.probes = 0
+        self.icmp_suppressed = 0
+        self._icmp_buckets = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def behaviour(self, dest_ip, dest_port, protocol):
+        """
+        Returns OPEN, RESET, UNREACHABLE or SILENT for a target.
+        """
+        draw = zlib.crc32(f"{dest_ip}:{dest_port}/{protocol}".encode()) / 0x100000000
+        if draw < self.reset:
+            return RESET
+        if draw < self.reset + self.unreachable:
+            return UNREACHABLE
+        if draw < self.reset + self.unreachable + self.silent:
+            return SILENT
+        return OPEN
+
+    def expected_verdict(self, dest_ip, dest_port, protocol):
+        """
+        Returns the verdict a loss-free probe of the target yields.
+        """
+        behaviour = self.behaviour(dest_ip, dest_port, protocol)
+        if protocol == "udp":
+            return {OPEN: "open", RESET: "closed"}.get(behaviour, "open|filtered")
+        return {OPEN: "open", RESET: "closed"}.get(behaviour, "filtered")
+
+    def _round_trip(self, dest_ip, dest_port, protocol):
+        """
+        Returns (behaviour, seconds until the reply arrives), with None for
+        the delay if nothing comes back.
+        """
+        behaviour = self.behaviour(dest_ip, dest_port, protocol)
+        with self._lock:
+            self.probes += 1
+            lost = self.loss and self._random.random() < self.loss
+            extra = self._random.random() * self.jitter if self.jitter else 0
+            if lost or behaviour == SILENT or (protocol == "udp" and behaviour == UNREACHABLE):
+                return behaviour, None
+            icmp = behaviour == UNREACHABLE or (protocol == "udp" and behaviour == RESET)
+            if icmp and not self._take_icmp_token(dest_ip):
+                self.icmp_suppressed += 1
+                return behaviour, None
+        return behaviour, self.latency + extra
+
+    def _take_icmp_token(self, dest_ip):
+        """
+        Spends one of the destination's ICMP error tokens, like the kernel's
+        per-destination rate limit. Returns False if none is left.
+        Must be called with the lock held.
+        """
+        if self.icmp_rate is None:
+            return True
+        now = time.monotonic()
+        tokens, updated = self._icmp_buckets.get(dest_ip, (self.icmp_burst, now))
+        tokens = min(self.icmp_burst, tokens + (now - updated) * self.icmp_rate)
+        allowed = tokens >= 1
+        self._icmp_buckets[dest_ip] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def _reply(self, packet, behaviour):
+        """
+        Builds the scapy reply a real target would send to `packet`.
+        """
+        ip = packet[IP]
+        if packet.haslayer(TCP):
+            probe = packet[TCP]
+            if behaviour == UNREACHABLE:
+                return IP(src=ip.dst) / ICMP(type=3, code=13) / IPerror(bytes(ip)[:28])
+            flags = "SA" if behaviour == OPEN else "RA"
+            return IP(src=ip.dst) / TCP(sport=probe.dport, dport=probe.sport, flags=flags, ack=(int(probe.seq) + 1))
+        if behaviour == RESET:
+            return IP(src=ip.dst) / ICMP(type=3, code=3) / IPerror(bytes(ip)[:28])
+        return IP(src=ip.dst) / UDP(sport=packet[UDP].dport, dport=packet[UDP].sport)
+
+    def sr1(self, packet, timeout=None, verbose=0, **kwargs):
+        """
+        Stand-in for scapy's sr1(): blocks for the round-trip time and returns
+        the reply, or blocks for `timeout` and returns None.
+        """
+        load_scapy(globals(), _SCAPY_NAMES)
+        protocol = "tcp" if packet.haslayer(TCP) else "udp"
+        layer = packet[TCP] if protocol == "tcp" else packet[UDP]
+        packet.sent_time = time.time()
+        behaviour, delay = self._round_trip(packet[IP].dst, int(layer.dport), protocol)
+        if delay is None or (timeout is not None and delay > timeout):
+            time.sleep(timeout or 0)
+            return None
+        time.sleep(delay)
+        reply = self._reply(packet, behaviour)
+        reply.time = packet.sent_time + delay
+        return reply
+
+    def sr(self, *args, **kwargs):
+        """
+        Stand-in for scapy's sr(), used to tear down open connections.
+        """
+        return [], []
+
+    def scanner_class(self):
+        """
+        Returns a batch SYN scanner class whose probes this target answers.
+        """
+        return type("SimulatedSynScanner", (SimulatedSynScanner,), {'target': self})
+
+    def udp_scanner_class(self):
+        """
+        Returns a UDP scanner class whose probes this target answers.
+        """
+        return type("SimulatedUdpScanner", (SimulatedUdpScanner,), {'target': self})
+
+    @contextlib.contextmanager
+    def attach(self):
+        """
+        Points FirewallRuleTester's sr1()/sr(), batch SYN and UDP scanners at
+        this target for the duration of the block. The connect engine is not
+        simulated: its connect() calls go to the kernel.
+        """
+        load_scapy(vars(tester_module), tester_module._SCAPY_NAMES)
+        scanner_cls = self.scanner_class()
+        udp_scanner_cls = self.udp_scanner_class()
+        replaced = {'sr1': self.sr1, 'sr': self.sr, 'BatchSynScanner': scanner_cls, 'RawSynScanner': scanner_cls,
+                    'UdpScanner': udp_scanner_cls, 'RawUdpScanner': udp_scanner_cls}
+        saved = {name: getattr(tester_module, name) for name in replaced}
+        for name, value in replaced.items():
+            setattr(tester_module, name, value)
+        try:
+            yield self
+        finally:
+            for name, value in saved.items():
+                setattr(tester_module, name, value)
+
+class _SimulatedReplies:
+    """
+    Scanner mixin that sends probes to a SimulatedTarget instead of a socket.
+    Replies are delivered from a timer thread through the same matching code
+    as sniffed ones.
+    """
+    target = None  # Bound by SimulatedTarget.scanner_class() / udp_scanner_class()
+
+    @staticmethod
+    def available():
+        return True
+
+    def _start(self, targets):
+        self._replies = []
+        self._reply_ids = itertools.count()
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._responder = threading.Thread(target=self._deliver, name="simulated-replies", daemon=True)
+        self._responder.start()
+
+    def _stop(self):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify()
+        self._responder.join()
+
+    def _deliver(self):
+        while True:
+            with self._wakeup:
+                while not self._stopping and (not self._replies or self._replies[0][0] > time.time()):
+                    self._wakeup.wait(self._replies[0][0] - time.time() if self._replies else None)
+                if self._stopping:
+                    return
+                due, _, reply = heapq.heappop(self._replies)
+            self._arrived(due, *reply)
+
+    def _schedule(self, delay, *reply):
+        """
+        Delivers a reply to _arrived() after `delay` seconds.
+        """
+        with self._wakeup:
+            heapq.heappush(self._replies, (time.time() + delay, next(self._reply_ids), reply))
+            self._wakeup.notify()
+
+class SimulatedSynScanner(_SimulatedReplies, BatchSynScanner):
+    """
+    BatchSynScanner whose SYNs go to a SimulatedTarget.
+    """
+    def _arrived(self, due, key, tcp_flags):
+        self._match_reply(key, tcp_flags, due, (key[2] + 1) & 0xFFFFFFFF)
+
+    def _send_syn(self, address, dest_port, seq):
+        behaviour, delay = self.target._round_trip(address, dest_port, "tcp")
+        if delay is not None:
+            self._schedule(delay, (address, dest_port, seq), {OPEN: 0x12, RESET: 0x14}.get(behaviour))
+
+    def _send_rst(self, address, dest_port, seq):
+        pass
+
+class SimulatedUdpScanner(_SimulatedReplies, UdpScanner):
+    """
+    UdpScanner whose probes go to a SimulatedTarget.
+    """
+    def _arrived(self, due, key, verdict, icmp):
+        self._match_reply(key, verdict, due, icmp)
+
+    def _send_udp(self, address, dest_port, payload=b'', payload_sum=0):
+        behaviour, delay = self.target._round_trip(address, dest_port, "udp")
+        if delay is not None:
+            self._schedule(delay, (address, dest_port), "closed" if behaviour == RESET else "open",
+                           behaviour == RESET)
+
+class LoopbackResponder:
+    """
+    Real sockets for the tester to probe: TCP listeners on the open ports
+    (the kernel answers the rest with RSTs) and UDP sockets that echo every
+    datagram. Bind it to 127.0.0.1, or to an address inside a network
+    namespace to put a real routing hop between tester and target.
+    """
+    def __init__(self, address="127.0.0.1", tcp_ports=(), udp_ports=()):
+        """
+        Initializes the LoopbackResponder.
+
+        Args:
+            address (str): Address to listen on.
+            tcp_ports (iterable): TCP ports to accept connections on.
+            udp_ports (iterable): UDP ports to answer datagrams on.
+        """
+        self.address = address
+        self.tcp_ports = list(tcp_ports)
+        self.udp_ports = list(udp_ports)
+        self._socks = []
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        selector = selectors.DefaultSelector()
+        for port in self.tcp_ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.address, port))
+            sock.listen(socket.SOMAXCONN)
+            sock.setblocking(False)
+            self._socks.append(sock)
+            selector.register(sock, selectors.EVENT_READ, "tcp")
+        for port in self.udp_ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((self.address, port))
+            sock.setblocking(False)
+            self._socks.append(sock)
+            selector.register(sock, selectors.EVENT_READ, "udp")
+        self._thread = threading.Thread(target=self._serve, args=(selector,), name="loopback-responder", daemon=True)
+        self._thread.start()
+        fw_logger.info(f"[*] Responder on {self.address}: {len(self.tcp_ports)} TCP and {len(self.udp_ports)} UDP "
+                       f"ports open.")
+        return self
+
+    def _serve(self, selector):
+        while not self._stopping.is_set():
+            for key, _ in selector.select(timeout=0.2):
+                try:
+                    if key.data == "tcp":
+                        # A SYN scan never completes the handshake; drop anything that does
+                        key.fileobj.accept()[0].close()
+                    else:
+                        data, peer = key.fileobj.recvfrom(65535)
+                        key.fileobj.sendto(data, peer)
+                except OSError:
+                    continue
+        selector.close()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        for sock in self._socks:
+            sock.close()
+        self._socks = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,65 @@
+import sys
+
+RESULT_FIELDS = ('name', 'dest_ip', 'dest_port', 'protocol', 'expected_result', 'actual_result', 'status', 'cached')
+
+class TestResult:
+    """
+    Compact record of one test case's outcome. The small vocabulary of
+    protocols, verdicts and statuses is interned so million-probe runs share
+    a handful of string objects.
+    """
+    __slots__ = RESULT_FIELDS
+
+    def __init__(self, name, dest_ip, dest_port, protocol, expected_result, actual_result, status, cached=False):
+        self.name = name
+        self.dest_ip = dest_ip
+        self.dest_port = dest_port
+        self.protocol = sys.intern(protocol)
+        self.expected_result = sys.intern(expected_result)
+        self.actual_result = sys.intern(actual_result)
+        self.status = sys.intern(status)
+        self.cached = cached
+
+    def __reduce__(self):
+        # Pickled as constructor arguments, which is much faster than the slots state shards would send otherwise
+        return TestResult, tuple(getattr(self, field) for field in RESULT_FIELDS)
+
+    def to_dict(self):
+        """
+        Returns the result as the dictionary shape used in reports.
+        """
+        return {field: getattr(self, field) for field in RESULT_FIELDS}
+
+class ResultTally:
+    """
+    Running pass/fail/skip counts, so summaries never need the full result list.
+    """
+    __slots__ = ('total', 'passed', 'failed', 'skipped', 'cached')
+
+    def __init__(self):
+        self.total = 0
+        self.passed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.cached = 0
+
+    def add(self, result):
+        """
+        Counts one result.
+
+        Args:
+            result (TestResult or dict): A test result.
+        """
+        if isinstance(result, dict):
+            status, actual_result, cached = result['status'], result['actual_result'], result.get('cached')
+        else:
+            status, actual_result, cached = result.status, result.actual_result, result.cached
+        self.total += 1
+        if status == "PASS":
+            self.passed += 1
+        elif status == "FAIL":
+            self.failed += 1
+        if actual_result == "skipped":
+            self.skipped += 1
+        if cached:
+            self.cached += 1
@@ -0,0 +1,328 @@
+import collections
+import socket
+import struct
+import sys
+import threading
+import time
+
+from .logger import fw_logger
+from .config import ROUTE_CHECK_INTERVAL, ROUTE_CACHE_TTL
+from .rawpacket import source_address_for
+
+# rtnetlink (linux/rtnetlink.h) message types, flags, multicast groups and route attributes
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_PREFSRC = 7
+RTA_TABLE = 15
+
+# Routing tables in the order the default policy rules consult them
+ROUTE_TABLES = (255, 254, 253)  # local, main, default
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_RTMSG = struct.Struct('=BBBBBBBBI')
+_RTATTR = struct.Struct('=HH')
+_ADDRESS = struct.Struct('!I')
+
+Route = collections.namedtuple('Route', ['prefix', 'iface', 'gateway', 'source'])
+Route.__doc__ = """
+The outcome of one route lookup, shared by every destination under `prefix`
+('a.b.c.d/n'). `gateway` is None for on-link destinations and `iface` or
+`source` is None where it could not be determined.
+"""
+
+_RouteEntry = collections.namedtuple('_RouteEntry', ['network', 'prefix_len', 'metric', 'oif', 'gateway', 'prefsrc'])
+
+def _parse_route(data, offset, length):
+    """
+    Returns the (table, _RouteEntry) of an RTM_NEWROUTE message, or None if it is not IPv4.
+    """
+    family, prefix_len, _, _, table, _, _, _, _ = _RTMSG.unpack_from(data, offset + _NLMSGHDR.size)
+    if family != socket.AF_INET:
+        return None
+    attrs = {}
+    position = offset + _NLMSGHDR.size + _RTMSG.size
+    while position + _RTATTR.size <= offset + length:
+        size, kind = _RTATTR.unpack_from(data, position)
+        if size < _RTATTR.size:
+            break
+        attrs[kind] = data[position + _RTATTR.size:position + size]
+        position += (size + 3) & ~3
+    if RTA_TABLE in attrs:
+        table = struct.unpack('=I', attrs[RTA_TABLE])[0]
+    network = _ADDRESS.unpack(attrs[RTA_DST])[0] if RTA_DST in attrs else 0
+    metric = struct.unpack('=I', attrs[RTA_PRIORITY])[0] if RTA_PRIORITY in attrs else 0
+    oif = struct.unpack('=I', attrs[RTA_OIF])[0] if RTA_OIF in attrs else None
+    gateway = socket.inet_ntoa(attrs[RTA_GATEWAY]) if RTA_GATEWAY in attrs else None
+    prefsrc = socket.inet_ntoa(attrs[RTA_PREFSRC]) if RTA_PREFSRC in attrs else None
+    return table, _RouteEntry(network, prefix_len, metric, oif, gateway, prefsrc)
+
+def read_routes():
+    """
+    Dumps the kernel's IPv4 routing tables over rtnetlink.
+
+    Returns:
+        dict: Maps routing table ids to lists of route entries.
+
+    Raises:
+        OSError: If rtnetlink is unavailable (e.g. not Linux).
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + _RTMSG.size, RTM_GETROUTE, NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+                  + _RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0))
+        tables = collections.defaultdict(list)
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, kind, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if kind == NLMSG_DONE:
+                    return dict(tables)
+                if kind == NLMSG_ERROR:
+                    code = -struct.unpack_from('=i', data, offset + _NLMSGHDR.size)[0]
+                    raise OSError(code, f"route dump failed: {code}")
+                if kind == RTM_NEWROUTE:
+                    parsed = _parse_route(data, offset, length)
+                    if parsed is not None:
+                        tables[parsed[0]].append(parsed[1])
+                if length < _NLMSGHDR.size:
+                    break
+                offset += (length + 3) & ~3
+    finally:
+        sock.close()
+
+def _watch_routes():
+    """
+    Returns a non-blocking rtnetlink socket subscribed to route, address and
+    link changes, or None if they cannot be watched.
+    """
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    except (OSError, AttributeError):
+        return None
+    try:
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+class RouteCache:
+    """
+    Per-run cache of route, next-hop and source address lookups, keyed by the
+    routing table entry a destination falls under, so suites with thousands
+    of destinations in a few subnets pay for a few lookups. The kernel's IPv4
+    tables are dumped over rtnetlink and matched by longest prefix (local,
+    main, then default table; policy rules are not modelled); the source
+    address of each entry comes from the kernel itself. Without rtnetlink,
+    every destination is its own entry.
+
+    Entries are dropped when the kernel reports a route, address or link
+    change, checked at most every ROUTE_CHECK_INTERVAL seconds, or every
+    ROUTE_CACHE_TTL seconds where changes cannot be watched. scapy's own
+    routing table is resynced then as well. Safe to share between probe
+    threads and engines.
+    """
+    def __init__(self, iface=None, metrics=None, check_interval=ROUTE_CHECK_INTERVAL, ttl=ROUTE_CACHE_TTL):
+        """
+        Initializes the RouteCache.
+
+        Args:
+            iface (str): Interface all probes leave through, or None to follow the routing table.
+            metrics (RunMetrics): Run metrics to count cache hits, misses and
+                invalidations in, or None.
+            check_interval (float): Seconds between checks for route changes.
+            ttl (float): Seconds entries are kept where route changes cannot be watched.
+        """
+        self.iface = iface
+        self.metrics = metrics
+        self.check_interval = check_interval
+        self.ttl = ttl
+        self.hits = self.misses = self.invalidations = 0
+        self._routes = {}  # (prefix_len, network) or address -> Route
+        self._prefixes = None  # Loaded on first use (see _load)
+        self._warned = False
+        self._lock = threading.Lock()
+        self._watch = None  # Opened with the first table dump, so runs that never look up a route open nothing
+        self._checked = self._loaded = time.monotonic()
+
+    def close(self):
+        """
+        Stops watching for route changes.
+        """
+        with self._lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+
+    def _changed(self, now):
+        """
+        Returns True if the routes may have changed since the last check.
+        """
+        if self._watch is None:
+            return now - self._loaded >= self.ttl
+        changed = False
+        try:
+            while True:
+                self._watch.recv(65536)
+                changed = True
+        except (BlockingIOError, InterruptedError):
+            return changed
+        except OSError:
+            return True  # Notifications overflowed the socket buffer
+
+    def _load(self):
+        """
+        Loads the routing tables as (mask, prefix length, entries by network)
+        tuples in the order a lookup consults them: by table, longest prefix first.
+        """
+        self._prefixes = []
+        if self._watch is None and not self._warned:
+            # Subscribe before dumping, so no change between the two goes unnoticed
+            self._watch = _watch_routes()
+        try:
+            tables = read_routes()
+        except OSError as e:
+            if not self._warned:
+                fw_logger.warning(f"[WARNING] Could not read the routing table ({e}); caching routes per destination.")
+                self._warned = True
+            return
+        for table in ROUTE_TABLES:
+            index = collections.defaultdict(dict)
+            for entry in tables.get(table, ()):
+                best = index[entry.prefix_len].get(entry.network)
+                if best is None or entry.metric < best.metric:
+                    index[entry.prefix_len][entry.network] = entry
+            for prefix_len in sorted(index, reverse=True):
+                mask = (0xFFFFFFFF << (32 - prefix_len)) & 0xFFFFFFFF
+                self._prefixes.append((mask, prefix_len, index[prefix_len]))
+
+    def invalidate(self):
+        """
+        Drops every cached lookup and reloads the routing tables on the next one.
+        """
+        with self._lock:
+            self._invalidate()
+
+    def _invalidate(self):
+        self._routes = {}
+        self._prefixes = None
+        self._loaded = time.monotonic()
+        self.invalidations += 1
+        if self.metrics is not None:
+            self.metrics.count_route_invalidation()
+        scapy_config = sys.modules.get('scapy.config')
+        if scapy_config is not None:
+            try:
+                scapy_config.conf.route.resync()
+            except Exception as e:
+                fw_logger.warning(f"[WARNING] Could not resync scapy's routing table: {e}")
+
+    def _match(self, address, value):
+        """
+        Returns the key and routing table entry the address `value` falls
+        under, or (address, None) if none does.
+        """
+        if self._prefixes is None:
+            self._load()
+        for mask, prefix_len, entries in self._prefixes:
+            entry = entries.get(value & mask)
+            if entry is not None:
+                return (prefix_len, value & mask), entry
+        return address, None
+
+    def _resolve(self, address, entry):
+        """
+        Builds the Route of a table entry (or of a lone address) from a destination under it.
+        """
+        if entry is None:
+            prefix, iface, gateway, prefsrc = f"{address}/32", None, None, None
+        else:
+            prefix = f"{socket.inet_ntoa(_ADDRESS.pack(entry.network))}/{entry.prefix_len}"
+            iface, gateway, prefsrc = None, entry.gateway, entry.prefsrc
+            if entry.oif is not None:
+                try:
+                    iface = socket.if_indextoname(entry.oif)
+                except OSError:
+                    pass
+        if self.iface is not None:
+            iface, prefsrc = self.iface, None
+        source = prefsrc
+        if source is None:
+            try:
+                source = source_address_for(address, self.iface)
+            except OSError:
+                pass  # Unreachable: the engines report the error when they send
+        return Route(prefix, iface, gateway, source)
+
+    def lookup(self, dest_ip):
+        """
+        Returns the Route to an IPv4 address, or None for hostnames and
+        other destinations that are not IPv4 addresses.
+        """
+        try:
+            value = _ADDRESS.unpack(socket.inet_aton(dest_ip))[0]
+        except (OSError, TypeError):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked >= self.check_interval:
+                self._checked = now
+                if self._changed(now):
+                    self._invalidate()
+            key, entry = self._match(dest_ip, value)
+            route = self._routes.get(key)
+            hit = route is not None
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                route = self._routes[key] = self._resolve(dest_ip, entry)
+        if self.metrics is not None:
+            self.metrics.count_route_lookup(hit)
+        return route
+
+    def source_for(self, dest_ip):
+        """
+        Returns the local address probes to `dest_ip` leave from, or None if unknown.
+        """
+        route = self.lookup(dest_ip)
+        return route.source if route is not None else None
+
+    def iface_for(self, dest_ip):
+        """
+        Returns the interface probes to `dest_ip` leave through, or None if unknown.
+        """
+        route = self.lookup(dest_ip)
+        return route.iface if route is not None else None
+
+    def next_hop(self, dest_ip):
+        """
+        Returns the address whose link-layer address frames to `dest_ip` are
+        sent to: the gateway, or the destination itself when it is on-link.
+        """
+        route = self.lookup(dest_ip)
+        if route is None:
+            return None
+        return route.gateway or dest_ip
+
+    def summary(self):
+        """
+        Returns the cache counters and the number of cached entries.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                    'entries': len(self._routes)}
@@ -1,9 +1,264 @@
+import ipaddress
+import json
+import re
+import time
 import yaml
 from .logger import fw_logger
+from .config import MONITOR_PRIORITIES
+from .payloads import decode_payload
+
+HOSTNAME_RE = re.compile(r'^(?=.*[A-Za-z])[A-Za-z0-9.-]+$')
+
+def _split_spec(spec):
+    """
+    Splits a YAML list or a comma-separated string into its items.
+    """
+    if isinstance(spec, (list, tuple)):
+        items = spec
+    else:
+        items = str(spec).split(',')
+    return [str(item).strip() for item in items if str(item).strip()]
+
+def parse_ip_spec(spec):
+    """
+    Parses a dest_ip specification into address ranges without expanding it.
+
+    Accepts a single address, a CIDR ("10.20.0.0/16"), an address range
+    ("10.0.0.1-10.0.0.50"), a hostname, or a list / comma-separated mix of those.
+
+    Args:
+        spec (str or list): The dest_ip value from a test case.
+
+    Returns:
+        list: (first, last) tuples of ipaddress objects, or (hostname, hostname).
+
+    Raises:
+        ValueError: If an item is not a valid address, network, range or hostname.
+    """
+    ranges = []
+    for item in _split_spec(spec):
+        try:
+            if '/' in item:
+                network = ipaddress.ip_network(item, strict=False)
+                ranges.append((network[0], network[-1]))
+            elif '-' in item and not HOSTNAME_RE.match(item):
+                first, last = (ipaddress.ip_address(part.strip()) for part in item.split('-', 1))
+                if first.version != last.version or first > last:
+                    raise ValueError(f"'{item}' is not an ascending address range")
+                ranges.append((first, last))
+            else:
+                address = ipaddress.ip_address(item)
+                ranges.append((address, address))
+        except ValueError:
+            if not HOSTNAME_RE.match(item):
+                raise ValueError(f"Invalid destination '{item}'")
+            ranges.append((item, item))
+    if not ranges:
+        raise ValueError("Empty destination")
+    return ranges
+
+def parse_port_spec(spec):
+    """
+    Parses a dest_port specification into port ranges without expanding it.
+
+    Accepts a single port, a range ("1-1024"), or a list / comma-separated mix of those.
+
+    Args:
+        spec (int, str or list): The dest_port value from a test case.
+
+    Returns:
+        list: (first, last) port tuples.
+
+    Raises:
+        ValueError: If an item is not a valid port or port range.
+    """
+    if isinstance(spec, bool):
+        raise ValueError(f"Invalid port '{spec}'")
+    ranges = []
+    for item in _split_spec(spec):
+        first, _, last = item.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError(f"Invalid port '{item}'")
+        if not 1 <= first <= last <= 65535:
+            raise ValueError(f"Invalid port range '{item}'")
+        ranges.append((first, last))
+    if not ranges:
+        raise ValueError("Empty port specification")
+    return ranges
+
+def _range_size(first, last):
+    if isinstance(first, str):
+        return 1
+    return int(last) - int(first) + 1
+
+def count_probes(test_cases):
+    """
+    Counts the probes a list of compact test cases expands to, without expanding them.
+
+    Args:
+        test_cases (iterable): Validated test case dictionaries.
+
+    Returns:
+        int: The number of (dest_ip, dest_port) probes.
+    """
+    total = 0
+    for test_case in test_cases:
+        ips, ports = probe_shape(test_case)
+        total += ips * ports
+    return total
+
+def probe_shape(test_case):
+    """
+    Counts the destinations and ports of one compact test case, without expanding it.
+
+    Args:
+        test_case (dict): A validated test case dictionary.
+
+    Returns:
+        tuple: (destinations, ports per destination).
+    """
+    ips = sum(_range_size(first, last) for first, last in parse_ip_spec(test_case['dest_ip']))
+    ports = sum(last - first + 1 for first, last in parse_port_spec(test_case['dest_port']))
+    return ips, ports
+
+def _iter_ips(ranges):
+    for first, last in ranges:
+        if isinstance(first, str):
+            yield first
+            continue
+        for value in range(int(first), int(last) + 1):
+            yield str(type(first)(value))
+
+def _iter_ports(ranges):
+    for first, last in ranges:
+        yield from range(first, last + 1)
+
+def expand_test_case(test_case):
+    """
+    Lazily expands a test case whose dest_ip / dest_port cover several targets
+    into one test case per (dest_ip, dest_port).
+
+    Args:
+        test_case (dict): A validated test case dictionary.
+
+    Yields:
+        dict: A test case with a single dest_ip and an integer dest_port.
+    """
+    ip_ranges = parse_ip_spec(test_case['dest_ip'])
+    port_ranges = parse_port_spec(test_case['dest_port'])
+    ips = sum(_range_size(first, last) for first, last in ip_ranges)
+    ports = sum(last - first + 1 for first, last in port_ranges)
+    if ips == 1 and ports == 1 and isinstance(test_case['dest_port'], int) \
+            and str(ip_ranges[0][0]) == test_case['dest_ip']:
+        yield test_case
+        return
+
+    name = test_case.get('name')
+    for dest_ip in _iter_ips(ip_ranges):
+        for dest_port in _iter_ports(port_ranges):
+            expanded = dict(test_case, dest_ip=dest_ip, dest_port=dest_port)
+            if name is not None and ips * ports > 1:
+                expanded['name'] = f"{name} ({dest_ip}:{dest_port})"
+            yield expanded
+
+def expand_test_cases(test_cases):
+    """
+    Lazily expands every test case into single-target test cases.
+    Entries that are not valid test cases are passed through unchanged.
+
+    Args:
+        test_cases (iterable): Test case dictionaries in compact form.
+
+    Yields:
+        dict: One test case per (dest_ip, dest_port).
+    """
+    for test_case in test_cases:
+        try:
+            yield from expand_test_case(test_case)
+        except (KeyError, TypeError, ValueError):
+            yield test_case
+
+def split_by_destination(test_cases):
+    """
+    Lazily splits every test case into one part per destination, where each
+    part expands (see expand_test_cases()) to exactly the test cases the
+    original expands to for that destination, in the same order. Callers that
+    route work by destination handle one part per host instead of one test
+    case per port, and leave the expansion to whoever runs the part.
+
+    Args:
+        test_cases (iterable): Test case dictionaries in compact form.
+
+    Yields:
+        tuple: (dest_ip, part, size), where `size` is the number of test cases
+            the part expands to. Entries that are not valid test cases are
+            passed through as their own part of size 1, with their raw
+            dest_ip (or None).
+    """
+    for test_case in test_cases:
+        try:
+            ip_ranges = parse_ip_spec(test_case['dest_ip'])
+            port_ranges = parse_port_spec(test_case['dest_port'])
+        except (KeyError, TypeError, ValueError):
+            yield test_case.get('dest_ip') if isinstance(test_case, dict) else None, test_case, 1
+            continue
+        ips = sum(_range_size(first, last) for first, last in ip_ranges)
+        ports = sum(last - first + 1 for first, last in port_ranges)
+        if ips == 1 and ports == 1:
+            yield str(ip_ranges[0][0]), test_case, 1
+        elif ports == 1:
+            # A part with a single target would lose the target suffix of its name: build the test case here
+            name = test_case.get('name')
+            dest_port = port_ranges[0][0]
+            for dest_ip in _iter_ips(ip_ranges):
+                part = dict(test_case, dest_ip=dest_ip, dest_port=dest_port)
+                if name is not None:
+                    part['name'] = f"{name} ({dest_ip}:{dest_port})"
+                yield dest_ip, part, 1
+        else:
+            for dest_ip in _iter_ips(ip_ranges):
+                yield dest_ip, dict(test_case, dest_ip=dest_ip), ports
+
+REQUIRED_FIELDS = ['name', 'dest_ip', 'dest_port', 'protocol', 'expected_result']
+
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+
+def _test_case_error(test_case):
+    """
+    Checks a single test case.
+    Returns a description of the first problem found, or None if it is valid.
+    """
+    if not isinstance(test_case, dict):
+        return "is not a valid dictionary."
+
+    for field in REQUIRED_FIELDS:
+        if field not in test_case:
+            return f"('{test_case.get('name', 'N/A')}') is missing required field: '{field}'"
+
+    try:
+        parse_ip_spec(test_case['dest_ip'])
+        parse_port_spec(test_case['dest_port'])
+    except ValueError as e:
+        return f"('{test_case.get('name', 'N/A')}') has an invalid target: {e}"
+    if 'priority' in test_case and str(test_case['priority']).lower() not in MONITOR_PRIORITIES:
+        return (f"('{test_case.get('name', 'N/A')}') has an invalid priority: {test_case['priority']!r} "
+                f"(expected one of {', '.join(MONITOR_PRIORITIES)})")
+    if 'payload' in test_case or 'payload_hex' in test_case:
+        if str(test_case['protocol']).lower() != "udp":
+            return f"('{test_case.get('name', 'N/A')}') sets a payload, which only UDP probes send"
+        try:
+            decode_payload(test_case)
+        except ValueError as e:
+            return f"('{test_case.get('name', 'N/A')}') has an invalid payload: {e}"
+    return None
 
 def validate_test_cases(test_cases):
     """
-    Validates that each test case has the required fields.
+    Validates that each test case has the required fields and that its
+    dest_ip and dest_port specifications parse, without expanding them.
 
     Args:
         test_cases (list): A list of test case dictionaries.
@@ -11,18 +266,109 @@ def validate_test_cases(test_cases):
     Returns:
         bool: True if all test cases are valid, False otherwise.
     """
-    required_fields = ['name', 'dest_ip', 'dest_port', 'protocol', 'expected_result']
     for i, test_case in enumerate(test_cases):
-        if not isinstance(test_case, dict):
-            fw_logger.error(f"[ERROR] Test case {i + 1} is not a valid dictionary.")
+        error = _test_case_error(test_case)
+        if error:
+            fw_logger.error(f"[ERROR] Test case {i + 1} {error}")
             return False
-
-        for field in required_fields:
-            if field not in test_case:
-                fw_logger.error(f"[ERROR] Test case {i + 1} ('{test_case.get('name', 'N/A')}') is missing required field: '{field}'")
-                return False
     return True
 
+def _iter_jsonl_records(f):
+    """
+    Yields (line_number, record) pairs from a JSON Lines stream.
+    Lines that are not valid JSON are yielded as (line_number, error).
+    """
+    for line_number, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+
+def _iter_yaml_records(f):
+    """
+    Yields (line_number, record) pairs from a single or multi-document YAML
+    stream. Top-level sequences are composed one item at a time so that large
+    files never have to be loaded as a whole; other documents are one record each.
+    """
+    loader = yaml.SafeLoader(f)
+    try:
+        loader.get_event()  # StreamStartEvent
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # DocumentStartEvent
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    node = loader.compose_node(None, None)
+                    yield node.start_mark.line + 1, loader.construct_document(node)
+                loader.get_event()  # SequenceEndEvent
+            else:
+                node = loader.compose_node(None, None)
+                record = loader.construct_document(node)
+                if record is not None:
+                    yield node.start_mark.line + 1, record
+            loader.get_event()  # DocumentEndEvent
+            loader.anchors = {}
+    finally:
+        loader.dispose()
+
+def _report_error(errors, message):
+    fw_logger.error(message)
+    if errors is not None:
+        errors.append(message)
+
+def iter_test_cases(file_path, errors=None, metrics=None):
+    """
+    Streams validated test cases from a YAML (single or multi-document) or JSON
+    Lines file, yielding each one as soon as it has been read. Invalid records
+    are logged with their line number and skipped.
+
+    Args:
+        file_path (str): The path to a YAML file, or a .jsonl / .ndjson file.
+        errors (list): If given, a message for every invalid record or
+            unreadable file is appended to it.
+        metrics (RunMetrics): If given, the time spent reading records and
+            validating them is added to its 'parse' and 'validate' phases.
+
+    Yields:
+        dict: Validated test case dictionaries in compact form.
+    """
+    loaded = skipped = 0
+    clock = time.perf_counter
+    try:
+        with open(file_path, 'r') as f:
+            if file_path.lower().endswith(JSONL_EXTENSIONS):
+                records = _iter_jsonl_records(f)
+            else:
+                records = _iter_yaml_records(f)
+
+            started = clock()
+            for line_number, record in records:
+                parsed = clock()
+                if isinstance(record, ValueError):
+                    error = f"is not valid JSON: {record}"
+                else:
+                    error = _test_case_error(record)
+                if metrics is not None:
+                    validated = clock()
+                    metrics.add_phase('parse', parsed - started)
+                    metrics.add_phase('validate', validated - parsed)
+                if error:
+                    _report_error(errors, f"[ERROR] Test case at {file_path}:{line_number} {error}")
+                    skipped += 1
+                else:
+                    loaded += 1
+                    yield record
+                started = clock()
+    except FileNotFoundError:
+        _report_error(errors, f"[ERROR] Test case file not found: {file_path}")
+    except yaml.YAMLError as e:
+        _report_error(errors, f"[ERROR] Error parsing YAML file {file_path}: {e}")
+
+    fw_logger.info(f"[*] Streamed {loaded} test cases from {file_path} ({skipped} invalid records skipped)")
+
 def parse_test_cases(file_path):
     """
     Reads a YAML file and parses it into a list of test case dictionaries.
@@ -46,6 +392,8 @@ def parse_test_cases(file_path):
         if not validate_test_cases(test_cases):
             raise ValueError("Invalid test case format. See logs for details.")
 
+        fw_logger.info(f"[*] Test cases expand to {count_probes(test_cases)} probes.")
+
         return test_cases
     except FileNotFoundError:
         fw_logger.error(f"[ERROR] Test case file not found: {file_path}")
@@ -0,0 +1,846 @@
+import ipaddress
+import re
+import socket
+from bisect import bisect_right
+
+from .logger import fw_logger
+from .config import RULE_BLOCK_SIZE
+
+MAX_ADDRESS = 2 ** 32 - 1
+MAX_PORT = 65535
+
+# Probes are always TCP SYNs or UDP datagrams, so these are the only protocols matched
+PROTOCOLS = ('tcp', 'udp')
+PROTOCOL_NUMBERS = {'6': 'tcp', '17': 'udp'}
+
+TCP_FLAGS = {'fin': 0x01, 'syn': 0x02, 'rst': 0x04, 'psh': 0x08, 'ack': 0x10, 'urg': 0x20, 'ece': 0x40, 'cwr': 0x80}
+PROBE_TCP_FLAGS = TCP_FLAGS['syn']
+
+# nftables hook names of the iptables built-in chains
+NFT_HOOKS = {'INPUT': 'input', 'FORWARD': 'forward', 'OUTPUT': 'output'}
+NFT_PRIORITIES = {'raw': -300, 'mangle': -150, 'dstnat': -100, 'filter': 0, 'security': 50, 'srcnat': 100}
+NFT_VERDICTS = ('accept', 'drop', 'reject', 'jump', 'goto', 'return', 'queue')
+
+# Matches whose outcome for a single fresh probe is known without modelling them
+NEUTRAL_MODULES = ('comment', 'limit', 'tcp', 'udp', 'multiport', 'state', 'conntrack', 'iprange', 'icmp', 'recent',
+                   'connlimit', 'hashlimit', 'addrtype')
+
+def _normalize(ranges):
+    """
+    Sorts (first, last) ranges and merges overlapping or adjacent ones.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+def _complement(ranges, maximum):
+    """
+    Returns the ranges of [0, maximum] not covered by normalized `ranges`.
+    """
+    result = []
+    start = 0
+    for first, last in ranges:
+        if first > start:
+            result.append((start, first - 1))
+        start = last + 1
+    if start <= maximum:
+        result.append((start, maximum))
+    return result
+
+def _intersect(a, b):
+    """
+    Intersects two normalized range lists; None stands for "everything".
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        first, last = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if first <= last:
+            result.append((first, last))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def _address_ranges(items):
+    """
+    Parses IPv4 addresses, networks and address ranges into integer ranges.
+    """
+    ranges = []
+    for item in items:
+        if '-' in item:
+            first, last = (int(ipaddress.IPv4Address(part.strip())) for part in item.split('-', 1))
+        else:
+            network = ipaddress.IPv4Network(item, strict=False)
+            first, last = int(network.network_address), int(network.broadcast_address)
+        ranges.append((first, last))
+    return _normalize(ranges)
+
+def _port(value):
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return socket.getservbyname(value)
+
+def _port_ranges(items, separator):
+    """
+    Parses ports, service names and port ranges ("1000:2000" for iptables,
+    "1000-2000" for nftables) into integer ranges.
+    """
+    ranges = []
+    for item in items:
+        first, sep, last = item.partition(separator)
+        first = _port(first) if first else 0
+        last = (_port(last) if last else MAX_PORT) if sep else first
+        ranges.append((first, last))
+    return _normalize(ranges)
+
+def _tcp_flag_bits(names):
+    names = [name for name in re.split(r'[,|()\s]+', names.lower()) if name]
+    if names == ['all']:
+        return 0xFF
+    return sum(TCP_FLAGS[name] for name in names if name != 'none')
+
+class Rule:
+    """
+    One rule of a chain, reduced to what decides the verdict for a probe:
+    the protocols, destination addresses and destination ports it matches,
+    and its action. Conditions that are the same for every probe of a run
+    (source address, interface, connection state, TCP flags) are resolved
+    when the rule is parsed and folded into `live`.
+    """
+    __slots__ = ('protocols', 'dst', 'dports', 'live', 'action', 'target', 'reject_with', 'text')
+
+    def __init__(self, text=''):
+        self.protocols = set(PROTOCOLS)
+        self.dst = None
+        self.dports = None
+        self.live = True
+        self.action = None
+        self.target = None
+        self.reject_with = None
+        self.text = text
+
+    def restrict_protocols(self, protocols, negate=False):
+        protocols = set(protocols)
+        self.protocols &= (set(PROTOCOLS) - protocols) if negate else protocols
+
+    def restrict_dst(self, ranges, negate=False):
+        self.dst = _intersect(self.dst, _complement(ranges, MAX_ADDRESS) if negate else ranges)
+
+    def restrict_dports(self, ranges, negate=False):
+        self.dports = _intersect(self.dports, _complement(ranges, MAX_PORT) if negate else ranges)
+
+    def require(self, condition):
+        """
+        Adds a condition that is constant for the whole run.
+        """
+        self.live = self.live and bool(condition)
+
+    @property
+    def matches_anything(self):
+        return self.live and bool(self.protocols) and self.dst != [] and self.dports != []
+
+class IntervalIndex:
+    """
+    Maps every value of a one-dimensional space (addresses or ports) to a
+    bitmask of the rules matching it. The space is cut into elementary
+    intervals at every rule boundary, so a lookup is one binary search.
+    """
+    __slots__ = ('starts', 'masks')
+
+    def __init__(self, rule_ranges):
+        """
+        Initializes the IntervalIndex.
+
+        Args:
+            rule_ranges (list): (bit, ranges) pairs, where `ranges` is a normalized
+                list of (first, last) values matched by the rule owning `bit`.
+        """
+        events = {0: 0}
+        for bit, ranges in rule_ranges:
+            for first, last in ranges:
+                events[first] = events.get(first, 0) ^ bit
+                events[last + 1] = events.get(last + 1, 0) ^ bit
+        self.starts = sorted(events)
+        self.masks = []
+        mask = 0
+        for start in self.starts:
+            mask ^= events[start]
+            self.masks.append(mask)
+
+    def lookup(self, value):
+        return self.masks[bisect_right(self.starts, value) - 1]
+
+class Chain:
+    """
+    A chain of rules with first-match semantics. Rules are indexed by
+    destination address and by protocol and destination port in two levels:
+    a summary index tells which blocks of RULE_BLOCK_SIZE rules can match a
+    probe, and per-block indexes give the matching rules within a block.
+    The rules matching a probe are the AND of the address and port lookups,
+    and the first one is the lowest set bit.
+    """
+    def __init__(self, name, policy=None, hook=None, priority=0):
+        self.name = name
+        self.policy = policy
+        self.hook = hook
+        self.priority = priority
+        self.rules = []
+        self._blocks = []
+        self._dst_summary = None
+        self._port_summary = None
+
+    @staticmethod
+    def _indexes(rule_sets):
+        """
+        Builds the address index and per-protocol port indexes for
+        (bit, rules) pairs, where each bit stands for the union of its rules.
+        """
+        dst_index = IntervalIndex(
+            (bit, _normalize(r for rule in rules for r in (rule.dst if rule.dst is not None else [(0, MAX_ADDRESS)])))
+            for bit, rules in rule_sets)
+        port_index = {
+            protocol: IntervalIndex(
+                (bit, _normalize(r for rule in rules if protocol in rule.protocols
+                                 for r in (rule.dports if rule.dports is not None else [(0, MAX_PORT)])))
+                for bit, rules in rule_sets)
+            for protocol in PROTOCOLS
+        }
+        return dst_index, port_index
+
+    def build_index(self):
+        """
+        Drops rules that can never match or never decide a verdict, then builds
+        the interval indexes over the remaining ones.
+        """
+        self.rules = [rule for rule in self.rules if rule.action is not None and rule.matches_anything]
+        blocks = [self.rules[offset:offset + RULE_BLOCK_SIZE] for offset in range(0, len(self.rules), RULE_BLOCK_SIZE)]
+        self._blocks = []
+        for b, block in enumerate(blocks):
+            dst_index, port_index = self._indexes([(1 << i, [rule]) for i, rule in enumerate(block)])
+            self._blocks.append((b * RULE_BLOCK_SIZE, dst_index.starts, dst_index.masks,
+                                 {protocol: (index.starts, index.masks) for protocol, index in port_index.items()}))
+        self._dst_summary, self._port_summary = self._indexes([(1 << b, block) for b, block in enumerate(blocks)])
+
+    def first_match(self, address, port, protocol, start=0):
+        """
+        Returns the position of the first rule at or after `start` that matches
+        a probe, or None.
+        """
+        blocks = self._dst_summary.lookup(address) & self._port_summary[protocol].lookup(port)
+        blocks &= -1 << (start // RULE_BLOCK_SIZE)
+        while blocks:
+            lowest = blocks & -blocks
+            offset, dst_starts, dst_masks, port_indexes = self._blocks[lowest.bit_length() - 1]
+            port_starts, port_masks = port_indexes[protocol]
+            mask = dst_masks[bisect_right(dst_starts, address) - 1] & port_masks[bisect_right(port_starts, port) - 1]
+            if start > offset:
+                mask &= -1 << (start - offset)
+            if mask:
+                return offset + (mask & -mask).bit_length() - 1
+            blocks ^= lowest
+        return None
+
+class Ruleset:
+    """
+    An offline model of a firewall ruleset that predicts the verdict a live
+    probe would get, without sending any packets.
+    """
+    def __init__(self, chains, entry_chains):
+        """
+        Initializes the Ruleset.
+
+        Args:
+            chains (dict): Maps chain names to Chain objects (jump and goto targets).
+            entry_chains (list): The chains a probe traverses in order; a probe
+                is accepted only if every one of them accepts it.
+        """
+        self.chains = chains
+        self.entry_chains = entry_chains
+        self._addresses = {}
+        for chain in set(chains.values()) | set(entry_chains):
+            chain.build_index()
+        for chain in self.chains.values():
+            for rule in chain.rules:
+                if rule.action in ('jump', 'goto') and rule.target not in self.chains:
+                    raise ValueError(f"Rule '{rule.text}' in chain {chain.name} jumps to unknown chain '{rule.target}'")
+        fw_logger.info(f"[*] Loaded ruleset with {sum(len(c.rules) for c in self.chains.values())} effective rules "
+                       f"in {len(self.chains)} chains.")
+
+    def _traverse(self, chain, address, port, protocol, depth=0):
+        """
+        Walks a chain and the chains it jumps to.
+        Returns the deciding rule, or None if the chain returns without a verdict.
+        """
+        if depth > 64:
+            raise ValueError(f"Chain {chain.name} jumps too deep (loop in the ruleset?)")
+        position = chain.first_match(address, port, protocol)
+        while position is not None:
+            rule = chain.rules[position]
+            if rule.action == 'return':
+                return None
+            if rule.action in ('jump', 'goto'):
+                decided = self._traverse(self.chains[rule.target], address, port, protocol, depth + 1)
+                if decided is not None or rule.action == 'goto':
+                    return decided
+                position = chain.first_match(address, port, protocol, position + 1)
+                continue
+            return rule
+        return None
+
+    def _address(self, dest_ip):
+        try:
+            return int.from_bytes(socket.inet_aton(dest_ip), 'big') if dest_ip.count('.') == 3 else None
+        except OSError:
+            return None
+
+    def resolve(self, dest_ip):
+        """
+        Returns the integer IPv4 address of `dest_ip`, resolving hostnames once, or None.
+        """
+        address = self._address(dest_ip)
+        if address is not None:
+            return address
+        if dest_ip not in self._addresses:
+            try:
+                self._addresses[dest_ip] = self._address(socket.gethostbyname(dest_ip))
+            except (OSError, UnicodeError):
+                fw_logger.error(f"[ERROR] Could not resolve {dest_ip} for ruleset simulation")
+                self._addresses[dest_ip] = None
+        return self._addresses[dest_ip]
+
+    def decide(self, address, port, protocol):
+        """
+        Returns (action, reject_with) for a probe to an integer address.
+        """
+        for chain in self.entry_chains:
+            rule = self._traverse(chain, address, port, protocol)
+            if rule is None:
+                action, reject_with = (chain.policy or 'accept'), None
+            else:
+                action, reject_with = rule.action, rule.reject_with
+            if action != 'accept':
+                return action, reject_with
+        return 'accept', None
+
+    def verdict(self, dest_ip, dest_port, protocol):
+        """
+        Predicts the result a live probe would report for one target.
+
+        Args:
+            dest_ip (str): Destination address or hostname.
+            dest_port (int): Destination port.
+            protocol (str): 'tcp' or 'udp'.
+
+        Returns:
+            str: 'open', 'closed', 'filtered', 'open|filtered' or 'error', using the
+                same vocabulary as the live TCP and UDP probes.
+        """
+        address = self.resolve(str(dest_ip))
+        if address is None or protocol not in PROTOCOLS:
+            return "error"
+        action, reject_with = self.decide(address, int(dest_port), protocol)
+        if protocol == "tcp":
+            if action == 'accept':
+                return "open"
+            if action == 'reject' and reject_with == 'tcp-reset':
+                return "closed"
+            return "filtered"  # Dropped, or rejected with an ICMP error
+        if action == 'reject' and reject_with in (None, 'port-unreachable'):
+            return "closed"
+        return "open|filtered"  # No reply whether accepted or dropped
+
+class _Context:
+    """
+    Run-wide facts about the probes that rules may test: the source address
+    and the inbound interface. Unknown facts make rules requiring them miss.
+    """
+    def __init__(self, source_ip=None, iface=None):
+        self.source = int(ipaddress.IPv4Address(source_ip)) if source_ip else None
+        self.iface = iface
+        self._warned = set()
+
+    def source_in(self, ranges):
+        return self.source is not None and any(first <= self.source <= last for first, last in ranges)
+
+    def iface_is(self, pattern):
+        """
+        Returns True if the probe's inbound interface matches an interface
+        pattern ("eth0", "eth+"). Without a configured interface, probes are
+        assumed to arrive on some external interface, i.e. anything but loopback.
+        """
+        pattern = pattern.strip('"')
+        if self.iface is None:
+            return pattern not in ('lo', 'lo+')
+        if pattern.endswith('+') or pattern.endswith('*'):
+            return self.iface.startswith(pattern[:-1])
+        return self.iface == pattern
+
+    def warn(self, feature, text):
+        if feature not in self._warned:
+            self._warned.add(feature)
+            fw_logger.warning(f"[WARNING] Ruleset feature '{feature}' is not modelled and assumed to match "
+                              f"(first seen in: {text})")
+
+# iptables options and how many arguments they take
+_IPTABLES_ARITY = {
+    '-p': 1, '--protocol': 1, '-s': 1, '--source': 1, '-d': 1, '--destination': 1,
+    '-i': 1, '--in-interface': 1, '-o': 1, '--out-interface': 1, '-m': 1, '--match': 1,
+    '-j': 1, '--jump': 1, '-g': 1, '--goto': 1, '-f': 0, '--fragment': 0,
+    '--dport': 1, '--destination-port': 1, '--sport': 1, '--source-port': 1,
+    '--dports': 1, '--destination-ports': 1, '--sports': 1, '--source-ports': 1, '--ports': 1,
+    '--state': 1, '--ctstate': 1, '--syn': 0, '--tcp-flags': 2, '--src-range': 1, '--dst-range': 1,
+    '--reject-with': 1, '--icmp-type': 1, '--comment': 1, '--set': 0, '--remove': 0, '--update': 0,
+    '--rcheck': 0, '--connlimit-above': 1, '--connlimit-upto': 1, '--hashlimit-above': 1,
+}
+_IPTABLES_TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+_IPTABLES_ACTIONS = {'ACCEPT': 'accept', 'DROP': 'drop', 'REJECT': 'reject', 'RETURN': 'return', 'QUEUE': 'drop',
+                     'NFQUEUE': 'drop'}
+
+def _is_option(token):
+    return token == '!' or (token.startswith('-') and len(token) > 1 and not token[1:].isdigit())
+
+def _parse_iptables_rule(tokens, text, context, chains):
+    """
+    Parses the tokens of one "-A CHAIN ..." line after the chain name.
+    """
+    rule = Rule(text)
+    modules = set()
+    i = 0
+    negate = jumped = False
+    while i < len(tokens):
+        option = tokens[i]
+        if option == '!':
+            negate, i = True, i + 1
+            continue
+        arity = _IPTABLES_ARITY.get(option)
+        if arity is None:
+            # Unknown option of some match module: consume its arguments
+            args_end = i + 1
+            while args_end < len(tokens) and not _is_option(tokens[args_end]):
+                args_end += 1
+            if not modules and rule.action is None and rule.target is None and not jumped:
+                context.warn(option, text)  # Options of declared modules and targets are not warned twice
+            i, negate = args_end, False
+            continue
+        args = tokens[i + 1:i + 1 + arity]
+        if args and args[0] == '!':  # Legacy "-d ! 10.0.0.1" negation
+            negate = True
+            args = tokens[i + 2:i + 2 + arity]
+            i += 1
+        i += 1 + arity
+        value = args[0] if args else None
+
+        if option in ('-p', '--protocol'):
+            value = PROTOCOL_NUMBERS.get(value, value.lower())
+            rule.restrict_protocols(PROTOCOLS if value == 'all' else [value], negate)
+        elif option in ('-d', '--destination'):
+            rule.restrict_dst(_address_ranges(value.split(',')), negate)
+        elif option == '--dst-range':
+            rule.restrict_dst(_address_ranges([value]), negate)
+        elif option in ('-s', '--source', '--src-range'):
+            rule.require(context.source_in(_address_ranges(value.split(','))) != negate)
+        elif option in ('-i', '--in-interface', '-o', '--out-interface'):
+            rule.require(context.iface_is(value) != negate)
+        elif option in ('-m', '--match'):
+            modules.add(value)
+            if value not in NEUTRAL_MODULES:
+                context.warn(value, text)
+        elif option in ('-f', '--fragment'):
+            rule.require(negate)  # Probes are never fragments
+        elif option in ('--dport', '--destination-port', '--dports', '--destination-ports', '--ports'):
+            rule.restrict_dports(_port_ranges(value.split(','), ':'), negate)
+        elif option in ('--sport', '--source-port', '--sports', '--source-ports'):
+            rule.require(negate)  # The probe's source port is random
+        elif option in ('--state', '--ctstate'):
+            rule.require(('NEW' in value.upper().split(',')) != negate)
+        elif option == '--syn':
+            rule.restrict_protocols(['tcp'])
+            rule.require(not negate)
+        elif option == '--tcp-flags':
+            mask, comparison = (_tcp_flag_bits(arg) for arg in args)
+            rule.restrict_protocols(['tcp'])
+            rule.require(((PROBE_TCP_FLAGS & mask) == comparison) != negate)
+        elif option in ('--update', '--rcheck', '--connlimit-above', '--hashlimit-above'):
+            rule.require(negate)  # A single fresh probe is never over a limit or in a recent list
+        elif option == '--icmp-type':
+            rule.restrict_protocols([])
+        elif option == '--reject-with':
+            rule.reject_with = value.replace('icmp-', '').replace('icmp6-', '')
+        elif option in ('-j', '--jump', '-g', '--goto'):
+            jumped = True
+            if value in _IPTABLES_ACTIONS:
+                rule.action = _IPTABLES_ACTIONS[value]
+            elif value in chains:
+                rule.action, rule.target = ('goto' if option in ('-g', '--goto') else 'jump'), value
+            # Anything else (LOG, MARK, ...) does not end the traversal
+        negate = False
+    if rule.action == 'reject' and rule.reject_with is None:
+        rule.reject_with = 'port-unreachable'
+    return rule
+
+def parse_iptables_save(text, chain="INPUT", source_ip=None, iface=None):
+    """
+    Parses the filter table of an iptables-save dump.
+
+    Args:
+        text (str): The iptables-save output.
+        chain (str): The chain probes enter (INPUT for the firewall host
+            itself, FORWARD for hosts behind it).
+        source_ip (str): The tester's source address as the firewall sees it,
+            or None if unknown.
+        iface (str): The interface probes arrive on, or None if unknown.
+
+    Returns:
+        Ruleset: The indexed ruleset.
+
+    Raises:
+        ValueError: If the dump cannot be parsed or `chain` does not exist.
+    """
+    context = _Context(source_ip, iface)
+    chains = {}
+    rule_lines = []
+    table = 'filter'
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('*'):
+            table = line[1:].strip()
+        elif table != 'filter' or line == 'COMMIT':
+            continue
+        elif line.startswith(':'):
+            name, policy = line[1:].split()[:2]
+            chains[name] = Chain(name, policy=None if policy == '-' else policy.lower())
+        else:
+            line = re.sub(r'^\[\d+:\d+\]\s*', '', line)  # iptables-save -c counters
+            rule_lines.append((line_number, line))
+
+    for line_number, line in rule_lines:
+        try:
+            tokens = [match.group(1) if match.group(1) is not None else match.group(2)
+                      for match in _IPTABLES_TOKEN_RE.finditer(line)]
+            if len(tokens) < 2 or tokens[0] not in ('-A', '--append'):
+                raise ValueError("expected '-A CHAIN ...'")
+            chain_name = tokens[1]
+            if chain_name not in chains:
+                chains[chain_name] = Chain(chain_name)
+            chains[chain_name].rules.append(_parse_iptables_rule(tokens[2:], line, context, chains))
+        except (ValueError, KeyError, OSError) as e:
+            raise ValueError(f"Invalid iptables rule at line {line_number}: {line} ({e})")
+
+    if chain not in chains:
+        raise ValueError(f"Chain '{chain}' not found in the filter table")
+    return Ruleset(chains, [chains[chain]])
+
+_NFT_TOKEN_RE = re.compile(r'\{[^}]*\}|"[^"]*"|\S+')
+_NFT_OPERATORS = ('==', '!=', '<', '>', '<=', '>=')
+
+def _nft_items(value, sets):
+    """
+    Expands an nft value (single item, anonymous "{ a, b }" set or "@named"
+    set) into its elements.
+    """
+    if value.startswith('@'):
+        if value[1:] not in sets:
+            raise ValueError(f"unknown set '{value}'")
+        return sets[value[1:]]
+    if value.startswith('{'):
+        return [item.strip() for item in value.strip('{}').split(',') if item.strip()]
+    return [value]
+
+def _nft_port_ranges(operator, value, sets):
+    if operator in ('<', '<=', '>', '>='):
+        port = _port(value) + {'<': -1, '<=': 0, '>': 1, '>=': 0}[operator]
+        return [(0, port)] if operator.startswith('<') else [(port, MAX_PORT)]
+    return _port_ranges(_nft_items(value, sets), '-')
+
+class _NftRuleParser:
+    """
+    Parses one nft rule statement line into a Rule.
+    """
+    def __init__(self, text, context, sets):
+        self.rule = Rule(text)
+        self.context = context
+        self.sets = sets
+        self.tokens = [token for token in _NFT_TOKEN_RE.findall(text)]
+        self.pos = 0
+
+    def _next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def _peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def _operand(self):
+        """
+        Returns (operator, value) for the comparison that follows a selector.
+        """
+        operator = '=='
+        if self._peek() in _NFT_OPERATORS:
+            operator = self._next()
+        return operator, self._next()
+
+    def _skip_unknown(self, token):
+        """
+        Skips an unmodelled expression up to the rule's verdict.
+        """
+        self.context.warn(token, self.rule.text)
+        while self._peek() is not None and self._peek() not in NFT_VERDICTS:
+            self.pos += 1
+
+    def parse(self):
+        rule = self.rule
+        while self._peek() is not None:
+            token = self._next()
+            if token in ('ip', 'tcp', 'udp', 'th', 'meta', 'ct') and self._peek() is not None:
+                self._selector(token, self._next())
+            elif token in ('iif', 'iifname', 'oif', 'oifname'):
+                operator, value = self._operand()
+                matched = any(self.context.iface_is(item) for item in _nft_items(value, self.sets))
+                rule.require(matched != (operator == '!='))
+            elif token == 'ip6':
+                rule.require(False)  # Probes are IPv4
+                self._skip_unknown(token)
+            elif token == 'counter':
+                while self._peek() in ('packets', 'bytes'):
+                    self.pos += 2
+            elif token in ('log', 'limit', 'comment'):
+                self._statement(token)
+            elif token in ('accept', 'drop', 'return'):
+                rule.action = token
+            elif token == 'queue':
+                rule.action = 'drop'
+                self.pos = len(self.tokens)
+            elif token in ('jump', 'goto'):
+                rule.action, rule.target = token, self._next()
+            elif token == 'reject':
+                rule.action, rule.reject_with = 'reject', 'port-unreachable'
+                if self._peek() == 'with':
+                    self.pos += 1
+                    kind, value = self._next(), self._next()
+                    if value == 'type':
+                        value = self._next()
+                    rule.reject_with = 'tcp-reset' if (kind, value) == ('tcp', 'reset') else value
+            elif token == 'continue':
+                pass
+            else:
+                self._skip_unknown(token)
+        return rule
+
+    def _statement(self, token):
+        """
+        Consumes the arguments of non-terminating statements.
+        """
+        if token == 'comment':
+            self.pos += 1
+        elif token == 'log':
+            while self._peek() in ('prefix', 'level', 'group', 'snaplen', 'queue-threshold', 'flags'):
+                self.pos += 2
+        elif token == 'limit':
+            self.pos += 1  # "rate"
+            over = self._peek() == 'over'
+            if over:
+                self.pos += 1
+            self.pos += 1  # "10/second"
+            if self._peek() in ('bytes', 'kbytes', 'mbytes'):
+                self.pos += 1
+            if self._peek() == 'burst':
+                self.pos += 3
+            self.rule.require(not over)  # One probe never exceeds a rate limit
+
+    def _selector(self, family, field):
+        rule = self.rule
+        if family == 'ip' and field in ('daddr', 'saddr'):
+            operator, value = self._operand()
+            ranges = _address_ranges(_nft_items(value, self.sets))
+            if field == 'daddr':
+                rule.restrict_dst(ranges, operator == '!=')
+            else:
+                rule.require(self.context.source_in(ranges) != (operator == '!='))
+        elif (family, field) in (('ip', 'protocol'), ('meta', 'l4proto')):
+            operator, value = self._operand()
+            protocols = [PROTOCOL_NUMBERS.get(item, item) for item in _nft_items(value, self.sets)]
+            rule.restrict_protocols(protocols, operator == '!=')
+        elif family in ('tcp', 'udp', 'th') and field in ('dport', 'sport'):
+            operator, value = self._operand()
+            rule.restrict_protocols(PROTOCOLS if family == 'th' else [family])
+            if field == 'dport':
+                rule.restrict_dports(_nft_port_ranges(operator, value, self.sets), operator == '!=')
+            else:
+                rule.require(operator == '!=')  # The probe's source port is random
+        elif (family, field) == ('tcp', 'flags'):
+            rule.restrict_protocols(['tcp'])
+            rule.require(self._tcp_flags_match())
+        elif (family, field) == ('ct', 'state'):
+            operator, value = self._operand()
+            states = [state.lower() for item in _nft_items(value, self.sets) for state in item.split(',')]
+            rule.require(('new' in states) != (operator == '!='))
+        elif (family, field) == ('meta', 'nfproto'):
+            operator, value = self._operand()
+            rule.require(('ipv4' in _nft_items(value, self.sets)) != (operator == '!='))
+        elif family == 'meta' and field in ('iif', 'iifname', 'oif', 'oifname'):
+            operator, value = self._operand()
+            matched = any(self.context.iface_is(item) for item in _nft_items(value, self.sets))
+            rule.require(matched != (operator == '!='))
+        else:
+            self._skip_unknown(f"{family} {field}")
+
+    def _tcp_flags_match(self):
+        """
+        Evaluates "tcp flags syn", "tcp flags & (fin|syn|rst|ack) == syn" and
+        "tcp flags syn / fin,syn,rst,ack" for the probe's SYN.
+        """
+        if self._peek() == '&':
+            self.pos += 1
+            mask = _tcp_flag_bits(self._next())
+            operator, value = self._operand()
+            return ((PROBE_TCP_FLAGS & mask) == _tcp_flag_bits(value)) != (operator == '!=')
+        operator, value = self._operand()
+        if self._peek() == '/':
+            self.pos += 1
+            mask = _tcp_flag_bits(self._next())
+            return ((PROBE_TCP_FLAGS & mask) == _tcp_flag_bits(value)) != (operator == '!=')
+        return bool(PROBE_TCP_FLAGS & _tcp_flag_bits(value)) != (operator == '!=')
+
+def _nft_priority(value):
+    """
+    Parses a base chain priority ("0", "-150", "filter", "filter + 10").
+    """
+    tokens = value.split()
+    priority = NFT_PRIORITIES[tokens[0]] if tokens[0] in NFT_PRIORITIES else int(tokens[0])
+    if len(tokens) == 3:
+        priority += int(tokens[2]) if tokens[1] == '+' else -int(tokens[2])
+    return priority
+
+def _nft_blocks(text):
+    """
+    Yields the statements of an nft ruleset one per line, joining lines that
+    continue inside an open "{ ... }" element list.
+    """
+    pending = ''
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        pending = f"{pending} {line}".strip() if pending else line
+        # An element list continues while "= {" braces stay open
+        if '= {' in pending and pending.count('{') > pending.count('}'):
+            continue
+        yield pending
+        pending = ''
+
+def parse_nft_ruleset(text, chain="INPUT", source_ip=None, iface=None):
+    """
+    Parses the ip and inet tables of an "nft list ruleset" dump.
+
+    Args:
+        text (str): The nft output.
+        chain (str): INPUT, FORWARD or OUTPUT to use every base chain on that
+            hook (in priority order), or the name of a chain to start from.
+        source_ip (str): The tester's source address as the firewall sees it,
+            or None if unknown.
+        iface (str): The interface probes arrive on, or None if unknown.
+
+    Returns:
+        Ruleset: The indexed ruleset.
+
+    Raises:
+        ValueError: If the dump cannot be parsed or has no matching chain.
+    """
+    context = _Context(source_ip, iface)
+    chains = {}
+    sets = {}
+    table = skip_table = current_chain = current_set = None
+    depth = 0
+    for line in _nft_blocks(text):
+        opens, closes = line.count('{'), line.count('}')
+        if skip_table is not None:
+            depth += opens - closes
+            if depth <= 0:
+                skip_table, depth = None, 0
+            continue
+        try:
+            if line.startswith('table '):
+                _, family, name = line.rstrip('{ ').split()[:3]
+                if family not in ('ip', 'inet'):
+                    skip_table, depth = name, 1
+                else:
+                    table = name
+            elif line.startswith(('chain ', 'set ', 'map ')) and line.endswith('{'):
+                kind, name = line.split()[:2]
+                if kind == 'chain':
+                    current_chain = chains[f"{table}/{name}"] = Chain(name)
+                elif kind == 'set':
+                    current_set = sets[name] = []
+                else:
+                    current_set = []  # Maps are not modelled
+            elif line == '}':
+                if current_chain is not None or current_set is not None:
+                    current_chain = current_set = None
+                else:
+                    table = None
+            elif current_set is not None:
+                if line.startswith('elements'):
+                    current_set.extend(_nft_items(line.split('=', 1)[1].strip(), sets))
+            elif current_chain is not None:
+                if line.startswith('type '):
+                    hook = re.search(r'hook (\w+)', line)
+                    priority = re.search(r'priority ([^;]+);', line)
+                    policy = re.search(r'policy (\w+)', line)
+                    current_chain.hook = hook.group(1) if hook else None
+                    if priority:
+                        current_chain.priority = _nft_priority(priority.group(1))
+                    current_chain.policy = policy.group(1) if policy else 'accept'
+                else:
+                    rule = _NftRuleParser(line, context, sets).parse()
+                    if rule.target is not None:
+                        rule.target = f"{table}/{rule.target}"  # Jumps stay within the table
+                    current_chain.rules.append(rule)
+        except (ValueError, KeyError, IndexError, OSError) as e:
+            raise ValueError(f"Invalid nftables statement: {line} ({e})")
+
+    hook = NFT_HOOKS.get(chain.upper())
+    if hook is not None:
+        entry_chains = sorted((c for c in chains.values() if c.hook == hook), key=lambda c: c.priority)
+    else:
+        entry_chains = [c for c in chains.values() if c.name == chain]
+    if not entry_chains:
+        raise ValueError(f"No chain for '{chain}' found in the nftables ruleset")
+    return Ruleset(chains, entry_chains)
+
+def load_ruleset(file_path, chain="INPUT", source_ip=None, iface=None):
+    """
+    Loads an iptables-save or "nft list ruleset" dump, detecting the format
+    from its contents.
+
+    Args:
+        file_path (str): Path to the dump.
+        chain (str): The chain probes enter (see parse_iptables_save / parse_nft_ruleset).
+        source_ip (str): The tester's source address as the firewall sees it, or None.
+        iface (str): The interface probes arrive on, or None.
+
+    Returns:
+        Ruleset: The indexed ruleset.
+
+    Raises:
+        ValueError: If the dump cannot be parsed.
+    """
+    with open(file_path, 'r') as f:
+        text = f.read()
+    if re.search(r'^\s*table\s+\w+\s+\S+\s*\{', text, re.MULTILINE):
+        return parse_nft_ruleset(text, chain, source_ip, iface)
+    return parse_iptables_save(text, chain, source_ip, iface)
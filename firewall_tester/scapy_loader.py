@@ -0,0 +1,46 @@
+import importlib
+
+# Module each scapy name used by the package is imported from
+SCAPY_NAMES = {
+    'IP': 'scapy.all',
+    'TCP': 'scapy.all',
+    'UDP': 'scapy.all',
+    'ICMP': 'scapy.all',
+    'IPerror': 'scapy.all',
+    'TCPerror': 'scapy.all',
+    'UDPerror': 'scapy.all',
+    'Raw': 'scapy.all',
+    'sr1': 'scapy.all',
+    'sr': 'scapy.all',
+    'RandShort': 'scapy.all',
+    'AsyncSniffer': 'scapy.all',
+    'conf': 'scapy.all',
+    'compile_filter': 'scapy.arch.common',
+    'L3RawSocket': 'scapy.supersocket',
+}
+
+def load_scapy(namespace, names):
+    """
+    Imports scapy names into a module namespace the first time probing needs
+    them, so importing the package does not pay for loading scapy. Names that
+    are already bound (e.g. patched in tests) are left alone.
+
+    Args:
+        namespace (dict): The globals() of the importing module.
+        names (iterable): Names from SCAPY_NAMES to bind.
+    """
+    for name in names:
+        if name not in namespace:
+            namespace[name] = getattr(importlib.import_module(SCAPY_NAMES[name]), name)
+
+def module_getattr(namespace, names, module_name):
+    """
+    Returns a module-level __getattr__ that loads the scapy `names` on first
+    attribute access, so `module.IP` and unittest.mock.patch keep working.
+    """
+    def __getattr__(name):
+        if name in names:
+            load_scapy(namespace, names)
+            return namespace[name]
+        raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+    return __getattr__
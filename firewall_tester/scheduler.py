@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import SCHEDULER_MAX_PENDING
+
+_DONE = object()
+
+class RateLimiter:
+    """
+    Paces callers to a global rate by handing out evenly spaced send slots.
+    """
+    def __init__(self, rate):
+        """
+        Initializes the RateLimiter.
+
+        Args:
+            rate (float): Maximum number of acquisitions per second.
+        """
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Waits until the next send slot is available.
+        """
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+                now = self._next_slot
+            self._next_slot = now + self.interval
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that paces every packet a run sends, shared by
+    the sr1 path and the batch SYN, connect and UDP scanners, retransmissions
+    included, so the packets-per-second limit holds whichever engine sends.
+    """
+    def __init__(self, rate, burst=1):
+        """
+        Initializes the TokenBucket.
+
+        Args:
+            rate (float): Tokens (packets) added per second.
+            burst (int): Maximum number of tokens saved up while idle.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, sleeping until it is available. Callers queue up in
+        order: each one that finds the bucket empty reserves the next token.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+            self._updated = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class HostLimiter:
+    """
+    Caps the number of in-flight probes per destination. Semaphores only exist
+    while a destination has probes queued or running.
+    """
+    def __init__(self, limit):
+        """
+        Initializes the HostLimiter.
+
+        Args:
+            limit (int): Maximum number of in-flight probes per destination.
+        """
+        self.limit = limit
+        self._semaphores = {}
+        self._users = collections.Counter()
+
+    async def acquire(self, host):
+        self._users[host] += 1
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.limit)
+        await self._semaphores[host].acquire()
+
+    def release(self, host):
+        self._semaphores[host].release()
+        self._users[host] -= 1
+        if not self._users[host]:
+            del self._users[host]
+            del self._semaphores[host]
+
+class AsyncProbeScheduler:
+    """
+    Runs blocking probe callables on a thread pool with a cap on in-flight
+    probes, a global packets-per-second limit and an optional per-destination
+    limit. Results are yielded in submission order.
+    """
+    def __init__(self, concurrency, max_pps=None, per_host_limit=None, metrics=None,
+                 max_pending=SCHEDULER_MAX_PENDING):
+        """
+        Initializes the AsyncProbeScheduler.
+
+        Args:
+            concurrency (int): Maximum number of probes in flight.
+            max_pps (float): Global limit on jobs started per second, or None for no limit.
+            per_host_limit (int): Maximum in-flight probes per destination, or None.
+            metrics (RunMetrics): Run metrics to record queue depths in, or None.
+            max_pending (int): Maximum number of jobs submitted but not yet handed
+                back in order; at least `concurrency`.
+        """
+        self.concurrency = max(1, concurrency)
+        self.max_pps = max_pps
+        self.per_host_limit = per_host_limit
+        self.metrics = metrics
+        self.max_pending = max(self.concurrency, max_pending)
+
+    async def _run_one(self, executor, slots, rate_limiter, host_limiter, host, func):
+        try:
+            if host_limiter is not None:
+                await host_limiter.acquire(host)
+            try:
+                if rate_limiter is not None:
+                    await rate_limiter.acquire()
+                return await asyncio.get_running_loop().run_in_executor(executor, func)
+            finally:
+                if host_limiter is not None:
+                    host_limiter.release(host)
+        finally:
+            slots.release()
+
+    async def _run(self, jobs, emit, stop=None):
+        slots = asyncio.Semaphore(self.concurrency)
+        rate_limiter = RateLimiter(self.max_pps) if self.max_pps else None
+        host_limiter = HostLimiter(self.per_host_limit) if self.per_host_limit else None
+        pending = collections.deque()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for host, func in jobs:
+                if stop is not None and stop.is_set():
+                    break
+                while len(pending) >= self.max_pending:
+                    # The oldest job holds up the rest; wait for it instead of queueing more behind it
+                    emit(await pending.popleft())
+                await slots.acquire()
+                pending.append(asyncio.ensure_future(
+                    self._run_one(executor, slots, rate_limiter, host_limiter, host, func)))
+                if self.metrics is not None:
+                    # Probes submitted but not yet handed back in order
+                    self.metrics.set_queue_depth('pending', len(pending))
+                # Hand back finished results in order so memory stays bounded
+                while pending and pending[0].done():
+                    emit(pending.popleft().result())
+            while pending:
+                emit(await pending.popleft())
+
+    def run(self, jobs):
+        """
+        Runs all jobs and returns their results in submission order.
+
+        Args:
+            jobs (iterable): (host, callable) tuples; each callable performs one probe.
+
+        Returns:
+            list: The return value of each callable, in the order of `jobs`.
+        """
+        results = []
+        asyncio.run(self._run(jobs, results.append))
+        return results
+
+    def iter_run(self, jobs, buffer_size=1024):
+        """
+        Runs all jobs on a background event loop and yields their results in
+        submission order as they finish. At most `buffer_size` finished results
+        are buffered, so memory stays flat regardless of the number of jobs.
+
+        Args:
+            jobs (iterable): (host, callable) tuples; each callable performs one probe.
+            buffer_size (int): Maximum number of finished results waiting to be consumed.
+
+        Yields:
+            The return value of each callable, in the order of `jobs`.
+        """
+        results = queue.Queue(maxsize=buffer_size)
+        stop = threading.Event()
+
+        def emit(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def worker():
+            try:
+                asyncio.run(self._run(jobs, emit, stop))
+                emit(_DONE)
+            except BaseException as e:
+                emit(e)
+
+        thread = threading.Thread(target=worker, name="probe-scheduler", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = results.get()
+                if self.metrics is not None:
+                    self.metrics.set_queue_depth('results', results.qsize())
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
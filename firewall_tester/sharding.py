@@ -0,0 +1,332 @@
+import collections
+import multiprocessing
+import queue
+import zlib
+
+from .logger import fw_logger, flush_logs, logging_settings, apply_logging_settings
+from .config import SHARD_CHUNK_SIZE, SHARD_WINDOW
+from .rules_parser import split_by_destination
+from .metrics import RunMetrics, timed
+from .routes import RouteCache
+
+# Marks the end of a shard's input and output streams
+_DONE = None
+
+def shard_by_destination(dest_ip, shards):
+    """
+    Returns the shard for a destination. The hash is stable across processes
+    and runs, so every probe to a host lands in the same shard and per-host
+    limits, timing and cache deduplication keep working.
+    """
+    return zlib.crc32(str(dest_ip).encode()) % shards
+
+class InterfaceSharder:
+    """
+    Assigns each destination to the shard of the interface the routing table
+    sends it through, falling back to the destination hash for destinations
+    routed through none of the shard interfaces (or not given as addresses).
+    Routes come from a RouteCache, so the parent never loads the packet stack.
+    """
+    def __init__(self, interfaces):
+        """
+        Initializes the InterfaceSharder.
+
+        Args:
+            interfaces (list): Interface names, one per shard.
+        """
+        self.interfaces = list(interfaces)
+        self.routes = RouteCache()
+        self._shards = {}
+
+    def close(self):
+        self.routes.close()
+
+    def __call__(self, dest_ip, shards):
+        shard = self._shards.get(dest_ip)
+        if shard is None:
+            iface = self.routes.iface_for(str(dest_ip))
+            shard = self.interfaces.index(iface) if iface in self.interfaces else shard_by_destination(dest_ip, shards)
+            self._shards[dest_ip] = shard
+        return shard
+
+def run_chunks(tester, chunks, sized=False):
+    """
+    Runs test cases that arrive in chunks through one FirewallRuleTester and
+    yields each chunk's outcomes as soon as the chunk is complete.
+
+    Each run of the tester covers the chunks that have already arrived, so
+    the tester never blocks waiting for input while it still holds outcomes
+    that whoever sends the chunks may be waiting on. Timing and cache state
+    carry over from run to run.
+
+    Args:
+        tester (FirewallRuleTester): The tester to run the chunks through.
+        chunks (queue.Queue): (key, test_cases) pairs of non-empty test case
+            lists, ended by None.
+        sized (bool): If True, each chunk's key is the number of test cases
+            it expands to, and it may hold compact test cases; otherwise every
+            test case in it is a single expanded one.
+
+    Yields:
+        tuple: (key, outcomes), one TestResult or None per expanded test case.
+    """
+    started = collections.deque()  # [key, size, outcomes] for every chunk fed to the tester
+    closed = False
+
+    def feed(chunk):
+        nonlocal closed
+        while True:
+            key, test_cases = chunk
+            started.append((key, key if sized else len(test_cases), []))
+            yield from test_cases
+            try:
+                chunk = chunks.get_nowait()
+            except queue.Empty:
+                return
+            if chunk is _DONE:
+                closed = True
+                return
+
+    while not closed:
+        chunk = chunks.get()
+        if chunk is _DONE:
+            break
+        for outcome in tester.probe_cases(feed(chunk)):
+            key, size, outcomes = started[0]
+            outcomes.append(outcome)
+            if len(outcomes) == size:
+                started.popleft()
+                yield key, outcomes
+
+def _run_shard(shard, tester_options, cache_options, log_settings, inbox, outbox):
+    """
+    Worker process body: runs the test cases it receives in chunks through its
+    own FirewallRuleTester (and thus its own sockets and sniffer) and sends the
+    outcomes back in chunks, in the order the test cases arrived.
+    """
+    # Imported here so the parent does not need the packet stack to start workers
+    from .tester import FirewallRuleTester
+    from .cache import ProbeCache
+
+    apply_logging_settings(log_settings)
+    try:
+        cache = ProbeCache(**cache_options) if cache_options is not None else None
+        with FirewallRuleTester([], cache=cache, **tester_options) as tester:
+            for _, outcomes in run_chunks(tester, inbox, sized=True):
+                outbox.put((shard, outcomes))
+        if cache is not None:
+            cache.close()
+        outbox.put((shard, {'timing': tester.timing.summary(), 'metrics': tester.metrics.summary()}))
+        # The parent may terminate the worker as soon as it is done
+        flush_logs()
+        outbox.put((shard, _DONE))
+    except BaseException as e:
+        flush_logs()
+        outbox.put((shard, RuntimeError(f"Shard {shard} failed: {e}")))
+
+class _MergedTiming:
+    """
+    Per-host timing rows collected from every shard, for the report.
+    """
+    def __init__(self):
+        self.rows = []
+
+    def summary(self):
+        return sorted(self.rows, key=lambda row: row['host'])
+
+class ShardedRuleTester:
+    """
+    Runs a test suite across worker processes, each with its own
+    FirewallRuleTester, to use several cores (or several interfaces) at once.
+    The parent splits the test cases by destination (see
+    split_by_destination()), deals the parts out by shard and merges the
+    results back into test-case order; the shards expand the port ranges.
+    """
+    def __init__(self, test_cases, shards, shard_by="destination", interfaces=None, cache_options=None,
+                 metrics=None, **tester_options):
+        """
+        Initializes the ShardedRuleTester.
+
+        Args:
+            test_cases (iterable): A list or stream of test case dictionaries.
+            shards (int): Number of worker processes; with interface sharding,
+                one per interface.
+            shard_by (str): 'destination' to split by a hash of dest_ip, or
+                'interface' to give each interface in `interfaces` its own shard.
+            interfaces (list): Interface names for interface sharding.
+            cache_options (dict): ProbeCache arguments for each shard's cache, or
+                None to run without a cache. Each shard keeps its own store,
+                at `path` with a '.shard<N>' suffix.
+            metrics (RunMetrics): Run metrics the shards' counters are merged
+                into as each shard finishes, or None for a fresh set.
+            **tester_options: FirewallRuleTester arguments for every shard. The
+                max_pps budget is divided evenly between the shards.
+        """
+        if shard_by == "interface":
+            if not interfaces:
+                raise ValueError("Interface sharding needs at least one interface")
+            shards = len(interfaces)
+            self.assign = InterfaceSharder(interfaces)
+        else:
+            self.assign = shard_by_destination
+        self.test_cases = test_cases
+        self.shards = max(1, shards)
+        self.interfaces = list(interfaces or [])
+        self.cache_options = cache_options
+        self.tester_options = dict(tester_options)
+        if self.tester_options.get('max_pps'):
+            self.tester_options['max_pps'] = self.tester_options['max_pps'] / self.shards
+        self.timing = _MergedTiming()
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.results = []
+        fw_logger.info(f"[*] Initialized sharded Firewall Rule Tester with {self.shards} shards (by {shard_by}).")
+
+    def _shard_options(self, shard):
+        options = dict(self.tester_options)
+        if self.interfaces:
+            # With destination sharding the interfaces are shared out round-robin
+            options['iface'] = self.interfaces[shard % len(self.interfaces)]
+        return options
+
+    def _shard_cache_options(self, shard):
+        if self.cache_options is None or not self.cache_options.get('path'):
+            return self.cache_options
+        # One SQLite file per shard: shards never share a destination, and would contend for one file's lock
+        return dict(self.cache_options, path=f"{self.cache_options['path']}.shard{shard}")
+
+    def iter_outcomes(self):
+        """
+        Executes all test cases across the shards and yields, for every expanded
+        test case in order, its TestResult or None if it was skipped.
+        """
+        yield from timed(self._iter_outcomes(), self.metrics, 'probe')
+
+    def _iter_outcomes(self):
+        # Spawned, not forked: the log writer, metrics exporter and profiler threads may be running, and a
+        # forked child could inherit a lock one of them holds
+        context = multiprocessing.get_context("spawn")
+        outbox = context.Queue()
+        inboxes = [context.Queue() for _ in range(self.shards)]
+        log_settings = logging_settings()
+        workers = [
+            context.Process(target=_run_shard, name=f"shard-{shard}", daemon=True,
+                            args=(shard, self._shard_options(shard), self._shard_cache_options(shard), log_settings,
+                                  inboxes[shard], outbox))
+            for shard in range(self.shards)
+        ]
+        for worker in workers:
+            worker.start()
+
+        # Test-case order as runs of [shard, count]: consecutive test cases dealt to one shard share a run
+        runs = collections.deque()
+        received = [collections.deque() for _ in range(self.shards)]  # Outcomes each shard has sent back
+        outgoing = [[] for _ in range(self.shards)]  # Parts not yet sent to each shard
+        outgoing_size = [0] * self.shards  # Test cases those parts expand to
+        next_seq = sent = buffered = 0
+        running = self.shards
+        parts = split_by_destination(self.test_cases)
+        exhausted = False
+        last_ip = last_shard = None
+
+        def send(shard):
+            if outgoing[shard]:
+                inboxes[shard].put((outgoing_size[shard], outgoing[shard]))
+                outgoing[shard] = []
+                outgoing_size[shard] = 0
+
+        try:
+            while running:
+                # Deal out parts until the reorder window is full
+                while not exhausted and sent - next_seq < SHARD_WINDOW:
+                    part = next(parts, None)
+                    if part is None:
+                        exhausted = True
+                        for shard in range(self.shards):
+                            send(shard)
+                            inboxes[shard].put(_DONE)
+                        break
+                    dest_ip, test_case, size = part
+                    if dest_ip is None:
+                        shard = sent % self.shards
+                    elif dest_ip == last_ip:
+                        shard = last_shard  # The ports of one destination, or its next test case
+                    else:
+                        shard = last_shard = self.assign(dest_ip, self.shards)
+                        last_ip = dest_ip
+                    outgoing[shard].append(test_case)
+                    outgoing_size[shard] += size
+                    if runs and runs[-1][0] == shard:
+                        runs[-1][1] += size
+                    else:
+                        runs.append([shard, size])
+                    sent += size
+                    if outgoing_size[shard] >= SHARD_CHUNK_SIZE:
+                        send(shard)
+                if not exhausted:
+                    # The window is full: every test case must be in flight before waiting on results
+                    for shard in range(self.shards):
+                        send(shard)
+
+                shard, chunk = self._receive(outbox, workers)
+                if chunk is _DONE:
+                    running -= 1
+                    continue
+                received[shard].extend(chunk)
+                buffered += len(chunk)
+                self.metrics.set_queue_depth('reorder', buffered)
+                while runs:
+                    run = runs[0]
+                    ready = received[run[0]]
+                    take = min(run[1], len(ready))
+                    for _ in range(take):
+                        yield ready.popleft()
+                    next_seq += take
+                    buffered -= take
+                    if take < run[1]:
+                        run[1] -= take
+                        break
+                    runs.popleft()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+            if isinstance(self.assign, InterfaceSharder):
+                self.assign.close()
+        fw_logger.info(f"[*] All {self.shards} shards finished.")
+
+    def _receive(self, outbox, workers):
+        """
+        Waits for the next chunk from any shard, failing if a worker died.
+        """
+        while True:
+            try:
+                shard, chunk = outbox.get(timeout=1)
+            except queue.Empty:
+                dead = [worker.name for worker in workers if worker.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"Shard worker(s) exited unexpectedly: {', '.join(dead)}")
+                continue
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if isinstance(chunk, dict):
+                self.timing.rows.extend(chunk['timing'])
+                self.metrics.merge(chunk['metrics'])
+                continue
+            return shard, chunk
+
+    def iter_results(self):
+        """
+        Executes all test cases across the shards and yields a TestResult for
+        each one in test-case order.
+        """
+        for result in self.iter_outcomes():
+            if result is not None:
+                yield result
+
+    def run_tests(self):
+        """
+        Executes all test cases across the shards and stores the results.
+        """
+        self.results.extend(result.to_dict() for result in self.iter_results())
+        return self.results
@@ -0,0 +1,480 @@
+import random
+import selectors
+import socket
+import threading
+import time
+
+from .logger import fw_logger
+from .config import DEFAULT_TIMEOUT, RAW_RECV_BUFFER
+from .rawpacket import (TcpTemplate, TCP_SYN, TCP_RST, IPPROTO_TCP, parse_reply, source_address_for,
+                        raw_sockets_available)
+from .scapy_loader import load_scapy, module_getattr
+
+# Linux socket option that sets the receive buffer above net.core.rmem_max (needs CAP_NET_ADMIN)
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+
+# scapy is only imported when a scapy-based scan starts
+_SCAPY_NAMES = ('IP', 'TCP', 'ICMP', 'IPerror', 'TCPerror', 'AsyncSniffer', 'conf', 'compile_filter', 'L3RawSocket')
+__getattr__ = module_getattr(globals(), _SCAPY_NAMES, __name__)
+
+class BatchSynScanner:
+    """
+    Sends TCP SYN probes for a whole run through one long-lived L3 socket and
+    matches SYN-ACK, RST and ICMP replies back to their probes with a single
+    BPF-filtered sniffer.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, iface=None, inter=0, timing=None, retries=0, recorder=None,
+                 routes=None, rate_limiter=None):
+        """
+        Initializes the BatchSynScanner.
+
+        Args:
+            timeout (float): Seconds to wait for replies after the last SYN is sent,
+                used when no timing table is given.
+            iface (str): Interface to send and sniff on (scapy default if None).
+            inter (float): Delay in seconds between two consecutive SYNs.
+            timing (TimingTable): Per-host RTT estimates that size the reply window
+                and record RTT samples, or None for a fixed window.
+            retries (int): Rounds of retransmission for unanswered SYNs.
+            recorder (PcapWriter): Capture to record every probe and reply to, or None.
+            routes (RouteCache): Run-wide cache of the interface and source
+                address to reach each destination from, or None to look them up.
+            rate_limiter (TokenBucket): Run-wide packet rate limit every SYN,
+                retransmissions included, waits for, or None for no limit.
+        """
+        self.timeout = timeout
+        self.iface = iface
+        self.inter = inter
+        self.timing = timing
+        self.retries = retries
+        self.recorder = recorder
+        self.routes = routes
+        self.rate_limiter = rate_limiter
+        self.sport = random.randint(1024, 65535)
+        self._sock = None
+        self._sniffer = None
+        self._pending = {}
+        self._unanswered = set()
+        self._verdicts = {}
+        self._addresses = {}
+        self._sending = False
+        self._persistent = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def _bpf_filter(self):
+        """
+        Returns the BPF filter matching replies to this scanner's probes.
+        """
+        return f"(tcp and dst port {self.sport}) or (icmp and icmp[0] == 3)"
+
+    def _is_reply(self, pkt):
+        """
+        Python equivalent of the BPF filter, used when libpcap cannot compile it.
+        """
+        if pkt.haslayer(TCP):
+            return pkt[TCP].dport == self.sport
+        return pkt.haslayer(ICMP) and int(pkt[ICMP].type) == 3
+
+    def _sniffer_filter(self):
+        """
+        Returns the AsyncSniffer keyword arguments that select our replies.
+        """
+        try:
+            compile_filter(self._bpf_filter())
+            return {"filter": self._bpf_filter()}
+        except Exception:
+            fw_logger.warning("[WARNING] BPF filters are unavailable (libpcap missing). Filtering replies in Python.")
+            return {"lfilter": self._is_reply}
+
+    def _sniff_ifaces(self, targets):
+        """
+        Returns the interface(s) to sniff on: the configured one, or every
+        interface the targets are routed through.
+        """
+        if self.iface is not None:
+            return self.iface
+        ifaces = {self._iface_for(dest_ip) for dest_ip in {dest_ip for dest_ip, _ in targets}}
+        return sorted(str(iface) for iface in ifaces) if len(ifaces) > 1 else ifaces.pop()
+
+    def _iface_for(self, dest_ip):
+        iface = self.routes.iface_for(dest_ip) if self.routes is not None else None
+        return iface if iface is not None else conf.route.route(dest_ip)[0]
+
+    def _source_for(self, address):
+        """
+        Returns the cached source address for probes to `address`, or None to
+        leave its selection to scapy or the kernel.
+        """
+        return self.routes.source_for(address) if self.routes is not None else None
+
+    def _open_socket(self, sniff_ifaces):
+        """
+        Opens the L3 socket all probes are sent through. Like scapy's sr(),
+        loopback targets need a kernel raw socket to get a reply.
+        """
+        if conf.loopback_name in (sniff_ifaces if isinstance(sniff_ifaces, list) else [sniff_ifaces]):
+            return L3RawSocket()
+        return conf.L3socket(iface=self.iface)
+
+    def _start(self, targets):
+        """
+        Opens the send socket and starts the reply sniffer.
+        """
+        load_scapy(globals(), _SCAPY_NAMES)
+        started = threading.Event()
+        sniff_ifaces = self._sniff_ifaces(targets)
+        self._sniffer = AsyncSniffer(iface=sniff_ifaces, prn=self._handle_reply, store=False,
+                                     started_callback=started.set, **self._sniffer_filter())
+        self._sock = self._open_socket(sniff_ifaces)
+        self._sniffer.start()
+        started.wait(self.timeout)
+
+    def _stop(self):
+        """
+        Stops the reply sniffer and closes the send socket.
+        """
+        if self._sniffer is not None and self._sniffer.running:
+            self._sniffer.stop()
+        self._sniffer = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def open(self, targets):
+        """
+        Opens the send socket and starts the reply sniffer for a series of
+        scans, which then reuse them instead of opening their own.
+
+        Args:
+            targets (iterable): (dest_ip, dest_port) tuples the scans will
+                probe, which decide the interfaces to sniff on.
+        """
+        load_scapy(globals(), _SCAPY_NAMES)
+        self._start(list(targets))
+        self._persistent = True
+        return self
+
+    def close(self):
+        """
+        Stops the sniffer and closes the socket opened by open().
+        """
+        self._persistent = False
+        self._stop()
+
+    def _record(self, packet, timestamp=None):
+        """
+        Writes a probe or reply, as bytes or a scapy packet, to the recorder if there is one.
+        """
+        if self.recorder is not None:
+            self.recorder.write(packet if isinstance(packet, (bytes, bytearray, memoryview)) else bytes(packet[IP]),
+                                timestamp)
+
+    def _send_syn(self, address, dest_port, seq):
+        packet = IP(src=self._source_for(address), dst=address) / TCP(sport=self.sport, dport=dest_port, flags="S",
+                                                                      seq=seq)
+        self._record(packet)  # Before sending: the reply may be recorded as soon as the packet leaves
+        self._sock.send(packet)
+
+    def _send_rst(self, address, dest_port, seq):
+        self._sock.send(IP(src=self._source_for(address), dst=address) / TCP(sport=self.sport, dport=dest_port,
+                                                                              flags="R", seq=seq))
+
+    def _register_probe(self, dest_ip, dest_port, attempt=0, address=None):
+        """
+        Allocates a sequence number for a probe and records it as pending.
+        Replies are matched on the resolved `address` when it differs from dest_ip.
+        Returns the sequence number.
+        """
+        seq = random.getrandbits(32)
+        self._pending[(address or dest_ip, dest_port, seq)] = ((dest_ip, dest_port), attempt, time.time())
+        self._unanswered.add((dest_ip, dest_port))
+        return seq
+
+    def _handle_reply(self, pkt):
+        """
+        Dissects a sniffed reply with scapy and matches it to its probe.
+        """
+        load_scapy(globals(), _SCAPY_NAMES)
+        if not pkt.haslayer(IP):
+            return
+        self._record(pkt, getattr(pkt, 'time', None))
+        if pkt.haslayer(TCP):
+            # SYN-ACK and RST-ACK both acknowledge our seq + 1
+            key = (pkt[IP].src, pkt[TCP].sport, (pkt[TCP].ack - 1) & 0xFFFFFFFF)
+            self._match_reply(key, int(pkt[TCP].flags), getattr(pkt, 'time', None), pkt[TCP].ack)
+        elif pkt.haslayer(ICMP) and pkt.haslayer(TCPerror):
+            # ICMP unreachable error quoting our SYN
+            key = (pkt[IPerror].dst, pkt[TCPerror].dport, pkt[TCPerror].seq)
+            self._match_reply(key, None, getattr(pkt, 'time', None))
+
+    def _match_reply(self, key, tcp_flags, received_at=None, ack=None):
+        """
+        Matches a reply to its probe by (ip, port, seq) and records the same
+        'open', 'closed' or 'filtered' verdict as a per-probe SYN scan.
+
+        Args:
+            key (tuple): (source address, source port, acknowledged seq) of the reply.
+            tcp_flags (int): TCP flags of the reply, or None for an ICMP error.
+            received_at (float): Capture timestamp, for RTT sampling.
+            ack (int): Acknowledgement number, used to tear down open connections.
+        """
+        if tcp_flags == 0x12:  # SYN-ACK (SA)
+            verdict = "open"
+        elif tcp_flags == 0x14:  # RST-ACK (RA)
+            verdict = "closed"
+        else:
+            verdict = "filtered"  # ICMP unreachable or other unexpected responses
+
+        with self._lock:
+            probe = self._pending.pop(key, None)
+            if probe is None:
+                return  # Not ours, or a duplicate reply
+            target, attempt, sent_at = probe
+            if target not in self._unanswered:
+                return  # Already answered through another transmission
+            self._unanswered.discard(target)
+            self._verdicts[target] = verdict
+            if not self._unanswered and not self._sending:
+                self._done.set()
+
+        if self.timing is not None:
+            # Karn's rule: replies to retransmissions are not RTT samples
+            rtt = float(received_at) - sent_at if attempt == 0 and received_at else None
+            kind = {0x12: "syn-ack", 0x14: "rst"}.get(tcp_flags, "icmp-unreachable" if tcp_flags is None else "tcp-other")
+            self.timing.record_reply(target[0], rtt, kind)
+
+        if verdict == "open":
+            # Send RST to close the half-open connection
+            self._send_rst(key[0], key[1], ack)
+
+    def _window(self, targets, attempt):
+        """
+        Returns how long to wait for replies after sending `targets`.
+        """
+        if self.timing is None:
+            return self.timeout
+        return max(self.timing.timeout_for(dest_ip, attempt) for dest_ip in {dest_ip for dest_ip, _ in targets})
+
+    def _send_round(self, targets, attempt):
+        """
+        Sends one SYN to every target, then waits one reply window.
+        """
+        with self._lock:
+            self._done.clear()
+            self._sending = True
+        for dest_ip, dest_port in targets:
+            address = self._addresses[dest_ip]
+            with self._lock:
+                seq = self._register_probe(dest_ip, dest_port, attempt, address)
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            if self.timing is not None:
+                self.timing.record_probe(dest_ip, attempt)
+            self._send_syn(address, dest_port, seq)
+            if self.inter:
+                time.sleep(self.inter)
+        with self._lock:
+            self._sending = False
+            if not self._unanswered:
+                self._done.set()
+
+        # Every probe gets the same window after the last one leaves
+        self._done.wait(self._window(targets, attempt))
+
+    def _resolve(self, targets):
+        """
+        Resolves each distinct destination to an IPv4 address once per scan.
+        Returns the targets that could not be resolved.
+        """
+        for dest_ip in {dest_ip for dest_ip, _ in targets}:
+            try:
+                self._addresses[dest_ip] = socket.gethostbyname(dest_ip)
+            except (OSError, UnicodeError) as e:
+                fw_logger.error(f"[ERROR] Could not resolve {dest_ip}: {e}")
+        return [target for target in targets if target[0] not in self._addresses]
+
+    def scan(self, targets):
+        """
+        Probes every (dest_ip, dest_port) target and waits one reply window
+        after the last SYN. Unanswered targets are retransmitted in up to
+        `retries` further rounds.
+
+        Args:
+            targets (iterable): (dest_ip, dest_port) tuples.
+
+        Returns:
+            dict: Maps (dest_ip, dest_port) to 'open', 'closed', 'filtered' or 'error'.
+        """
+        targets = list(dict.fromkeys(targets))
+        if not targets:
+            return {}
+
+        self._pending = {}
+        self._unanswered = set()
+        self._verdicts = {}
+        self._addresses = {}
+
+        results = {target: "error" for target in self._resolve(targets)}
+        targets = [target for target in targets if target[0] in self._addresses]
+        if not targets:
+            return results
+
+        persistent = self._persistent
+        try:
+            if not persistent:
+                self._start(targets)
+            # An open() scanner runs many small scans; their progress lines would flood the log
+            log = fw_logger.debug if persistent else fw_logger.info
+
+            log(f"[*] Sending {len(targets)} TCP SYN probes from source port {self.sport}...")
+            unanswered = targets
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    log(f"[*] Retransmitting {len(unanswered)} unanswered TCP SYN probes...")
+                self._send_round(unanswered, attempt)
+                with self._lock:
+                    unanswered = [target for target in targets if target in self._unanswered]
+                if self.timing is not None:
+                    for dest_ip, _ in unanswered:
+                        self.timing.record_timeout(dest_ip)
+                if not unanswered:
+                    break
+        except Exception as e:
+            fw_logger.error(f"[ERROR] Batch TCP scan failed: {e}")
+            results.update((target, "error") for target in targets)
+            return results
+        finally:
+            self._sending = False
+            if not persistent:
+                self._stop()
+
+        # No response usually means filtered
+        results.update((target, self._verdicts.get(target, "filtered")) for target in targets)
+        return results
+
+class RawSynScanner(BatchSynScanner):
+    """
+    Fast path of the batched SYN scan. Probes are patched into prebuilt header
+    templates and sent over a plain raw socket; replies are read from raw TCP
+    and ICMP sockets and dissected with struct, without scapy objects. Needs
+    Linux raw socket support; BatchSynScanner remains the reference path.
+    """
+    # Protocols of the raw sockets replies are read from
+    _recv_protocols = (socket.IPPROTO_TCP, socket.IPPROTO_ICMP)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._templates = {}
+        self._packed = {}
+        self._recv_socks = []
+        self._receiver = None
+        self._stopping = threading.Event()
+
+    @staticmethod
+    def available():
+        """
+        Returns True if the raw socket fast path can be used.
+        """
+        return raw_sockets_available()
+
+    def _templates_for(self, address):
+        """
+        Returns the (SYN, RST) templates for the source address used to reach `address`.
+        """
+        src_ip = self._source_for(address) or source_address_for(address, self.iface)
+        templates = self._templates.get(src_ip)
+        if templates is None:
+            templates = self._templates[src_ip] = (TcpTemplate(src_ip, self.sport, TCP_SYN),
+                                                   TcpTemplate(src_ip, self.sport, TCP_RST))
+        return templates
+
+    def _start(self, targets):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
+        for proto in self._recv_protocols:
+            recv_sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, proto)
+            recv_sock.setblocking(False)
+            # The default buffer holds only a few hundred replies, fewer than one burst of SYNs draws
+            try:
+                recv_sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, RAW_RECV_BUFFER)
+            except OSError:
+                recv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RAW_RECV_BUFFER)
+            self._recv_socks.append(recv_sock)
+        if self.iface is not None:
+            for sock in [self._sock] + self._recv_socks:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, self.iface.encode())
+
+        # Source address selection happens once per destination, not once per packet
+        for address in set(self._addresses.values()):
+            self._packed_for(address)
+
+        self._stopping.clear()
+        self._receiver = threading.Thread(target=self._receive_loop, name="raw-syn-receiver", daemon=True)
+        self._receiver.start()
+
+    def _packed_for(self, address):
+        """
+        Returns the packed address and templates for `address`, built on first
+        use so an open() scanner can reach destinations it was not opened with.
+        """
+        packed = self._packed.get(address)
+        if packed is None:
+            packed = self._packed[address] = (socket.inet_aton(address),) + self._templates_for(address)
+        return packed
+
+    def _stop(self):
+        self._stopping.set()
+        if self._receiver is not None:
+            self._receiver.join()
+            self._receiver = None
+        for recv_sock in self._recv_socks:
+            recv_sock.close()
+        self._recv_socks = []
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _send_syn(self, address, dest_port, seq):
+        packed, syn_template, _ = self._packed_for(address)
+        packet = syn_template.build(packed, dest_port, seq)
+        self._record(packet)  # Before sending: the reply may be recorded as soon as the packet leaves
+        self._sock.sendto(packet, (address, 0))
+
+    def _send_rst(self, address, dest_port, seq):
+        packed, _, rst_template = self._packed_for(address)
+        self._sock.sendto(rst_template.build(packed, dest_port, seq), (address, 0))
+
+    def _handle_raw(self, data, received_at):
+        """
+        Dissects a raw reply with struct and matches it to its probe.
+        """
+        reply = parse_reply(data)
+        if reply is None:
+            return
+        if reply[0] == 'tcp':
+            _, src_ip, sport, dport, ack, flags = reply
+            if dport == self.sport and flags & 0x10:  # Only ACKs answer a SYN
+                self._record(data, received_at)
+                self._match_reply((src_ip, sport, (ack - 1) & 0xFFFFFFFF), flags, received_at, ack)
+        elif reply[0] == 'icmp' and reply[2] == 3 and reply[5] == IPPROTO_TCP and reply[6] == self.sport:
+            _, _, _, _, quoted_dst, _, _, quoted_dport, quoted_seq = reply
+            self._record(data, received_at)
+            self._match_reply((quoted_dst, quoted_dport, quoted_seq), None, received_at)
+
+    def _receive_loop(self):
+        buffer = bytearray(65535)
+        view = memoryview(buffer)
+        with selectors.DefaultSelector() as selector:
+            for recv_sock in self._recv_socks:
+                selector.register(recv_sock, selectors.EVENT_READ)
+            while not self._stopping.is_set():
+                for key, _ in selector.select(timeout=0.05):
+                    while True:
+                        try:
+                            size = key.fileobj.recv_into(buffer)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError:
+                            return
+                        self._handle_raw(view[:size], time.time())
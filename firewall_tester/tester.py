@@ -1,45 +1,194 @@
+import collections
+import contextlib
+import functools
+import itertools
+import logging
+import math
 import socket
 import time
-from scapy.all import IP, TCP, UDP, ICMP, sr1, sr, RandShort
 
-from .logger import fw_logger
-from .config import DEFAULT_TIMEOUT
+from .logger import fw_logger, probe_logger
+from .config import DEFAULT_TIMEOUT, DEFAULT_RETRIES, BATCH_SCAN_SIZE, UDP_REPROBES
+from .rules_parser import expand_test_cases, probe_shape
+from .syn_scanner import BatchSynScanner, RawSynScanner
+from .udp_scanner import UdpScanner, RawUdpScanner
+from .connect_scanner import ConnectScanner
+from .payloads import PayloadLibrary, payload_digest
+from .scheduler import AsyncProbeScheduler, TokenBucket
+from .results import TestResult
+from .timing import TimingTable, IcmpRateTable
+from .metrics import RunMetrics, timed
+from .routes import RouteCache
+from .scapy_loader import load_scapy, module_getattr
+
+# scapy is only imported once the first probe is sent
+_SCAPY_NAMES = ('IP', 'TCP', 'UDP', 'ICMP', 'Raw', 'sr1', 'sr', 'RandShort')
+__getattr__ = module_getattr(globals(), _SCAPY_NAMES, __name__)
+
+# TCP engines that probe a whole scan window at once through a scanner
+BATCH_TCP_ENGINES = ("batch", "connect")
+
+def _measure_rtt(packet, resp):
+    """
+    Returns the round-trip time in seconds between sending `packet` and
+    capturing `resp`, or None if it cannot be determined.
+    """
+    try:
+        rtt = float(resp.time) - float(packet.sent_time)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return rtt if rtt >= 0 else None
+
+def _reply_kind(resp):
+    """
+    Classifies a reply for the run metrics: 'syn-ack', 'rst', 'tcp-other',
+    'icmp-unreachable', 'icmp-other', 'udp' or 'other'.
+    """
+    if resp.haslayer(TCP):
+        flags = int(resp[TCP].flags)
+        if flags & 0x12 == 0x12:
+            return "syn-ack"
+        return "rst" if flags & 0x04 else "tcp-other"
+    if resp.haslayer(ICMP):
+        return "icmp-unreachable" if int(resp[ICMP].type) == 3 else "icmp-other"
+    return "udp" if resp.haslayer(UDP) else "other"
 
 class FirewallRuleTester:
     """
     Tests firewall rules by sending crafted packets and analyzing responses.
     """
-    def __init__(self, test_cases):
+    def __init__(self, test_cases, tcp_engine="sr1", udp_engine="sr1", concurrency=1, max_pps=None,
+                 per_host_limit=None, timeout=DEFAULT_TIMEOUT, adaptive_timeout=True, retries=DEFAULT_RETRIES,
+                 cache=None, fast_path=False, ruleset=None, iface=None, metrics=None, udp_payloads=True,
+                 recorder=None):
         """
         Initializes the FirewallRuleTester.
 
         Args:
-            test_cases (list): A list of test case dictionaries.
+            test_cases (iterable): A list or stream of test case dictionaries. CIDR,
+                address range, port range and list targets are expanded lazily while
+                the tests run.
+            tcp_engine (str): 'sr1' to probe TCP ports one at a time, 'batch' to
+                send all SYNs through one socket and sniffer, or 'connect' to make
+                non-blocking connect() calls, which needs no root.
+            udp_engine (str): 'sr1' to probe UDP ports one at a time, 'batch' to
+                interleave them across hosts through one socket and sniffer, paced
+                to each host's learned ICMP error rate limit, or 'skip' to report
+                UDP test cases as skipped (UDP probes need raw sockets).
+            concurrency (int): Maximum number of probes in flight (1 runs serially).
+            max_pps (float): Global packets-per-second limit, or None for no limit.
+                Every engine's sends wait for it, retransmissions included.
+            per_host_limit (int): Maximum in-flight probes per destination, or None.
+            timeout (float): Probe timeout in seconds; the initial timeout for each
+                host when adaptive timeouts are enabled.
+            adaptive_timeout (bool): Derive per-host timeouts from measured RTTs.
+            retries (int): Retransmissions of an unanswered probe before it is
+                declared filtered (TCP) or open|filtered (UDP).
+            cache (ProbeCache): Cache of verdicts per (dest_ip, dest_port, protocol, UDP payload)
+                that deduplicates probes, or None to probe every test case.
+            fast_path (bool): Send batched SYNs from prebuilt raw packet templates
+                instead of scapy packets when raw sockets are available.
+            ruleset (Ruleset): Offline ruleset, or CaptureReplay of a recorded run,
+                to evaluate test cases against instead of sending probes, or None
+                to probe the network.
+            iface (str): Interface to send probes and sniff replies on, or None
+                to follow the routing table.
+            metrics (RunMetrics): Run metrics to count probes, replies and
+                results in, or None for a fresh set (see `self.metrics`).
+            udp_payloads (bool): Probe well-known UDP ports with a request their
+                service answers (see payloads.UDP_PAYLOADS) instead of an empty
+                datagram. Test case 'payload' / 'payload_hex' overrides apply either way.
+            recorder (PcapWriter): Capture to record every probe sent and reply
+                received to, for replay with capture.CaptureReplay, or None.
+
+        Call close() (or use the tester as a context manager) when done, to stop
+        the route cache from watching for route changes.
         """
         self.test_cases = test_cases
+        self.tcp_engine = tcp_engine
+        self.udp_engine = udp_engine
+        self.concurrency = concurrency
+        self.max_pps = max_pps
+        self.rate_limiter = TokenBucket(max_pps) if max_pps else None
+        self.per_host_limit = per_host_limit
+        self.retries = retries
+        self.cache = cache
+        self.fast_path = fast_path
+        self.ruleset = ruleset
+        self.iface = iface
+        self._iface_args = {'iface': iface} if iface else {}
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.timing = TimingTable(initial_timeout=timeout, adaptive=adaptive_timeout, metrics=self.metrics)
+        self.icmp_limits = IcmpRateTable()
+        self.payloads = PayloadLibrary(enabled=udp_payloads)
+        self.recorder = recorder
+        self.routes = RouteCache(iface=iface, metrics=self.metrics)
         self.results = []
-        fw_logger.info(f"[*] Initialized Firewall Rule Tester with {len(self.test_cases)} test cases.")
+        self._scanner = None
+        self._udp_scanner = None
+        if hasattr(self.test_cases, '__len__'):
+            fw_logger.info(f"[*] Initialized Firewall Rule Tester with {len(self.test_cases)} test cases.")
+        else:
+            fw_logger.info("[*] Initialized Firewall Rule Tester with a streamed test case source.")
 
-    def _test_tcp_port(self, dest_ip, dest_port, timeout=DEFAULT_TIMEOUT):
+    def close(self):
+        """
+        Releases the route cache's route change subscription.
+        """
+        self.routes.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _send_probe(self, packet, dest_ip, timeout=None):
+        """
+        Sends a probe with sr1(), retransmitting it up to `self.retries` times
+        while unanswered. Unless `timeout` is given, each attempt waits for the
+        host's RTT-based timeout, backing off on retransmissions.
+        Returns the first reply, or None.
+        """
+        for attempt in range(self.retries + 1):
+            wait = timeout if timeout is not None else self.timing.timeout_for(dest_ip, attempt)
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            self.timing.record_probe(dest_ip, attempt)
+            resp = sr1(packet, timeout=wait, verbose=0, **self._iface_args)
+            if self.recorder is not None:
+                self.recorder.write(bytes(packet), getattr(packet, 'sent_time', None))
+                if resp is not None:
+                    self.recorder.write(bytes(resp[IP]), getattr(resp, 'time', None))
+            if resp is not None:
+                # Karn's rule: replies to retransmissions are not RTT samples
+                self.timing.record_reply(dest_ip, None if attempt else _measure_rtt(packet, resp), _reply_kind(resp))
+                return resp
+            self.timing.record_timeout(dest_ip)
+        return None
+
+    def _test_tcp_port(self, dest_ip, dest_port, timeout=None):
         """
         Attempts a TCP SYN scan to determine if a TCP port is open, closed, or filtered.
         Returns 'open', 'closed', 'filtered', or 'error'.
         """
+        load_scapy(globals(), _SCAPY_NAMES)
         try:
-            # Craft SYN packet
+            # Craft SYN packet, with its sequence number drawn once so retransmissions and the capture match
             ip_layer = IP(dst=dest_ip)
-            tcp_layer = TCP(dport=dest_port, flags="S", seq=RandShort())
+            tcp_layer = TCP(dport=dest_port, flags="S", seq=int(RandShort()))
             packet = ip_layer / tcp_layer
 
             # Send packet and wait for response
-            resp = sr1(packet, timeout=timeout, verbose=0)
+            resp = self._send_probe(packet, dest_ip, timeout)
 
             if resp is None:
                 return "filtered"  # No response usually means filtered
             elif resp.haslayer(TCP):
                 if resp[TCP].flags == 0x12:  # SYN-ACK (SA)
                     # Send RST to close the connection gracefully
-                    sr(IP(dst=dest_ip) / TCP(dport=dest_port, flags="R", seq=resp[TCP].ack), timeout=1, verbose=0)
+                    sr(IP(dst=dest_ip) / TCP(dport=dest_port, flags="R", seq=resp[TCP].ack), timeout=1, verbose=0,
+                       **self._iface_args)
                     return "open"
                 elif resp[TCP].flags == 0x14:  # RST-ACK (RA)
                     return "closed"
@@ -52,19 +201,20 @@ class FirewallRuleTester:
             fw_logger.error(f"[ERROR] TCP test for {dest_ip}:{dest_port} failed: {e}")
             return "error"
 
-    def _test_udp_port(self, dest_ip, dest_port, timeout=DEFAULT_TIMEOUT):
+    def _test_udp_port(self, dest_ip, dest_port, timeout=None, payload=b''):
         """
-        Attempts a UDP scan to determine if a UDP port is open/filtered or closed.
-        Returns 'open|filtered', 'closed', or 'error'.
+        Attempts a UDP scan to determine if a UDP port is open, open/filtered or closed.
+        Returns 'open', 'open|filtered', 'closed', or 'error'.
         """
+        load_scapy(globals(), _SCAPY_NAMES)
         try:
-            # Craft UDP packet
+            # Craft UDP packet, with a request the port's service answers if one is known
             ip_layer = IP(dst=dest_ip)
             udp_layer = UDP(dport=dest_port)
-            packet = ip_layer / udp_layer
+            packet = ip_layer / udp_layer / Raw(load=payload) if payload else ip_layer / udp_layer
 
             # Send packet and wait for response
-            resp = sr1(packet, timeout=timeout, verbose=0)
+            resp = self._send_probe(packet, dest_ip, timeout)
 
             if resp is None:
                 return "open|filtered"  # No response could mean open or filtered
@@ -80,60 +230,321 @@ class FirewallRuleTester:
             fw_logger.error(f"[ERROR] UDP test for {dest_ip}:{dest_port} failed: {e}")
             return "error"
 
-    def run_tests(self):
+    def _batch_targets(self, test_cases, protocol):
         """
-        Executes all defined test cases and stores the results.
+        Returns the (dest_ip, dest_port) targets of the given test cases that a
+        batch scan of `protocol` has to probe: those without a cached verdict.
         """
-        fw_logger.info("[*] Starting firewall rule tests...")
-        for i, test_case in enumerate(self.test_cases):
-            try:
-                test_name = test_case.get('name', f"Test Case {i + 1}")
-                dest_ip = test_case['dest_ip']
-                dest_port = test_case['dest_port']
-                protocol = test_case['protocol'].lower()
-                expected_result = test_case['expected_result'].lower()
-
-                fw_logger.info(
-                    f"[TEST] Running '{test_name}' (-> {dest_ip}:{dest_port}/{protocol}, Expected: {expected_result})")
-
-                actual_result = "error"
-                if protocol == "tcp":
-                    actual_result = self._test_tcp_port(dest_ip, dest_port)
-                elif protocol == "udp":
-                    actual_result = self._test_udp_port(dest_ip, dest_port)
-                else:
-                    fw_logger.warning(f"[WARNING] Unsupported protocol '{protocol}' for test '{test_name}'. Skipping.")
-                    actual_result = "skipped"
+        return [
+            (test_case['dest_ip'], test_case['dest_port'])
+            for test_case in test_cases
+            if isinstance(test_case, dict) and str(test_case.get('protocol', '')).lower() == protocol
+            and 'dest_ip' in test_case and 'dest_port' in test_case
+            and (self.cache is None
+                 or self.cache.get(self.cache.make_key(test_case['dest_ip'], test_case['dest_port'], protocol)) is None)
+        ]
+
+    def _batch_scan_tcp(self, test_cases):
+        """
+        Probes the TCP targets of the given test cases in one batch.
+        Returns a dict mapping (dest_ip, dest_port) to the verdict.
+        """
+        scanner = self._scanner or self._new_scanner()
+        return scanner.scan(self._batch_targets(test_cases, "tcp"))
+
+    def _batch_scan_udp(self, test_cases):
+        """
+        Probes the UDP targets of the given test cases in one batch, paced to
+        each host's ICMP error rate limit. A target probed with several
+        payloads gets one scan per payload, as their replies look alike.
+        Returns a dict mapping (dest_ip, dest_port, payload digest) to the verdict.
+        """
+        rounds = []  # Maps (dest_ip, dest_port) to (payload, word sum, digest), each target once per round
+        seen = set()
+        for test_case in test_cases:
+            if not (isinstance(test_case, dict) and str(test_case.get('protocol', '')).lower() == "udp"
+                    and 'dest_ip' in test_case and 'dest_port' in test_case):
+                continue
+            target = (test_case['dest_ip'], test_case['dest_port'])
+            payload, word_sum = self.payloads.get(target[1], test_case)
+            digest = payload_digest(payload)
+            if target + (digest,) in seen or (
+                    self.cache is not None and self.cache.get(self.cache.make_key(*target, "udp", payload)) is not None):
+                continue
+            seen.add(target + (digest,))
+            payloads = next((payloads for payloads in rounds if target not in payloads), None)
+            if payloads is None:
+                payloads = {}
+                rounds.append(payloads)
+            payloads[target] = (payload, word_sum, digest)
+
+        scanner = self._udp_scanner or self._new_udp_scanner()
+        verdicts = {}
+        for payloads in rounds:
+            results = scanner.scan(list(payloads), {target: entry[:2] for target, entry in payloads.items()})
+            verdicts.update((target + (payloads[target][2],), verdict) for target, verdict in results.items())
+        return verdicts
+
+    def _new_scanner(self):
+        if self.tcp_engine == "connect":
+            scanner_cls = ConnectScanner
+        else:
+            scanner_cls = RawSynScanner if self.fast_path and RawSynScanner.available() else BatchSynScanner
+        return scanner_cls(timeout=self.timing.initial_timeout, iface=self.iface, timing=self.timing,
+                           retries=self.retries, recorder=self.recorder, routes=self.routes,
+                           rate_limiter=self.rate_limiter)
+
+    def _new_udp_scanner(self):
+        scanner_cls = RawUdpScanner if self.fast_path and RawUdpScanner.available() else UdpScanner
+        return scanner_cls(timeout=self.timing.initial_timeout, iface=self.iface, timing=self.timing,
+                           retries=self.retries, icmp_limits=self.icmp_limits, recorder=self.recorder,
+                           routes=self.routes, rate_limiter=self.rate_limiter)
+
+    @contextlib.contextmanager
+    def open_scanner(self, targets, udp_targets=()):
+        """
+        Keeps one batch TCP scanner's and one batch UDP scanner's sockets and
+        sniffers open for every scan window run inside the block, instead of
+        opening them per window. Opens nothing for the sr1 engines or an
+        offline ruleset, and no UDP scanner without UDP targets.
+
+        Args:
+            targets (iterable): TCP (dest_ip, dest_port) tuples the block will probe.
+            udp_targets (iterable): UDP (dest_ip, dest_port) tuples the block will probe.
+        """
+        udp_targets = list(udp_targets)
+        try:
+            if self.ruleset is None and self.tcp_engine in BATCH_TCP_ENGINES:
+                self._scanner = self._new_scanner().open(targets)
+            if self.ruleset is None and self.udp_engine == "batch" and udp_targets:
+                self._udp_scanner = self._new_udp_scanner().open(udp_targets)
+            yield
+        finally:
+            scanners = (self._scanner, self._udp_scanner)
+            self._scanner = self._udp_scanner = None
+            for scanner in scanners:
+                if scanner is not None:
+                    scanner.close()
+
+    def _probe(self, dest_ip, dest_port, protocol, tcp_verdicts=None, udp_verdicts=None, test_case=None):
+        """
+        Determines the actual result for one target, from the offline ruleset,
+        a batched scan, the probe cache or a fresh probe, in that order.
+        `test_case` may override the UDP payload.
+        Returns (actual_result, cached).
+        """
+        if self.ruleset is not None:
+            return self.ruleset.verdict(dest_ip, dest_port, protocol), False
 
-                # Determine status
-                status = "FAIL"
-                if actual_result == expected_result:
-                    status = "PASS"
-                # Special handling for UDP 'open|filtered'
-                elif protocol == "udp" and actual_result == "open|filtered" and expected_result in ["open", "open|filtered"]:
-                    status = "PASS"
+        if protocol == "tcp":
+            payload = b''
+            batch_verdicts, batch_key = tcp_verdicts, (dest_ip, dest_port)
+            probe = functools.partial(self._test_tcp_port, dest_ip, dest_port)
+        else:
+            payload, _ = self.payloads.get(dest_port, test_case)
+            batch_verdicts, batch_key = udp_verdicts, (dest_ip, dest_port, payload_digest(payload))
+            probe = functools.partial(self._test_udp_port, dest_ip, dest_port, payload=payload)
 
+        if batch_verdicts is not None and batch_key in batch_verdicts:
+            actual_result = batch_verdicts[batch_key]
+            if self.cache is not None:
+                self.cache.put(self.cache.make_key(dest_ip, dest_port, protocol, payload), actual_result)
+            return actual_result, False
 
+        if self.cache is None:
+            return probe(), False
+        return self.cache.get_or_probe(self.cache.make_key(dest_ip, dest_port, protocol, payload), probe)
+
+    def _run_test_case(self, i, test_case, tcp_verdicts=None, udp_verdicts=None):
+        """
+        Runs a single test case and determines its status. TCP and UDP verdicts
+        from batched scans are used instead of probing when given.
+        Returns a TestResult, or None if the test case was skipped.
+        """
+        try:
+            test_name = test_case.get('name', f"Test Case {i + 1}")
+            dest_ip = test_case['dest_ip']
+            dest_port = test_case['dest_port']
+            protocol = test_case['protocol'].lower()
+            expected_result = test_case['expected_result'].lower()
+
+            # Per-probe lines use lazy %-formatting: nothing is formatted while they are off
+            probe_logger.info("[TEST] Running '%s' (-> %s:%s/%s, Expected: %s)",
+                              test_name, dest_ip, dest_port, protocol, expected_result)
+
+            actual_result = "error"
+            cached = False
+            if protocol == "udp" and self.udp_engine == "skip":
+                probe_logger.warning("[WARNING] UDP test '%s' needs raw sockets. Skipping.", test_name)
+                actual_result = "skipped"
+            elif protocol in ("tcp", "udp"):
+                actual_result, cached = self._probe(dest_ip, dest_port, protocol, tcp_verdicts, udp_verdicts,
+                                                    test_case)
+            else:
+                probe_logger.warning("[WARNING] Unsupported protocol '%s' for test '%s'. Skipping.", protocol, test_name)
+                actual_result = "skipped"
+
+            # Determine status
+            status = "FAIL"
+            if actual_result == expected_result:
+                status = "PASS"
+            # Special handling for UDP 'open|filtered'
+            elif protocol == "udp" and actual_result == "open|filtered" and expected_result in ["open", "open|filtered"]:
+                status = "PASS"
+
+            level = logging.WARNING if status == "FAIL" else logging.INFO
+            if probe_logger.isEnabledFor(level):
+                fields = {'test': test_name, 'dest_ip': dest_ip, 'dest_port': dest_port, 'protocol': protocol,
+                          'expected_result': expected_result, 'actual_result': actual_result, 'status': status}
                 if status == "FAIL":
-                    fw_logger.warning(f"[FAIL] Test '{test_name}': Expected '{expected_result}', Got '{actual_result}'")
+                    probe_logger.warning("[FAIL] Test '%s': Expected '%s', Got '%s'", test_name, expected_result,
+                                         actual_result, extra=fields)
                 else:
-                    fw_logger.info(f"[PASS] Test '{test_name}': Actual '{actual_result}' matches expected.")
-
-                self.results.append({
-                    "name": test_name,
-                    "dest_ip": dest_ip,
-                    "dest_port": dest_port,
-                    "protocol": protocol,
-                    "expected_result": expected_result,
-                    "actual_result": actual_result,
-                    "status": status
-                })
-            except KeyError as e:
-                fw_logger.error(f"[ERROR] Skipping test case {i + 1} due to missing key: {e}")
-                continue  # Skip to the next test case
-            except Exception as e:
-                fw_logger.critical(f"[CRITICAL] An unexpected error occurred during test '{test_case.get('name', i + 1)}': {e}")
-                continue
+                    probe_logger.info("[PASS] Test '%s': Actual '%s' matches expected.", test_name, actual_result,
+                                      extra=fields)
+            self.metrics.count_result(status, actual_result)
+
+            return TestResult(test_name, dest_ip, dest_port, protocol, expected_result, actual_result, status, cached)
+        except KeyError as e:
+            fw_logger.error(f"[ERROR] Skipping test case {i + 1} due to missing key: {e}")
+            return None  # Skip to the next test case
+        except Exception as e:
+            fw_logger.critical(f"[CRITICAL] An unexpected error occurred during test '{test_case.get('name', i + 1)}': {e}")
+            return None
+
+    def _iter_jobs(self, test_cases):
+        """
+        Yields (dest_ip, callable) pairs that run each expanded test case.
+        With a batch engine, test cases are scanned in windows of
+        BATCH_SCAN_SIZE so expanded suites never have to be held in memory.
+        """
+        test_cases = enumerate(expand_test_cases(test_cases))
+        batch_tcp = self.tcp_engine in BATCH_TCP_ENGINES and self.ruleset is None
+        batch_udp = self.udp_engine == "batch" and self.ruleset is None
+        if batch_tcp or batch_udp:
+            windows = iter(lambda: list(itertools.islice(test_cases, BATCH_SCAN_SIZE)), [])
+        else:
+            windows = ([case] for case in test_cases)
+
+        for window in windows:
+            tcp_verdicts = self._batch_scan_tcp(case for _, case in window) if batch_tcp else None
+            udp_verdicts = self._batch_scan_udp(case for _, case in window) if batch_udp else None
+            for i, test_case in window:
+                dest_ip = test_case.get('dest_ip') if isinstance(test_case, dict) else None
+                yield dest_ip, functools.partial(self._run_test_case, i, test_case, tcp_verdicts, udp_verdicts)
+
+    def plan(self):
+        """
+        Works out what a run would do without sending anything: how many probes
+        the test cases expand to and an upper bound on the run time, assuming
+        every probe waits out its timeout and all retransmissions. Batch UDP
+        also allows for its re-probes and for every closed port's error being
+        held to the host's ICMP rate limit. Consumes the test case source.
+
+        Returns:
+            dict: 'test_cases', 'probes', 'tcp_probes', 'udp_probes',
+                'unsupported' and 'estimated_seconds'.
+        """
+        plan = {'test_cases': 0, 'probes': 0, 'tcp_probes': 0, 'udp_probes': 0, 'unsupported': 0}
+        batch_udp = self.udp_engine == "batch"
+        icmp = self.icmp_limits
+        host_ports = collections.Counter()  # UDP ports of each single-destination test case's host
+        icmp_time = 0.0  # ICMP pacing of the multi-destination UDP test cases
+        for test_case in self.test_cases:
+            try:
+                ips, ports = probe_shape(test_case)
+            except (KeyError, TypeError, ValueError):
+                ips, ports = 1, 0  # Passed through unexpanded, like expand_test_cases()
+            probes = ips * ports or 1
+            protocol = str(test_case.get('protocol', '')).lower() if isinstance(test_case, dict) else ""
+            plan['test_cases'] += 1
+            plan['probes'] += probes
+            if protocol in ("tcp", "udp"):
+                plan[f'{protocol}_probes'] += probes
+            else:
+                plan['unsupported'] += probes
+            if protocol == "udp" and batch_udp and ports:
+                if ips == 1:
+                    host_ports[str(test_case['dest_ip'])] += ports
+                else:
+                    # The hosts sharing a scan window are paced side by side, the windows one after another
+                    hosts_per_window = max(1, BATCH_SCAN_SIZE // ports)
+                    icmp_time += math.ceil(ips / hosts_per_window) * max(0, ports - icmp.burst) / icmp.rate
+        if host_ports:
+            icmp_time += max(0, max(host_ports.values()) - icmp.burst) / icmp.rate
+
+        # Worst case for one probe: every attempt times out, backing off
+        probe_time = sum(self.timing.timeout_for(None, attempt) for attempt in range(self.retries + 1))
+        batch_time = serial_probes = 0
+        if self.tcp_engine in BATCH_TCP_ENGINES:
+            # One reply window per retransmission round for each scan window
+            batch_time += math.ceil(plan['tcp_probes'] / BATCH_SCAN_SIZE) * probe_time
+        else:
+            serial_probes += plan['tcp_probes']
+        packets = (plan['tcp_probes'] + plan['udp_probes']) * (self.retries + 1)
+        if batch_udp:
+            # Every round may re-probe ports whose port-unreachable was rate limited away, and closed
+            # ports draw errors no faster than each host's ICMP rate limit allows
+            udp_time = sum(self.timing.timeout_for(None, attempt) for attempt in range(self.retries + UDP_REPROBES + 1))
+            batch_time += math.ceil(plan['udp_probes'] / BATCH_SCAN_SIZE) * udp_time + icmp_time
+            packets += plan['udp_probes'] * UDP_REPROBES
+        elif self.udp_engine != "skip":
+            serial_probes += plan['udp_probes']
+        estimate = batch_time + serial_probes * probe_time / self.concurrency
+        if self.max_pps:
+            # Every packet, batched or not, waits for the rate limit
+            estimate = max(estimate, packets / self.max_pps)
+        plan['estimated_seconds'] = round(estimate, 3)
+        return plan
+
+    def iter_outcomes(self):
+        """
+        Executes all defined test cases and yields, for every expanded test case
+        in order, its TestResult or None if it was skipped.
+        """
+        fw_logger.info("[*] Starting firewall rule tests...")
+
+        if self.concurrency > 1 or self.max_pps or self.per_host_limit:
+            fw_logger.info(f"[*] Running with concurrency {self.concurrency}, "
+                           f"max {self.max_pps or 'unlimited'} pps, per-host limit {self.per_host_limit or 'none'}")
+        yield from self.probe_cases(self.test_cases)
 
         fw_logger.info("[*] Firewall rule tests finished.")
+
+    def probe_cases(self, test_cases):
+        """
+        Runs the given test cases like iter_outcomes(), without its start and
+        finish log lines, for callers that drive the tester in many small runs.
+
+        Args:
+            test_cases (iterable): Test case dictionaries in compact form.
+
+        Yields:
+            TestResult: For every expanded test case in order, or None if it was skipped.
+        """
+        if self.concurrency > 1 or self.per_host_limit:
+            # The packet rate is paced where packets are sent (see rate_limiter), not per job
+            scheduler = AsyncProbeScheduler(self.concurrency, None, self.per_host_limit, self.metrics)
+            results = scheduler.iter_run(self._iter_jobs(test_cases))
+        else:
+            results = (func() for _, func in self._iter_jobs(test_cases))
+        yield from timed(results, self.metrics, 'probe')
+
+    def iter_results(self):
+        """
+        Executes all defined test cases and yields a TestResult for each one, in
+        test-case order, as soon as it is available. Nothing is accumulated, so
+        memory stays flat regardless of suite size.
+        Test cases run concurrently when a concurrency above 1, a packet rate
+        limit or a per-destination limit is configured.
+        """
+        for result in self.iter_outcomes():
+            if result is not None:
+                yield result
+
+    def run_tests(self):
+        """
+        Executes all defined test cases and stores the results.
+        """
+        self.results.extend(result.to_dict() for result in self.iter_results())
         return self.results
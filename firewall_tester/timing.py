@@ -0,0 +1,342 @@
+import bisect
+import collections
+import threading
+
+from .config import (DEFAULT_TIMEOUT, MIN_RTT_TIMEOUT, MAX_RTT_TIMEOUT, TIMING_MAX_HOSTS, ICMP_RATE, ICMP_BURST,
+                     ICMP_RATE_MAX, ICMP_HEADROOM, ICMP_RATE_WINDOW)
+
+class HostTiming:
+    """
+    Smoothed round-trip time and variance for one destination, in the style of
+    RFC 6298 and nmap, plus probe counters for reporting.
+    """
+    __slots__ = ('srtt', 'rttvar', 'probes', 'replies', 'timeouts', 'retransmits', 'min_rtt', 'max_rtt')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.probes = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.retransmits = 0
+        self.min_rtt = None
+        self.max_rtt = None
+
+    def add_sample(self, rtt):
+        """
+        Updates the RTT estimate with one measured round trip, in seconds.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            delta = rtt - self.srtt
+            self.srtt += delta / 8
+            self.rttvar += (abs(delta) - self.rttvar) / 4
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.max_rtt = rtt if self.max_rtt is None else max(self.max_rtt, rtt)
+
+class TimingTable:
+    """
+    Per-destination RTT estimates that drive probe timeouts. Until a host has
+    answered, its timeout is the initial timeout; afterwards it is
+    srtt + 4 * rttvar, clamped to [MIN_RTT_TIMEOUT, MAX_RTT_TIMEOUT].
+    Only the `max_hosts` most recently probed hosts are kept, so a run over
+    a large network holds a bounded table. Safe to share between probe threads.
+    """
+    def __init__(self, initial_timeout=DEFAULT_TIMEOUT, adaptive=True,
+                 min_timeout=MIN_RTT_TIMEOUT, max_timeout=MAX_RTT_TIMEOUT, metrics=None, max_hosts=TIMING_MAX_HOSTS):
+        """
+        Initializes the TimingTable.
+
+        Args:
+            initial_timeout (float): Timeout in seconds before a host has been measured.
+            adaptive (bool): If False, every probe uses the initial timeout.
+            min_timeout (float): Lower bound for adaptive timeouts, in seconds.
+            max_timeout (float): Upper bound for adaptive timeouts, in seconds.
+            metrics (RunMetrics): Run-wide metrics that every probe, reply and
+                timeout is also counted in, or None.
+            max_hosts (int): Maximum number of hosts kept; the least recently
+                probed one is dropped to make room for a new one.
+        """
+        self.initial_timeout = initial_timeout
+        self.adaptive = adaptive
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.metrics = metrics
+        self.max_hosts = max_hosts
+        self._hosts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        timing = self._hosts.get(host)
+        if timing is None:
+            timing = self._hosts[host] = HostTiming()
+            if len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        return timing
+
+    def timeout_for(self, host, attempt=0):
+        """
+        Returns the timeout in seconds for a probe to `host`. Retransmissions
+        back off exponentially, up to the maximum timeout.
+
+        Args:
+            host (str): The destination address.
+            attempt (int): 0 for the first transmission, 1 for the first retransmission, ...
+        """
+        with self._lock:
+            timing = self._hosts.get(host)
+            if not self.adaptive or timing is None or timing.srtt is None:
+                timeout = self.initial_timeout
+            else:
+                timeout = min(max(timing.srtt + 4 * timing.rttvar, self.min_timeout), self.max_timeout)
+        return min(timeout * (2 ** attempt), max(self.max_timeout, timeout))
+
+    def record_probe(self, host, attempt=0):
+        """
+        Counts one transmitted probe (or retransmission) to `host`.
+        """
+        with self._lock:
+            timing = self._host(host)
+            timing.probes += 1
+            if attempt:
+                timing.retransmits += 1
+        if self.metrics is not None:
+            self.metrics.count_probe(attempt)
+
+    def record_reply(self, host, rtt=None, kind=None):
+        """
+        Counts a reply from `host` and, if given, feeds its RTT in seconds into
+        the estimate. Replies to retransmitted probes should pass no RTT (Karn's rule).
+        `kind` ('syn-ack', 'rst', 'icmp-unreachable', ...) is counted in the run metrics.
+        """
+        with self._lock:
+            timing = self._host(host)
+            timing.replies += 1
+            if rtt is not None and rtt >= 0:
+                timing.add_sample(rtt)
+        if self.metrics is not None:
+            self.metrics.count_reply(kind, rtt)
+
+    def record_timeout(self, host):
+        """
+        Counts a probe to `host` that got no reply within its timeout.
+        """
+        with self._lock:
+            self._host(host).timeouts += 1
+        if self.metrics is not None:
+            self.metrics.count_timeout()
+
+    def summary(self):
+        """
+        Returns per-host timing statistics, sorted by host.
+
+        Returns:
+            list: One dictionary per host with counters and RTT figures in milliseconds.
+        """
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        rows = []
+        with self._lock:
+            hosts = sorted(self._hosts.items(), key=lambda item: str(item[0]))
+        for host, timing in hosts:
+            rows.append({
+                "host": host,
+                "probes": timing.probes,
+                "replies": timing.replies,
+                "timeouts": timing.timeouts,
+                "retransmits": timing.retransmits,
+                "srtt_ms": ms(timing.srtt),
+                "rttvar_ms": ms(timing.rttvar),
+                "min_rtt_ms": ms(timing.min_rtt),
+                "max_rtt_ms": ms(timing.max_rtt),
+                "timeout_ms": ms(self.timeout_for(host)),
+            })
+        return rows
+
+class IcmpBudget:
+    """
+    Mirror of one destination's ICMP error token bucket, rebuilt from the
+    errors that arrived: a host spends a token only on errors it sends, so
+    replaying its bucket over the received ones tells whether it could
+    have afforded an error at any given moment. Errors are dated by when the
+    probe that drew them was sent, which is when the host saw it, shifted by
+    the same one-way delay as every other probe.
+    """
+    __slots__ = ('rate', 'base_tokens', 'base_time', 'sends', 'pace_tokens', 'pace_time', 'expected',
+                 'errors', 'resolved')
+
+    def __init__(self, burst, now, rate):
+        self.rate = rate
+        self.base_tokens = burst
+        self.base_time = now
+        self.sends = []
+        self.pace_tokens = burst
+        self.pace_time = now
+        self.expected = 0.0
+        self.errors = 0
+        self.resolved = 0
+
+class IcmpRateTable:
+    """
+    Learns how many ICMP errors per second each destination sends, so UDP
+    probes can be paced to that budget and a missing port-unreachable can be
+    told apart from one the host rate-limited away.
+
+    Hosts that have sent no ICMP error are not paced. Once a host has, each
+    probe to it reserves the share of its probes that drew errors so far,
+    paced at `headroom` times the learned rate so the estimate can rise: the
+    rate only ever grows to what received errors prove, (errors - burst) / seconds
+    over the last `window` errors. A probe that got no answer while the
+    mirrored bucket was empty may have been rate limited (see suppressible()).
+    Safe to share between probe threads.
+    """
+    def __init__(self, rate=ICMP_RATE, burst=ICMP_BURST, max_rate=ICMP_RATE_MAX, headroom=ICMP_HEADROOM,
+                 window=ICMP_RATE_WINDOW):
+        """
+        Initializes the IcmpRateTable.
+
+        Args:
+            rate (float): Errors per second assumed for a host until it proves more.
+            burst (int): Errors a host sends back to back before its limit applies.
+            max_rate (float): Upper bound for learned rates.
+            headroom (float): Factor above the learned rate that probes are paced at.
+            window (int): Recent errors per host the rate is measured over.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate
+        self.headroom = headroom
+        self.window = window
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, host, now):
+        budget = self._hosts.get(host)
+        if budget is None:
+            budget = self._hosts[host] = IcmpBudget(self.burst, now, self.rate)
+        return budget
+
+    def responsive(self, host):
+        """
+        Returns True once `host` has sent an ICMP error, so its probes are paced.
+        """
+        with self._lock:
+            budget = self._hosts.get(host)
+            return budget is not None and budget.errors > 0
+
+    def take(self, host, now, reprobe=False):
+        """
+        Reserves a send slot for a probe that may draw an ICMP error from `host`.
+
+        Args:
+            host (str): The destination address.
+            now (float): The current time.monotonic().
+            reprobe (bool): The port's last error may have been rate limited
+                away, so the probe most likely draws one and reserves a whole token.
+
+        Returns:
+            tuple: (0, cost) if the probe may go now, where `cost` must be
+                handed to resolve() once the probe is answered or times out,
+                or (seconds until a slot frees up, None).
+        """
+        with self._lock:
+            budget = self._budget(host, now)
+            if not budget.errors:
+                return 0, 0.0
+            pace = budget.rate * self.headroom
+            budget.pace_tokens = min(self.burst, budget.pace_tokens + (now - budget.pace_time) * pace)
+            budget.pace_time = now
+            if reprobe:
+                # No headroom: a re-probe rate limited away again would be wasted
+                cost, pace = 1.0, budget.rate
+                available = min(budget.pace_tokens, self._tokens_at(budget, now)) - budget.expected
+            else:
+                cost = (budget.errors + 1) / (budget.resolved + 2)
+                available = budget.pace_tokens - budget.expected
+            if available < cost:
+                return (cost - available) / pace, None
+            budget.expected += cost
+            return 0, cost
+
+    def resolve(self, host, cost, counted=True):
+        """
+        Releases the reservation of a probe that was answered or timed out.
+
+        Args:
+            host (str): The destination address.
+            cost (float): The cost take() returned for the probe.
+            counted (bool): The outcome tells whether the port draws errors;
+                False for a timeout that may have been rate limited.
+        """
+        with self._lock:
+            budget = self._hosts.get(host)
+            if budget is None:
+                return
+            budget.expected = max(0.0, budget.expected - cost)
+            if counted:
+                budget.resolved += 1
+
+    def record_error(self, host, sent_at, now):
+        """
+        Records an ICMP error from `host` and raises its learned rate to what
+        the recent errors prove.
+
+        Args:
+            host (str): The destination address.
+            sent_at (float): time.monotonic() when the probe that drew the error was sent.
+            now (float): The current time.monotonic().
+        """
+        with self._lock:
+            budget = self._budget(host, sent_at)
+            budget.errors += 1
+            budget.pace_tokens = min(self.burst, budget.pace_tokens + (now - budget.pace_time) * budget.rate
+                                     * self.headroom) - 1
+            budget.pace_time = now
+            sends = budget.sends
+            # Replies can overtake each other; keep the errors in the order the host sent them
+            bisect.insort(sends, sent_at)
+            while len(sends) > self.window:
+                # Fold the oldest error into the replay's starting point
+                first = sends.pop(0)
+                budget.base_tokens = max(0.0, min(self.burst, budget.base_tokens
+                                                  + (first - budget.base_time) * budget.rate) - 1)
+                budget.base_time = first
+            span = sends[-1] - sends[0]
+            if len(sends) > self.burst and span > 0:
+                budget.rate = min(self.max_rate, max(budget.rate, (len(sends) - self.burst) / span))
+
+    def _tokens_at(self, budget, at):
+        """
+        Replays a host's bucket at its learned rate over the errors sent before `at`.
+        """
+        tokens, last = budget.base_tokens, budget.base_time
+        for error_at in budget.sends:
+            if error_at >= at:
+                break
+            tokens = max(0.0, min(self.burst, tokens + (error_at - last) * budget.rate) - 1)
+            last = error_at
+        return min(self.burst, tokens + (at - last) * budget.rate)
+
+    def suppressible(self, host, sent_at):
+        """
+        Returns True if `host` may have had no token left to answer a probe
+        sent at `sent_at` (time.monotonic()), so its missing error proves
+        nothing. Call once the errors of the probes sent before it are in.
+        """
+        with self._lock:
+            budget = self._hosts.get(host)
+            return budget is not None and self._tokens_at(budget, sent_at) < 1
+
+    def summary(self):
+        """
+        Returns the learned budget of every host that sent ICMP errors, sorted by host.
+        """
+        with self._lock:
+            hosts = sorted(self._hosts.items(), key=lambda item: str(item[0]))
+        return [{"host": host, "icmp_rate": round(budget.rate, 3), "icmp_errors": budget.errors}
+                for host, budget in hosts if budget.errors]
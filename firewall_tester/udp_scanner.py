@@ -0,0 +1,288 @@
+import collections
+import heapq
+import socket
+import time
+
+from .logger import fw_logger
+from .config import DEFAULT_TIMEOUT, UDP_REPROBES
+from .rawpacket import UdpTemplate, IPPROTO_UDP, parse_reply, source_address_for
+from .syn_scanner import BatchSynScanner, RawSynScanner
+from .timing import IcmpRateTable
+from .scapy_loader import load_scapy, module_getattr
+
+# scapy is only imported when a scapy-based scan starts
+_SCAPY_NAMES = ('IP', 'UDP', 'ICMP', 'IPerror', 'UDPerror', 'Raw')
+__getattr__ = module_getattr(globals(), _SCAPY_NAMES, __name__)
+
+class UdpScanner(BatchSynScanner):
+    """
+    Probes the UDP targets of a run through one long-lived socket and sniffer,
+    like the batch SYN scan, but paced to what each destination's ICMP error
+    rate limit allows. Linux and most firewalls send about one port-unreachable
+    per second per destination, so probing a host faster turns closed ports
+    into false open|filtered verdicts.
+
+    Probes go out round robin across hosts, one per host per turn. Hosts that
+    have never sent an ICMP error are probed at full speed; once a host sends
+    one, its probes are paced to its learned budget (see IcmpRateTable). A port
+    that got no answer while its host may have been out of ICMP tokens is
+    re-probed within that budget, up to `reprobes` times.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, iface=None, inter=0, timing=None, retries=0, icmp_limits=None,
+                 reprobes=UDP_REPROBES, recorder=None, routes=None, rate_limiter=None):
+        """
+        Initializes the UdpScanner.
+
+        Args:
+            timeout (float): Seconds to wait for a reply, used when no timing table is given.
+            iface (str): Interface to send and sniff on (scapy default if None).
+            inter (float): Unused; pacing follows the ICMP budgets.
+            timing (TimingTable): Per-host RTT estimates that size each probe's
+                reply window and record RTT samples, or None for a fixed window.
+            retries (int): Retransmissions of an unanswered probe, for packet loss.
+            icmp_limits (IcmpRateTable): Learned ICMP budgets, shared between
+                scans, or None for a fresh table.
+            reprobes (int): Extra probes of a port whose port-unreachable may
+                have been rate limited away.
+            recorder (PcapWriter): Capture to record every probe and reply to, or None.
+            routes (RouteCache): Run-wide cache of the interface and source
+                address to reach each destination from, or None to look them up.
+            rate_limiter (TokenBucket): Run-wide packet rate limit every probe,
+                re-probes included, waits for on top of the ICMP pacing, or None.
+        """
+        super().__init__(timeout=timeout, iface=iface, inter=inter, timing=timing, retries=retries, recorder=recorder,
+                         routes=routes, rate_limiter=rate_limiter)
+        self.icmp_limits = icmp_limits if icmp_limits is not None else IcmpRateTable()
+        self.reprobes = reprobes
+        self.recovered = 0
+        self._suppressible = set()
+        self._payloads = {}
+
+    def _bpf_filter(self):
+        return f"(udp and dst port {self.sport}) or (icmp and icmp[0] == 3)"
+
+    def _is_reply(self, pkt):
+        if pkt.haslayer(ICMP):
+            return int(pkt[ICMP].type) == 3
+        return pkt.haslayer(UDP) and pkt[UDP].dport == self.sport
+
+    def _handle_reply(self, pkt):
+        """
+        Dissects a sniffed reply with scapy and matches it to its probe.
+        """
+        load_scapy(globals(), _SCAPY_NAMES)
+        if not pkt.haslayer(IP):
+            return
+        self._record(pkt, getattr(pkt, 'time', None))
+        if pkt.haslayer(ICMP):
+            if int(pkt[ICMP].type) == 3 and pkt.haslayer(UDPerror) and pkt[UDPerror].sport == self.sport:
+                key = (pkt[IPerror].dst, pkt[UDPerror].dport)
+                self._match_reply(key, "closed" if int(pkt[ICMP].code) == 3 else "open|filtered",
+                                  getattr(pkt, 'time', None), icmp=True)
+        elif pkt.haslayer(UDP):
+            self._match_reply((pkt[IP].src, pkt[UDP].sport), "open", getattr(pkt, 'time', None))
+
+    def _match_reply(self, key, verdict, received_at=None, icmp=False):
+        """
+        Matches a reply to its probe by (ip, port) and records the same verdict
+        as a per-probe UDP scan: 'closed' for port-unreachable, 'open' for a
+        UDP answer, 'open|filtered' for other ICMP errors.
+
+        Args:
+            key (tuple): (address, port) the probe was sent to.
+            verdict (str): The verdict the reply means.
+            received_at (float): Capture timestamp, for RTT sampling.
+            icmp (bool): The reply is an ICMP error, which counts against the host's budget.
+        """
+        with self._lock:
+            probe = self._pending.pop(key, None)
+            if probe is None:
+                return  # Not ours, a duplicate, or an answer to a probe already timed out
+            target, attempt, sent_at, sent_mono, cost = probe
+            self._verdicts[target] = verdict
+            if icmp and target in self._suppressible:
+                self.recovered += 1
+        self._done.set()
+
+        if icmp:
+            self.icmp_limits.record_error(target[0], sent_mono, time.monotonic())
+        self.icmp_limits.resolve(target[0], cost)
+        if self.timing is not None:
+            # Karn's rule: replies to retransmissions are not RTT samples
+            rtt = float(received_at) - sent_at if attempt == 0 and received_at else None
+            self.timing.record_reply(target[0], rtt, "icmp-unreachable" if icmp else "udp")
+
+    def _send_udp(self, address, dest_port, payload=b'', payload_sum=0):
+        load_scapy(globals(), _SCAPY_NAMES)
+        packet = IP(src=self._source_for(address), dst=address) / UDP(sport=self.sport, dport=dest_port)
+        if payload:
+            packet = packet / Raw(load=payload)
+        self._record(packet)  # Before sending: the reply may be recorded as soon as the packet leaves
+        self._sock.send(packet)
+
+    def _reply_window(self, dest_ip, attempt):
+        if self.timing is None:
+            return self.timeout * (2 ** attempt)
+        return self.timing.timeout_for(dest_ip, attempt)
+
+    def _timed_out(self, target, attempt, sent_mono, cost):
+        """
+        Settles an unanswered probe. Returns True if the port gets another one.
+        """
+        dest_ip = target[0]
+        suppressible = self.icmp_limits.suppressible(dest_ip, sent_mono)
+        self.icmp_limits.resolve(dest_ip, cost, counted=not suppressible)
+        if suppressible:
+            self._suppressible.add(target)
+            return attempt < self.retries + self.reprobes
+        return attempt < self.retries
+
+    def _run(self, targets):
+        """
+        Sends every probe within its host's budget and waits for the answers,
+        re-probing ports whose answer may have been rate limited away.
+        Returns the number of probes sent.
+        """
+        queues = collections.OrderedDict()  # dest_ip -> deque of (target, attempt) still to send
+        for target in targets:
+            queues.setdefault(target[0], collections.deque()).append((target, 0))
+        deadlines = []  # (deadline, target, attempt) of probes in flight
+        sent = 0
+
+        while True:
+            # Cleared before looking at anything a reply can change, so no wakeup is lost
+            self._done.clear()
+            now = time.monotonic()
+            while deadlines and deadlines[0][0] <= now:
+                _, target, attempt = heapq.heappop(deadlines)
+                key = (self._addresses[target[0]], target[1])
+                with self._lock:
+                    probe = self._pending.get(key)
+                    if probe is None or probe[1] != attempt:
+                        continue  # Answered
+                    del self._pending[key]
+                if self.timing is not None:
+                    self.timing.record_timeout(target[0])
+                if self._timed_out(target, attempt, probe[3], probe[4]):
+                    queues.setdefault(target[0], collections.deque()).append((target, attempt + 1))
+
+            # One probe per host per turn, within each host's budget
+            next_slot = None
+            sending = False
+            for dest_ip in list(queues):
+                queue = queues[dest_ip]
+                target, attempt = queue[0]
+                wait, cost = self.icmp_limits.take(dest_ip, now, reprobe=target in self._suppressible)
+                if wait:
+                    next_slot = wait if next_slot is None else min(next_slot, wait)
+                    continue
+                queue.popleft()
+                if not queue:
+                    del queues[dest_ip]
+                address = self._addresses[dest_ip]
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                with self._lock:
+                    self._pending[(address, target[1])] = (target, attempt, time.time(), time.monotonic(), cost)
+                if self.timing is not None:
+                    self.timing.record_probe(dest_ip, attempt)
+                self._send_udp(address, target[1], *self._payloads.get(target, (b'', 0)))
+                heapq.heappush(deadlines, (time.monotonic() + self._reply_window(dest_ip, attempt), target, attempt))
+                sent += 1
+                sending = True
+            if sending:
+                continue
+            if not queues and not deadlines:
+                return sent
+
+            waits = [wait for wait in (next_slot, deadlines[0][0] - time.monotonic() if deadlines else None)
+                     if wait is not None]
+            self._done.wait(max(0, min(waits)))
+
+    def scan(self, targets, payloads=None):
+        """
+        Probes every (dest_ip, dest_port) UDP target.
+
+        Args:
+            targets (iterable): (dest_ip, dest_port) tuples.
+            payloads (dict): Maps targets to the (payload, checksum word sum) to
+                probe them with (see PayloadLibrary); others get an empty datagram.
+
+        Returns:
+            dict: Maps (dest_ip, dest_port) to 'open', 'closed', 'open|filtered' or 'error'.
+        """
+        targets = list(dict.fromkeys(targets))
+        if not targets:
+            return {}
+
+        self._pending = {}
+        self._verdicts = {}
+        self._addresses = {}
+        self._suppressible = set()
+        self._payloads = payloads or {}
+
+        results = {target: "error" for target in self._resolve(targets)}
+        targets = [target for target in targets if target[0] in self._addresses]
+        if not targets:
+            return results
+
+        persistent = self._persistent
+        try:
+            if not persistent:
+                self._start(targets)
+            sent = self._run(targets)
+        except Exception as e:
+            fw_logger.error(f"[ERROR] Batch UDP scan failed: {e}")
+            results.update((target, "error") for target in targets)
+            return results
+        finally:
+            if not persistent:
+                self._stop()
+
+        paced = sum(1 for dest_ip in {dest_ip for dest_ip, _ in targets} if self.icmp_limits.responsive(dest_ip))
+        (fw_logger.debug if persistent else fw_logger.info)(
+            f"[*] Sent {sent} UDP probes for {len(targets)} targets ({paced} hosts paced to their ICMP rate limit, "
+            f"{self.recovered} rate-limited port-unreachables recovered).")
+        # No answer means open or filtered
+        results.update((target, self._verdicts.get(target, "open|filtered")) for target in targets)
+        return results
+
+class RawUdpScanner(UdpScanner, RawSynScanner):
+    """
+    Fast path of the UDP scan: probes are built from UdpTemplate headers and
+    sent over a plain raw socket; replies are read from raw UDP and ICMP
+    sockets and dissected with struct. Needs Linux raw socket support.
+    """
+    _recv_protocols = (socket.IPPROTO_UDP, socket.IPPROTO_ICMP)
+
+    def _packed_for(self, address):
+        packed = self._packed.get(address)
+        if packed is None:
+            packed = self._packed[address] = (socket.inet_aton(address),
+                                              UdpTemplate(self._source_for(address)
+                                                          or source_address_for(address, self.iface), self.sport))
+        return packed
+
+    def _send_udp(self, address, dest_port, payload=b'', payload_sum=0):
+        packed, template = self._packed_for(address)
+        packet = template.build(packed, dest_port, payload, payload_sum)
+        self._record(packet)  # Before sending: the reply may be recorded as soon as the packet leaves
+        self._sock.sendto(packet, (address, 0))
+
+    def _handle_raw(self, data, received_at):
+        """
+        Dissects a raw reply with struct and matches it to its probe.
+        """
+        reply = parse_reply(data)
+        if reply is None:
+            return
+        if reply[0] == 'udp':
+            _, src_ip, sport, dport = reply
+            if dport == self.sport:
+                self._record(data, received_at)
+                self._match_reply((src_ip, sport), "open", received_at)
+        elif reply[0] == 'icmp' and reply[2] == 3 and reply[5] == IPPROTO_UDP and reply[6] == self.sport:
+            _, _, _, code, quoted_dst, _, _, quoted_dport, _ = reply
+            self._record(data, received_at)
+            self._match_reply((quoted_dst, quoted_dport), "closed" if code == 3 else "open|filtered", received_at,
+                              icmp=True)
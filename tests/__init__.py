@@ -0,0 +1,11 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+from firewall_tester.logger import set_log_file
+
+# Keep test runs out of the real logs/firewall_test.log
+_log_dir = tempfile.mkdtemp(prefix="firewall_tester_tests_")
+atexit.register(shutil.rmtree, _log_dir, ignore_errors=True)
+set_log_file(os.path.join(_log_dir, 'firewall_test.log'))
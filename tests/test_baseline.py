@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from firewall_tester.baseline import BaselineStore, case_hash
+from firewall_tester.reporter import format_baseline_diff
+from firewall_tester.ruleset import parse_iptables_save
+from firewall_tester.tester import FirewallRuleTester
+
+RULESET = """
+*filter
+:INPUT DROP [0:0]
+-A INPUT -p tcp -m tcp --dport {port} -j ACCEPT
+COMMIT
+"""
+
+def make_case(name, port, expected="open"):
+    return {"name": name, "dest_ip": "192.0.2.1", "dest_port": port, "protocol": "tcp", "expected_result": expected}
+
+class TestBaselineStore(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.baseline.fw_logger', 'firewall_tester.tester.fw_logger',
+                       'firewall_tester.ruleset.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "baseline.db")
+
+    def _run(self, test_cases, open_port=80, **select_options):
+        baseline = BaselineStore(self.path)
+        tester = FirewallRuleTester(baseline.select(test_cases, **select_options),
+                                    ruleset=parse_iptables_save(RULESET.format(port=open_port)))
+        for result in tester.iter_results():
+            baseline.observe(result)
+        return baseline.close()
+
+    def test_hash_ignores_key_order(self):
+        case = make_case("Web", 80)
+        self.assertEqual(case_hash(case), case_hash(dict(reversed(list(case.items())))))
+        self.assertNotEqual(case_hash(case), case_hash(make_case("Web", 81)))
+
+    def test_changed_only_selects_new_and_modified_cases(self):
+        suite = [make_case(f"Port {port}", port) for port in range(1, 101)]
+        first = self._run(suite, changed_only=True)
+        self.assertEqual((first['new'], first['unchanged_skipped'], first['new_targets']), (100, 0, 100))
+
+        edited = suite[:98] + [make_case("Port 99", 99, "filtered"), make_case("Port 1000", 1000)]
+        second = self._run(edited, changed_only=True, sample=0.1, seed=7)
+        self.assertEqual((second['new'], second['modified']), (1, 1))
+        self.assertEqual(second['unchanged_probed'] + second['unchanged_skipped'], 98)
+        self.assertGreater(second['unchanged_probed'], 0)
+        self.assertEqual(second['compared'], 2 + second['unchanged_probed'])
+        self.assertEqual(second['removed'], ["Port 100"])
+
+        third = self._run(edited, changed_only=True, sample=0)
+        self.assertEqual((third['new'], third['modified'], third['unchanged_skipped'], third['removed']), (0, 0, 100, []))
+
+    def test_diff_reports_verdict_changes(self):
+        suite = [make_case("Web", 80), make_case("Alt", 8080, "filtered")]
+        self._run(suite, open_port=80)
+        diff = self._run(suite, open_port=8080)
+
+        self.assertEqual((diff['compared'], diff['verdict_changes'], diff['unchanged']), (2, 2, 0))
+        web = next(change for change in diff['changes'] if change['dest_port'] == 80)
+        self.assertEqual((web['previous_result'], web['actual_result']), ("open", "filtered"))
+        self.assertEqual((web['previous_status'], web['status']), ("PASS", "FAIL"))
+        self.assertIn("  [PASS -> FAIL] Web: open -> filtered (expected open)", format_baseline_diff(diff))
+
+        self.assertEqual(self._run(suite, open_port=8080)['verdict_changes'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import patch
+
+from firewall_tester.benchmark import generate_suite, run_benchmark, format_results
+from firewall_tester.responder import SimulatedTarget
+from firewall_tester.tester import FirewallRuleTester
+
+class TestSimulatedTarget(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.tester.fw_logger', 'firewall_tester.syn_scanner.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+        self.target = SimulatedTarget(latency=0.001, reset=0.3, unreachable=0.2, silent=0.1)
+        self.suite = list(generate_suite(400, hosts=20, ports=50, udp_share=0.25))
+
+    def assert_verdicts(self, **tester_options):
+        with self.target.attach():
+            results = FirewallRuleTester(self.suite, timeout=0.05, **tester_options).run_tests()
+        expected = [self.target.expected_verdict(case['dest_ip'], case['dest_port'], case['protocol'])
+                    for case in self.suite]
+        self.assertEqual([result['actual_result'] for result in results], expected)
+        self.assertEqual(set(expected), {"open", "closed", "filtered", "open|filtered"})
+
+    def test_sr1_engine(self):
+        self.assert_verdicts(concurrency=32)
+
+    def test_batch_engine(self):
+        self.assert_verdicts(tcp_engine="batch", fast_path=True)
+
+    def test_connect_engine_is_not_simulated(self):
+        with self.assertRaises(ValueError):
+            run_benchmark(10, tester_options={'tcp_engine': "connect"})
+
+    def test_attach_restores_scapy(self):
+        from firewall_tester import tester
+        original = tester.sr1
+        with self.target.attach():
+            self.assertEqual(tester.sr1, self.target.sr1)
+        self.assertIs(tester.sr1, original)
+
+class TestBenchmark(unittest.TestCase):
+
+    @patch('firewall_tester.tester.fw_logger')
+    def test_run_benchmark_measures_the_run(self, mock_logger):
+        row = run_benchmark(300, tester_options={'concurrency': 16, 'timeout': 0.05},
+                            target_options={'latency': 0, 'silent': 0}, suite_options={'hosts': 10})
+        self.assertEqual(row['size'], 300)
+        self.assertEqual(sum(row['verdicts'].values()), 300)
+        self.assertGreater(row['probes_per_second'], 0)
+        self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+        self.assertGreater(row['peak_rss_mb'], 0)
+        self.assertEqual(len(format_results([row])), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
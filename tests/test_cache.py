@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from firewall_tester.cache import ProbeCache
+from firewall_tester.tester import FirewallRuleTester
+
+class TestProbeCache(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.cache.fw_logger').start()
+        self.addCleanup(patch.stopall)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "probes.db")
+        self.key = ProbeCache.make_key("1.1.1.1", 80, "TCP")
+
+    def test_dedupes_within_run(self):
+        cache = ProbeCache()
+        probe = MagicMock(return_value="open")
+        self.assertEqual(cache.get_or_probe(self.key, probe), ("open", False))
+        self.assertEqual(cache.get_or_probe(self.key, probe), ("open", True))
+        probe.assert_called_once()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_errors_are_not_cached(self):
+        cache = ProbeCache()
+        probe = MagicMock(side_effect=["error", "closed"])
+        self.assertEqual(cache.get_or_probe(self.key, probe), ("error", False))
+        self.assertEqual(cache.get_or_probe(self.key, probe), ("closed", False))
+
+    def test_concurrent_duplicates_wait_for_first_probe(self):
+        cache = ProbeCache()
+        calls = []
+
+        def probe():
+            calls.append(1)
+            time.sleep(0.05)
+            return "filtered"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_probe(self.key, probe)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("filtered", False)] + [("filtered", True)] * 3)
+
+    def test_persisted_across_runs_within_ttl(self):
+        cache = ProbeCache(path=self.path, ttl=60)
+        cache.put(self.key, "closed")
+        cache.close()
+
+        self.assertEqual(ProbeCache(path=self.path, ttl=60).get(self.key), "closed")
+        with patch('firewall_tester.cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(ProbeCache(path=self.path, ttl=60).get(self.key))
+
+    def test_size_bounded_eviction(self):
+        cache = ProbeCache(path=self.path, max_entries=2)
+        for port in (1, 2, 3):
+            cache.put(ProbeCache.make_key("1.1.1.1", port, "tcp"), "closed")
+        self.assertIsNone(cache.get(ProbeCache.make_key("1.1.1.1", 1, "tcp")))
+        cache.close()
+
+        with sqlite3.connect(self.path) as db:
+            ports = sorted(row[0] for row in db.execute("SELECT dest_port FROM probes"))
+        self.assertEqual(ports, [2, 3])
+
+    def test_stores_without_payloads_are_dropped(self):
+        with sqlite3.connect(self.path) as db:
+            db.execute("CREATE TABLE probes (dest_ip TEXT, dest_port INTEGER, protocol TEXT, "
+                       "verdict TEXT, probed_at REAL, PRIMARY KEY (dest_ip, dest_port, protocol))")
+            db.execute("INSERT INTO probes VALUES ('1.1.1.1', 53, 'udp', 'open', ?)", (time.time(),))
+        db.close()
+
+        cache = ProbeCache(path=self.path)
+        self.assertIsNone(cache.get(ProbeCache.make_key("1.1.1.1", 53, "udp")))
+        cache.put(ProbeCache.make_key("1.1.1.1", 53, "udp", b"query"), "open")
+        cache.close()
+        cache = ProbeCache(path=self.path)
+        self.assertEqual(cache.get(ProbeCache.make_key("1.1.1.1", 53, "udp", b"query")), "open")
+        self.assertIsNone(cache.get(ProbeCache.make_key("1.1.1.1", 53, "udp")))
+        cache.close()
+
+class TestTesterCache(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.tester.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+    def test_duplicate_targets_are_probed_once(self):
+        test_cases = [
+            {"name": "Allow", "dest_ip": "1.1.1.1", "dest_port": 80, "protocol": "tcp", "expected_result": "open"},
+            {"name": "Allow again", "dest_ip": "1.1.1.1", "dest_port": 80, "protocol": "tcp", "expected_result": "closed"},
+        ]
+        tester = FirewallRuleTester(test_cases, cache=ProbeCache())
+        with patch.object(tester, '_test_tcp_port', return_value="open") as mock_tcp_test:
+            results = tester.run_tests()
+
+        mock_tcp_test.assert_called_once()
+        self.assertEqual([r['cached'] for r in results], [False, True])
+        self.assertEqual([r['status'] for r in results], ["PASS", "FAIL"])
+
+
+if __name__ == '__main__':
+    unittest.main()
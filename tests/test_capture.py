@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from scapy.all import Ether, Dot1Q, IP, TCP, UDP, ICMP, IPerror, wrpcap
+from scapy.utils import PcapNgWriter
+
+from firewall_tester.config import REPLAY_PROBE_WINDOW
+from firewall_tester.capture import PcapWriter, CaptureReplay, load_capture, iter_packets
+from firewall_tester.responder import SimulatedTarget
+from firewall_tester.tester import FirewallRuleTester
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.capture.fw_logger', 'firewall_tester.tester.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "run.pcap")
+
+    def test_replay_of_a_recorded_run_gives_the_same_verdicts(self):
+        test_cases = [{"name": f"{host}:{port}/{protocol}", "dest_ip": host, "dest_port": port, "protocol": protocol,
+                       "expected_result": "open"}
+                      for host in ("10.0.0.1", "10.0.0.2") for port in range(20, 30) for protocol in ("tcp", "udp")]
+        target = SimulatedTarget(latency=0.001, seed=5)
+        with target.attach(), PcapWriter(self.path) as recorder:
+            live = FirewallRuleTester(test_cases, timeout=0.01, retries=1, recorder=recorder,
+                                      concurrency=8).run_tests()
+        self.assertEqual({result['actual_result'] for result in live}, {"open", "closed", "filtered", "open|filtered"})
+
+        with patch('firewall_tester.tester.sr1') as mock_sr1:
+            replayed = FirewallRuleTester(test_cases, ruleset=load_capture(self.path)).run_tests()
+        mock_sr1.assert_not_called()
+        self.assertEqual([result['actual_result'] for result in replayed],
+                         [result['actual_result'] for result in live])
+
+    def test_reads_third_party_pcap_and_pcapng(self):
+        syn = IP(src="192.168.1.2", dst="10.0.0.9") / TCP(sport=40000, dport=443, flags="S", seq=1000)
+        udp = IP(src="192.168.1.2", dst="10.0.0.9") / UDP(sport=40001, dport=161)
+        packets = [
+            Ether() / syn,
+            Ether() / IP(src="10.0.0.9", dst="192.168.1.2") / TCP(sport=443, dport=40000, flags="SA", ack=1001),
+            Ether() / Dot1Q(vlan=7) / udp,
+            Ether() / Dot1Q(vlan=7) / IP(src="10.0.0.9", dst="192.168.1.2") / ICMP(type=3, code=3)
+            / IPerror(bytes(udp)[:28]),
+        ]
+        wrpcap(self.path, packets)
+        replay = load_capture(self.path)
+        self.assertEqual(replay.packets, 4)
+        self.assertEqual(replay.verdict("10.0.0.9", 443, "tcp"), "open")
+        self.assertEqual(replay.verdict("10.0.0.9", 161, "udp"), "closed")
+        self.assertEqual(replay.verdict("10.0.0.9", 22, "tcp"), "error")  # Never probed
+
+        pcapng = self.path + "ng"
+        writer = PcapNgWriter(pcapng)
+        for packet in packets[:3]:
+            writer.write(packet)
+        writer.close()
+        replay = load_capture(pcapng)
+        self.assertEqual(replay.verdict("10.0.0.9", 443, "tcp"), "open")
+        self.assertEqual(replay.verdict("10.0.0.9", 161, "udp"), "open|filtered")
+
+    def test_only_datagrams_from_the_probing_host_are_udp_probes(self):
+        ours, target = "192.168.1.2", "10.0.0.9"
+        packets = [
+            IP(src=ours, dst=target) / UDP(sport=40001, dport=161),
+            IP(src="10.0.0.53", dst=ours) / UDP(sport=53, dport=40002),  # Unsolicited DNS answer
+            IP(src=target, dst=ours) / UDP(sport=123, dport=123),  # The target speaks first
+            IP(src=ours, dst=target) / UDP(sport=123, dport=123),
+            IP(src=target, dst=ours) / UDP(sport=161, dport=40001),
+        ]
+        with PcapWriter(self.path) as recorder:
+            for timestamp, packet in enumerate(packets):
+                recorder.write(bytes(packet), timestamp)
+        replay = load_capture(self.path)
+        self.assertEqual(replay.sources, {ours})
+        self.assertEqual(replay.verdict(target, 161, "udp"), "open")
+        self.assertEqual(replay.verdict(target, 123, "udp"), "open|filtered")
+        self.assertEqual(replay.verdict(ours, 40002, "udp"), "error")
+        self.assertEqual(replay.verdict(ours, 123, "udp"), "error")
+
+        # Sources given explicitly are not learned from the capture
+        self.assertEqual(load_capture(self.path, sources=["192.168.9.9"]).verdict(target, 161, "udp"), "error")
+
+    def test_probes_are_forgotten_after_the_reply_window(self):
+        syn = IP(src="192.168.1.2", dst="10.0.0.9") / TCP(sport=40000, dport=443, flags="S", seq=1000)
+        late = IP(src="10.0.0.9", dst="192.168.1.2") / TCP(sport=443, dport=40000, flags="SA", ack=1001)
+        with PcapWriter(self.path) as recorder:
+            recorder.write(bytes(syn), 100)
+            recorder.write(bytes(late), 100 + REPLAY_PROBE_WINDOW + 1)
+        self.assertEqual(load_capture(self.path).verdict("10.0.0.9", 443, "tcp"), "filtered")
+
+    def test_hostnames_are_not_resolved(self):
+        with PcapWriter(self.path) as recorder:
+            recorder.write(bytes(IP(src="192.168.1.2", dst="10.0.0.9") / UDP(sport=40001, dport=53)))
+        replay = load_capture(self.path)
+        with patch('socket.gethostbyname') as mock_resolve:
+            self.assertEqual(replay.verdict("dns.example", 53, "udp"), "error")
+        mock_resolve.assert_not_called()
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b"not a capture")
+        with self.assertRaises(ValueError):
+            CaptureReplay(self.path).load()
+
+        with PcapWriter(self.path) as recorder:
+            recorder.write(bytes(IP(dst="10.0.0.1") / UDP(dport=53)), 1.5)
+        with open(self.path, 'ab') as f:
+            f.write(b"\x00" * 7)
+        with self.assertRaises(ValueError):
+            list(iter_packets(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import errno
+import socket
+import time
+import unittest
+from unittest.mock import patch
+
+from firewall_tester.cli import pick_tcp_engine, pick_udp_engine
+from firewall_tester.connect_scanner import ConnectScanner
+from firewall_tester.tester import FirewallRuleTester
+from firewall_tester.timing import TimingTable
+
+def listener(backlog=8):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(backlog)
+    return sock
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+class TestConnectScanner(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.connect_scanner.fw_logger', 'firewall_tester.tester.fw_logger',
+                       'firewall_tester.cli.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+
+    def _listener(self, backlog=8):
+        sock = listener(backlog)
+        self.addCleanup(sock.close)
+        return sock.getsockname()[1]
+
+    def _closed_ports(self, count):
+        # Bound without listening: the ports stay distinct and refuse connections
+        ports = []
+        for _ in range(count):
+            sock = socket.socket()
+            sock.bind(("127.0.0.1", 0))
+            self.addCleanup(sock.close)
+            ports.append(sock.getsockname()[1])
+        return ports
+
+    def test_verdicts(self):
+        open_port = self._listener()
+        closed_port = unused_port()
+        timing = TimingTable(initial_timeout=0.3)
+        results = ConnectScanner(timeout=0.3, timing=timing).scan(
+            [("127.0.0.1", open_port), ("127.0.0.1", closed_port), ("host.invalid", 80)])
+
+        self.assertEqual(results, {("127.0.0.1", open_port): "open", ("127.0.0.1", closed_port): "closed",
+                                   ("host.invalid", 80): "error"})
+        self.assertEqual(timing.summary()[0]['replies'], 2)
+
+    def test_unanswered_connect_is_filtered_after_retries(self):
+        # Linux drops SYNs to a listener whose accept queue is full
+        port = self._listener(backlog=0)
+        fillers = []
+        for _ in range(3):
+            filler = socket.socket()
+            filler.setblocking(False)
+            filler.connect_ex(("127.0.0.1", port))
+            self.addCleanup(filler.close)
+            fillers.append(filler)
+        time.sleep(0.05)
+
+        scanner = ConnectScanner(timeout=0.1, retries=1)
+        with patch.object(scanner, '_connect', side_effect=scanner._connect) as connect:
+            results = scanner.scan([("127.0.0.1", port)])
+        self.assertEqual(results, {("127.0.0.1", port): "filtered"})
+        self.assertEqual(connect.call_count, 2)
+
+    def test_in_flight_limit(self):
+        ports = self._closed_ports(50)
+        results = ConnectScanner(timeout=0.3, max_in_flight=4).scan([("127.0.0.1", port) for port in ports])
+        self.assertEqual(set(results.values()), {"closed"})
+        self.assertEqual(len(results), 50)
+
+    def test_running_out_of_sockets_throttles_connects_for_a_while(self):
+        ports = self._closed_ports(40)
+        real_socket = socket.socket
+        created, peaks, failed = [], [], []
+
+        def socket_with_one_emfile(*args):
+            live = sum(sock.fileno() >= 0 for sock in created)
+            if len(created) == 2 and not failed:
+                failed.append(live)
+                raise OSError(errno.EMFILE, "Too many open files")
+            peaks.append(live + 1)
+            sock = real_socket(*args)
+            created.append(sock)
+            return sock
+
+        with patch('firewall_tester.connect_scanner.socket.socket', side_effect=socket_with_one_emfile):
+            results = ConnectScanner(timeout=0.3, max_in_flight=8).scan([("127.0.0.1", port) for port in ports])
+        self.assertEqual(set(results.values()), {"closed"})
+        self.assertEqual(len(results), 40)
+        self.assertEqual(failed, [2])
+        self.assertGreater(max(peaks[2:]), 3)  # The limit recovered after the transient EMFILE
+
+    def test_running_out_of_sockets_with_nothing_in_flight_is_an_error(self):
+        with patch('firewall_tester.connect_scanner.socket.socket', side_effect=OSError(errno.EMFILE, "Too many")):
+            results = ConnectScanner(timeout=0.3).scan([("127.0.0.1", 1), ("127.0.0.1", 2)])
+        self.assertEqual(results, {("127.0.0.1", 1): "error", ("127.0.0.1", 2): "error"})
+
+    def test_tester_runs_the_connect_engine(self):
+        open_port = self._listener()
+        test_cases = [{"name": "Open", "dest_ip": "127.0.0.1", "dest_port": open_port, "protocol": "tcp",
+                       "expected_result": "open"},
+                      {"name": "Closed", "dest_ip": "127.0.0.1", "dest_port": unused_port(), "protocol": "tcp",
+                       "expected_result": "closed"}]
+        with patch('firewall_tester.tester.sr1') as mock_sr1:
+            results = FirewallRuleTester(test_cases, tcp_engine="connect", timeout=0.3).run_tests()
+        mock_sr1.assert_not_called()
+        self.assertEqual([result["status"] for result in results], ["PASS", "PASS"])
+
+    def test_connect_engine_is_picked_without_raw_sockets(self):
+        with patch('firewall_tester.cli.raw_sockets_available', return_value=False):
+            self.assertEqual(pick_tcp_engine("sr1"), "connect")
+            self.assertEqual(pick_tcp_engine("batch"), "connect")
+        with patch('firewall_tester.cli.raw_sockets_available', return_value=True):
+            self.assertEqual(pick_tcp_engine("batch"), "batch")
+
+    def test_udp_is_skipped_without_raw_sockets(self):
+        with patch('firewall_tester.cli.raw_sockets_available', return_value=False):
+            udp_engine = pick_udp_engine("batch")
+        self.assertEqual(udp_engine, "skip")
+        test_cases = [{"name": "DNS", "dest_ip": "127.0.0.1", "dest_port": 53, "protocol": "udp",
+                       "expected_result": "open"}]
+        with patch('firewall_tester.tester.sr1') as mock_sr1:
+            results = FirewallRuleTester(test_cases, tcp_engine="connect", udp_engine=udp_engine).run_tests()
+        mock_sr1.assert_not_called()
+        self.assertEqual(results[0]["actual_result"], "skipped")
+
+if __name__ == '__main__':
+    unittest.main()
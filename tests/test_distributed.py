@@ -0,0 +1,178 @@
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from firewall_tester.distributed import Coordinator, parse_address, run_worker
+from firewall_tester.ruleset import parse_iptables_save
+from firewall_tester.tester import FirewallRuleTester
+
+RULESET = """
+*filter
+:INPUT DROP [0:0]
+-A INPUT -s 10.0.0.0/8 -p tcp -m tcp --dport 22 -j ACCEPT
+-A INPUT -p tcp -m tcp --dport 80 -j ACCEPT
+-A INPUT -p tcp -m tcp --dport 23 -j REJECT --reject-with tcp-reset
+COMMIT
+"""
+
+TEST_CASES = [
+    {"name": "SSH", "dest_ip": "192.0.2.0/28", "dest_port": 22, "protocol": "tcp", "expected_result": "open"},
+    {"name": "Bad port", "dest_ip": "192.0.2.1", "dest_port": 0, "protocol": "tcp", "expected_result": "open"},
+    {"name": "Web", "dest_ip": "192.0.2.0/29", "dest_port": "80,23", "protocol": "tcp", "expected_result": "open"},
+]
+
+def _serial(ruleset, vantage):
+    return [dict(result, vantage=vantage) for result in FirewallRuleTester(TEST_CASES, ruleset=ruleset).run_tests()]
+
+class TestDistributedRun(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.distributed.fw_logger', 'firewall_tester.tester.fw_logger',
+                       'firewall_tester.ruleset.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+        self.lan = parse_iptables_save(RULESET, source_ip="10.1.1.1")
+        self.wan = parse_iptables_save(RULESET, source_ip="203.0.113.1")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+
+    def start_worker(self, address, vantage, ruleset, token=None):
+        process = multiprocessing.Process(target=run_worker, args=(address, vantage),
+                                          kwargs={'ruleset': ruleset, 'token': token}, daemon=True)
+        process.start()
+        self.processes.append(process)
+
+    def test_every_vantage_point_runs_the_suite(self):
+        coordinator = Coordinator(TEST_CASES, "unix:" + os.path.join(self.tmpdir.name, "coordinator.sock"),
+                                  vantages=["lan", "wan"], chunk_size=4, window=3)
+        coordinator.start()
+        address = "unix:" + coordinator.address
+        for vantage, ruleset in [("lan", self.lan), ("lan", self.lan), ("wan", self.wan), ("wan", self.wan)]:
+            self.start_worker(address, vantage, ruleset)
+
+        results = coordinator.run_tests()
+
+        lan = [result for result in results if result['vantage'] == "lan"]
+        wan = [result for result in results if result['vantage'] == "wan"]
+        self.assertEqual(len(results), 2 * (16 + 1 + 16))
+        self.assertEqual(lan, _serial(self.lan, "lan"))
+        self.assertEqual(wan, _serial(self.wan, "wan"))
+        # The source-restricted SSH rule only opens from inside
+        self.assertEqual((lan[0]['actual_result'], wan[0]['actual_result']), ("open", "filtered"))
+
+    def test_workers_share_the_suite_without_vantage_points(self):
+        coordinator = Coordinator(TEST_CASES, "127.0.0.1:0", chunk_size=5)
+        coordinator.start()
+        address = "127.0.0.1:%d" % coordinator.address[1]
+        for vantage in ("a", "b", "c"):
+            self.start_worker(address, vantage, self.lan)
+
+        results = coordinator.run_tests()
+
+        self.assertEqual([dict(result, vantage=None) for result in results], _serial(self.lan, None))
+        self.assertTrue({result['vantage'] for result in results} <= {"a", "b", "c"})
+
+    @patch('firewall_tester.distributed._FINISH_TIMEOUT', 0.5)
+    def test_work_of_slow_and_lost_workers_is_rerun(self):
+        coordinator = Coordinator(TEST_CASES, "unix:" + os.path.join(self.tmpdir.name, "coordinator.sock"),
+                                  chunk_size=8, reissue_after=0.2)
+        coordinator.start()
+        results = []
+        runner = threading.Thread(target=lambda: results.extend(coordinator.run_tests()))
+        runner.start()
+
+        def take_chunk():
+            sock = socket.socket(socket.AF_UNIX)
+            sock.connect(coordinator.address)
+            sock.sendall(b'{"type":"hello","vantage":"x"}\n{"type":"request"}\n')
+            message = json.loads(sock.makefile('rb').readline())
+            self.assertEqual(message['type'], "chunk")
+            return sock
+
+        slow = take_chunk()            # Holds its work unit until the end
+        take_chunk().close()           # Disconnects with its work unit
+        self.start_worker("unix:" + coordinator.address, "x", self.lan)
+        runner.join(30)
+        slow.close()
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual([dict(result, vantage=None) for result in results], _serial(self.lan, None))
+
+    def test_unknown_vantage_point_is_rejected(self):
+        coordinator = Coordinator(TEST_CASES, "unix:" + os.path.join(self.tmpdir.name, "coordinator.sock"),
+                                  vantages=["lan"])
+        coordinator.start()
+        results = []
+        runner = threading.Thread(target=lambda: results.extend(coordinator.run_tests()))
+        runner.start()
+
+        with self.assertRaises(ConnectionError):
+            run_worker("unix:" + coordinator.address, "dmz")
+        self.start_worker("unix:" + coordinator.address, "lan", self.lan)
+        runner.join(30)
+
+        self.assertEqual(results, _serial(self.lan, "lan"))
+
+    def test_workers_sending_malformed_messages_are_dropped(self):
+        coordinator = Coordinator(TEST_CASES, "unix:" + os.path.join(self.tmpdir.name, "coordinator.sock"),
+                                  chunk_size=8)
+        coordinator.start()
+        results = []
+        runner = threading.Thread(target=lambda: results.extend(coordinator.run_tests()))
+        runner.start()
+
+        for messages in (b'[1, 2]\n',
+                         b'{"type":"hello"}\n{"type":"request","count":"2"}\n',
+                         b'{"type":"hello"}\n{"type":"request"}\n{"type":"results","chunk":0}\n',
+                         b'{"type":"hello"}\n{"type":"request"}\n{"type":"results","chunk":0,"outcomes":[{}]}\n'):
+            sock = socket.socket(socket.AF_UNIX)
+            sock.connect(coordinator.address)
+            sock.sendall(messages)
+            replies = [json.loads(line) for line in sock.makefile('rb')]
+            sock.close()
+            self.assertEqual(replies[-1]['type'], "error")
+            self.assertIn("malformed message", replies[-1]['message'])
+        self.start_worker("unix:" + coordinator.address, "x", self.lan)
+        runner.join(30)
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual([dict(result, vantage=None) for result in results], _serial(self.lan, None))
+
+    def test_workers_must_present_the_token(self):
+        coordinator = Coordinator(TEST_CASES, "127.0.0.1:0", token="s3cret")
+        coordinator.start()
+        address = "127.0.0.1:%d" % coordinator.address[1]
+        results = []
+        runner = threading.Thread(target=lambda: results.extend(coordinator.run_tests()))
+        runner.start()
+
+        for token in (None, "guess"):
+            with self.assertRaises(ConnectionError):
+                run_worker(address, "x", token=token)
+        self.start_worker(address, "x", self.lan, token="s3cret")
+        runner.join(30)
+
+        self.assertEqual([dict(result, vantage=None) for result in results], _serial(self.lan, None))
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("unix:/run/fw.sock"), (socket.AF_UNIX, "/run/fw.sock"))
+        self.assertEqual(parse_address(":7878"), (socket.AF_INET, ("", 7878)))
+        self.assertEqual(parse_address("[::1]:7878"), (socket.AF_INET6, ("::1", 7878)))
+        with self.assertRaises(ValueError):
+            parse_address("scanner.example.com")
+
+
+if __name__ == '__main__':
+    unittest.main()
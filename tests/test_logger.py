@@ -0,0 +1,105 @@
+import io
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from firewall_tester import logger
+from firewall_tester.logger import (JsonFormatter, set_probe_log_level, probe_logger, set_log_file, flush_logs,
+                                   set_console_stream)
+from firewall_tester.tester import FirewallRuleTester
+
+class TestQueuedLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        target = logger._BatchedStreamHandler(self.stream)
+        target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.handler = logger._QueueHandler([target])
+        self.log = logging.getLogger('firewall_tester_test')
+        self.log.propagate = False
+        self.log.addHandler(self.handler)
+        self.addCleanup(self.log.removeHandler, self.handler)
+
+    def test_records_are_written_by_the_writer_thread(self):
+        for i in range(2000):
+            self.log.warning("record %d", i)
+        self.handler.flush()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(lines[0], "WARNING record 0")
+        self.assertEqual(lines[-1], "WARNING record 1999")
+        self.assertEqual(len(lines), 2000)
+        self.assertEqual(self.handler.writer._thread.name, "log-writer")
+
+    def test_json_formatter_adds_extra_fields(self):
+        record = logging.LogRecord('firewall_tester.probe', logging.WARNING, __file__, 1, "[FAIL] %s", ("SSH",), None)
+        record.dest_port = 22
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual((entry['level'], entry['message'], entry['dest_port']), ("WARNING", "[FAIL] SSH", 22))
+        self.assertNotIn('args', entry)
+
+class TestLogFile(unittest.TestCase):
+
+    def test_records_go_to_the_file_set_last(self):
+        previous = logger._log_file()
+        self.addCleanup(set_log_file, previous)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'nested', 'run.log')
+            set_log_file(path)
+            self.assertEqual(logger.logging_settings()['log_file'], path)
+            logger.fw_logger.warning("[WARNING] moved")
+            flush_logs()
+            with open(path) as log_file:
+                self.assertIn("[WARNING] moved", log_file.read())
+            set_log_file(previous)
+
+    def test_console_output_can_move_to_stderr(self):
+        self.addCleanup(set_console_stream, 'stdout')
+        with patch('sys.stdout', io.StringIO()) as stdout, patch('sys.stderr', io.StringIO()) as stderr:
+            set_console_stream('stderr')
+            self.assertEqual(logger.logging_settings()['console'], 'stderr')
+            logger.fw_logger.info("[*] aside")
+            flush_logs()
+            set_console_stream('stdout')
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertIn("[*] aside", stderr.getvalue())
+
+class TestProbeLogLevel(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.tester.fw_logger').start()
+        self.handle = patch.object(logger.fw_logger.handlers[0], 'handle').start()
+        self.addCleanup(patch.stopall)
+        self.addCleanup(set_probe_log_level, 'auto')
+
+    def _run(self, count):
+        self.handle.reset_mock()
+        test_cases = [{"name": f"TCP {port}", "dest_ip": "1.1.1.1", "dest_port": port, "protocol": "tcp",
+                       "expected_result": "open"} for port in range(1, count + 1)]
+        tester = FirewallRuleTester(test_cases)
+        with patch.object(tester, '_test_tcp_port', side_effect=lambda ip, port: "open" if port % 2 else "closed"):
+            tester.run_tests()
+        return [call.args[0] for call in self.handle.call_args_list if call.args[0].name == probe_logger.name]
+
+    def test_levels(self):
+        set_probe_log_level('off')
+        self.assertEqual(self._run(10), [])
+
+        set_probe_log_level('warning')
+        records = self._run(10)
+        self.assertEqual(len(records), 5)
+        self.assertTrue(all(record.status == "FAIL" for record in records))
+
+        set_probe_log_level('info')
+        self.assertEqual(len(self._run(10)), 20)
+
+    @patch('firewall_tester.logger.PROBE_LOG_AUTO_LIMIT', 7)
+    def test_auto_stops_after_the_limit(self):
+        set_probe_log_level('auto')
+        self.assertEqual(len(self._run(10)), 7)
+        self.assertEqual(probe_logger.level, logger.LOG_OFF)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from unittest.mock import patch
+
+from firewall_tester.benchmark import generate_suite
+from firewall_tester.cli import write_report
+from firewall_tester.metrics import RunMetrics, MetricsExporter, format_prometheus, write_textfile
+from firewall_tester.profiling import SamplingProfiler, format_profile
+from firewall_tester.reporter import generate_report, get_report_writer
+from firewall_tester.responder import SimulatedTarget
+from firewall_tester.rules_parser import iter_test_cases
+from firewall_tester.ruleset import parse_iptables_save
+from firewall_tester.sharding import ShardedRuleTester
+from firewall_tester.tester import FirewallRuleTester
+
+RULESET = """
+*filter
+:INPUT DROP [0:0]
+-A INPUT -p tcp -m tcp --dport 80 -j ACCEPT
+COMMIT
+"""
+
+class TestRunMetrics(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.tester.fw_logger', 'firewall_tester.metrics.fw_logger',
+                       'firewall_tester.sharding.fw_logger', 'firewall_tester.ruleset.fw_logger',
+                       'firewall_tester.rules_parser.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+
+    def test_probe_engines_count_probes_replies_and_results(self):
+        for engine in ("sr1", "batch"):
+            target = SimulatedTarget(latency=0.001, loss=0.2, seed=3)
+            with target.attach():
+                tester = FirewallRuleTester(list(generate_suite(300)), tcp_engine=engine, concurrency=16,
+                                            timeout=0.05, retries=1)
+                outcomes = list(tester.iter_outcomes())
+            summary = tester.metrics.summary()
+
+            self.assertEqual(summary['probes_sent'], sum(summary['replies'].values()) + summary['timeouts'])
+            self.assertEqual(summary['probes_sent'], 300 + summary['retransmits'])
+            self.assertEqual(set(summary['replies']), {"syn-ack", "rst", "icmp-unreachable"})
+            self.assertEqual(sum(summary['tests'].values()), len(outcomes))
+            self.assertEqual(summary['verdicts']['open'], summary['replies']['syn-ack'])
+            self.assertGreater(summary['phases']['probe'], 0)
+            self.assertGreater(summary['queue_depth_max']['pending'], 1)
+            self.assertEqual(sum(row['probes'] for row in tester.timing.summary()), summary['probes_sent'])
+
+    def test_prometheus_histogram_is_cumulative(self):
+        metrics = RunMetrics(rtt_buckets=(0.001, 0.01))
+        for rtt in (0.0005, 0.005, 0.005, 2):
+            metrics.count_reply("rst", rtt)
+        text = format_prometheus(metrics.summary())
+        self.assertIn('firewall_tester_rtt_seconds_bucket{le="0.001"} 1', text)
+        self.assertIn('firewall_tester_rtt_seconds_bucket{le="0.01"} 3', text)
+        self.assertIn('firewall_tester_rtt_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('firewall_tester_rtt_seconds_count 4', text)
+        self.assertIn('firewall_tester_replies_total{type="rst"} 4', text)
+
+    def test_parse_and_validate_phases(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "cases.jsonl")
+            with open(path, 'w') as f:
+                for case in generate_suite(200):
+                    f.write(json.dumps(case) + "\n")
+                f.write('{"name": "broken"}\n')
+            metrics = RunMetrics()
+            self.assertEqual(len(list(iter_test_cases(path, metrics=metrics))), 200)
+        raw = metrics.summary()['raw_phases']
+        self.assertGreater(raw['parse'], 0)
+        self.assertGreater(raw['validate'], 0)
+
+    def test_shard_metrics_are_merged(self):
+        ruleset = parse_iptables_save(RULESET)
+        test_cases = [{"name": "Web", "dest_ip": "192.0.2.0/28", "dest_port": "80,81", "protocol": "tcp",
+                       "expected_result": "open"}]
+        tester = ShardedRuleTester(test_cases, 3, ruleset=ruleset)
+        tester.run_tests()
+        summary = tester.metrics.summary()
+        self.assertEqual(summary['tests'], {"PASS": 16, "FAIL": 16})
+        self.assertEqual(summary['verdicts'], {"open": 16, "filtered": 16})
+
+class TestMetricsExport(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.metrics.fw_logger').start()
+        self.addCleanup(patch.stopall)
+        self.metrics = RunMetrics()
+        self.metrics.count_probe()
+        self.metrics.count_reply("syn-ack", 0.002)
+        self.metrics.count_result("PASS", "open")
+
+    def test_http_endpoint_and_textfile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "fw.prom")
+            with MetricsExporter(self.metrics, textfile=path, port=0) as exporter:
+                base = f"http://127.0.0.1:{exporter.port}"
+                text = urllib.request.urlopen(base + "/metrics").read().decode()
+                summary = json.loads(urllib.request.urlopen(base + "/metrics.json").read())
+            self.assertIn("firewall_tester_probes_sent_total 1", text)
+            self.assertEqual(summary['tests'], {"PASS": 1})
+            with open(path) as f:
+                self.assertIn('firewall_tester_tests_total{status="PASS"} 1', f.read())
+            self.assertEqual(os.listdir(tmpdir), ["fw.prom"])
+
+    def test_textfile_replaces_atomically(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "fw.prom")
+            write_textfile(self.metrics.summary(), path)
+            self.metrics.count_probe(attempt=1)
+            write_textfile(self.metrics.summary(), path)
+            with open(path) as f:
+                self.assertIn("firewall_tester_retransmits_total 1", f.read())
+
+    def test_summary_embedded_in_reports(self):
+        summary = self.metrics.summary()
+        report = json.loads(generate_report([], "json", metrics=summary))
+        self.assertEqual(report['metrics']['probes_sent'], 1)
+        self.assertEqual(json.loads(generate_report([], "json")), [])
+        self.assertIn("[###] Run Metrics:", generate_report([], "console", metrics=summary))
+
+        stream = io.StringIO()
+        writer = get_report_writer('jsonl', stream)
+        writer.write_metrics(summary)
+        writer.close()
+        self.assertEqual(json.loads(stream.getvalue())['metrics']['replies'], {"syn-ack": 1})
+
+    @patch('firewall_tester.cli.fw_logger')
+    def test_report_with_embedded_metrics_is_rendered_once(self, _):
+        tester = FirewallRuleTester(list(generate_suite(20, hosts=2, ports=10)), ruleset=parse_iptables_save(RULESET))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "report.json")
+            with patch('firewall_tester.cli.generate_report', side_effect=generate_report) as render:
+                write_report(tester, "json", path, embed_metrics=True)
+            render.assert_called_once()
+            with open(path) as f:
+                self.assertEqual(sum(json.load(f)['metrics']['tests'].values()), 20)
+        self.assertIn('report', tester.metrics.summary()['phases'])
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_samples_every_thread(self):
+        stop = threading.Event()
+
+        def busy_worker():
+            while not stop.is_set():
+                sum(range(1000))
+
+        thread = threading.Thread(target=busy_worker, name="busy")
+        with SamplingProfiler(interval=0.001) as profiler:
+            thread.start()
+            time.sleep(0.2)
+            stop.set()
+            thread.join()
+
+        self.assertGreater(profiler.samples, 0)
+        self.assertTrue(any(stack[0] == "busy" for stack in profiler.stacks))
+        self.assertTrue(any(name.startswith("busy_worker") for name, _, _ in profiler.top(50)))
+        self.assertIn("busy_worker", "\n".join(format_profile(profiler, 50)))
+
+if __name__ == '__main__':
+    unittest.main()
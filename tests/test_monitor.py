@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from firewall_tester.monitor import FirewallMonitor
+from firewall_tester.responder import SimulatedTarget, SimulatedSynScanner, SimulatedUdpScanner
+from firewall_tester.rules_parser import validate_test_cases
+from firewall_tester.ruleset import parse_iptables_save
+from firewall_tester.tester import FirewallRuleTester
+
+RULESET = """
+*filter
+:INPUT DROP [0:0]
+-A INPUT -p tcp -m tcp --dport {port} -j ACCEPT
+COMMIT
+"""
+
+class TestFirewallMonitor(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.monitor.fw_logger', 'firewall_tester.tester.fw_logger',
+                       'firewall_tester.syn_scanner.fw_logger', 'firewall_tester.ruleset.fw_logger',
+                       'firewall_tester.rules_parser.fw_logger', 'firewall_tester.udp_scanner.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+
+    def test_probes_are_spread_over_the_interval_through_one_scanner(self):
+        test_cases = [{"name": f"Port {port}", "dest_ip": "192.0.2.1", "dest_port": port, "protocol": "tcp",
+                       "expected_result": "open"} for port in range(1, 21)]
+        start = patch.object(SimulatedSynScanner, '_start', autospec=True, side_effect=SimulatedSynScanner._start)
+        with SimulatedTarget(latency=0.001).attach(), start as opened:
+            tester = FirewallRuleTester(test_cases, tcp_engine="batch", timeout=0.05)
+            monitor = FirewallMonitor(tester, interval=0.5)
+            with patch.object(tester, 'probe_cases', side_effect=tester.probe_cases) as probe_cases:
+                monitor.run(duration=1.0)
+                batches = [len(call.args[0]) for call in probe_cases.call_args_list]
+
+        opened.assert_called_once()
+        self.assertGreaterEqual(monitor.probes, 35)
+        self.assertGreater(len(batches), 5)
+        self.assertLess(max(batches), 20)
+        self.assertEqual(tester.metrics.summary()['probes_sent'], monitor.probes)
+
+    def test_udp_probes_share_one_scanner(self):
+        test_cases = [{"name": f"Port {port}", "dest_ip": "192.0.2.1", "dest_port": port, "protocol": "udp",
+                       "expected_result": "open|filtered"} for port in range(1, 11)]
+        start = patch.object(SimulatedUdpScanner, '_start', autospec=True, side_effect=SimulatedUdpScanner._start)
+        with SimulatedTarget(latency=0.001).attach(), start as opened:
+            tester = FirewallRuleTester(test_cases, udp_engine="batch", timeout=0.05)
+            monitor = FirewallMonitor(tester, interval=0.5)
+            monitor.run(duration=1.0)
+
+        opened.assert_called_once()
+        self.assertGreaterEqual(monitor.probes, 15)
+        self.assertIsNone(tester._udp_scanner)
+
+    def test_verdict_changes_raise_alerts(self):
+        test_cases = [{"name": "Web", "dest_ip": "192.0.2.1", "dest_port": 80, "protocol": "tcp",
+                       "expected_result": "open"},
+                      {"name": "SSH", "dest_ip": "192.0.2.1", "dest_port": 22, "protocol": "tcp",
+                       "expected_result": "filtered"}]
+        tester = FirewallRuleTester(test_cases, ruleset=parse_iptables_save(RULESET.format(port=80)))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            monitor = FirewallMonitor(tester, interval=60, alert_dir=tmpdir)
+            monitor._probe([0, 1])
+            monitor._probe([0, 1])
+            self.assertEqual(os.listdir(tmpdir), [])
+
+            tester.ruleset = parse_iptables_save(RULESET.format(port=443))
+            monitor._probe([0, 1])
+            self.assertEqual(monitor.alerts, 1)
+            [name] = os.listdir(tmpdir)
+            with open(os.path.join(tmpdir, name)) as f:
+                event = json.load(f)
+        self.assertEqual((event['name'], event['previous_result'], event['actual_result'], event['status']),
+                         ("Web", "open", "filtered", "FAIL"))
+
+    def test_priorities(self):
+        test_cases = [{"name": name, "dest_ip": "192.0.2.1", "dest_port": 80, "protocol": "tcp",
+                       "expected_result": "open", "priority": name} for name in ("high", "normal", "low")]
+        monitor = FirewallMonitor(FirewallRuleTester(test_cases), interval=100)
+        self.assertEqual([monitor._period(test_case) for test_case in test_cases], [25, 100, 400])
+        self.assertTrue(validate_test_cases(test_cases))
+        self.assertFalse(validate_test_cases([dict(test_cases[0], priority="urgent")]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from scapy.all import IP, UDP, Raw, DNS, NTP, SNMP, ISAKMP
+
+from firewall_tester.cache import ProbeCache
+from firewall_tester.payloads import PayloadLibrary, UDP_PAYLOADS, decode_payload, payload_digest
+from firewall_tester.rawpacket import payload_word_sum
+from firewall_tester.rules_parser import validate_test_cases
+from firewall_tester.tester import FirewallRuleTester
+
+def make_case(**fields):
+    return dict({"name": "DNS", "dest_ip": "192.0.2.1", "dest_port": 53, "protocol": "udp",
+                 "expected_result": "open"}, **fields)
+
+class TestPayloadLibrary(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.tester.fw_logger', 'firewall_tester.rules_parser.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+
+    def test_payloads_are_valid_requests(self):
+        self.assertEqual(DNS(UDP_PAYLOADS[53]).qdcount, 1)
+        self.assertEqual(NTP(UDP_PAYLOADS[123]).mode, 3)
+        self.assertEqual(SNMP(UDP_PAYLOADS[161]).community.val, b"public")
+        self.assertEqual(ISAKMP(UDP_PAYLOADS[500]).length, len(UDP_PAYLOADS[500]))
+        self.assertEqual(len(UDP_PAYLOADS[443]), 1200)
+
+    def test_lookup_and_overrides(self):
+        library = PayloadLibrary()
+        payload, word_sum = library.get(123)
+        self.assertEqual(payload, UDP_PAYLOADS[123])
+        self.assertEqual(word_sum, payload_word_sum(payload))
+        self.assertEqual(library.get(40000), (b'', 0))
+
+        override = make_case(payload_hex="de ad be ef")
+        self.assertEqual(library.get(53, override)[0], b"\xde\xad\xbe\xef")
+        # Decoded once per distinct override
+        self.assertIs(library.get(53, override), library.get(53, dict(override, name="Other")))
+        self.assertEqual(library.get(53, make_case(payload=""))[0], b"")
+
+        disabled = PayloadLibrary(enabled=False)
+        self.assertEqual(disabled.get(53), (b'', 0))
+        self.assertEqual(disabled.get(53, make_case(payload="hello"))[0], b"hello")
+
+    def test_validation(self):
+        self.assertTrue(validate_test_cases([make_case(payload="ping"), make_case(payload_hex="00ff")]))
+        self.assertFalse(validate_test_cases([make_case(payload_hex="xyz")]))
+        self.assertFalse(validate_test_cases([make_case(payload="a", payload_hex="00")]))
+        self.assertFalse(validate_test_cases([make_case(payload=5)]))
+        self.assertFalse(validate_test_cases([make_case(protocol="tcp", payload="a")]))
+        with self.assertRaises(ValueError):
+            decode_payload(make_case(payload_hex="0"))
+
+    @patch('firewall_tester.tester.sr1')
+    def test_probe_carries_the_payload(self, mock_sr1):
+        mock_sr1.side_effect = lambda packet, **kwargs: IP(src=packet[IP].dst) / UDP(sport=packet[UDP].dport)
+        tester = FirewallRuleTester([make_case(), make_case(name="Custom", dest_port=9999, payload_hex="0102")],
+                                    timeout=0.1)
+        results = tester.run_tests()
+
+        self.assertEqual([result['actual_result'] for result in results], ["open", "open"])
+        sent = [call.args[0] for call in mock_sr1.call_args_list]
+        self.assertEqual(sent[0][Raw].load, UDP_PAYLOADS[53])
+        self.assertEqual(sent[1][Raw].load, b"\x01\x02")
+
+        mock_sr1.reset_mock()
+        FirewallRuleTester([make_case()], timeout=0.1, udp_payloads=False).run_tests()
+        self.assertFalse(mock_sr1.call_args.args[0].haslayer(Raw))
+
+    @patch('firewall_tester.tester.sr1')
+    def test_cached_verdicts_are_kept_per_payload(self, mock_sr1):
+        mock_sr1.return_value = None
+        test_cases = [make_case(name="Empty", dest_port=9999), make_case(name="Hello", dest_port=9999, payload="hello"),
+                      make_case(name="Hello again", dest_port=9999, payload="hello")]
+        results = FirewallRuleTester(test_cases, timeout=0.1, cache=ProbeCache()).run_tests()
+
+        self.assertEqual([result['cached'] for result in results], [False, False, True])
+        sent = [call.args[0] for call in mock_sr1.call_args_list]
+        self.assertEqual([packet[Raw].load if packet.haslayer(Raw) else b'' for packet in sent], [b'', b'hello'])
+
+    def test_batch_scans_each_payload_of_a_target(self):
+        test_cases = [make_case(name="Empty", dest_port=9999), make_case(name="Hello", dest_port=9999, payload="hello"),
+                      make_case(name="DNS")]
+        tester = FirewallRuleTester(test_cases, udp_engine="batch", cache=ProbeCache())
+        scanner = MagicMock()
+        scanner.scan.side_effect = [{("192.0.2.1", 9999): "closed", ("192.0.2.1", 53): "open"},
+                                    {("192.0.2.1", 9999): "open"}]
+        with patch.object(tester, '_new_udp_scanner', return_value=scanner):
+            results = tester.run_tests()
+
+        self.assertEqual([result['actual_result'] for result in results], ["closed", "open", "open"])
+        self.assertEqual([call.args[1][("192.0.2.1", 9999)][0] for call in scanner.scan.call_args_list],
+                         [b'', b'hello'])
+        self.assertEqual(tester.cache.get(ProbeCache.make_key("192.0.2.1", 9999, "udp", b'hello')), "open")
+        self.assertEqual(payload_digest(b''), '')
+
+if __name__ == '__main__':
+    unittest.main()
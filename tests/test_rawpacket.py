@@ -0,0 +1,98 @@
+import socket
+import unittest
+from unittest.mock import patch, MagicMock
+
+from scapy.all import IP, TCP, UDP, ICMP, IPerror, TCPerror, raw
+
+from firewall_tester.rawpacket import TcpTemplate, UdpTemplate, TCP_SYN, TCP_RST, checksum, parse_reply
+from firewall_tester.syn_scanner import RawSynScanner
+from firewall_tester.tester import FirewallRuleTester
+
+class TestPacketTemplates(unittest.TestCase):
+
+    def test_tcp_template_matches_scapy(self):
+        # scapy is the reference implementation for every header field and checksum
+        template = TcpTemplate("10.0.0.1", 40000, TCP_SYN)
+        for dst, dport, seq in [("10.0.0.2", 80, 0), ("192.168.1.254", 65535, 0xFFFFFFFF), ("8.8.8.8", 1, 123456789)]:
+            expected = raw(IP(src="10.0.0.1", dst=dst) / TCP(sport=40000, dport=dport, flags="S", seq=seq))
+            self.assertEqual(bytes(template.build(socket.inet_aton(dst), dport, seq)), expected)
+
+        rst = TcpTemplate("10.0.0.1", 40000, TCP_RST)
+        expected = raw(IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=40000, dport=443, flags="R", seq=42))
+        self.assertEqual(bytes(rst.build(socket.inet_aton("10.0.0.2"), 443, 42)), expected)
+
+    def test_udp_template_matches_scapy(self):
+        template = UdpTemplate("10.0.0.1", 53000)
+        for payload in (b'', b'\x00\x01abc', b'odd'):
+            expected = raw(IP(src="10.0.0.1", dst="10.0.0.9") / UDP(sport=53000, dport=161) / payload)
+            self.assertEqual(bytes(template.build(socket.inet_aton("10.0.0.9"), 161, payload)), expected)
+
+    def test_checksum_of_valid_header_is_zero(self):
+        self.assertEqual(checksum(raw(IP(src="10.0.0.1", dst="10.0.0.2"))[:20]), 0)
+
+    def test_parse_reply(self):
+        self.assertEqual(
+            parse_reply(memoryview(raw(IP(src="1.1.1.1") / TCP(sport=80, dport=4000, flags="SA", ack=11)))),
+            ('tcp', "1.1.1.1", 80, 4000, 11, 0x12))
+        self.assertEqual(parse_reply(raw(IP(src="1.1.1.1") / UDP(sport=53, dport=4000))), ('udp', "1.1.1.1", 53, 4000))
+        icmp = raw(IP(src="9.9.9.9") / ICMP(type=3, code=13) /
+                   IPerror(src="10.0.0.1", dst="1.1.1.1") / TCPerror(sport=4000, dport=443, seq=7))
+        self.assertEqual(parse_reply(icmp), ('icmp', "9.9.9.9", 3, 13, "1.1.1.1", 6, 4000, 443, 7))
+        self.assertIsNone(parse_reply(b'\x60' + b'\x00' * 39))
+
+class TestRawSynScanner(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.syn_scanner.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+        self.scanner = RawSynScanner(timeout=0.2)
+        self.scanner._sock = MagicMock()
+        self.scanner._packed["1.1.1.1"] = (socket.inet_aton("1.1.1.1"),
+                                           TcpTemplate("10.0.0.1", self.scanner.sport, TCP_SYN),
+                                           TcpTemplate("10.0.0.1", self.scanner.sport, TCP_RST))
+
+    def test_raw_reply_classification(self):
+        sport = self.scanner.sport
+        seq_open = self.scanner._register_probe("1.1.1.1", 80)
+        seq_closed = self.scanner._register_probe("1.1.1.1", 22)
+        seq_icmp = self.scanner._register_probe("1.1.1.1", 443)
+
+        self.scanner._handle_raw(raw(IP(src="1.1.1.1") / TCP(sport=80, dport=sport, flags="SA", ack=seq_open + 1)), 1.0)
+        self.scanner._handle_raw(raw(IP(src="1.1.1.1") / TCP(sport=22, dport=sport, flags="RA", ack=seq_closed + 1)), 1.0)
+        self.scanner._handle_raw(raw(IP(src="9.9.9.9") / ICMP(type=3, code=13) /
+                                     IPerror(dst="1.1.1.1") / TCPerror(sport=sport, dport=443, seq=seq_icmp)), 1.0)
+
+        self.assertEqual(self.scanner._verdicts,
+                         {("1.1.1.1", 80): "open", ("1.1.1.1", 22): "closed", ("1.1.1.1", 443): "filtered"})
+        # The RST for the open port is built from the template
+        packet = IP(bytes(self.scanner._sock.sendto.call_args[0][0]))
+        self.assertEqual((packet[TCP].dport, str(packet[TCP].flags), packet[TCP].seq), (80, "R", seq_open + 1))
+
+    def test_other_traffic_is_ignored(self):
+        seq = self.scanner._register_probe("1.1.1.1", 80)
+        # Wrong destination port, then a bare SYN without ACK
+        self.scanner._handle_raw(raw(IP(src="1.1.1.1") / TCP(sport=80, dport=1, flags="SA", ack=seq + 1)), 1.0)
+        self.scanner._handle_raw(raw(IP(src="1.1.1.1") / TCP(sport=80, dport=self.scanner.sport, flags="S", ack=seq + 1)), 1.0)
+        self.assertEqual(self.scanner._verdicts, {})
+
+    @patch('firewall_tester.tester.BatchSynScanner')
+    @patch('firewall_tester.tester.RawSynScanner')
+    def test_tester_prefers_fast_path(self, mock_raw_cls, mock_batch_cls):
+        patch('firewall_tester.tester.fw_logger').start()
+        mock_raw_cls.return_value.scan.return_value = {}
+        mock_batch_cls.return_value.scan.return_value = {}
+        case = [{"name": "t", "dest_ip": "1.1.1.1", "dest_port": 80, "protocol": "tcp", "expected_result": "open"}]
+
+        mock_raw_cls.available.return_value = True
+        FirewallRuleTester(case, tcp_engine="batch", fast_path=True)._batch_scan_tcp(case)
+        mock_raw_cls.return_value.scan.assert_called_once()
+
+        # Falls back to scapy without raw socket support
+        mock_raw_cls.available.return_value = False
+        FirewallRuleTester(case, tcp_engine="batch", fast_path=True)._batch_scan_tcp(case)
+        mock_batch_cls.return_value.scan.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
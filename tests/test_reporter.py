@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import unittest
+import xml.etree.ElementTree as ET
+from unittest.mock import patch
+
+from firewall_tester import results
+from firewall_tester.reporter import generate_report, get_report_writer
+from firewall_tester.tester import FirewallRuleTester
+
+def make_results():
+    return [
+        results.TestResult("Web", "1.1.1.1", 80, "tcp", "open", "open", "PASS"),
+        results.TestResult("SSH", "1.1.1.1", 22, "tcp", "filtered", "open", "FAIL"),
+        results.TestResult("GRE", "1.1.1.1", 0, "gre", "filtered", "skipped", "FAIL"),
+    ]
+
+class TestResultRecords(unittest.TestCase):
+
+    def test_result_is_compact(self):
+        result = make_results()[0]
+        self.assertFalse(hasattr(result, '__dict__'))
+        self.assertEqual(result.to_dict(), {
+            "name": "Web", "dest_ip": "1.1.1.1", "dest_port": 80, "protocol": "tcp",
+            "expected_result": "open", "actual_result": "open", "status": "PASS", "cached": False})
+
+    def test_tally(self):
+        tally = results.ResultTally()
+        for result in make_results():
+            tally.add(result)
+        self.assertEqual((tally.total, tally.passed, tally.failed, tally.skipped), (3, 1, 2, 1))
+
+class TestReportWriters(unittest.TestCase):
+
+    def _write(self, output_format):
+        stream = io.StringIO()
+        writer = get_report_writer(output_format, stream)
+        for result in make_results():
+            writer.write(result)
+        writer.close()
+        self.assertEqual(writer.tally.failed, 2)
+        return stream.getvalue()
+
+    def test_jsonl(self):
+        lines = self._write('jsonl').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[1])['status'], "FAIL")
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self._write('csv'))))
+        self.assertEqual([row['name'] for row in rows], ["Web", "SSH", "GRE"])
+        self.assertEqual(rows[0]['dest_port'], "80")
+
+    def test_junit(self):
+        suite = ET.fromstring(self._write('junit')).find('testsuite')
+        cases = suite.findall('testcase')
+        self.assertEqual(len(cases), 3)
+        self.assertIsNone(cases[0].find('failure'))
+        self.assertIn("Got 'open'", cases[1].find('failure').get('message'))
+        self.assertIsNotNone(cases[2].find('skipped'))
+
+    def test_console_report_accepts_records(self):
+        report = generate_report(make_results(), "console")
+        self.assertIn("Total test cases run: 3", report)
+        self.assertIn("Failed: 2", report)
+        self.assertIn("Reason: Unsupported protocol 'gre'.", report)
+
+    def test_vantage_points(self):
+        tagged = [dict(result.to_dict(), vantage=vantage)
+                  for vantage in ("dmz", "lan") for result in make_results()[:2]]
+        report = generate_report(tagged, "console")
+        self.assertIn("  - dmz: 2 run, 1 passed, 1 failed, 0 skipped", report)
+        self.assertIn("    Vantage point: lan", report)
+
+        stream = io.StringIO()
+        writer = get_report_writer('csv', stream, results.RESULT_FIELDS + ('vantage',))
+        for result in tagged:
+            writer.write(result)
+        self.assertEqual([row['vantage'] for row in csv.DictReader(io.StringIO(stream.getvalue()))],
+                         ["dmz", "dmz", "lan", "lan"])
+        self.assertEqual(writer.vantage_tallies['lan'].passed, 1)
+
+class TestIterResults(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.tester.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+    def test_iter_results_streams_records(self):
+        for concurrency in (1, 8):
+            test_cases = ({"name": f"TCP {port}", "dest_ip": "1.1.1.1", "dest_port": port, "protocol": "tcp",
+                           "expected_result": "closed"} for port in range(1, 101))
+            tester = FirewallRuleTester(test_cases, concurrency=concurrency)
+            with patch.object(tester, '_test_tcp_port', return_value="closed"):
+                stream = tester.iter_results()
+                first = next(stream)
+                self.assertIsInstance(first, results.TestResult)
+                self.assertEqual([first.dest_port] + [r.dest_port for r in stream], list(range(1, 101)))
+            # Nothing is accumulated on the tester
+            self.assertEqual(tester.results, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from firewall_tester.metrics import RunMetrics, format_prometheus
+from firewall_tester.routes import RouteCache, _RouteEntry
+from firewall_tester.tester import FirewallRuleTester
+
+def _entry(network, prefix_len, oif=None, gateway=None, prefsrc=None, metric=0):
+    value = sum(int(part) << shift for part, shift in zip(network.split('.'), (24, 16, 8, 0)))
+    return _RouteEntry(value, prefix_len, metric, oif, gateway, prefsrc)
+
+TABLES = {
+    254: [_entry("0.0.0.0", 0, gateway="192.0.2.1", prefsrc="192.0.2.2"),
+          _entry("10.1.0.0", 16, prefsrc="10.1.0.5"),
+          _entry("10.1.0.0", 16, prefsrc="10.1.0.9", metric=100),
+          _entry("10.1.2.0", 24, gateway="10.1.0.1", prefsrc="10.1.0.5")],
+    255: [_entry("10.1.0.5", 32, prefsrc="10.1.0.5")],
+}
+
+class TestRouteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_logger = patch('firewall_tester.routes.fw_logger').start()
+        self.mock_read = patch('firewall_tester.routes.read_routes', return_value=TABLES).start()
+        patch('firewall_tester.routes._watch_routes', return_value=None).start()
+        self.mock_source = patch('firewall_tester.routes.source_address_for', return_value="172.16.0.2").start()
+        self.addCleanup(patch.stopall)
+        self.metrics = RunMetrics()
+        self.routes = RouteCache(metrics=self.metrics)
+
+    def test_destinations_share_their_longest_prefix_entry(self):
+        self.assertEqual(self.routes.lookup("10.1.7.7").prefix, "10.1.0.0/16")
+        self.assertEqual(self.routes.source_for("10.1.9.9"), "10.1.0.5")  # Lowest metric wins
+        self.assertEqual(self.routes.next_hop("10.1.9.9"), "10.1.9.9")  # On-link
+        self.assertEqual(self.routes.next_hop("10.1.2.3"), "10.1.0.1")
+        self.assertEqual(self.routes.lookup("10.1.0.5").prefix, "10.1.0.5/32")  # Local table first
+        self.assertEqual(self.routes.next_hop("8.8.8.8"), "192.0.2.1")
+        self.assertEqual(self.routes.source_for("8.8.4.4"), "192.0.2.2")
+        self.assertIsNone(self.routes.lookup("example.com"))
+
+        self.assertEqual(self.routes.summary(), {'hits': 3, 'misses': 4, 'invalidations': 0, 'entries': 4})
+        self.mock_read.assert_called_once()
+        self.mock_source.assert_not_called()
+        self.assertEqual(self.metrics.summary()['route_cache'], {'hits': 3, 'misses': 4, 'invalidations': 0})
+
+    def test_invalidate_reloads_the_routing_table(self):
+        self.routes.source_for("8.8.8.8")
+        self.routes.invalidate()
+        self.mock_read.return_value = {254: [_entry("0.0.0.0", 0, gateway="192.0.2.1", prefsrc="192.0.2.3")]}
+        self.assertEqual(self.routes.source_for("8.8.8.8"), "192.0.2.3")
+        self.assertEqual(self.routes.summary(), {'hits': 0, 'misses': 2, 'invalidations': 1, 'entries': 1})
+        self.assertIn('firewall_tester_route_cache_invalidations_total 1', format_prometheus(self.metrics.summary()))
+
+    def test_entries_expire_where_changes_cannot_be_watched(self):
+        routes = RouteCache(check_interval=0, ttl=0)
+        routes.lookup("8.8.8.8")
+        routes.lookup("8.8.8.8")
+        self.assertEqual(routes.summary()['invalidations'], 2)
+        self.assertEqual(self.mock_read.call_count, 2)
+
+    def test_caches_per_destination_without_rtnetlink(self):
+        self.mock_read.side_effect = OSError("unsupported")
+        self.assertEqual(self.routes.source_for("10.0.0.1"), "172.16.0.2")
+        self.assertEqual(self.routes.source_for("10.0.0.1"), "172.16.0.2")
+        self.assertEqual(self.routes.lookup("10.0.0.2").prefix, "10.0.0.2/32")
+        self.assertEqual(self.routes.summary(), {'hits': 1, 'misses': 2, 'invalidations': 0, 'entries': 2})
+        self.mock_read.assert_called_once()
+        self.mock_logger.warning.assert_called_once()
+
+    def test_interface_option_overrides_the_route(self):
+        routes = RouteCache(iface="eth9")
+        self.assertEqual(routes.iface_for("8.8.8.8"), "eth9")
+        self.assertEqual(routes.source_for("8.8.8.8"), "172.16.0.2")
+        self.mock_source.assert_called_once_with("8.8.8.8", "eth9")
+
+    @patch('firewall_tester.tester.fw_logger')
+    def test_tester_close_stops_watching_routes(self, _):
+        watch = MagicMock()
+        with patch('firewall_tester.routes._watch_routes', return_value=watch), FirewallRuleTester([]) as tester:
+            tester.routes.source_for("8.8.8.8")
+            watch.close.assert_not_called()
+        watch.close.assert_called_once()
+        self.assertIsNone(tester.routes._watch)
+
+if __name__ == '__main__':
+    unittest.main()
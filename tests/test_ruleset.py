@@ -0,0 +1,195 @@
+import random
+import socket
+import unittest
+from unittest.mock import patch
+
+from firewall_tester.ruleset import parse_iptables_save, parse_nft_ruleset
+from firewall_tester.tester import FirewallRuleTester
+
+IPTABLES_SAVE = """
+# Generated by iptables-save
+*nat
+:PREROUTING ACCEPT [0:0]
+-A PREROUTING -p tcp --dport 8080 -j REDIRECT --to-ports 80
+COMMIT
+*filter
+:INPUT DROP [0:0]
+:FORWARD DROP [0:0]
+:OUTPUT ACCEPT [0:0]
+:WEB - [0:0]
+-A INPUT -i lo -j ACCEPT
+-A INPUT -m conntrack --ctstate RELATED,ESTABLISHED -j ACCEPT
+-A INPUT -s 10.0.0.0/8 -p tcp -m tcp --dport 22 -m comment --comment "ssh from lan" -j ACCEPT
+-A INPUT -p tcp -m tcp --dport 23 -j REJECT --reject-with tcp-reset
+-A INPUT -p tcp -m multiport --dports 80,443 -j WEB
+-A INPUT -p udp -m udp --dport 53 -j ACCEPT
+-A INPUT -p udp -m udp --dport 161 -j REJECT
+-A INPUT -p tcp -m tcp --dport 3000:3999 -j LOG --log-prefix "dev "
+-A INPUT ! -d 192.168.1.10/32 -p tcp -m tcp --dport 3000:3999 -j ACCEPT
+-A INPUT -j REJECT --reject-with icmp-host-prohibited
+-A WEB -d 192.168.1.0/24 -j RETURN
+-A WEB -j ACCEPT
+COMMIT
+"""
+
+NFT_RULESET = """
+table inet filter {
+	set lan_hosts {
+		type ipv4_addr
+		flags interval
+		elements = { 192.168.1.0/24,
+			     10.0.0.1-10.0.0.9 }
+	}
+
+	chain input {
+		type filter hook input priority filter; policy drop;
+		ct state established,related accept
+		iif "lo" accept
+		tcp dport { 22, 80, 443 } accept comment "public"
+		ip daddr @lan_hosts tcp dport 8000-8080 accept
+		udp dport 53 counter packets 0 bytes 0 accept
+		tcp dport 23 reject with tcp reset
+		udp dport 161 reject
+		tcp flags & (fin|syn|rst|ack) == syn tcp dport 9000 jump dev
+		meta l4proto tcp reject with icmpx type admin-prohibited
+	}
+
+	chain dev {
+		ip daddr != 192.168.1.10 accept
+	}
+}
+table ip raw {
+	chain prerouting {
+		type filter hook prerouting priority raw; policy accept;
+	}
+}
+table ip6 filter6 {
+	chain input {
+		type filter hook input priority 0; policy drop;
+	}
+}
+"""
+
+class TestIptablesRuleset(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.ruleset.fw_logger').start()
+        self.addCleanup(patch.stopall)
+        self.ruleset = parse_iptables_save(IPTABLES_SAVE)
+
+    def test_verdicts(self):
+        expected = {
+            ("1.2.3.4", 22, "tcp"): "filtered",         # Source restricted to the LAN
+            ("1.2.3.4", 23, "tcp"): "closed",           # tcp-reset
+            ("1.2.3.4", 80, "tcp"): "open",             # Accepted in the WEB chain
+            ("192.168.1.5", 80, "tcp"): "filtered",     # RETURN, then the final REJECT
+            ("1.2.3.4", 53, "udp"): "open|filtered",
+            ("1.2.3.4", 161, "udp"): "closed",          # Default icmp-port-unreachable
+            ("1.2.3.4", 162, "udp"): "open|filtered",   # icmp-host-prohibited
+            ("1.2.3.4", 3500, "tcp"): "open",           # LOG does not end the traversal
+            ("192.168.1.10", 3500, "tcp"): "filtered",
+        }
+        for (dest_ip, dest_port, protocol), verdict in expected.items():
+            self.assertEqual(self.ruleset.verdict(dest_ip, dest_port, protocol), verdict,
+                             f"{dest_ip}:{dest_port}/{protocol}")
+
+    def test_source_address_enables_source_rules(self):
+        ruleset = parse_iptables_save(IPTABLES_SAVE, source_ip="10.1.1.1")
+        self.assertEqual(ruleset.verdict("1.2.3.4", 22, "tcp"), "open")
+
+    def test_unknown_chain(self):
+        with self.assertRaises(ValueError):
+            parse_iptables_save(IPTABLES_SAVE, chain="NOPE")
+
+    def test_unresolvable_destination(self):
+        self.assertEqual(self.ruleset.verdict("no-such-host.invalid", 80, "tcp"), "error")
+
+class TestNftRuleset(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.ruleset.fw_logger').start()
+        self.addCleanup(patch.stopall)
+        self.ruleset = parse_nft_ruleset(NFT_RULESET)
+
+    def test_verdicts(self):
+        expected = {
+            ("1.2.3.4", 22, "tcp"): "open",
+            ("1.2.3.4", 23, "tcp"): "closed",
+            ("192.168.1.5", 8000, "tcp"): "open",       # Named interval set
+            ("10.0.0.5", 8080, "tcp"): "open",
+            ("10.0.0.10", 8080, "tcp"): "filtered",     # Outside the set: admin-prohibited
+            ("1.2.3.4", 53, "udp"): "open|filtered",
+            ("1.2.3.4", 161, "udp"): "closed",
+            ("1.2.3.4", 9000, "tcp"): "open",           # SYN matches the flags test, then jumps
+            ("192.168.1.10", 9000, "tcp"): "filtered",  # dev returns, falls through to reject
+        }
+        for (dest_ip, dest_port, protocol), verdict in expected.items():
+            self.assertEqual(self.ruleset.verdict(dest_ip, dest_port, protocol), verdict,
+                             f"{dest_ip}:{dest_port}/{protocol}")
+
+    def test_only_ipv4_input_hook_chains_are_entered(self):
+        self.assertEqual([chain.name for chain in self.ruleset.entry_chains], ["input"])
+
+class TestIndexedMatcher(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.ruleset.fw_logger').start()
+        # Small blocks so the two-level index spans many blocks
+        patch('firewall_tester.ruleset.RULE_BLOCK_SIZE', 4).start()
+        self.addCleanup(patch.stopall)
+
+    def test_index_matches_linear_scan(self):
+        rng = random.Random(7)
+        lines = ["*filter", ":INPUT DROP [0:0]"]
+        for _ in range(300):
+            parts = ["-A INPUT"]
+            if rng.random() < 0.7:
+                parts.append(f"{'! ' if rng.random() < 0.1 else ''}-d 10.0.{rng.randint(0, 3)}.{rng.randint(0, 255)}/"
+                             f"{rng.choice([24, 28, 32])}")
+            parts.append(f"-p {rng.choice(['tcp', 'udp'])}")
+            if rng.random() < 0.8:
+                first = rng.randint(1, 100)
+                parts.append(f"--dport {first}:{first + rng.randint(0, 20)}")
+            parts.append(f"-j {rng.choice(['ACCEPT', 'DROP', 'REJECT'])}")
+            lines.append(" ".join(parts))
+        ruleset = parse_iptables_save("\n".join(lines + ["COMMIT"]))
+        chain = ruleset.entry_chains[0]
+
+        def linear_first_match(address, port, protocol):
+            for position, rule in enumerate(chain.rules):
+                if protocol in rule.protocols \
+                        and (rule.dst is None or any(first <= address <= last for first, last in rule.dst)) \
+                        and (rule.dports is None or any(first <= port <= last for first, last in rule.dports)):
+                    return position
+            return None
+
+        for _ in range(2000):
+            address = int.from_bytes(socket.inet_aton(f"10.0.{rng.randint(0, 3)}.{rng.randint(0, 255)}"), 'big')
+            port, protocol = rng.randint(1, 130), rng.choice(['tcp', 'udp'])
+            self.assertEqual(chain.first_match(address, port, protocol), linear_first_match(address, port, protocol))
+
+class TestSimulatedRun(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.ruleset.fw_logger').start()
+        patch('firewall_tester.tester.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+    @patch('firewall_tester.tester.sr1')
+    def test_run_tests_against_ruleset(self, mock_sr1):
+        test_cases = [
+            {"name": "Web", "dest_ip": "1.2.3.0/31", "dest_port": "80,443", "protocol": "tcp", "expected_result": "open"},
+            {"name": "Telnet", "dest_ip": "1.2.3.4", "dest_port": 23, "protocol": "tcp", "expected_result": "filtered"},
+            {"name": "DNS", "dest_ip": "1.2.3.4", "dest_port": 53, "protocol": "udp", "expected_result": "open"},
+        ]
+        tester = FirewallRuleTester(test_cases, tcp_engine="batch", ruleset=parse_iptables_save(IPTABLES_SAVE))
+
+        results = tester.run_tests()
+
+        mock_sr1.assert_not_called()
+        self.assertEqual([r['status'] for r in results], ["PASS"] * 4 + ["FAIL", "PASS"])
+        self.assertEqual(results[4]['actual_result'], "closed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,16 @@
 
 import unittest
-import subprocess
 import os
+import tempfile
 import yaml
 
 class TestFirewallTesterRunner(unittest.TestCase):
     def setUp(self):
-        self.test_cases_dir = "/home/duffer/Gemini/Project_1(complete)/024_firewall_rule_tester/test_cases"
-        os.makedirs(self.test_cases_dir, exist_ok=True)
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.test_cases_dir = self._tmpdir.name
 
     def tearDown(self):
-        pass
+        self._tmpdir.cleanup()
 
     def test_tcp_filtered_scenario(self):
         """Test that the runner module loads and test case YAML parsing works."""
@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from firewall_tester.responder import SimulatedTarget
+from firewall_tester.scheduler import AsyncProbeScheduler, TokenBucket
+from firewall_tester.tester import FirewallRuleTester
+
+class TestAsyncProbeScheduler(unittest.TestCase):
+
+    def test_results_keep_submission_order(self):
+        # Earlier jobs sleep longer so they finish last
+        jobs = [("1.1.1.1", lambda n=n: (time.sleep(0.01 * (5 - n)), n)[1]) for n in range(5)]
+        results = AsyncProbeScheduler(concurrency=5).run(jobs)
+        self.assertEqual(results, [0, 1, 2, 3, 4])
+
+    def _track_in_flight(self, n_jobs, hosts, scheduler):
+        lock = threading.Lock()
+        in_flight = {"total": 0, "max_total": 0}
+        per_host = {host: 0 for host in hosts}
+        max_per_host = {host: 0 for host in hosts}
+
+        def probe(host):
+            with lock:
+                in_flight["total"] += 1
+                per_host[host] += 1
+                in_flight["max_total"] = max(in_flight["max_total"], in_flight["total"])
+                max_per_host[host] = max(max_per_host[host], per_host[host])
+            time.sleep(0.01)
+            with lock:
+                in_flight["total"] -= 1
+                per_host[host] -= 1
+
+        jobs = [(hosts[n % len(hosts)], lambda h=hosts[n % len(hosts)]: probe(h)) for n in range(n_jobs)]
+        scheduler.run(jobs)
+        return in_flight["max_total"], max_per_host
+
+    def test_concurrency_cap(self):
+        max_total, _ = self._track_in_flight(20, ["1.1.1.1", "2.2.2.2"], AsyncProbeScheduler(concurrency=3))
+        self.assertLessEqual(max_total, 3)
+
+    def test_per_host_limit(self):
+        _, max_per_host = self._track_in_flight(
+            20, ["1.1.1.1", "2.2.2.2"], AsyncProbeScheduler(concurrency=8, per_host_limit=1))
+        self.assertEqual(max_per_host, {"1.1.1.1": 1, "2.2.2.2": 1})
+
+    def test_packet_rate_limit(self):
+        start = time.monotonic()
+        AsyncProbeScheduler(concurrency=10, max_pps=100).run([("1.1.1.1", lambda: None)] * 11)
+        # 11 evenly spaced sends at 100 pps span at least 100 ms
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_pending_jobs_are_bounded_behind_a_slow_head(self):
+        metrics = MagicMock()
+        jobs = [("1.1.1.1", lambda: time.sleep(0.1))] + [("2.2.2.2", lambda: None)] * 50
+        results = AsyncProbeScheduler(concurrency=4, metrics=metrics, max_pending=8).run(jobs)
+        self.assertEqual(len(results), 51)
+        self.assertEqual(max(call.args[1] for call in metrics.set_queue_depth.call_args_list), 8)
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_paces_callers_across_threads(self):
+        bucket = TokenBucket(200)
+        start = time.monotonic()
+        threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(10)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 40 tokens at 200 per second, the first one free
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    @patch('firewall_tester.syn_scanner.fw_logger')
+    def test_batch_scans_and_retransmissions_are_paced(self, _):
+        test_cases = [{"name": f"Port {port}", "dest_ip": "192.0.2.1", "dest_port": port, "protocol": "tcp",
+                       "expected_result": "open"} for port in range(1, 21)]
+        with SimulatedTarget(latency=0.001, reset=0, unreachable=0, silent=1.0).attach():
+            tester = FirewallRuleTester(test_cases, tcp_engine="batch", max_pps=200, timeout=0.01, retries=1,
+                                        adaptive_timeout=False)
+            start = time.monotonic()
+            tester.run_tests()
+        # 20 SYNs and 20 retransmissions at 200 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+class TestConcurrentRunTests(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.tester.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+    def test_run_tests_concurrent_matches_serial(self):
+        test_cases = [
+            {"name": f"TCP {port}", "dest_ip": "1.1.1.1", "dest_port": port, "protocol": "tcp", "expected_result": "open"}
+            for port in range(1, 21)
+        ]
+        verdict = lambda dest_ip, dest_port: "open" if dest_port % 2 else "closed"
+
+        serial = FirewallRuleTester(test_cases)
+        concurrent = FirewallRuleTester(test_cases, concurrency=8, max_pps=1000, per_host_limit=4)
+        for tester in (serial, concurrent):
+            with patch.object(tester, '_test_tcp_port', side_effect=verdict):
+                tester.run_tests()
+
+        self.assertEqual(concurrent.results, serial.results)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import queue
+import unittest
+from unittest.mock import patch
+
+from firewall_tester.ruleset import parse_iptables_save
+from firewall_tester.sharding import ShardedRuleTester, InterfaceSharder, shard_by_destination, run_chunks
+from firewall_tester.tester import FirewallRuleTester
+
+RULESET = """
+*filter
+:INPUT DROP [0:0]
+-A INPUT -p tcp -m tcp --dport 22 -j ACCEPT
+-A INPUT -d 10.0.0.0/30 -p tcp -m multiport --dports 80,443 -j ACCEPT
+-A INPUT -p tcp -m tcp --dport 23 -j REJECT --reject-with tcp-reset
+-A INPUT -p udp -m udp --dport 161 -j REJECT
+COMMIT
+"""
+
+class TestShardAssignment(unittest.TestCase):
+
+    def test_destination_hash_is_stable(self):
+        shards = [shard_by_destination(f"10.0.0.{i}", 4) for i in range(64)]
+        self.assertEqual(shards, [shard_by_destination(f"10.0.0.{i}", 4) for i in range(64)])
+        self.assertEqual(set(shards), {0, 1, 2, 3})
+
+    def test_interface_sharder_follows_routes(self):
+        sharder = InterfaceSharder(["eth0", "eth1"])
+        routes = {"10.0.0.1": "eth1", "10.0.0.2": "eth0", "10.0.0.3": "wlan0"}
+        with patch.object(sharder.routes, 'iface_for', side_effect=routes.get):
+            self.assertEqual(sharder("10.0.0.1", 2), 1)
+            self.assertEqual(sharder("10.0.0.2", 2), 0)
+            # Unrouted through a shard interface: falls back to the hash
+            self.assertEqual(sharder("10.0.0.3", 2), shard_by_destination("10.0.0.3", 2))
+            self.assertEqual(sharder("host.example", 2), shard_by_destination("host.example", 2))
+        sharder.close()
+
+        sharder = InterfaceSharder(["eth0", "lo"])
+        self.addCleanup(sharder.close)
+        self.assertEqual(sharder("127.0.0.1", 2), 1)  # Through the real routing table
+
+class TestShardedRuleTester(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.sharding.fw_logger', 'firewall_tester.tester.fw_logger',
+                       'firewall_tester.ruleset.fw_logger', 'firewall_tester.rules_parser.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+        self.ruleset = parse_iptables_save(RULESET)
+
+    def test_results_match_serial_run_in_order(self):
+        test_cases = [
+            {"name": "Web", "dest_ip": "10.0.0.0/29", "dest_port": "80,443", "protocol": "tcp", "expected_result": "open"},
+            {"name": "Bad port", "dest_ip": "10.0.0.1", "dest_port": 0, "protocol": "tcp", "expected_result": "open"},
+            {"name": "SSH", "dest_ip": "10.0.1.0/28", "dest_port": 22, "protocol": "tcp", "expected_result": "open"},
+            {"name": "Telnet", "dest_ip": "10.0.0.4", "dest_port": 23, "protocol": "tcp", "expected_result": "closed"},
+            {"name": "SNMP", "dest_ip": "10.0.2.0/30", "dest_port": 161, "protocol": "udp", "expected_result": "closed"},
+        ]
+        serial = FirewallRuleTester(test_cases, ruleset=self.ruleset).run_tests()
+
+        # A small chunk size and window exercise chunking and the reorder buffer. With concurrency the
+        # shards run through the scheduler, which reads ahead of the outcomes it has handed back.
+        with patch('firewall_tester.sharding.SHARD_CHUNK_SIZE', 3), patch('firewall_tester.sharding.SHARD_WINDOW', 7):
+            sharded = ShardedRuleTester(test_cases, 3, ruleset=self.ruleset).run_tests()
+            concurrent = ShardedRuleTester(test_cases, 3, ruleset=self.ruleset, concurrency=4).run_tests()
+
+        self.assertEqual(len(serial), 16 + 1 + 16 + 1 + 4)
+        self.assertEqual(sharded, serial)
+        self.assertEqual(concurrent, serial)
+
+    def test_chunks_run_without_a_start_line_each(self):
+        chunks = queue.Queue()
+        for port in (22, 23, 80):
+            chunks.put((2, [{"name": "Hosts", "dest_ip": "10.0.0.1-10.0.0.2", "dest_port": port, "protocol": "tcp",
+                             "expected_result": "open"}]))
+        chunks.put(None)
+        with patch('firewall_tester.tester.fw_logger') as mock_logger:
+            tester = FirewallRuleTester([], ruleset=self.ruleset)
+            sizes = [len(outcomes) for _, outcomes in run_chunks(tester, chunks, sized=True)]
+        self.assertEqual(sizes, [2, 2, 2])
+        messages = [call.args[0] for call in mock_logger.info.call_args_list]
+        self.assertFalse([message for message in messages if "Starting firewall rule tests" in message])
+
+    def test_shards_keep_their_own_cache_file(self):
+        tester = ShardedRuleTester([], 2, cache_options={'path': "/tmp/probes.db", 'ttl': 60})
+        self.assertEqual(tester._shard_cache_options(1), {'path': "/tmp/probes.db.shard1", 'ttl': 60})
+        self.assertIsNone(ShardedRuleTester([], 2)._shard_cache_options(0))
+
+    def test_max_pps_is_split_between_shards(self):
+        tester = ShardedRuleTester([], 4, interfaces=["eth0", "eth1"], max_pps=1000)
+        self.assertEqual(tester._shard_options(1), {'max_pps': 250, 'iface': "eth1"})
+        self.assertEqual(tester._shard_options(2)['iface'], "eth0")
+
+    def test_interface_sharding_needs_interfaces(self):
+        with self.assertRaises(ValueError):
+            ShardedRuleTester([], 2, shard_by="interface")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from scapy.all import IP, TCP, ICMP, IPerror, TCPerror
+
+from firewall_tester.syn_scanner import BatchSynScanner
+from firewall_tester.timing import TimingTable
+from firewall_tester.tester import FirewallRuleTester
+
+class TestBatchSynScanner(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.syn_scanner.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+        self.scanner = BatchSynScanner(timeout=0.2)
+        self.scanner._sock = MagicMock()
+
+    def test_reply_classification(self):
+        seq_open = self.scanner._register_probe("1.1.1.1", 80)
+        seq_closed = self.scanner._register_probe("1.1.1.1", 22)
+        seq_icmp = self.scanner._register_probe("1.1.1.1", 443)
+
+        sport = self.scanner.sport
+        self.scanner._handle_reply(IP(src="1.1.1.1") / TCP(sport=80, dport=sport, flags="SA", ack=seq_open + 1))
+        self.scanner._handle_reply(IP(src="1.1.1.1") / TCP(sport=22, dport=sport, flags="RA", ack=seq_closed + 1))
+        self.scanner._handle_reply(
+            IP(src="9.9.9.9") / ICMP(type=3, code=13) /
+            IPerror(dst="1.1.1.1") / TCPerror(sport=sport, dport=443, seq=seq_icmp))
+
+        self.assertEqual(self.scanner._verdicts[("1.1.1.1", 80)], "open")
+        self.assertEqual(self.scanner._verdicts[("1.1.1.1", 22)], "closed")
+        self.assertEqual(self.scanner._verdicts[("1.1.1.1", 443)], "filtered")
+        # The open port gets a RST to tear down the half-open connection
+        self.scanner._sock.send.assert_called_once()
+        self.assertTrue(self.scanner._done.is_set())
+
+    def test_reply_with_wrong_seq_is_ignored(self):
+        seq = self.scanner._register_probe("1.1.1.1", 80)
+        self.scanner._handle_reply(
+            IP(src="1.1.1.1") / TCP(sport=80, dport=self.scanner.sport, flags="SA", ack=seq + 2))
+        self.assertEqual(self.scanner._verdicts, {})
+
+    @patch('firewall_tester.syn_scanner.AsyncSniffer')
+    @patch('firewall_tester.syn_scanner.conf')
+    def test_scan_shares_one_socket(self, mock_conf, mock_sniffer_cls):
+        mock_sock = MagicMock()
+        mock_conf.L3socket.return_value = mock_sock
+        scanner = self.scanner
+
+        def reply(packet):
+            if packet[TCP].flags == "S" and packet[TCP].dport == 22:
+                scanner._handle_reply(
+                    IP(src=packet[IP].dst) / TCP(sport=22, dport=scanner.sport, flags="RA", ack=packet[TCP].seq + 1))
+        mock_sock.send.side_effect = reply
+
+        results = scanner.scan([("1.1.1.1", 22), ("1.1.1.1", 443), ("1.1.1.1", 22)])
+
+        self.assertEqual(results, {("1.1.1.1", 22): "closed", ("1.1.1.1", 443): "filtered"})
+        mock_conf.L3socket.assert_called_once()
+        self.assertEqual(mock_sock.send.call_count, 2)
+        mock_sniffer_cls.return_value.start.assert_called_once()
+        mock_sock.close.assert_called_once()
+
+    @patch('firewall_tester.syn_scanner.AsyncSniffer')
+    @patch('firewall_tester.syn_scanner.conf')
+    def test_scan_retransmits_unanswered(self, mock_conf, mock_sniffer_cls):
+        mock_sock = MagicMock()
+        mock_conf.L3socket.return_value = mock_sock
+        timing = TimingTable(initial_timeout=0.05)
+        scanner = BatchSynScanner(timeout=0.05, timing=timing, retries=1)
+        sent = []
+
+        def reply(packet):
+            sent.append(packet[TCP].dport)
+            # Only the retransmission gets through
+            if len(sent) == 2:
+                scanner._handle_reply(
+                    IP(src=packet[IP].dst) / TCP(sport=22, dport=scanner.sport, flags="RA", ack=packet[TCP].seq + 1))
+        mock_sock.send.side_effect = reply
+
+        results = scanner.scan([("1.1.1.1", 22)])
+
+        self.assertEqual(results, {("1.1.1.1", 22): "closed"})
+        self.assertEqual(sent, [22, 22])
+        row = timing.summary()[0]
+        self.assertEqual((row['probes'], row['retransmits'], row['timeouts'], row['replies']), (2, 1, 1, 1))
+
+class TestBatchEngine(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.tester.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+    @patch('firewall_tester.tester.BatchSynScanner')
+    def test_run_tests_uses_batch_verdicts(self, mock_scanner_cls):
+        mock_scanner_cls.return_value.scan.return_value = {("1.1.1.1", 80): "open", ("1.1.1.1", 22): "filtered"}
+        test_cases = [
+            {"name": "TCP Open", "dest_ip": "1.1.1.1", "dest_port": 80, "protocol": "tcp", "expected_result": "open"},
+            {"name": "TCP Closed", "dest_ip": "1.1.1.1", "dest_port": 22, "protocol": "tcp", "expected_result": "closed"},
+        ]
+        tester = FirewallRuleTester(test_cases, tcp_engine="batch")
+
+        with patch.object(tester, '_test_tcp_port') as mock_tcp_test:
+            results = tester.run_tests()
+            mock_tcp_test.assert_not_called()
+
+        mock_scanner_cls.return_value.scan.assert_called_once_with([("1.1.1.1", 80), ("1.1.1.1", 22)])
+        self.assertEqual([r['status'] for r in results], ["PASS", "FAIL"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,29 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import os
+import subprocess
+import sys
 import yaml
 
 from scapy.all import IP, TCP, UDP, ICMP
 
-from firewall_tester.rules_parser import parse_test_cases
+from firewall_tester.rules_parser import (parse_test_cases, validate_test_cases, expand_test_cases, count_probes,
+                                          iter_test_cases, split_by_destination)
 from firewall_tester.tester import FirewallRuleTester
 
 class TestRulesParser(unittest.TestCase):
 
     def setUp(self):
         self.test_cases_file = "test_cases/temp_rules.yaml"
+        self.jsonl_file = "test_cases/temp_rules.jsonl"
         # Mock logger
-        patch('firewall_tester.rules_parser.fw_logger').start()
+        self.mock_logger = patch('firewall_tester.rules_parser.fw_logger').start()
         self.addCleanup(patch.stopall)
 
     def tearDown(self):
-        if os.path.exists(self.test_cases_file):
-            os.remove(self.test_cases_file)
+        for path in (self.test_cases_file, self.jsonl_file):
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_parse_valid_yaml(self):
         os.makedirs("test_cases", exist_ok=True)
@@ -55,6 +60,102 @@ class TestRulesParser(unittest.TestCase):
         test_cases = parse_test_cases(self.test_cases_file)
         self.assertEqual(test_cases, [])
 
+    def test_stream_multi_document_yaml(self):
+        os.makedirs("test_cases", exist_ok=True)
+        yaml_content = """
+- name: Test1
+  dest_ip: 1.1.1.1
+  dest_port: 80
+  protocol: tcp
+  expected_result: open
+- name: Missing port
+  dest_ip: 1.1.1.1
+  protocol: tcp
+  expected_result: open
+---
+name: Test2
+dest_ip: 2.2.2.2
+dest_port: 53
+protocol: udp
+expected_result: closed
+"""
+        with open(self.test_cases_file, 'w') as f:
+            f.write(yaml_content)
+
+        test_cases = list(iter_test_cases(self.test_cases_file))
+        self.assertEqual([t['name'] for t in test_cases], ["Test1", "Test2"])
+        # The invalid record is reported with its line number
+        self.assertIn(f"{self.test_cases_file}:7", self.mock_logger.error.call_args[0][0])
+
+    def test_stream_yields_before_parse_error(self):
+        os.makedirs("test_cases", exist_ok=True)
+        with open(self.test_cases_file, 'w') as f:
+            f.write("- {name: Test1, dest_ip: 1.1.1.1, dest_port: 80, protocol: tcp, expected_result: open}\n"
+                    "- {name: Test2, dest_ip: [unclosed\n")
+
+        test_cases = iter_test_cases(self.test_cases_file)
+        self.assertEqual(next(test_cases)['name'], "Test1")
+        self.assertEqual(list(test_cases), [])
+        self.mock_logger.error.assert_called_once()
+
+    def test_stream_jsonl(self):
+        os.makedirs("test_cases", exist_ok=True)
+        with open(self.jsonl_file, 'w') as f:
+            f.write('{"name": "Test1", "dest_ip": "1.1.1.1", "dest_port": 80, "protocol": "tcp", "expected_result": "open"}\n')
+            f.write('\n')
+            f.write('{"name": "Broken", \n')
+            f.write('{"name": "Test2", "dest_ip": "10.0.0.0/24", "dest_port": "1-1024", "protocol": "tcp", "expected_result": "filtered"}\n')
+
+        test_cases = list(iter_test_cases(self.jsonl_file))
+        self.assertEqual([t['name'] for t in test_cases], ["Test1", "Test2"])
+        self.assertIn(f"{self.jsonl_file}:3", self.mock_logger.error.call_args[0][0])
+
+    def test_expand_cidr_and_port_ranges(self):
+        test_case = {"name": "Block", "dest_ip": "10.20.0.0/30", "dest_port": "22,80-81",
+                     "protocol": "tcp", "expected_result": "filtered"}
+        self.assertTrue(validate_test_cases([test_case]))
+        self.assertEqual(count_probes([test_case]), 12)
+
+        expanded = expand_test_cases([test_case])
+        first = next(expanded)
+        self.assertEqual((first['dest_ip'], first['dest_port']), ("10.20.0.0", 22))
+        self.assertEqual(first['name'], "Block (10.20.0.0:22)")
+        rest = list(expanded)
+        self.assertEqual(len(rest), 11)
+        self.assertEqual((rest[-1]['dest_ip'], rest[-1]['dest_port']), ("10.20.0.3", 81))
+
+    def test_expand_address_range_and_port_list(self):
+        test_case = {"name": "Allow", "dest_ip": ["10.0.0.254-10.0.1.1", "web.example.com"], "dest_port": [443, "8000-8001"],
+                     "protocol": "tcp", "expected_result": "open"}
+        targets = [(case['dest_ip'], case['dest_port']) for case in expand_test_cases([test_case])]
+        self.assertEqual(len(targets), 15)
+        self.assertEqual(targets[:3], [("10.0.0.254", 443), ("10.0.0.254", 8000), ("10.0.0.254", 8001)])
+        self.assertEqual(targets[-1], ("web.example.com", 8001))
+
+    def test_single_target_is_passed_through(self):
+        test_case = {"name": "One", "dest_ip": "1.1.1.1", "dest_port": 80, "protocol": "tcp", "expected_result": "open"}
+        self.assertIs(next(expand_test_cases([test_case])), test_case)
+
+    def test_split_by_destination_expands_like_the_test_cases(self):
+        test_cases = [
+            {"name": "Web", "dest_ip": "10.0.0.0/30", "dest_port": "80,443", "protocol": "tcp", "expected_result": "open"},
+            {"name": "SSH", "dest_ip": "10.0.0.1-10.0.0.2", "dest_port": 22, "protocol": "tcp", "expected_result": "open"},
+            {"name": "One", "dest_ip": "10.0.0.9/32", "dest_port": "53", "protocol": "udp", "expected_result": "closed"},
+            {"name": "Bad", "dest_ip": "not valid!", "dest_port": 1},
+        ]
+        parts = list(split_by_destination(test_cases))
+        self.assertEqual([(dest_ip, size) for dest_ip, _, size in parts],
+                         [("10.0.0.0", 2), ("10.0.0.1", 2), ("10.0.0.2", 2), ("10.0.0.3", 2),
+                          ("10.0.0.1", 1), ("10.0.0.2", 1), ("10.0.0.9", 1), ("not valid!", 1)])
+        self.assertEqual(list(expand_test_cases(part for _, part, _ in parts)), list(expand_test_cases(test_cases)))
+
+    def test_validate_rejects_invalid_targets(self):
+        base = {"name": "Bad", "protocol": "tcp", "expected_result": "open"}
+        self.assertFalse(validate_test_cases([dict(base, dest_ip="10.0.0.0/33", dest_port=80)]))
+        self.assertFalse(validate_test_cases([dict(base, dest_ip="10.0.0.9-10.0.0.1", dest_port=80)]))
+        self.assertFalse(validate_test_cases([dict(base, dest_ip="1.1.1.1", dest_port="1024-1")]))
+        self.assertFalse(validate_test_cases([dict(base, dest_ip="1.1.1.1", dest_port=70000)]))
+
 class TestFirewallRuleTester(unittest.TestCase):
 
     def setUp(self):
@@ -158,6 +259,50 @@ class TestFirewallRuleTester(unittest.TestCase):
             self.assertEqual(results[5]['status'], "PASS")
             self.assertEqual(results[5]['actual_result'], "open")
 
+    def test_run_tests_expands_port_range(self):
+        tester = FirewallRuleTester([
+            {"name": "Range", "dest_ip": "1.1.1.1", "dest_port": "20-22", "protocol": "tcp", "expected_result": "filtered"},
+        ])
+        with patch.object(tester, '_test_tcp_port', return_value="filtered") as mock_tcp_test:
+            results = tester.run_tests()
+
+        self.assertEqual([r['dest_port'] for r in results], [20, 21, 22])
+        self.assertEqual(results[0]['name'], "Range (1.1.1.1:20)")
+        self.assertEqual(mock_tcp_test.call_count, 3)
+
+    @patch('firewall_tester.tester.sr1')
+    def test_plan_sends_nothing(self, mock_sr1):
+        tester = FirewallRuleTester([
+            {"name": "Web", "dest_ip": "10.0.0.0/30", "dest_port": "80,443", "protocol": "tcp", "expected_result": "open"},
+            {"name": "DNS", "dest_ip": "10.0.0.1", "dest_port": 53, "protocol": "udp", "expected_result": "open"},
+            {"name": "Ping", "dest_ip": "10.0.0.1", "dest_port": 7, "protocol": "icmp", "expected_result": "open"},
+        ], concurrency=3, timeout=1, retries=1, adaptive_timeout=False)
+
+        plan = tester.plan()
+
+        mock_sr1.assert_not_called()
+        self.assertEqual((plan['test_cases'], plan['probes'], plan['tcp_probes'], plan['udp_probes'], plan['unsupported']),
+                         (3, 10, 8, 1, 1))
+        # 9 probes of up to 1s + 2s (one backed-off retransmission), 3 at a time
+        self.assertEqual(plan['estimated_seconds'], 9.0)
+
+    @patch('firewall_tester.tester.sr1')
+    def test_plan_paces_batch_udp_by_icmp_rate(self, mock_sr1):
+        test_cases = [
+            {"name": "Closed", "dest_ip": "10.0.0.1", "dest_port": "1-20", "protocol": "udp", "expected_result": "closed"},
+            {"name": "More", "dest_ip": "10.0.0.1", "dest_port": "21-30", "protocol": "udp", "expected_result": "closed"},
+        ]
+        plan = FirewallRuleTester(test_cases, udp_engine="batch", timeout=1, retries=1, adaptive_timeout=False).plan()
+
+        mock_sr1.assert_not_called()
+        # One scan window of 1s + 2s + 4s + 8s (a retransmission and two re-probes), and the host's
+        # 30 port-unreachables at one per second after a burst of six
+        self.assertEqual(plan['estimated_seconds'], 15 + 24)
+
+    def test_import_does_not_load_scapy(self):
+        code = "import sys, firewall_tester.cli; sys.exit('scapy' in sys.modules)"
+        self.assertEqual(subprocess.run([sys.executable, "-c", code]).returncode, 0)
+
 
 if __name__ == '__main__' :
     unittest.main()
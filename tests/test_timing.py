@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from firewall_tester.timing import TimingTable
+from firewall_tester.reporter import format_host_timing
+from firewall_tester.tester import FirewallRuleTester
+
+class TestTimingTable(unittest.TestCase):
+
+    def test_initial_timeout_until_measured(self):
+        timing = TimingTable(initial_timeout=1)
+        self.assertEqual(timing.timeout_for("1.1.1.1"), 1)
+
+    def test_timeout_tracks_rtt(self):
+        timing = TimingTable(initial_timeout=1, min_timeout=0.01, max_timeout=10)
+        timing.record_reply("1.1.1.1", 0.2)
+        # srtt = 0.2, rttvar = 0.1
+        self.assertAlmostEqual(timing.timeout_for("1.1.1.1"), 0.6)
+        timing.record_reply("1.1.1.1", 0.2)
+        # srtt stays 0.2, rttvar decays to 0.075
+        self.assertAlmostEqual(timing.timeout_for("1.1.1.1"), 0.5)
+        # Other hosts are unaffected
+        self.assertEqual(timing.timeout_for("2.2.2.2"), 1)
+
+    def test_timeout_is_clamped_and_backs_off(self):
+        timing = TimingTable(initial_timeout=1, min_timeout=0.1, max_timeout=2)
+        timing.record_reply("1.1.1.1", 0.0002)
+        self.assertEqual(timing.timeout_for("1.1.1.1"), 0.1)
+        self.assertEqual(timing.timeout_for("1.1.1.1", attempt=2), 0.4)
+        self.assertEqual(timing.timeout_for("1.1.1.1", attempt=10), 2)
+
+    def test_fixed_timeout(self):
+        timing = TimingTable(initial_timeout=1, adaptive=False)
+        timing.record_reply("1.1.1.1", 0.001)
+        self.assertEqual(timing.timeout_for("1.1.1.1"), 1)
+
+    def test_summary(self):
+        timing = TimingTable()
+        timing.record_probe("1.1.1.1")
+        timing.record_timeout("1.1.1.1")
+        timing.record_probe("1.1.1.1", attempt=1)
+        timing.record_reply("1.1.1.1")
+        row = timing.summary()[0]
+        self.assertEqual((row['probes'], row['retransmits'], row['timeouts'], row['replies']), (2, 1, 1, 1))
+        self.assertIsNone(row['srtt_ms'])
+
+    def test_least_recently_probed_hosts_are_dropped(self):
+        timing = TimingTable(max_hosts=2)
+        for host in ("1.1.1.1", "2.2.2.2", "1.1.1.1", "3.3.3.3"):
+            timing.record_probe(host)
+        self.assertEqual([row['host'] for row in timing.summary()], ["1.1.1.1", "3.3.3.3"])
+
+    def test_report_lists_only_the_slowest_hosts(self):
+        timing = TimingTable(initial_timeout=1)
+        for n in range(1, 6):
+            timing.record_probe(f"10.0.0.{n}")
+            timing.record_reply(f"10.0.0.{n}", n / 100)
+        timing.record_probe("10.0.0.9")
+        timing.record_timeout("10.0.0.9")
+        lines = format_host_timing(timing.summary(), top=2)
+        self.assertIn("Hosts: 6 (1 without an RTT sample), Probes: 6", lines[1])
+        self.assertEqual([line for line in lines if "Host:" in line], ["  - Host: 10.0.0.5", "  - Host: 10.0.0.4"])
+        self.assertEqual(len(format_host_timing(timing.summary(), top=None)), 1 + 6 * 3)
+
+class TestRetransmission(unittest.TestCase):
+
+    def setUp(self):
+        patch('firewall_tester.tester.fw_logger').start()
+        self.addCleanup(patch.stopall)
+
+    @patch('firewall_tester.tester.sr1')
+    def test_unanswered_probe_is_retransmitted(self, mock_sr1):
+        mock_sr1.return_value = None
+        tester = FirewallRuleTester([], timeout=0.5, retries=2)
+
+        self.assertEqual(tester._test_tcp_port("1.1.1.1", 443), "filtered")
+        self.assertEqual(mock_sr1.call_count, 3)
+        self.assertEqual([c.kwargs['timeout'] for c in mock_sr1.call_args_list], [0.5, 1.0, 2.0])
+        self.assertEqual(tester.timing.summary()[0]['timeouts'], 3)
+
+    @patch('firewall_tester.tester.sr1')
+    def test_reply_after_retransmit_stops_retrying(self, mock_sr1):
+        mock_resp = MagicMock()
+        mock_resp.haslayer.side_effect = lambda x: False
+        mock_sr1.side_effect = [None, mock_resp]
+        tester = FirewallRuleTester([], retries=3)
+
+        self.assertEqual(tester._test_udp_port("1.1.1.1", 53), "open|filtered")
+        self.assertEqual(mock_sr1.call_count, 2)
+        row = tester.timing.summary()[0]
+        self.assertEqual((row['replies'], row['retransmits']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from unittest.mock import patch
+
+from scapy.all import IP, UDP, ICMP, IPerror, UDPerror
+
+from firewall_tester.udp_scanner import UdpScanner
+from firewall_tester.timing import IcmpRateTable
+from firewall_tester.responder import SimulatedTarget
+from firewall_tester.tester import FirewallRuleTester
+
+class TestIcmpRateTable(unittest.TestCase):
+
+    def test_hosts_are_paced_once_they_send_errors(self):
+        table = IcmpRateTable(rate=1.0, burst=2)
+        self.assertEqual(table.take("1.1.1.1", 0.0), (0, 0.0))
+        self.assertFalse(table.responsive("1.1.1.1"))
+
+        table.record_error("1.1.1.1", 0.0, 0.01)
+        self.assertTrue(table.responsive("1.1.1.1"))
+        wait, cost = table.take("1.1.1.1", 0.01)
+        self.assertEqual(wait, 0)
+        self.assertGreater(cost, 0)
+        table.take("1.1.1.1", 0.01)
+        wait, cost = table.take("1.1.1.1", 0.01)
+        self.assertGreater(wait, 0)
+        self.assertIsNone(cost)
+
+    def test_suppressible_once_the_burst_is_spent(self):
+        table = IcmpRateTable(rate=1.0, burst=2)
+        table.take("1.1.1.1", 0.0)
+        table.record_error("1.1.1.1", 0.0, 0.01)
+        table.record_error("1.1.1.1", 0.001, 0.01)
+        self.assertFalse(table.suppressible("1.1.1.1", 0.0005))
+        self.assertTrue(table.suppressible("1.1.1.1", 0.002))
+        # One token back after a second at the assumed rate
+        self.assertFalse(table.suppressible("1.1.1.1", 1.1))
+        self.assertFalse(table.suppressible("2.2.2.2", 0.002))
+
+    def test_rate_grows_to_what_errors_prove(self):
+        table = IcmpRateTable(rate=1.0, burst=2)
+        for i in range(12):
+            table.record_error("1.1.1.1", i * 0.1, i * 0.1 + 0.01)
+        self.assertAlmostEqual(table.summary()[0]['icmp_rate'], 10 / 1.1, places=2)
+        self.assertEqual(table.summary()[0]['icmp_errors'], 12)
+
+class TestUdpScanner(unittest.TestCase):
+
+    def setUp(self):
+        for target in ('firewall_tester.udp_scanner.fw_logger', 'firewall_tester.syn_scanner.fw_logger',
+                       'firewall_tester.tester.fw_logger'):
+            patch(target).start()
+        self.addCleanup(patch.stopall)
+
+    def test_reply_classification(self):
+        scanner = UdpScanner(timeout=0.2)
+        sport = scanner.sport
+        scanner._pending = {("1.1.1.1", port): (("1.1.1.1", port), 0, 0.0, 0.0, 0.0) for port in (53, 69, 161)}
+        scanner._verdicts = {}
+
+        scanner._handle_reply(IP(src="1.1.1.1") / UDP(sport=53, dport=sport))
+        scanner._handle_reply(IP(src="1.1.1.1") / ICMP(type=3, code=3) /
+                              IPerror(dst="1.1.1.1") / UDPerror(sport=sport, dport=69))
+        scanner._handle_reply(IP(src="9.9.9.9") / ICMP(type=3, code=13) /
+                              IPerror(dst="1.1.1.1") / UDPerror(sport=sport, dport=161))
+
+        self.assertEqual(scanner._verdicts, {("1.1.1.1", 53): "open", ("1.1.1.1", 69): "closed",
+                                             ("1.1.1.1", 161): "open|filtered"})
+        self.assertEqual(scanner.icmp_limits.summary()[0]['icmp_errors'], 2)
+
+    def test_batch_engine_recovers_rate_limited_port_unreachables(self):
+        test_cases = [{"name": f"{host} {port}", "dest_ip": host, "dest_port": port, "protocol": "udp",
+                       "expected_result": "closed"} for host in ("10.0.0.1", "10.0.0.2") for port in range(1000, 1030)]
+        target = SimulatedTarget(latency=0.001, icmp_rate=10, seed=3)
+        with target.attach():
+            tester = FirewallRuleTester(test_cases, udp_engine="batch", timeout=0.05)
+            tester.icmp_limits = IcmpRateTable(rate=10)
+            results = list(tester.iter_results())
+
+        self.assertEqual(len(results), len(test_cases))
+        self.assertGreater(target.icmp_suppressed, 0)
+        for result in results:
+            self.assertEqual(result.actual_result, target.expected_verdict(result.dest_ip, result.dest_port, "udp"))
+
+if __name__ == '__main__':
+    unittest.main()